@@ -0,0 +1,212 @@
+"""Human vs ASR keyword agreement over many trials, with NumPy.
+
+Each scored trial has two boolean vectors, one entry per keyword: whether
+the audiologist heard the subject say it (audio_annotations), and whether
+the ASR found it.  The scorers used to add these up into 2x2 confusion
+matrices one keyword at a time.  MatchArrays instead keeps all the trials'
+vectors end to end in two flat boolean arrays, with the offset of each
+trial, and codes for each trial's project, subject and SNR.  Any grouping of
+the trials then gets all its confusion matrices from one np.bincount, and
+the same arrays give the agreement rates and Cohen's kappa, or can be sliced
+to a subset of the trials without going back to the database.
+
+Confusion matrices are indexed [human, asr], as in score_and_report.
+"""
+import array
+import dataclasses
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+FIELDS = ('project', 'subject', 'snr')
+
+
+def confusion(human: ArrayLike, asr: ArrayLike) -> NDArray:
+    """The 2x2 confusion matrix of two boolean vectors of the same length."""
+    index = np.asarray(human, dtype=np.intp) * 2 + np.asarray(asr, dtype=np.intp)
+    return np.bincount(index, minlength=4).reshape(2, 2)
+
+
+def agreement_rate(confusions: NDArray) -> NDArray:
+    """Fraction of keywords where human and ASR agree, for (..., 2, 2) matrices.
+
+    NaN where a matrix is empty.
+    """
+    confusions = np.asarray(confusions, dtype=float)
+    n = confusions.sum(axis=(-2, -1))
+    agree = confusions[..., 0, 0] + confusions[..., 1, 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return agree / n
+
+
+def cohens_kappa(confusions: NDArray) -> NDArray:
+    """Cohen's kappa of (..., 2, 2) confusion matrices.
+
+    NaN where it is undefined: an empty matrix, or both raters giving the
+    same answer for every keyword.
+    """
+    confusions = np.asarray(confusions, dtype=float)
+    n = confusions.sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = (confusions[..., 0, 0] + confusions[..., 1, 1]) / n
+        human = confusions.sum(axis=-1) / n[..., None]
+        asr = confusions.sum(axis=-2) / n[..., None]
+        expected = (human * asr).sum(axis=-1)
+        kappa = (observed - expected) / (1 - expected)
+    return np.where(expected < 1, kappa, np.nan)
+
+
+@dataclasses.dataclass
+class MatchArrays:
+    """The human and ASR keyword matches of many trials.
+
+    Attributes:
+        human: Whether the audiologist heard each keyword, all trials end to end.
+        asr: Whether the ASR found each keyword.
+        offsets: Trial i's keywords are [offsets[i], offsets[i+1]).
+        codes: For each of FIELDS, the index of each trial's value in labels.
+        labels: For each of FIELDS, its distinct values.
+    """
+    human: NDArray
+    asr: NDArray
+    offsets: NDArray
+    codes: Dict[str, NDArray]
+    labels: Dict[str, List[Any]]
+
+    @classmethod
+    def from_trials(cls, trials: Iterable[Tuple[Any, Any, Any, Sequence[bool], Sequence[bool]]]
+                    ) -> 'MatchArrays':
+        """Build from (project, subject, snr, human matches, asr matches)."""
+        builder = MatchArraysBuilder()
+        for trial in trials:
+            builder.add(*trial)
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def trial_index(self) -> NDArray:
+        """The trial each keyword belongs to."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def group_confusions(self, by: Sequence[str] = ('project',)
+                         ) -> Tuple[List[Tuple[Any, ...]], NDArray]:
+        """The confusion matrix of each group of trials.
+
+        Args:
+            by: The FIELDS to group the trials by.
+
+        Returns:
+            The (sorted) groups present, as tuples of the field values, and
+            their confusion matrices, a (groups, 2, 2) array.
+        """
+        dims = tuple(max(len(self.labels[f]), 1) for f in by)
+        if by:
+            trial_group = np.ravel_multi_index([self.codes[f] for f in by], dims)
+        else:
+            trial_group = np.zeros(len(self), dtype=np.intp)
+        groups, trial_group = np.unique(trial_group, return_inverse=True)
+        word_group = trial_group.reshape(-1)[self.trial_index()]
+        index = (word_group * 4 + self.human.astype(np.intp) * 2
+                 + self.asr.astype(np.intp))
+        confusions = np.bincount(index, minlength=len(groups) * 4)
+        names = [tuple(self.labels[f][c] for f, c in zip(by, np.unravel_index(g, dims)))
+                 for g in groups]
+        return names, confusions.reshape(len(groups), 2, 2)
+
+    def confusions(self, by: Sequence[str] = ('project',)) -> Dict[Any, NDArray]:
+        """The confusion matrices of group_confusions, keyed by the field value
+        (when grouping by one field) or the tuple of values."""
+        names, confusions = self.group_confusions(by)
+        if len(by) == 1:
+            names = [name[0] for name in names]
+        return dict(zip(names, confusions))
+
+    def trial_mask(self, **values: Any) -> NDArray:
+        """Select the trials with the given field values, e.g. project='quick'."""
+        mask = np.ones(len(self), dtype=bool)
+        for field, value in values.items():
+            labels = self.labels[field]
+            if value not in labels:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.codes[field] == labels.index(value)
+        return mask
+
+    def subset(self, mask: NDArray) -> 'MatchArrays':
+        """The trials selected by a boolean mask (over trials)."""
+        lengths = np.diff(self.offsets)[mask]
+        word_mask = np.repeat(mask, np.diff(self.offsets))
+        return MatchArrays(
+            human=self.human[word_mask], asr=self.asr[word_mask],
+            offsets=np.concatenate([[0], np.cumsum(lengths)]),
+            codes={f: c[mask] for f, c in self.codes.items()},
+            labels=self.labels)
+
+
+class MatchArraysBuilder:
+    """Collects trials one at a time (e.g. from a score_and_report sink)."""
+    __slots__ = ('human', 'asr', 'lengths', 'codes', 'labels')
+
+    def __init__(self):
+        self.human = array.array('B')
+        self.asr = array.array('B')
+        self.lengths = array.array('q')
+        self.codes = {f: array.array('q') for f in FIELDS}
+        self.labels: Dict[str, Dict[Any, int]] = {f: {} for f in FIELDS}
+
+    def add(self, project: Any, subject: Any, snr: Any,
+            human: Sequence[bool], asr: Sequence[bool]) -> None:
+        """Add a trial; as with zip, extra keywords of the longer vector are ignored."""
+        n = min(len(human), len(asr))
+        self.human.extend(bool(h) for h in human[:n])
+        self.asr.extend(bool(a) for a in asr[:n])
+        self.lengths.append(n)
+        for field, value in zip(FIELDS, (project, subject, snr)):
+            labels = self.labels[field]
+            self.codes[field].append(labels.setdefault(value, len(labels)))
+
+    def build(self, sort_labels: bool = True) -> MatchArrays:
+        """Return the MatchArrays of the trials added so far.
+
+        Args:
+            sort_labels: Renumber the codes so the labels are sorted (when
+                they can be compared), making the group order predictable.
+        """
+        codes, labels = {}, {}
+        for field in FIELDS:
+            values = list(self.labels[field])
+            field_codes = np.frombuffer(self.codes[field], dtype=np.int64).astype(np.intp)
+            if sort_labels and values:
+                try:
+                    order = sorted(range(len(values)), key=lambda i: values[i])
+                except TypeError:
+                    order = list(range(len(values)))
+                rank = np.empty(len(values), dtype=np.intp)
+                rank[order] = np.arange(len(values))
+                field_codes = rank[field_codes]
+                values = [values[i] for i in order]
+            codes[field] = field_codes
+            labels[field] = values
+        lengths = np.frombuffer(self.lengths, dtype=np.int64)
+        return MatchArrays(
+            human=np.frombuffer(self.human, dtype=np.uint8).astype(bool),
+            asr=np.frombuffer(self.asr, dtype=np.uint8).astype(bool),
+            offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.intp),
+            codes=codes, labels=labels)
+
+
+def summary(matches: MatchArrays, by: Sequence[str] = ('project',)
+            ) -> List[Dict[str, Any]]:
+    """Agreement statistics for each group: counts, agreement rate and kappa."""
+    names, confusions = matches.group_confusions(by)
+    rates = agreement_rate(confusions)
+    kappas = cohens_kappa(confusions)
+    rows = []
+    for name, c, rate, kappa in zip(names, confusions, rates, kappas):
+        row: Dict[str, Any] = dict(zip(by, name))
+        row.update(keywords=int(c.sum()), agreement=float(rate), kappa=float(kappa),
+                   both=int(c[1, 1]), neither=int(c[0, 0]),
+                   human_only=int(c[1, 0]), asr_only=int(c[0, 1]))
+        rows.append(row)
+    return rows
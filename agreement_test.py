@@ -0,0 +1,81 @@
+"""Tests for agreement.py."""
+
+import math
+
+import numpy as np
+from absl.testing import absltest
+
+import agreement
+
+
+def random_trials(rng, n):
+    trials = []
+    for _ in range(n):
+        words = int(rng.integers(0, 6))
+        trials.append((rng.choice(['quick', 'win', 'azbio']),
+                       f'A1S{rng.integers(0, 4)}', int(rng.integers(0, 5)) * 5,
+                       list(rng.random(words) < 0.7), list(rng.random(words) < 0.6)))
+    return trials
+
+
+class AgreementTest(absltest.TestCase):
+
+    def test_confusion(self):
+        c = agreement.confusion([True, True, False, False], [True, False, True, True])
+        self.assertEqual(c.tolist(), [[0, 2], [1, 1]])
+        self.assertEqual(agreement.confusion([], []).tolist(), [[0, 0], [0, 0]])
+
+    def test_kappa(self):
+        c = np.array([[20, 5], [10, 15]])
+        observed = 35 / 50
+        expected = (25 / 50) * (30 / 50) + (25 / 50) * (20 / 50)
+        self.assertAlmostEqual(agreement.cohens_kappa(c),
+                               (observed - expected) / (1 - expected))
+        self.assertAlmostEqual(agreement.agreement_rate(c), observed)
+        # Undefined when both always say the same thing, or with no keywords.
+        kappas = agreement.cohens_kappa(np.array([[[0, 0], [0, 7]], [[0, 0], [0, 0]]]))
+        self.assertTrue(np.isnan(kappas).all())
+        self.assertTrue(math.isnan(agreement.agreement_rate(np.zeros((2, 2)))))
+
+    def test_group_confusions(self):
+        trials = random_trials(np.random.default_rng(0), 300)
+        matches = agreement.MatchArrays.from_trials(trials)
+        self.assertLen(matches, 300)
+        for by in [('project',), ('subject', 'snr'), ('project', 'subject', 'snr'), ()]:
+            expected = {}
+            for trial in trials:
+                key = tuple(dict(zip(agreement.FIELDS, trial[:3]))[f] for f in by)
+                c = expected.setdefault(key, np.zeros((2, 2), dtype=int))
+                for h, a in zip(trial[3], trial[4]):
+                    c[int(h), int(a)] += 1
+            names, confusions = matches.group_confusions(by)
+            self.assertEqual(names, sorted(expected))
+            for name, c in zip(names, confusions):
+                np.testing.assert_array_equal(c, expected[name])
+
+    def test_subset(self):
+        trials = random_trials(np.random.default_rng(1), 100)
+        matches = agreement.MatchArrays.from_trials(trials)
+        quick = matches.subset(matches.trial_mask(project='quick', snr=10))
+        expected = agreement.MatchArrays.from_trials(
+            t for t in trials if t[0] == 'quick' and t[2] == 10)
+        self.assertLen(quick, len(expected))
+        np.testing.assert_array_equal(quick.confusions(by=())[()],
+                                      expected.confusions(by=())[()])
+        self.assertLen(matches.subset(matches.trial_mask(project='none')), 0)
+
+    def test_builder(self):
+        builder = agreement.MatchArraysBuilder()
+        self.assertEqual(builder.build().confusions(), {})
+        builder.add('win', 'A1S1', 0, [True, False, True], [True, True])  # As zip
+        builder.add('quick', 'A1S1', 5, [False], [False])
+        matches = builder.build(sort_labels=False)
+        self.assertEqual(list(matches.confusions()), ['win', 'quick'])
+        self.assertEqual(matches.offsets.tolist(), [0, 2, 3])
+        rows = agreement.summary(builder.build(), by=('project', 'snr'))
+        self.assertEqual([(r['project'], r['snr'], r['keywords'], r['agreement'])
+                          for r in rows], [('quick', 5, 1, 1.0), ('win', 0, 2, 0.5)])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -62,6 +62,10 @@ from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import sqlite3
 
+import agreement
+import asr_storage
+import scoring
+
 def get_all_sql_data(database: str = 'experiments.db'):
   """Get all the test results from the database, joining all the tables."""
   con = sqlite3.connect(database)
@@ -189,23 +193,23 @@ def split_words(original_list: list[str],
 def process_all_ground_truth(
     db_file: str, 
     homonym_list: Dict[str, Set[str]]) -> Dict[Tuple[str, int, int], 
-                                               List[Set[str]]]:
+                                               scoring.AnswerMatcher]:
   """
   Create a ground truth dictionary, indexed. by the test name, list number,
-  and then sentence number. The ground truth for each sentence is a list of 
-  sets of keywords.
+  and then sentence number. The ground truth for each sentence is the
+  compiled matcher of its keywords (see scoring.py).
   """
   test_transcripts = get_all_test_transcripts(db_file)
   print(f'Read ground truth for {len(test_transcripts)} tests.')
 
   all_ground_truth = {}
+  matchers = scoring.matcher_cache(scoring.ANALYSIS, homonym_list)
   for t in test_transcripts:
     test_name = t[1]
     list_number = t[5]
     sentence_number = t[4]
-    word_list = t[7].lower().split(' ') # a list of words (some with / to separate homonyms)
-    ground_truth = [format_homonyms(word, homonym_list, keep_hyphens=True) 
-                    for word in word_list]
+    # One matcher per keyword (some with / to separate homonyms)
+    ground_truth = matchers.get(t[7])
     all_ground_truth[(test_name, list_number, sentence_number)] = ground_truth
   return all_ground_truth
 
@@ -262,7 +266,8 @@ def normalize_word(word:str, keep_hyphens:bool = False) -> str:
     return re.sub(r'[^\w-]', '', word.lower())
   return re.sub(r'[^\w]', '', word.lower())
 
-def normalize_results(a_result: QS_result) -> QS_result:
+def normalize_results(a_result: QS_result,
+                      words: Optional[List[dict]] = None) -> QS_result:
   """Normalize one result object.  This involves the following steps:
   1) Convert user names that look random into fixed user names
   2) Convert the ASR result from a setence to a list of words
@@ -271,9 +276,19 @@ def normalize_results(a_result: QS_result) -> QS_result:
      # no longer needed since we collect the ground truth at scoring time
   5) Finally, convert the human recognition results into a list of recognized words.
 
+  If the recognized words are given (from the audio_asr_words table) the ASR
+  JSON is not parsed at all.
+
   Return the original result object after these enhancements.
   """
   a_result.user_name = fix_random_user_names(a_result.user_name)
+  if words is not None:
+    if isinstance(a_result.annotation_matches, str):
+      a_result.annotation_matches = json.loads(a_result.annotation_matches)
+    if isinstance(a_result.trials_answer, str):
+      a_result.trials_answer = a_result.trials_answer.split(' ')
+    a_result.asr_words = [w['word'] for w in words]
+    return a_result
   if isinstance(a_result.asr_results, str) and a_result.asr_results:
     a_result.asr_results = json.loads(a_result.asr_results)
 
@@ -297,40 +312,30 @@ def normalize_results(a_result: QS_result) -> QS_result:
 def asr_match(desired_word_set: Union[set[str], str], 
              recognized_words: dict) -> Tuple[bool, float]:
   """Determine if we can find a keyword in the recognized words.
-  Slightly more complicated in cases of hyphenated words.
+  Slightly more complicated in cases of hyphenated words, which match when
+  all their parts are recognized.
   
   Recognized_word is a dictionary with 'word', 'start', 'end', 'prob' fields.
   
   Returns:
     is_match:bool, 
-    start_time:float
+    start_time:float (of the first matching word)
   """
-  if isinstance(desired_word_set, set):
-    # Did the ASR recognize any of the words in the homonym set?
-    results = [asr_match(w, recognized_words) for w in desired_word_set]
-    return any(r[0] for r in results), results[0][1]  # Return first recognized word
-  elif isinstance(desired_word_set, str):
-    desired_word:str = desired_word_set
-    if '-' in desired_word[1:]:  # Ignore leading hyphen
-      parts = desired_word.split('-')
-      parts[1] = set([parts[1], '-' + parts[1]])
-      results = [asr_match(w, recognized_words) for w in parts]
-      has_all_parts = all(r[0] for r in results)
-      return has_all_parts, results[0][1]  # Return first recognized time
-    for reco in recognized_words:
-        asr_word = normalize_word(reco['word'])
-        desired_word = normalize_word(desired_word)
-        if asr_word == desired_word:
-          return True, reco['start']
-    return False, np.nan
-  raise ValueError(f'Unknown type for desired_word_set: {type(desired_word_set)}')
+  if isinstance(desired_word_set, str):
+    desired_word_set = {desired_word_set}
+  elif not isinstance(desired_word_set, set):
+    raise ValueError(f'Unknown type for desired_word_set: {type(desired_word_set)}')
+  slot = scoring.compile_slot(scoring.ANALYSIS, '/'.join(desired_word_set))
+  times = scoring.ANALYSIS.tokenize(recognized_words)
+  return slot.match(times), slot.first_time(times)
 
 
 def score_asr_system(a_result: QS_result,
                      all_ground_truth: Dict[Tuple[str, int, int], 
                                             list[set[str]]],
                      test_name: str = 'unknown', # Optional for debugging
-                     debug: bool = False):
+                     debug: bool = False,
+                     words: Optional[List[dict]] = None):
   # Score the ASR results, creating a list of true/false
   # ground truth is a list of sets of words, one set per keyword
   ground_truth = all_ground_truth[(a_result.trials_project,
@@ -338,6 +343,15 @@ def score_asr_system(a_result: QS_result,
                                    a_result.trials_level_number)]
   word_matches = []
   match_times = []
+  if words is not None:
+    # The recognized words came from the audio_asr_words table.
+    if isinstance(a_result.annotation_matches, str):
+      a_result.annotation_matches = json.loads(a_result.annotation_matches)
+    word_matches, match_times = ground_truth.match_times(
+        scoring.ANALYSIS.tokenize(words))
+    a_result.asr_matches = word_matches
+    a_result.asr_times = match_times
+    return
   # Parse the JSON result, if we haven't already done that.
   if isinstance(a_result.asr_results, str) and a_result.asr_results:
     # print('Trying to parse ASR results for', a_result.asr_results)
@@ -348,12 +362,9 @@ def score_asr_system(a_result: QS_result,
   if (a_result.asr_results and 'segments' in a_result.asr_results and
       a_result.asr_results['segments'] and
       'words' in a_result.asr_results['segments'][0]):
-    for word_truth_set in ground_truth:
-      # For each word in the ground truth, see if ASR found it
-      is_match, word_time = asr_match(word_truth_set,
-                                      a_result.asr_results['segments'][0]['words'])
-      word_matches.append(is_match)
-      match_times.append(word_time)
+    # For each word in the ground truth, see if ASR found it
+    word_matches, match_times = ground_truth.match_times(
+        scoring.ANALYSIS.tokenize(a_result.asr_results['segments'][0]['words']))
   else:
     # Handle cases where segments or words are missing
     # For example, you could set all matches to False and times to NaN
@@ -379,8 +390,13 @@ def score_matches(a_result: QS_result, debug: bool = False):
 
 def convert_sql_to_results(all_query_results,
                            all_ground_truth: List[set[str]], 
-                           debug_count: int = 0) -> List[QS_result]:
+                           debug_count: int = 0,
+                           words_by_ref: Optional[Dict[int, List[dict]]] = None
+                           ) -> List[QS_result]:
   """Convert the SQL database into a list of qs_result objects.
+
+  words_by_ref, if given, holds the recognized words of each result from the
+  compact audio_asr_words table, and is used instead of the ASR JSON.
   """
   debug_test_count = {}
   all_results = []
@@ -400,7 +416,8 @@ def convert_sql_to_results(all_query_results,
       debug_test_count[test_name] += 1
       # print(test_name, debug_test_count[test_name])
 
-      normalize_results(a_result)
+      words = words_by_ref.get(a_result.asr_id, []) if words_by_ref is not None else None
+      normalize_results(a_result, words)
       # if not a_result.user_name.startswith('A'):
       #   continue
       if a_result.user_name in ['A1P8', 'A1P9', 'A2P15']:
@@ -409,7 +426,8 @@ def convert_sql_to_results(all_query_results,
       # if a_result.user_info_value != 'pilot':
       #   continue
       score_asr_system(a_result, all_ground_truth, test_name=test_name,
-                       debug=debug_test_count[test_name] < debug_count)
+                       debug=debug_test_count[test_name] < debug_count,
+                       words=words)
       score_matches(a_result, debug=debug_test_count[test_name] < debug_count)
     all_results.append(a_result)
   return all_results
@@ -465,30 +483,37 @@ def save_results_as_csv(all_results: List[QS_result],
 def accumulate_errors(sum: NDArray, human: ArrayLike, asr: ArrayLike) -> None:
   assert sum.ndim == 2
   assert sum.shape == (2, 2)
-  for h, a in zip(human, asr):
-    sum[int(h), int(a)] += 1
+  n = min(len(human), len(asr))
+  sum += agreement.confusion(list(human)[:n], list(asr)[:n])
 
 # sum = np.zeros((2, 2), dtype=int)
 # accumulate_errors(sum, [True, False], [True, True])
 # sum
 
 
+def all_test_matches(all_results: List[QS_result],
+                     valid_subject_re: re.Pattern) -> agreement.MatchArrays:
+  """Collect the audiologist and ASR matches of the valid subjects' trials,
+  for slicing by test, subject and SNR (see agreement.MatchArrays).
+  """
+  valid_subject_re = re.compile(valid_subject_re)
+  builder = agreement.MatchArraysBuilder()
+  for r in all_results:
+    if valid_subject_re.match(r.user_name):
+      builder.add(r.trials_project, r.user_name, r.trials_snr,
+                  r.annotation_matches or [], r.asr_matches or [])
+  # Keep the tests in the order they were first seen.
+  return builder.build(sort_labels=False)
+
+
 def all_test_confusions(all_results: List[QS_result], 
                         valid_subject_re: re.Pattern) -> Dict[str, NDArray]:
   """Create a dictionary of confusion matrices, one per test type.
   Each confusion matrix is indexed by
     human, asr
   """
-  valid_subject_re = re.compile(valid_subject_re)
-  all_confusions = {}
-  for r in all_results:
-    if valid_subject_re.match(r.user_name):
-      test_name = r.trials_project
-      if test_name not in all_confusions:
-        all_confusions[test_name] = np.zeros((2, 2), dtype=int)
-      accumulate_errors(all_confusions[test_name],
-                        r.annotation_matches, r.asr_matches)
-  return all_confusions
+  return all_test_matches(all_results, valid_subject_re).confusions(
+      by=('project',))
 
 # all_confusions = all_test_confusions(all_results)
 # all_confusions
@@ -637,8 +662,9 @@ def generate_html_report(all_results: List[QS_result],
     # Display ground truth from all_ground_truth dictionary
     ground_truth = all_ground_truth.get((result.trials_project, 
                                          result.trials_trial_number, 
-                                         result.trials_level_number), ["N/A"])
-    ground_truth_string = ', '.join(['/'.join(homonym_list) for homonym_list in ground_truth])
+                                         result.trials_level_number), None)
+    ground_truth_string = 'N/A' if ground_truth is None else ', '.join(
+        ['/'.join(sorted(slot.alternatives)) for slot in ground_truth])
     html_output += f"<td>{ground_truth_string}</td>"
     html_output += f"<td>{', '.join([fix_encoding(r) for r in result.asr_words]) if result.asr_words else 'N/A'}</td>"
     html_output += f"<td>{result.annotation_matches}</td>"
@@ -697,9 +723,14 @@ def main(argv):
   # Read and normalize the user and asr results from the database. Create
   # a list of QS_result objects, and save to a CSV file for later analysis.
   all_query_results = get_all_sql_data(FLAGS.dbfile)
+  words_by_ref = None
+  with sqlite3.connect(FLAGS.dbfile) as con:
+    if asr_storage.has_compact_tables(con):
+      words_by_ref = asr_storage.load_words(con, segment=0)
   all_results = convert_sql_to_results(all_query_results,
                                        all_ground_truth, 
-                                       debug_count=FLAGS.debug_count)
+                                       debug_count=FLAGS.debug_count,
+                                       words_by_ref=words_by_ref)
   csv_file = save_results_as_csv(all_results, 'quicksin_results.csv')
 
   # Summarize the test results
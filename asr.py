@@ -4,10 +4,13 @@ This module provides two ASR engine wrappers around OpenAI Whisper:
 `WhisperASR` for standard transcription and `PromptedWhisperASR` for
 transcription with an optional initial prompt. Each engine exposes a
 `recognize` method that returns the raw Whisper output augmented with
-engine metadata.
+engine metadata.  All of them accept a decode_budget.DecodeBudget that bounds
+the time spent on a single utterance.
 """
 
-from typing import Any, List, Union
+import contextlib
+import time
+from typing import Any, Callable, List, Optional, Union
 
 # Documentation seems to be at:
 #   https://whisper-api.com/docs/transcription-options/#setting-the-language
@@ -18,6 +21,8 @@ import whisper
 from whisper.normalizers import EnglishTextNormalizer
 from whisper.decoding import LogitFilter, DecodingTask
 
+from decode_budget import DecodeBudget, DecodeBudgetExceeded, HARD_GUARDS, fallback_cap_fired
+
 
 # assert not subprocess.run(
 #     ["which", "ffmpeg"], stdout=subprocess.DEVNULL).returncode
@@ -26,6 +31,151 @@ from whisper.decoding import LogitFilter, DecodingTask
 
 whisper_normalizer = EnglishTextNormalizer()
 
+
+@contextlib.contextmanager
+def extra_logit_filters(make_filters: Callable[[DecodingTask], List[LogitFilter]],
+                        on_results: Optional[Callable[[DecodingTask, list], None]] = None):
+    """Add logit filters to every DecodingTask created inside the block.
+
+    Whisper builds a new DecodingTask for each window and temperature, so we
+    temporarily hook DecodingTask.__init__ (and DecodingTask.run).
+
+    Args:
+        make_filters: Called with each new task, returns the filters to append.
+        on_results: If given, called with each task and the DecodingResults
+            its run returned.
+    """
+    original_init = DecodingTask.__init__
+    original_run = DecodingTask.run
+
+    def hooked_init(task_self, task_model, task_options):
+        # Call the original __init__ which sets up task_self.logit_filters
+        original_init(task_self, task_model, task_options)
+        if hasattr(task_self, 'logit_filters'):
+            task_self.logit_filters.extend(make_filters(task_self))
+        else:
+            print("Warning: DecodingTask has no logit_filters attribute. Logit filters will not be applied.")
+
+    def hooked_run(task_self, mel):
+        results = original_run(task_self, mel)
+        on_results(task_self, results)
+        return results
+
+    DecodingTask.__init__ = hooked_init
+    if on_results is not None:
+        DecodingTask.run = hooked_run
+    try:
+        yield
+    finally:
+        # Always restore the original functions so we don't permanently break them
+        DecodingTask.__init__ = original_init
+        DecodingTask.run = original_run
+
+
+class BudgetLogitFilter(LogitFilter):
+    """Enforces the token and wall-clock guards of a DecodeBudget for one
+    DecodingTask (one temperature attempt at one window).
+
+    The token cap itself is Whisper's sample_len; check_results only notes
+    when the text used all of it without ending.  Past the deadline the
+    filter forces the end of the text after the first token, so the
+    remaining windows finish quickly.  The guards that fired are in fired.
+    """
+
+    def __init__(self, eot: int, sample_begin: int, sample_len: Optional[int],
+                 deadline: Optional[float]):
+        self.eot = eot
+        self.sample_begin = sample_begin
+        self.sample_len = sample_len
+        self.deadline = deadline
+        self.fired = set()
+
+    def check_results(self, results: list):
+        """Note the token cap if a DecodingResult of the task ran out of tokens.
+
+        The text of a result stops before its EOT, so one that ended at the
+        last step has sample_len - 1 tokens, and only a cut off one has
+        sample_len.
+        """
+        if self.sample_len and any(len(r.tokens) >= self.sample_len for r in results):
+            self.fired.add('token_cap')
+
+    def apply(self, logits: torch.Tensor, tokens: torch.Tensor):
+        # Whisper divides by the text length when ranking, so let the first
+        # token through before ending the text.
+        if (self.deadline is not None and time.perf_counter() > self.deadline
+                and tokens.shape[-1] > self.sample_begin):
+            self.fired.add('wall_clock')
+            logits[:] = -float('inf')
+            logits[:, self.eot] = 0
+
+
+def budgeted_transcribe(model, audio_path: str,
+                        budget: Optional[DecodeBudget] = None,
+                        logit_filters: List[LogitFilter] = (),
+                        **options) -> dict[str, Any]:
+    """Run model.transcribe with extra logit filters and a decode budget.
+
+    Args:
+        model: The Whisper model.
+        audio_path: Path to the audio file to transcribe.
+        budget: Limits on the decoding, or None for Whisper's defaults.
+        logit_filters: Filters to add to every decoding task.
+        **options: Passed on to model.transcribe.
+
+    Returns:
+        Whisper's result.  With a budget, result['decode_budget'] records the
+        limits used and the guards that fired.
+
+    Raises:
+        DecodeBudgetExceeded: The token or wall-clock guard truncated the text.
+    """
+    if budget is None or not budget.enabled():
+        if not logit_filters:
+            return model.transcribe(audio_path, **options)
+        with extra_logit_filters(lambda task: list(logit_filters)):
+            return model.transcribe(audio_path, **options)
+
+    audio = whisper.load_audio(audio_path)
+    sample_len = budget.sample_len(len(audio) / whisper.audio.SAMPLE_RATE)
+    if sample_len:
+        options['sample_len'] = sample_len
+    temperatures = options['temperature'] = budget.temperatures()
+    deadline = time.perf_counter() + budget.max_seconds if budget.max_seconds > 0 else None
+    # The budget filter of each attempt of each window.  Whisper decodes a
+    # window at each temperature of the ladder in turn until one is good
+    # enough, and keeps the last, so only that attempt's guards count.
+    windows: List[List[BudgetLogitFilter]] = []
+
+    def make_filters(task):
+        budget_filter = BudgetLogitFilter(task.tokenizer.eot, task.sample_begin,
+                                          sample_len, deadline)
+        if not windows or task.options.temperature == temperatures[0]:
+            windows.append([])
+        windows[-1].append(budget_filter)
+        return list(logit_filters) + [budget_filter]
+
+    def check_results(task, results):
+        for logit_filter in task.logit_filters:
+            if isinstance(logit_filter, BudgetLogitFilter):
+                logit_filter.check_results(results)
+
+    with extra_logit_filters(make_filters, check_results):
+        result = model.transcribe(audio, **options)
+    fired = set().union(*(attempts[-1].fired for attempts in windows))
+    if fallback_cap_fired(budget, result.get('segments', [])):
+        fired.add('fallback_cap')
+    guards = sorted(fired)
+    result['decode_budget'] = {'sample_len': sample_len,
+                               'temperatures': list(options['temperature']),
+                               'max_seconds': budget.max_seconds,
+                               'guards': guards}
+    hard = [g for g in guards if g in HARD_GUARDS]
+    if hard:
+        raise DecodeBudgetExceeded(hard, result)
+    return result
+
+
 class WhisperASR:
     """Standard Whisper ASR wrapper.
 
@@ -46,7 +196,8 @@ class WhisperASR:
                   audio_path: str,
                   language: str = 'en',
                   initial_prompt: str = '',
-                  valid_words: List[str] = None # Ignored for this class
+                  valid_words: List[str] = None, # Ignored for this class
+                  budget: Optional[DecodeBudget] = None,
                   ) -> dict[str, Any]:
         """Transcribe an audio file using Whisper.
 
@@ -54,15 +205,20 @@ class WhisperASR:
             audio_path: Path to the audio file to transcribe.
             language: Language code to use for transcription.
             initial_prompt: Optional initial prompt to bias transcription.
+            budget: Optional limits on the decoding time of this utterance.
 
         Returns:
             A dictionary containing Whisper transcription results merged with
             engine metadata.
+
+        Raises:
+            DecodeBudgetExceeded: If the budget truncated the transcription.
         """
-        res = self.model.transcribe(audio_path, word_timestamps=True,
-                                    language=language,
-                                    initial_prompt=initial_prompt,
-                                    fp16=False)
+        res = budgeted_transcribe(self.model, audio_path, budget,
+                                  word_timestamps=True,
+                                  language=language,
+                                  initial_prompt=initial_prompt,
+                                  fp16=False)
         return {**res, **self.meta}
 
 
@@ -89,7 +245,8 @@ class PromptedWhisperASR:
                   audio_path: str,
                   language: str = 'en',
                   initial_prompt: str = '',
-                  valid_words: List[str] = None # Ignored for this class
+                  valid_words: List[str] = None, # Ignored for this class
+                  budget: Optional[DecodeBudget] = None,
                   ) -> dict[str, Any]:
         """Transcribe an audio file using Whisper with an initial prompt.
 
@@ -97,13 +254,18 @@ class PromptedWhisperASR:
             audio_path: Path to the audio file to transcribe.
             language: Language code to use for transcription.
             initial_prompt: Optional initial prompt to bias transcription.
+            budget: Optional limits on the decoding time of this utterance.
 
         Returns:
             A dictionary containing Whisper transcription results merged with
             engine metadata.
+
+        Raises:
+            DecodeBudgetExceeded: If the budget truncated the transcription.
         """
-        res = self.model.transcribe(
-                audio_path, word_timestamps=True,
+        res = budgeted_transcribe(
+                self.model, audio_path, budget,
+                word_timestamps=True,
                 initial_prompt=initial_prompt,
                 language=language,
                 fp16=False)
@@ -131,11 +293,16 @@ class OOVLogitFilter(LogitFilter):
         logits[:, mask] -= self.penalty
 
 class ForcedWhisperASR(WhisperASR): # Assuming WhisperASR is your base class
+    def __init__(self, model_name: str = "small.en"):
+        super().__init__(model_name)
+        self.meta = {"model_name": model_name, "model_type": "forced"}
+
     def recognize(self, audio_path: str, 
                   initial_prompt: str = '', 
                   valid_words: List[str] = None, 
                   oov_penalty: float = 10.0,
-                  language='en') -> dict[str, Any]:
+                  language='en',
+                  budget: Optional[DecodeBudget] = None) -> dict[str, Any]:
         options = {"initial_prompt": initial_prompt, 
                    "word_timestamps": True,
                    "fp16": False}
@@ -166,31 +333,12 @@ class ForcedWhisperASR(WhisperASR): # Assuming WhisperASR is your base class
                 timestamp_begin=timestamp_begin
             )
             
-            # Temporarily inject the filter into Whisper's DecodingTask __init__
-            original_init = DecodingTask.__init__
-            
-            def hooked_init(task_self, task_model, task_options):
-                # Call the original __init__ which sets up task_self.logit_filters
-                original_init(task_self, task_model, task_options)
-                
-                # Append our custom filter to the pipeline
-                if hasattr(task_self, 'logit_filters'):
-                    task_self.logit_filters.append(custom_filter)
-                else:   
-                    print("Warning: DecodingTask has no logit_filters attribute. OOV filtering may not work.")
-
-            DecodingTask.__init__ = hooked_init
-            
-            try:
-                # Transcribe with the hooked filter
-                result = self.model.transcribe(audio_path, **options)
-                print(f"Applied OOV filter with {len(allowed_token_ids)} allowed tokens and penalty {oov_penalty}")
-                print(f' Transcribe returned: {result}')
-            finally:
-                # Always restore the original function so we don't permanently break it
-                DecodingTask.__init__ = original_init
-                
-            return result
+            # Transcribe with the filter added to each of Whisper's decoding tasks
+            result = budgeted_transcribe(self.model, audio_path, budget,
+                                         logit_filters=[custom_filter], **options)
+            print(f"Applied OOV filter with {len(allowed_token_ids)} allowed tokens and penalty {oov_penalty}")
+            print(f' Transcribe returned: {result}')
+            return {**result, **self.meta}
             
         # Fallback if no valid_words were passed
-        return self.model.transcribe(audio_path, **options)
\ No newline at end of file
+        return {**budgeted_transcribe(self.model, audio_path, budget, **options), **self.meta}
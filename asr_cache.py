@@ -0,0 +1,273 @@
+"""Persistent, content-addressed cache of ASR results.
+
+Whisper results only depend on the audio and on the decoding configuration,
+so they are cached under a key built from the hash of the audio file and
+every option that changes the decoding: the model name, the engine class,
+the prompt, the valid-words list, the OOV penalty, the acoustic prime, the
+language and the decode budget.
+
+The cache lives in its own SQLite file, separate from experiments.db, so it
+survives clear_single_word_asr.py, offline_asr.py --force, and copying the
+database into a new run_exp directory.  Several worker processes can share
+one cache file.  Each offline_asr run is recorded in a runs table so we can
+report how much decoding time the cache saved.  The last-used times and the
+run counters are buffered and written in one transaction per flush_every
+updates (and by flush() and close()), so the processes sharing the file
+rarely wait for each other's write lock.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+CACHE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        decode_seconds REAL NOT NULL,
+        created REAL NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_results_last_used ON results (last_used);
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        label TEXT,
+        started REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0,
+        saved_seconds REAL NOT NULL DEFAULT 0,
+        decode_seconds REAL NOT NULL DEFAULT 0
+    );
+"""
+
+# Digests of files we have already hashed, keyed by (path, size, mtime).
+_file_digests: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 hex digest of a file's contents.
+
+    Digests are memoized by path, size and modification time, so priming
+    files that are reused for many utterances are only read once.
+
+    Args:
+        path: Path to the file to hash.
+
+    Returns:
+        The hex digest of the file contents.
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _file_digests:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _file_digests[memo_key] = h.hexdigest()
+    return _file_digests[memo_key]
+
+
+def value_digest(value: Any) -> str:
+    """Return the SHA-256 hex digest of a JSON-serializable value."""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True)
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def make_key(audio_hash: str,
+             model_name: str,
+             engine: str,
+             prompt: str = '',
+             valid_words: Optional[List[str]] = None,
+             oov_penalty: Optional[float] = None,
+             priming: str = '',
+             language: str = 'en',
+             budget: Optional[Dict[str, Any]] = None) -> str:
+    """Build the cache key for one decoding.
+
+    Args:
+        audio_hash: Digest of the audio file to recognize.
+        model_name: The Whisper model name, such as "medium.en".
+        engine: Name of the ASR engine class.
+        prompt: The initial prompt passed to Whisper.
+        valid_words: Valid words for forced decoding, or None.
+        oov_penalty: OOV penalty for forced decoding, or None.
+        priming: Digest and length of the acoustic prime, or '' for none.
+        language: Language code used for transcription.
+        budget: The settings of the decode budget, or None if there is none.
+
+    Returns:
+        A hex string identifying this audio and decoding configuration.
+    """
+    fields = {
+        'audio': audio_hash,
+        'model_name': model_name,
+        'engine': engine,
+        'prompt': value_digest(prompt) if prompt else '',
+        'valid_words': value_digest(valid_words) if valid_words else '',
+        'oov_penalty': oov_penalty if valid_words else None,
+        'priming': priming,
+        'language': language,
+    }
+    if budget:
+        # Only added when set, so the keys of earlier results stay valid.
+        fields['budget'] = budget
+    return value_digest(fields)
+
+
+class ASRCache:
+    """A size-bounded cache of ASR results stored in a SQLite file."""
+
+    def __init__(self, path: str, max_bytes: int = 0, flush_every: int = 256):
+        """Open (creating if needed) the cache.
+
+        Args:
+            path: Path to the cache's SQLite file.
+            max_bytes: Target maximum size of the cached results, enforced by
+                evict(). Zero means unbounded.
+            flush_every: Number of buffered touch() and record() calls
+                written together by one flush().
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.con = sqlite3.connect(path, timeout=60.0)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.executescript(CACHE_SCHEMA)
+        # Buffered last_used times, and [hits, misses, saved, decoded] by run.
+        self._touched: Dict[str, float] = {}
+        self._runs: Dict[int, List[float]] = {}
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self.con.close()
+
+    def lookup(self, key: str, touch: bool = True
+               ) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return the cached result and its original decode time, or None.
+
+        Args:
+            key: The cache key, from make_key.
+            touch: Whether to mark the result as used. Worker processes pass
+                False and leave it to the process that owns the run.
+        """
+        row = self.con.execute(
+            'SELECT data, decode_seconds FROM results WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            return None
+        if touch:
+            self.touch(key)
+        return json.loads(zlib.decompress(row[0])), row[1]
+
+    def touch(self, key: str):
+        """Mark a result as used now (written by the next flush)."""
+        self._touched[key] = time.time()
+        self._buffered()
+
+    def store(self, key: str, result: Dict[str, Any], decode_seconds: float):
+        """Add a result to the cache."""
+        data = zlib.compress(json.dumps(result).encode('utf-8'))
+        now = time.time()
+        with self.con:
+            self.con.execute(
+                'INSERT OR REPLACE INTO results '
+                '(key, data, size, decode_seconds, created, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, data, len(data), decode_seconds, now, now))
+
+    def start_run(self, label: str = '') -> int:
+        """Register a new run and return its id, used by record()."""
+        with self.con:
+            cur = self.con.execute(
+                'INSERT INTO runs (label, started) VALUES (?, ?)',
+                (label, time.time()))
+        return cur.lastrowid
+
+    def record(self, run_id: int, hit: bool, seconds: float):
+        """Count one lookup for a run (written by the next flush).
+
+        Args:
+            run_id: The id returned by start_run.
+            hit: Whether the result came from the cache.
+            seconds: For a hit, the decode time the cache saved; for a miss,
+                the time spent decoding.
+        """
+        counts = self._runs.setdefault(run_id, [0, 0, 0.0, 0.0])
+        if hit:
+            counts[0] += 1
+            counts[2] += seconds
+        else:
+            counts[1] += 1
+            counts[3] += seconds
+        self._buffered()
+
+    def _buffered(self):
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered last_used times and run counters in one transaction."""
+        if not self._pending:
+            return
+        with self.con:
+            self.con.executemany(
+                'UPDATE results SET last_used = MAX(last_used, ?) WHERE key = ?',
+                [(t, key) for key, t in self._touched.items()])
+            self.con.executemany(
+                'UPDATE runs SET hits = hits + ?, misses = misses + ?, '
+                'saved_seconds = saved_seconds + ?, '
+                'decode_seconds = decode_seconds + ? WHERE id = ?',
+                [tuple(counts) + (run_id,) for run_id, counts in self._runs.items()])
+        self._touched.clear()
+        self._runs.clear()
+        self._pending = 0
+
+    def run_report(self, run_id: int) -> Dict[str, Any]:
+        """Return the hit/miss counts and the time saved for a run."""
+        self.flush()
+        row = self.con.execute(
+            'SELECT hits, misses, saved_seconds, decode_seconds FROM runs '
+            'WHERE id = ?', (run_id,)).fetchone()
+        hits, misses, saved, decoded = row if row else (0, 0, 0.0, 0.0)
+        total = hits + misses
+        return {'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / total if total else 0.0,
+                'saved_seconds': saved,
+                'decode_seconds': decoded}
+
+    def size(self) -> Tuple[int, int]:
+        """Return the number of cached results and their total size in bytes."""
+        count, total = self.con.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return count, total
+
+    def evict(self) -> int:
+        """Remove the least recently used results until under max_bytes.
+
+        Returns:
+            The number of results removed.
+        """
+        if not self.max_bytes:
+            return 0
+        self.flush()
+        _, total = self.size()
+        if total <= self.max_bytes:
+            return 0
+        victims = []
+        for key, size in self.con.execute(
+                'SELECT key, size FROM results ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        with self.con:
+            self.con.executemany('DELETE FROM results WHERE key = ?', victims)
+        return len(victims)
@@ -0,0 +1,83 @@
+"""Tests for asr_cache.py."""
+
+import os
+
+from absl.testing import absltest
+
+import asr_cache
+
+
+class ASRCacheTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_path = os.path.join(self.create_tempdir().full_path, 'cache.db')
+
+    def test_make_key(self):
+        key = asr_cache.make_key('abc', 'tiny.en', 'WhisperASR')
+        self.assertEqual(key, asr_cache.make_key('abc', 'tiny.en', 'WhisperASR'))
+        self.assertNotEqual(key, asr_cache.make_key('abc', 'tiny.en', 'WhisperASR',
+                                                    prompt='Please select'))
+        self.assertNotEqual(
+            asr_cache.make_key('abc', 'tiny.en', 'ForcedWhisperASR',
+                               valid_words=['a'], oov_penalty=10.0),
+            asr_cache.make_key('abc', 'tiny.en', 'ForcedWhisperASR',
+                               valid_words=['a'], oov_penalty=5.0))
+
+    def test_file_digest(self):
+        path = self.create_tempfile(content='audio').full_path
+        self.assertEqual(asr_cache.file_digest(path), asr_cache.value_digest('audio'))
+
+    def test_store_lookup_and_report(self):
+        cache = asr_cache.ASRCache(self.cache_path)
+        run_id = cache.start_run('test')
+        self.assertIsNone(cache.lookup('k'))
+        cache.store('k', {'text': 'hello'}, 2.5)
+        cache.record(run_id, False, 2.5)
+        result, seconds = cache.lookup('k')
+        cache.record(run_id, True, seconds)
+        self.assertEqual(result, {'text': 'hello'})
+        report = cache.run_report(run_id)
+        self.assertEqual((report['hits'], report['misses']), (1, 1))
+        self.assertAlmostEqual(report['saved_seconds'], 2.5)
+        cache.close()
+
+    def test_buffered_writes(self):
+        cache = asr_cache.ASRCache(self.cache_path, flush_every=3)
+        other = asr_cache.ASRCache(self.cache_path)
+        run_id = cache.start_run('test')
+        cache.store('k', {'text': 'hello'}, 2.5)
+        cache.con.execute("UPDATE results SET last_used = 0")
+        cache.con.commit()
+        self.assertIsNotNone(cache.lookup('k'))
+        cache.record(run_id, True, 2.5)
+        # Nothing is written until flush_every updates are buffered.
+        self.assertEqual(other.con.execute('SELECT last_used FROM results').fetchone(), (0,))
+        self.assertEqual(other.run_report(run_id)['hits'], 0)
+        cache.record(run_id, False, 1.0)
+        self.assertGreater(other.con.execute('SELECT last_used FROM results').fetchone()[0], 0)
+        self.assertEqual((other.run_report(run_id)['hits'], other.run_report(run_id)['misses']),
+                         (1, 1))
+        # A worker's lookup without touch buffers nothing; close() flushes the rest.
+        other.lookup('k', touch=False)
+        self.assertEqual(other._pending, 0)
+        cache.record(run_id, True, 2.5)
+        cache.close()
+        self.assertEqual(other.run_report(run_id)['hits'], 2)
+        other.close()
+
+    def test_evict_least_recently_used(self):
+        cache = asr_cache.ASRCache(self.cache_path)
+        for i in range(4):
+            cache.store(f'k{i}', {'text': 'x' * 1000 + str(i)}, 1.0)
+        cache.con.execute("UPDATE results SET last_used = 0 WHERE key = 'k0'")
+        _, total = cache.size()
+        cache.max_bytes = total - 1
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.lookup('k0'))
+        self.assertIsNotNone(cache.lookup('k3'))
+        cache.close()
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -0,0 +1,273 @@
+"""Compact storage of ASR results for the analysis programs.
+
+audio_asr.data holds Whisper's full JSON for every trial (segment token ids,
+avg_logprob, compression ratios, ...), but the analysis programs only need
+the recognized text and the per-word word/start/end/probability. This module
+keeps those in compact form next to the JSON:
+
+  audio_asr.text     The recognized text.
+  audio_asr_words    One row per recognized word: (ref, idx, segment, word,
+                     start_time, end_time, prob), in recognition order.
+  audio_asr_raw      Optionally, the full Whisper JSON, zlib-compressed. In
+                     that case audio_asr.data only keeps the top-level fields
+                     (text, model_name, model_type, ...) without the segments.
+
+Readers use has_compact_tables() to decide whether they can read these tables
+and fall back to parsing audio_asr.data for rows written before the
+migration (audio_asr.text is NULL for those).
+
+audio_asr also gets virtual generated columns for the fields we select
+results by (model_name, model_type and config_fingerprint, see
+MODEL_COLUMNS), with indexes, so filtering by model is an index lookup
+instead of a json_extract() over every row.
+"""
+import json
+import sqlite3
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+RAW_STORAGE_MODES = ['inline', 'cold']
+
+ASR_WORDS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS audio_asr_words (
+        ref INTEGER NOT NULL,
+        idx INTEGER NOT NULL,
+        segment INTEGER NOT NULL,
+        word TEXT,
+        start_time REAL,
+        end_time REAL,
+        prob REAL,
+        PRIMARY KEY (ref, idx)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS audio_asr_raw (
+        ref INTEGER PRIMARY KEY,
+        data BLOB
+    );
+"""
+
+# Generated columns of audio_asr and the JSON field each one is extracted from.
+MODEL_COLUMNS = {
+    'model_name': '$.model_name',
+    'model_type': '$.model_type',
+    'config_fingerprint': '$.config_fingerprint',
+}
+
+MODEL_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_audio_asr_model ON audio_asr (model_name, model_type);
+    CREATE INDEX IF NOT EXISTS idx_audio_asr_config_fingerprint ON audio_asr (config_fingerprint);
+"""
+
+
+def table_columns(con: sqlite3.Connection, table: str) -> List[str]:
+    """Return the column names of a table (empty if it does not exist)."""
+    return [row[1] for row in con.execute(f'PRAGMA table_xinfo({table})')]
+
+
+def has_compact_tables(con: sqlite3.Connection) -> bool:
+    """Return whether the database has the text column and the words table."""
+    return ('text' in table_columns(con, 'audio_asr') and
+            bool(table_columns(con, 'audio_asr_words')))
+
+
+def ensure_compact_tables(con: sqlite3.Connection):
+    """Create the compact tables and the audio_asr.text column if needed."""
+    con.executescript(ASR_WORDS_SCHEMA)
+    if 'text' not in table_columns(con, 'audio_asr'):
+        con.execute('ALTER TABLE audio_asr ADD COLUMN text TEXT')
+
+
+def json_field_sql(column: str, path: str) -> str:
+    """Return the SQL expression extracting a JSON field, NULL for invalid JSON."""
+    return f"CASE WHEN json_valid({column}) THEN json_extract({column}, '{path}') END"
+
+
+def has_model_columns(con: sqlite3.Connection) -> bool:
+    """Return whether audio_asr has the generated model columns."""
+    return set(MODEL_COLUMNS) <= set(table_columns(con, 'audio_asr'))
+
+
+def model_field_sql(con: sqlite3.Connection, field: str, table: str = 'audio_asr') -> str:
+    """Return the SQL expression for a field of MODEL_COLUMNS.
+
+    This is the (indexed) generated column when the database has it, and
+    otherwise the json_extract() of audio_asr.data.
+
+    Args:
+        con: A connection to the experiments database.
+        field: One of the keys of MODEL_COLUMNS.
+        table: The name or alias of audio_asr in the query.
+    """
+    if field not in MODEL_COLUMNS:
+        raise ValueError(f'Unknown audio_asr field {field!r}, '
+                         f'expected one of {sorted(MODEL_COLUMNS)}')
+    if field in table_columns(con, 'audio_asr'):
+        return f'{table}.{field}'
+    return json_field_sql(f'{table}.data', MODEL_COLUMNS[field])
+
+
+def ensure_model_columns(con: sqlite3.Connection):
+    """Add the generated model columns to audio_asr and index them.
+
+    The columns are VIRTUAL, so adding them does not rewrite the table, but
+    building the indexes reads the JSON of every row once.
+    """
+    columns = table_columns(con, 'audio_asr')
+    for column, path in MODEL_COLUMNS.items():
+        if column not in columns:
+            con.execute(f'ALTER TABLE audio_asr ADD COLUMN {column} TEXT '
+                        f'GENERATED ALWAYS AS ({json_field_sql("data", path)}) VIRTUAL')
+    con.executescript(MODEL_INDEXES)
+
+
+def result_text(res: Dict[str, Any]) -> str:
+    """Return the recognized text of a Whisper result as a string.
+
+    Results with an acoustic prime store the text as a list of words (see
+    offline_asr.remove_prime_from_results); those are joined back together.
+    """
+    text = res.get('text', '')
+    if isinstance(text, list):
+        return ''.join(str(t) for t in text)
+    return str(text or '')
+
+
+def result_words(res: Dict[str, Any]) -> List[Tuple[int, str, Any, Any, Any]]:
+    """Return (segment, word, start, end, probability) for each recognized word."""
+    words = []
+    for segment_number, segment in enumerate(res.get('segments') or []):
+        for w in segment.get('words') or []:
+            words.append((segment_number, w.get('word'), w.get('start'),
+                          w.get('end'), w.get('probability')))
+    return words
+
+
+def slim_result(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the top-level fields of a Whisper result, without the segments."""
+    return {k: v for k, v in res.items() if k != 'segments'}
+
+
+def write_compact(cur: sqlite3.Cursor, ref: int, res: Dict[str, Any],
+                  raw_storage: str = 'inline'):
+    """Write the text, word rows and (for 'cold' storage) the raw JSON of a result.
+
+    The caller is responsible for writing audio_asr.data (see stored_data) and
+    committing.
+
+    Args:
+        cur: A cursor on the experiments database.
+        ref: The audio_results id of the trial.
+        res: The Whisper result dictionary.
+        raw_storage: 'inline' to keep the full JSON in audio_asr.data, or
+            'cold' to compress it into audio_asr_raw.
+    """
+    cur.execute('UPDATE audio_asr SET text = ? WHERE ref = ?',
+                (result_text(res), ref))
+    cur.execute('DELETE FROM audio_asr_words WHERE ref = ?', (ref,))
+    cur.executemany(
+        'INSERT INTO audio_asr_words '
+        '(ref, idx, segment, word, start_time, end_time, prob) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(ref, i) + w for i, w in enumerate(result_words(res))])
+    if raw_storage == 'cold':
+        cur.execute('INSERT OR REPLACE INTO audio_asr_raw (ref, data) VALUES (?, ?)',
+                    (ref, zlib.compress(json.dumps(res).encode('utf-8'))))
+    else:
+        cur.execute('DELETE FROM audio_asr_raw WHERE ref = ?', (ref,))
+
+
+def stored_data(res: Dict[str, Any], raw_storage: str = 'inline') -> str:
+    """Return the JSON to store in audio_asr.data for a result."""
+    if raw_storage == 'cold':
+        return json.dumps(slim_result(res))
+    return json.dumps(res)
+
+
+def load_result(con: sqlite3.Connection, ref: int) -> Optional[Dict[str, Any]]:
+    """Return the full Whisper result of a trial, wherever it is stored."""
+    if table_columns(con, 'audio_asr_raw'):
+        row = con.execute('SELECT data FROM audio_asr_raw WHERE ref = ?',
+                          (ref,)).fetchone()
+        if row and row[0]:
+            return json.loads(zlib.decompress(row[0]))
+    row = con.execute('SELECT data FROM audio_asr WHERE ref = ?', (ref,)).fetchone()
+    if not row or not row[0]:
+        return None
+    return json.loads(row[0])
+
+
+def load_words(con: sqlite3.Connection,
+               segment: Optional[int] = None,
+               refs: Optional[Iterable[int]] = None
+               ) -> Dict[int, List[Dict[str, Any]]]:
+    """Return the recognized words of each trial from audio_asr_words.
+
+    Args:
+        con: A connection to the experiments database.
+        segment: If given, only return words from this segment number (the
+            reports have always shown the words of the first segment).
+        refs: If given, only return the words of these trials.
+
+    Returns:
+        A dictionary mapping the audio_results id to a list of word dicts with
+        Whisper's keys: 'word', 'start', 'end' and 'probability'.
+    """
+    query = ('SELECT ref, word, start_time, end_time, prob FROM audio_asr_words '
+             'WHERE (? IS NULL OR segment = ?)')
+    args: Tuple = (segment, segment)
+    if refs is not None:
+        refs = list(refs)
+        query += f' AND ref IN ({", ".join("?" * len(refs))})'
+        args += tuple(refs)
+    words: Dict[int, List[Dict[str, Any]]] = {}
+    for ref, word, start, end, prob in con.execute(query + ' ORDER BY ref, idx', args):
+        words.setdefault(ref, []).append(
+            {'word': word, 'start': start, 'end': end, 'probability': prob})
+    return words
+
+
+def backfill(con: sqlite3.Connection, batch_size: int = 1000,
+             raw_storage: str = 'inline') -> int:
+    """Fill the compact tables for rows written before they existed.
+
+    Rows are converted in batches, each committed separately, so the
+    migration can be interrupted and restarted, and never holds more than one
+    batch of JSON in memory.
+
+    Args:
+        con: A connection to the experiments database.
+        batch_size: Number of audio_asr rows converted per transaction.
+        raw_storage: 'inline' to leave audio_asr.data alone, or 'cold' to also
+            move the full JSON into audio_asr_raw.
+
+    Returns:
+        The number of rows converted.
+    """
+    ensure_compact_tables(con)
+    con.commit()
+    converted = 0
+    last_ref = -1
+    while True:
+        rows = con.execute(
+            "SELECT ref, data FROM audio_asr "
+            "WHERE ref > ? AND text IS NULL AND data IS NOT NULL AND data != '' "
+            "ORDER BY ref LIMIT ?", (last_ref, batch_size)).fetchall()
+        if not rows:
+            break
+        cur = con.cursor()
+        for ref, data in rows:
+            last_ref = ref
+            try:
+                res = json.loads(data)
+            except json.JSONDecodeError:
+                print(f'Skipping ref {ref}: invalid ASR JSON.')
+                continue
+            if not isinstance(res, dict):
+                continue
+            write_compact(cur, ref, res, raw_storage=raw_storage)
+            if raw_storage == 'cold':
+                cur.execute('UPDATE audio_asr SET data = ? WHERE ref = ?',
+                            (stored_data(res, raw_storage), ref))
+            converted += 1
+        con.commit()
+        print(f'Converted {converted} audio_asr rows (up to ref {last_ref}).')
+    return converted
@@ -0,0 +1,85 @@
+"""Tests for asr_storage.py."""
+
+import json
+import sqlite3
+
+from absl.testing import absltest
+
+import asr_storage
+
+
+def whisper_result(words, text=None):
+    return {'text': text if text is not None else ' '.join(words),
+            'model_name': 'tiny.en',
+            'segments': [{'id': 0, 'tokens': [1, 2, 3],
+                          'words': [{'word': w, 'start': i * 0.5,
+                                     'end': i * 0.5 + 0.4, 'probability': 0.9}
+                                    for i, w in enumerate(words)]}]}
+
+
+class ASRStorageTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.con = sqlite3.connect(':memory:')
+        self.con.execute('CREATE TABLE audio_asr (ref INTEGER PRIMARY KEY, data TEXT)')
+        self.con.executemany(
+            'INSERT INTO audio_asr (ref, data) VALUES (?, ?)',
+            [(1, json.dumps(whisper_result(['hello', 'world']))),
+             (2, json.dumps(whisper_result(['ship'], text=['[prime] ', 'ship']))),
+             (3, 'not json'),
+             (4, '')])
+        self.con.commit()
+
+    def test_result_text(self):
+        self.assertEqual(asr_storage.result_text({'text': 'a b'}), 'a b')
+        self.assertEqual(asr_storage.result_text({'text': ['a', ' b']}), 'a b')
+        self.assertEqual(asr_storage.result_text({}), '')
+
+    def test_backfill(self):
+        self.assertFalse(asr_storage.has_compact_tables(self.con))
+        self.assertEqual(asr_storage.backfill(self.con, batch_size=1), 2)
+        self.assertTrue(asr_storage.has_compact_tables(self.con))
+
+        texts = dict(self.con.execute('SELECT ref, text FROM audio_asr'))
+        self.assertEqual(texts[1], 'hello world')
+        self.assertEqual(texts[2], '[prime] ship')
+        self.assertIsNone(texts[3])
+        words = asr_storage.load_words(self.con, segment=0)
+        self.assertEqual([w['word'] for w in words[1]], ['hello', 'world'])
+        self.assertEqual(asr_storage.load_words(self.con, refs=[2]).keys(), {2})
+
+        # Already converted rows are skipped on a second run.
+        self.assertEqual(asr_storage.backfill(self.con), 0)
+
+    def test_backfill_cold(self):
+        asr_storage.backfill(self.con, raw_storage='cold')
+        data = json.loads(self.con.execute(
+            'SELECT data FROM audio_asr WHERE ref = 1').fetchone()[0])
+        self.assertEqual(data['model_name'], 'tiny.en')
+        self.assertNotIn('segments', data)
+        self.assertEqual(asr_storage.load_result(self.con, 1),
+                         whisper_result(['hello', 'world']))
+        self.assertIsNone(asr_storage.load_result(self.con, 4))
+
+    def test_model_columns(self):
+        self.assertEqual(asr_storage.model_field_sql(self.con, 'model_name'),
+                         "CASE WHEN json_valid(audio_asr.data) THEN "
+                         "json_extract(audio_asr.data, '$.model_name') END")
+        with self.assertRaises(ValueError):
+            asr_storage.model_field_sql(self.con, 'text')
+
+        asr_storage.ensure_model_columns(self.con)
+        asr_storage.ensure_model_columns(self.con)  # Safe to run again.
+        self.assertTrue(asr_storage.has_model_columns(self.con))
+        self.assertEqual(asr_storage.model_field_sql(self.con, 'model_name', 'asr'),
+                         'asr.model_name')
+        names = dict(self.con.execute('SELECT ref, model_name FROM audio_asr'))
+        self.assertEqual(names, {1: 'tiny.en', 2: 'tiny.en', 3: None, 4: None})
+        plan = ' '.join(row[-1] for row in self.con.execute(
+            "EXPLAIN QUERY PLAN SELECT ref FROM audio_asr WHERE model_name = 'tiny.en'"))
+        self.assertIn('idx_audio_asr_model', plan)
+
+
+if __name__ == '__main__':
+    absltest.main()
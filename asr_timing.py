@@ -0,0 +1,239 @@
+"""Per-stage timing of the offline ASR pipeline.
+
+offline_asr.py times each task in these stages:
+
+  queue_wait      From handing the task to a free worker until the worker
+                  starts it: the pool hand-over.  offline_asr.py gives the
+                  pool one task per worker at a time (see imap_submitted),
+                  so this does not include the time spent behind other tasks.
+  audio_load      Reading the WAV file (to get its duration).
+  priming_concat  Running ffmpeg to prepend the acoustic prime.
+  transcribe      The whole call to the recognizer, split (for Whisper models
+                  instrumented with instrument_engine) into:
+    encode        Time spent in the audio encoder.
+    decode        Time spent decoding, excluding the encoder.
+  db_write        Writing the result into the experiments database.
+
+plus the number of decodes run at a temperature above zero (Whisper's
+temperature fallbacks) and the decode budget guards that fired (see
+decode_budget.py). Each task becomes one JSON line in the trace file,
+and summarize() reduces the records to real-time factor, utterances per
+second and latency percentiles per project and model.
+
+The encoder and decoder times are measured on the host, so they are only
+exact on the CPU; on a GPU part of the encoder time shows up as decode time.
+"""
+import collections
+import contextlib
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, TextIO
+
+import numpy as np
+
+STAGES = ['queue_wait', 'audio_load', 'priming_concat', 'transcribe',
+          'encode', 'decode', 'db_write']
+
+
+class TaskTimer:
+    """Accumulates the time spent in each stage of one task."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as (part of) stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+
+class EngineStats:
+    """Encoder/decoder counters of the model loaded in this process."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.encode_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.decode_calls = 0
+        self.fallbacks = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {'encode': self.encode_seconds,
+                'decode': self.decode_seconds,
+                'decode_calls': self.decode_calls,
+                'fallbacks': self.fallbacks}
+
+    def restore(self, snapshot: Dict[str, Any]):
+        """Reset the counters to a value returned by snapshot()."""
+        self.encode_seconds = snapshot['encode']
+        self.decode_seconds = snapshot['decode']
+        self.decode_calls = snapshot['decode_calls']
+        self.fallbacks = snapshot['fallbacks']
+
+
+# Each worker process has its own model, and so its own counters.
+engine_stats = EngineStats()
+
+
+def instrument_engine(engine: Any) -> bool:
+    """Count the encoder and decoder time of an engine's Whisper model.
+
+    Adds forward hooks to the model's encoder and wraps model.decode, which
+    whisper.transcribe calls once per 30 second window and temperature.
+    The counts go to engine_stats.
+
+    Args:
+        engine: An ASR engine from asr.py, with the Whisper model in .model.
+
+    Returns:
+        Whether the engine could be instrumented.
+    """
+    import torch  # Only needed when there is a model to instrument.
+
+    model = getattr(engine, 'model', None)
+    if not isinstance(model, torch.nn.Module) or getattr(model, '_asr_timing', False):
+        return False
+    encoder = getattr(model, 'encoder', None)
+    if not isinstance(encoder, torch.nn.Module):
+        return False
+    encoder_start = []
+
+    def pre_hook(module, inputs):
+        encoder_start.append(time.perf_counter())
+
+    def post_hook(module, inputs, output):
+        if encoder_start:
+            engine_stats.encode_seconds += time.perf_counter() - encoder_start.pop()
+
+    encoder.register_forward_pre_hook(pre_hook)
+    encoder.register_forward_hook(post_hook)
+
+    original_decode = model.decode
+
+    def timed_decode(mel, options=None, **kwargs):
+        encode_before = engine_stats.encode_seconds
+        start = time.perf_counter()
+        try:
+            if options is None:
+                return original_decode(mel, **kwargs)
+            return original_decode(mel, options, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            # The decoding task runs the encoder itself; don't count it twice.
+            engine_stats.decode_seconds += elapsed - (engine_stats.encode_seconds -
+                                                      encode_before)
+            engine_stats.decode_calls += 1
+            if getattr(options, 'temperature', 0.0):
+                engine_stats.fallbacks += 1
+
+    model.decode = timed_decode
+    model._asr_timing = True
+    return True
+
+
+def write_record(trace: Optional[TextIO], record: Dict[str, Any]):
+    """Append one task record to a JSONL trace, if there is one."""
+    if trace is not None:
+        trace.write(json.dumps(record) + '\n')
+        trace.flush()
+
+
+def read_trace(path: str) -> List[Dict[str, Any]]:
+    """Read the task records of a JSONL trace file."""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _group_summary(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Summarize the records of one project and model."""
+    ok = [r for r in records if not r.get('error')]
+    decoded = [r for r in ok if not r.get('cache_hit')]
+    latency = np.array([r.get('task_seconds', 0.0) for r in ok])
+    audio_seconds = sum(max(r.get('audio_seconds', 0.0), 0.0) for r in decoded)
+    transcribe_seconds = sum(r.get('transcribe', 0.0) for r in decoded)
+    task_seconds = float(latency.sum())
+    summary = {
+        'utterances': len(ok),
+        'errors': len(records) - len(ok),
+        'cache_hits': len(ok) - len(decoded),
+        'audio_seconds': audio_seconds,
+        # Seconds of recognizer time per second of audio.
+        'real_time_factor': transcribe_seconds / audio_seconds if audio_seconds else None,
+        # Throughput of a single worker.
+        'utterances_per_second': len(ok) / task_seconds if task_seconds else None,
+        'p50_latency': float(np.percentile(latency, 50)) if len(ok) else None,
+        'p95_latency': float(np.percentile(latency, 95)) if len(ok) else None,
+        'fallbacks': sum(r.get('fallbacks', 0) for r in ok),
+        'guards': dict(collections.Counter(
+            g for r in records for g in r.get('budget_guards') or [])),
+        'mean_seconds': {stage: sum(r.get(stage, 0.0) for r in ok) / len(ok)
+                         for stage in STAGES} if ok else {},
+    }
+    return summary
+
+
+def summarize(records: Iterable[Dict[str, Any]],
+              wall_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """Reduce task records to per project and model timing statistics.
+
+    Args:
+        records: Task records, as written to the trace.
+        wall_seconds: Elapsed time of the whole run, used for the overall
+            throughput (all workers together).
+
+    Returns:
+        A dictionary with an 'all' summary and a 'groups' list with the
+        summary of each (project, model_name).
+    """
+    records = list(records)
+    groups = collections.defaultdict(list)
+    for r in records:
+        groups[(r.get('project'), r.get('model_name'))].append(r)
+    overall = _group_summary(records)
+    overall['wall_seconds'] = wall_seconds
+    overall['throughput'] = (overall['utterances'] / wall_seconds
+                             if wall_seconds else None)
+    return {
+        'all': overall,
+        'groups': [{'project': project, 'model_name': model_name,
+                    **_group_summary(group)}
+                   for (project, model_name), group in sorted(
+                       groups.items(), key=lambda kv: tuple(map(str, kv[0])))],
+    }
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """Return a summary from summarize() as a printable table."""
+
+    def fmt(value, spec='.3f'):
+        return '-' if value is None else format(value, spec)
+
+    lines = [f'{"project":<10} {"model":<12} {"utts":>6} {"hits":>6} {"errors":>6} '
+             f'{"RTF":>7} {"utt/s":>7} {"p50 s":>7} {"p95 s":>7} {"fallbk":>6}']
+    rows = [dict(project='all', model_name='', **summary['all'])] + summary['groups']
+    for g in rows:
+        lines.append(
+            f'{str(g["project"]):<10} {str(g["model_name"] or ""):<12} '
+            f'{g["utterances"]:>6} {g["cache_hits"]:>6} {g["errors"]:>6} '
+            f'{fmt(g["real_time_factor"]):>7} {fmt(g["utterances_per_second"]):>7} '
+            f'{fmt(g["p50_latency"]):>7} {fmt(g["p95_latency"]):>7} {g["fallbacks"]:>6}')
+    overall = summary['all']
+    if overall.get('guards'):
+        lines.append('Decode budget guards fired: ' + ', '.join(
+            f'{guard} {count}' for guard, count in sorted(overall['guards'].items())))
+    if overall.get('wall_seconds'):
+        lines.append(f'Wall time {overall["wall_seconds"]:.1f}s, '
+                     f'{fmt(overall["throughput"])} utterances/s over all workers.')
+    if overall.get('mean_seconds'):
+        lines.append('Mean seconds per utterance: ' + ', '.join(
+            f'{stage} {seconds:.3f}' for stage, seconds in overall['mean_seconds'].items()))
+    return '\n'.join(lines)
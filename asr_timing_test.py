@@ -0,0 +1,90 @@
+"""Tests for asr_timing.py."""
+
+import io
+import json
+import types
+
+import torch
+from absl.testing import absltest
+
+import asr_timing
+
+
+class TinyModel(torch.nn.Module):
+    """Stands in for a Whisper model: an encoder and a decode method."""
+
+    def __init__(self):
+        super().__init__()
+        self.encoder = torch.nn.Linear(4, 4)
+
+    def decode(self, mel, options=None):
+        return self.encoder(mel).sum()
+
+
+class ASRTimingTest(absltest.TestCase):
+
+    def test_task_timer(self):
+        timer = asr_timing.TaskTimer()
+        with timer.stage('transcribe'):
+            pass
+        timer.add('transcribe', 1.0)
+        timer.add('db_write', 0.5)
+        self.assertGreaterEqual(timer.stages['transcribe'], 1.0)
+        self.assertEqual(timer.stages['db_write'], 0.5)
+
+    def test_instrument_engine(self):
+        engine = types.SimpleNamespace(model=TinyModel())
+        self.assertTrue(asr_timing.instrument_engine(engine))
+        self.assertFalse(asr_timing.instrument_engine(engine))  # Only once.
+        self.assertFalse(asr_timing.instrument_engine(types.SimpleNamespace()))
+
+        asr_timing.engine_stats.reset()
+        mel = torch.ones(1, 4)
+        engine.model.decode(mel, types.SimpleNamespace(temperature=0.0))
+        engine.model.decode(mel, types.SimpleNamespace(temperature=0.2))
+        stats = asr_timing.engine_stats.snapshot()
+        self.assertEqual(stats['decode_calls'], 2)
+        self.assertEqual(stats['fallbacks'], 1)
+        self.assertGreater(stats['encode'], 0.0)
+        self.assertGreaterEqual(stats['decode'], 0.0)
+
+        asr_timing.engine_stats.reset()
+        self.assertEqual(asr_timing.engine_stats.snapshot()['decode_calls'], 0)
+
+    def test_summarize(self):
+        records = [
+            {'project': 'quick', 'model_name': 'tiny.en', 'audio_seconds': 2.0,
+             'transcribe': 1.0, 'task_seconds': 1.0, 'fallbacks': 1},
+            {'project': 'quick', 'model_name': 'tiny.en', 'audio_seconds': 2.0,
+             'transcribe': 3.0, 'task_seconds': 3.0, 'fallbacks': 0},
+            {'project': 'quick', 'model_name': 'tiny.en', 'audio_seconds': 2.0,
+             'cache_hit': True, 'task_seconds': 0.0},
+            {'project': 'win', 'model_name': 'tiny.en', 'error': 'boom'},
+        ]
+        trace = io.StringIO()
+        for r in records:
+            asr_timing.write_record(trace, r)
+        self.assertEqual([json.loads(line) for line in trace.getvalue().splitlines()],
+                         records)
+
+        summary = asr_timing.summarize(records, wall_seconds=2.0)
+        overall = summary['all']
+        self.assertEqual(overall['utterances'], 3)
+        self.assertEqual(overall['errors'], 1)
+        self.assertEqual(overall['cache_hits'], 1)
+        # Cache hits are not part of the real-time factor.
+        self.assertAlmostEqual(overall['real_time_factor'], 1.0)
+        self.assertAlmostEqual(overall['utterances_per_second'], 0.75)
+        self.assertAlmostEqual(overall['throughput'], 1.5)
+        self.assertAlmostEqual(overall['p95_latency'], 2.8)
+        self.assertEqual(overall['fallbacks'], 1)
+
+        groups = {g['project']: g for g in summary['groups']}
+        self.assertEqual(groups['quick']['utterances'], 3)
+        self.assertEqual(groups['win']['errors'], 1)
+        self.assertIsNone(groups['win']['p95_latency'])
+        self.assertIn('quick', asr_timing.format_summary(summary))
+
+
+if __name__ == '__main__':
+    absltest.main()
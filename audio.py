@@ -1,10 +1,17 @@
 import os, os.path, json, random, functools, uuid, subprocess
 from flask import (
-    Blueprint, request, session, abort, redirect, Response, send_from_directory)
+    Blueprint, request, session, abort, redirect, Response)
 from storage import Database, relpath, DatabaseBP
+from serving import send_immutable, stream_json
+from plot_cache import plot_cache
+from thresholds import threshold_cache
+import scoring
+import ingest
+import upload_manifest
+from review_modules import coverage
 from plot import scatter_results, logistic_results
 
-upload_location = relpath("uploads")
+upload_location = upload_manifest.UPLOAD_DIR
 
 # prefixed with audio to avoid namespace collisions with other APIs
 class AudioDB(Database):
@@ -19,6 +26,9 @@ class AudioDB(Database):
         os.makedirs(upload_location, exist_ok=True)
         with self.app.app_context():
             self.validate()
+            ingest.ensure_tables(self.get())
+            coverage.ensure_coverage_tables(self.get())
+            upload_manifest.ensure_table(self.get(), upload_location)
 
     def conflict_clause(self, cls):
         if not self.upserting:
@@ -85,6 +95,10 @@ class AudioBP(DatabaseBP):
     audio_keys = (
         "id", "lang", "level_number", "trial_number", "filename", "answer")
     audio_done = [1, "--", 0, 1, "", 1]
+    # rows read per query by audio_recognize_iter
+    recognize_chunk = 500
+    # most results returned by one page of /recognized
+    recognize_page_max = 1000
 
     def audio_url(self, v):
         return v and "audio/" + v
@@ -198,25 +212,25 @@ class AudioBP(DatabaseBP):
             f"INSERT INTO {self.results_table} "
             "(subject, trial, reply_filename) VALUES (?, ?, ?)",
             (session["user"], cur["id"], fname))
+        coverage.record_result(db, rowid)
+        upload_manifest.record_upload(db, rowid, fpath)
+        self.audio_ingest(db, rowid, fpath)
         session["cur"] = session["q"]
         return json.dumps({1: self.audio_next(
             db, json.loads(session["cur"]),
             self.audio_parse(db, rowid, fpath, cur["answer"]))})
 
+    def audio_ingest(self, db, rowid, fpath):
+        # convert to a trimmed WAV in the background (see ingest.py)
+        return ingest.get_ingestor().submit(db.database, rowid, fpath)
+
     # delayed by one level because of preloading
     def completion_condition(self, reply, answer):
         return self.proportion_correct(reply, answer) == 0
 
     def proportion_correct(self, reply, answer):
-        reply = set(reply.split(" "))
-        correct, total = 0, 0
-        for options in answer.split(" "):
-            total += 1
-            for option in options.split("/"):
-                if option in reply:
-                    correct += 1
-                    break
-        return correct / max(total, 1)
+        matchers = scoring.matcher_cache(scoring.EXACT)
+        return matchers.get(answer).fraction(matchers.tokens(reply))
 
     @staticmethod
     def map_answer(f, answer, delimitors=" /"):
@@ -228,8 +242,24 @@ class AudioBP(DatabaseBP):
         return "".join(j + f(answer[i:k]) for (i, j), k in sep)
 
     def audio_plotter(self, db, query="1", args=()):
+        return self.flask_png(*self.audio_plot_points(db, query, args))
+
+    # the table holding the scores that are plotted
+    @property
+    def plot_table(self):
+        return self.asr_table
+
+    def audio_plot_points(self, db, query="1", args=()):
+        results = self.audio_plot_rows(db, query, args)
+        if len(results) == 0:
+            abort(400)
+        return tuple(zip(*((snr, score) for _, _, snr, score in results)))
+
+    # (plot_table rowid, subject, snr, score) of each scored result
+    def audio_plot_rows(self, db, query="1", args=()):
         results = db.queryall(
-            f"SELECT {self.trials_table}.snr, {self.asr_table}.data, "
+            f"SELECT {self.asr_table}.rowid, {self.results_table}.subject, "
+            f"{self.trials_table}.snr, {self.asr_table}.data, "
             f"{self.trials_table}.answer FROM {self.results_table} "
             f"LEFT JOIN {self.trials_table} "
                 f"ON {self.results_table}.trial={self.trials_table}.id "
@@ -237,21 +267,34 @@ class AudioBP(DatabaseBP):
                 f"ON {self.results_table}.id={self.asr_table}.ref "
             f"WHERE project=? AND {self.asr_table}.data IS NOT NULL AND "
             f"{query}", (self.project_key,) + tuple(args))
-        if len(results) == 0:
-            abort(400)
-        results = [(snr, self.proportion_correct(
-            json.loads(reply), answer)) for snr, reply, answer in results]
-        return self.flask_png(*zip(*results))
+        return [(rowid, subject, snr, self.proportion_correct(
+            json.loads(reply), answer))
+            for rowid, subject, snr, reply, answer in results]
+
+    # changes whenever the results behind audio_plot_rows may have
+    def audio_plot_version(self, db):
+        return db.queryone(
+            f"SELECT (SELECT MAX(id) FROM {self.results_table}), "
+            f"MAX(rowid), COUNT(*) FROM {self.plot_table}")
+
+    def audio_plot_count_since(self, db, rowid):
+        return db.queryone(
+            f"SELECT COUNT(*) FROM {self.plot_table} WHERE rowid > ?",
+            (rowid,))[0]
+
+    def render_png(self, x, y):
+        return self.flask_png(x, y).get_data()
 
     def audio_recognized(self, db):
         if "user" not in session:
             abort(400)
         return self.audio_recognize(
-            db, f" WHERE project=? AND {self.results_table}.subject=?",
+            db, f"project=? AND {self.results_table}.subject=?",
             (self.project_key, session["user"]))
 
     def result_fields(self):
         return {
+            "id": f"{self.results_table}.id",
             "time": "users.t",
             "subject": f"{self.results_table}.subject",
             "username": "users.username",
@@ -262,19 +305,61 @@ class AudioBP(DatabaseBP):
             "trial_number": f"{self.trials_table}.trial_number",
         }
 
-    def audio_recognize(self, db, query="", args=()):
-        transcription = db.queryall(
-            "SELECT "
-                f"{','.join(self.result_fields[1])} "
-            f"FROM {self.results_table} "
-                f"LEFT JOIN {self.trials_table} "
-                    f"ON {self.results_table}.trial={self.trials_table}.id "
-                "LEFT JOIN users ON subject=users.id "
-                f"LEFT JOIN {self.asr_table} "
-                    f"ON {self.results_table}.id={self.asr_table}.ref"
-            f"{query}", args)
-        keys = self.result_fields[0]
-        return json.dumps([dict(zip(keys, i)) for i in transcription])
+    def recognize_joins(self):
+        return (
+            f"LEFT JOIN {self.trials_table} "
+                f"ON {self.results_table}.trial={self.trials_table}.id "
+            "LEFT JOIN users ON subject=users.id "
+            f"LEFT JOIN {self.asr_table} "
+                f"ON {self.results_table}.id={self.asr_table}.ref")
+
+    def recognize_record(self, row):
+        return dict(zip(self.result_fields[0], row))
+
+    # the order of a result's records, one per joined ASR (and annotation) row
+    def recognize_order(self):
+        return f"{self.asr_table}.rowid"
+
+    def audio_recognize_iter(self, db, where="1", args=(), after=0,
+                             limit=None):
+        """Yields the recognized results matching where, by result id.
+
+        A result has one record per ASR (and annotation) row joined to it.
+        The results are read recognize_chunk at a time: each chunk's ids are
+        picked by their own query, starting after the last id read (keyset
+        pagination), and then all of their records are read, so a result's
+        records are never split between chunks, and neither the rows nor a
+        database lock are held while the client reads.  limit counts
+        results, not records.
+        """
+        results = self.results_table
+        while limit is None or limit > 0:
+            size = self.recognize_chunk if limit is None else min(
+                limit, self.recognize_chunk)
+            ids = db.queryall(
+                f"SELECT DISTINCT {results}.id "
+                f"FROM {results} {self.recognize_joins()} "
+                f"WHERE {where} AND {results}.id > ? "
+                f"ORDER BY {results}.id LIMIT ?",
+                tuple(args) + (after, size))
+            if not ids:
+                return
+            rows = db.queryall(
+                f"SELECT {','.join(self.result_fields[1])} "
+                f"FROM {results} {self.recognize_joins()} "
+                f"WHERE {where} AND {results}.id > ? AND {results}.id <= ? "
+                f"ORDER BY {results}.id, {self.recognize_order()}",
+                tuple(args) + (after, ids[-1][0]))
+            for row in rows:
+                yield self.recognize_record(row)
+            if len(ids) < size:
+                return
+            after = ids[-1][0]
+            if limit is not None:
+                limit -= len(ids)
+
+    def audio_recognize(self, db, where="1", args=()):
+        return stream_json(self.audio_recognize_iter(db, where, args))
 
     def asr(self, path):
         raise NotImplementedError()
@@ -291,9 +376,15 @@ class AudioAnnotatedBP(AudioBP):
         self._route_db("/reset", methods=["POST"])(self.audio_reset)
         self._route_db("/effort", methods=["POST"])(self.audio_effort)
 
-    def audio_plotter(self, db, query="1", args=()):
+    @property
+    def plot_table(self):
+        return self.annotations_table
+
+    def audio_plot_rows(self, db, query="1", args=()):
         results = db.queryall(
-            f"SELECT {self.trials_table}.snr, {self.annotations_table}.data "
+            f"SELECT {self.annotations_table}.rowid, "
+            f"{self.results_table}.subject, "
+            f"{self.trials_table}.snr, {self.annotations_table}.data "
             f"FROM {self.results_table} "
             f"LEFT JOIN {self.trials_table} ON "
                 f"{self.results_table}.trial={self.trials_table}.id "
@@ -303,11 +394,10 @@ class AudioAnnotatedBP(AudioBP):
             f"AND {self.annotations_table}.data != '' AND "
             f"{self.trials_table}.project=? AND {query}",
             (self.project_key,) + tuple(args))
-        if len(results) == 0:
-            abort(400)
-        results = [(snr, json.loads(data)) for snr, data in results]
-        results = [(snr, sum(data) / len(data)) for snr, data in results]
-        return self.flask_png(*zip(*results))
+        results = [(rowid, subject, snr, json.loads(data))
+                   for rowid, subject, snr, data in results]
+        return [(rowid, subject, snr, sum(data) / len(data))
+                for rowid, subject, snr, data in results]
 
     def audio_parse(self, db, rowid, fpath, answer, dump=False, data=None):
         def wrapped(dump=False):
@@ -336,15 +426,19 @@ class AudioAnnotatedBP(AudioBP):
         res["answer"] = json.loads(session["q"])["answer"]
         return json.dumps(res)
 
-    def audio_recognize(self, db, query="", args=()):
-        res = super().audio_recognize(db, (
-            f" LEFT JOIN {self.annotations_table} ON "
-                f"{self.results_table}.id = {self.annotations_table}.ref"
-            f"{query}"), args)
-        res = json.loads(res)
-        res = [{**i, "annotations": [] if i["annotations"] is None else
-                json.loads(i["annotations"])} for i in res]
-        return json.dumps(res)
+    def recognize_joins(self):
+        return (
+            f"{super().recognize_joins()} LEFT JOIN {self.annotations_table} "
+                f"ON {self.results_table}.id = {self.annotations_table}.ref")
+
+    def recognize_order(self):
+        return f"{super().recognize_order()}, {self.annotations_table}.rowid"
+
+    def recognize_record(self, row):
+        res = super().recognize_record(row)
+        res["annotations"] = [] if res["annotations"] is None else \
+            json.loads(res["annotations"])
+        return res
 
     def audio_async(self, *args):
         return self.audio_parse(*args)
@@ -385,11 +479,14 @@ class AudioNormalizedBP(AudioBP):
         super().__init__(*a, **kw)
         from asr import whisper_normalizer
         self.normalizer = whisper_normalizer
+        self.normalized_answers = {}
 
     def proportion_correct(self, reply, answer):
+        if answer not in self.normalized_answers:
+            self.normalized_answers[answer] = self.map_answer(
+                self.normalizer, answer)
         return super().proportion_correct(
-            self.normalizer(reply["text"]),
-            self.map_answer(self.normalizer, answer))
+            self.normalizer(reply["text"]), self.normalized_answers[answer])
 
 class AudioWhisperBP(AudioNormalizedBP):
     def __init__(self, *a, **kw):
@@ -416,28 +513,84 @@ class AudioResultsBP(AudioAnnotatedBP):
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
         self._route_db("/plot")(self.audio_plot)
+        self._route_db("/thresholds")(self.audio_thresholds)
         self._route_db("/upload/<fname>")(self.upload)
 
     def audio_recognized(self, db):
-        if request.args.get("user", None) == "all":
-            return self.audio_recognize(
-                    db, f" WHERE project=?", (self.project_key,))
-        if "user" not in session:
-            abort(400)
-        user = request.args.get("user", session["user"])
-        return self.audio_recognize(
-            db, f" WHERE project=? AND {self.results_table}.subject=?",
-            (self.project_key, user))
+        """The recognized results of a subject, or all subjects.
+
+        Query parameters:
+            user (or subject): The subject, or "all"; defaults to the
+                session's user.
+            since, until: Only results recorded in this time range
+                (SQLite timestamps, e.g. "2024-05-01 12:00:00").
+            list: Only results of this list (trial_number).
+            after: Only results with a larger id, to continue from the last
+                result received.
+            limit: Return a page of at most this many results, as
+                {"results": [...], "next": <after for the next page>}.  A
+                result with several ASR rows has a record for each, all on
+                the same page.
+            format: "ndjson" to stream one JSON object per line (also chosen
+                by Accept: application/x-ndjson); otherwise a JSON list.
+        """
+        user = request.args.get("user", request.args.get("subject"))
+        if user is None:
+            if "user" not in session:
+                abort(400)
+            user = session["user"]
+        where, args = [f"{self.trials_table}.project=?"], [self.project_key]
+        if user != "all":
+            where.append(f"{self.results_table}.subject=?")
+            args.append(user)
+        for key, condition in (
+                ("since", f"{self.results_table}.t >= ?"),
+                ("until", f"{self.results_table}.t < ?"),
+                ("list", f"{self.trials_table}.trial_number=?")):
+            if key in request.args:
+                where.append(condition)
+                args.append(request.args[key])
+        where = " AND ".join(where)
+        after = request.args.get("after", 0, type=int)
+        limit = request.args.get("limit", None, type=int)
+        ndjson = request.args.get("format") == "ndjson" or (
+            request.accept_mimetypes.best == "application/x-ndjson")
+        if limit is None:
+            return stream_json(
+                self.audio_recognize_iter(db, where, args, after), ndjson)
+        limit = max(1, min(limit, self.recognize_page_max))
+        if ndjson:
+            # the id of the last line is the next page's after
+            return stream_json(self.audio_recognize_iter(
+                db, where, args, after, limit), ndjson)
+        results = list(self.audio_recognize_iter(db, where, args, after, limit))
+        full = len({result["id"] for result in results}) == limit
+        return json.dumps({
+            "results": results, "next": results[-1]["id"] if full else None})
 
     def audio_plot(self, db):
         user = request.args.get("user", session["user"])
         if user == "all":
-            return self.audio_plotter(db)
-        return self.audio_plotter(
-                db, f"{self.results_table}.subject=?", (user,))
+            query, args = "1", ()
+        else:
+            query, args = f"{self.results_table}.subject=?", (user,)
+        return plot_cache.respond(
+            (self.project_key, str(user)), tuple(self.audio_plot_version(db)),
+            lambda: self.audio_plot_points(db, query, args),
+            lambda points: self.render_png(*points),
+            stale_ok="stale" in request.args)
+
+    def audio_thresholds(self, db):
+        version = tuple(self.audio_plot_version(db))
+        subjects = threshold_cache.update(
+            self.project_key, version,
+            lambda rowid: self.audio_plot_rows(
+                db, f"{self.plot_table}.rowid > ?", (rowid,)),
+            lambda rowid: self.audio_plot_count_since(db, rowid))
+        return json.dumps({"project": self.project_key, "subjects": subjects})
 
     def upload(self, db, fname):
-        return send_from_directory(upload_location, fname)
+        return send_immutable(upload_location, fname)
 
 class AudioConferenceBP(AudioWhisperBP, AudioResultsBP):
     def audio_parse(self, db, rowid, fpath, answer, dump=False):
@@ -0,0 +1,69 @@
+"""Tests for the /recognized paging of audio.py."""
+
+import json
+import os
+
+import flask
+from absl.testing import absltest
+
+from projects import QuickBP
+from storage import Database, relpath
+
+
+class RecognizedTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app = flask.Flask(__name__)
+        path = os.path.join(self.create_tempdir().full_path, 'test.db')
+        self.db = Database(self.app, path, relpath('schema.sql'))
+        self.bp = QuickBP(lambda: self.db)
+        self.bp.recognize_chunk = 2
+        self.enterContext(self.app.app_context())
+        # Result 2, the last of the first chunk, has two ASR rows and result
+        # 3 two annotations; result 4 has neither.
+        self.db.get().executescript("""
+            INSERT INTO users (id, username) VALUES (1, 'subject');
+            INSERT INTO audio_trials (id, project, trial_number, active)
+                VALUES (1, 'quick', 1, 1), (2, 'win', 1, 1);
+            INSERT INTO audio_results (id, subject, trial) VALUES
+                (1, 1, 1), (2, 1, 1), (3, 1, 1), (4, 1, 1), (5, 1, 2), (6, 1, 1);
+            INSERT INTO audio_asr (ref, data) VALUES
+                (1, '{"text": "a"}'), (2, '{"text": "b"}'), (2, '{"text": "c"}'),
+                (3, '{"text": "d"}'), (5, '{"text": "e"}'), (6, '{"text": "f"}');
+            INSERT INTO audio_annotations (ref, data) VALUES
+                (3, '[true]'), (3, '[false]');
+        """)
+        self.expected = [(1, 'a', []), (2, 'b', []), (2, 'c', []), (3, 'd', [True]),
+                         (3, 'd', [False]), (4, None, []), (6, 'f', [])]
+
+    def records(self, records):
+        return [(r['id'], r['transcript'] and json.loads(r['transcript'])['text'],
+                 r['annotations']) for r in records]
+
+    def page(self, **args):
+        with self.app.test_request_context('/recognized', query_string=args):
+            return json.loads(self.bp.audio_recognized(self.db))
+
+    def test_chunks(self):
+        self.assertEqual(
+            self.records(self.bp.audio_recognize_iter(
+                self.db, 'audio_trials.project=?', ('quick',))),
+            self.expected)
+        self.assertEqual(
+            self.records(self.bp.audio_recognize_iter(
+                self.db, 'audio_trials.project=?', ('quick',), after=1, limit=2)),
+            self.expected[1:5])
+
+    def test_pages(self):
+        records, after = [], 0
+        while after is not None:
+            page = self.page(user='all', limit=2, after=after)
+            records += page['results']
+            after = page['next']
+        self.assertEqual(self.records(records), self.expected)
+        self.assertEqual(self.page(user='all', limit=2, after=2)['next'], 4)
+
+
+if __name__ == '__main__':
+    absltest.main()
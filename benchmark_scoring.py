@@ -0,0 +1,114 @@
+"""Measure how many ASR results per second the scorers of scoring.py match.
+
+Scores the text of every audio_asr row of a database against its trial's
+answer with each text policy: once compiling the answer for every row (as
+the scorers used to), and once with a MatcherCache.
+
+    python benchmark_scoring.py --dbfile experiments.db --homonyms homonym_list.csv
+"""
+import sqlite3
+import time
+from typing import Dict, FrozenSet, List, Tuple
+
+from absl import app
+from absl import flags
+
+import asr_storage
+import scoring
+
+FLAGS = flags.FLAGS
+
+try:
+    flags.DEFINE_string('dbfile', 'experiments_malcolm.db',
+                        'Which SQLite3 database file to process.')
+except flags.DuplicateFlagError:
+    pass  # Flag was already defined by another module during pytest collection
+try:
+    flags.DEFINE_string('homonyms', 'homonym_list.csv',
+                        'Path to the comma-delimited homonyms file.')
+except flags.DuplicateFlagError:
+    pass
+flags.DEFINE_integer('scoring_repeats', 3,
+                     'Times to score every row when measuring the rate.')
+
+
+def read_homonym_groups(filename: str) -> Dict[str, FrozenSet[str]]:
+    """Map each word of the homonym file to its group (including itself)."""
+    homonyms = {}
+    with open(filename) as f:
+        for line in f:
+            words = [w.strip().lower()
+                     for w in line.split('#', 1)[0].split(',') if w.strip()]
+            for w in words:
+                homonyms[w] = frozenset(words)
+    return homonyms
+
+
+def benchmark(rows: List[Tuple[str, str]], homonyms: scoring.Homonyms,
+              repeats: int = 3) -> Dict[str, Dict[str, float]]:
+    """Measure the rows scored per second by each text policy.
+
+    Args:
+        rows: (answer, transcript text) pairs.
+        homonyms: The homonym map.
+        repeats: Number of passes over the rows.
+
+    Returns:
+        For each policy, the rate compiling every row's answer ('uncached')
+        and with a MatcherCache ('cached').
+    """
+    results = {}
+    for policy in (scoring.EXACT, scoring.REPORT, scoring.RATERS):
+        cache = scoring.MatcherCache(policy, homonyms)
+
+        def uncached():
+            for answer, text in rows:
+                scoring.compile_answer(policy, answer, homonyms).count(
+                    policy.tokenize(text))
+
+        def cached():
+            for answer, text in rows:
+                cache.get(answer).count(cache.tokens(text))
+
+        rates = {}
+        for name, f in (('uncached', uncached), ('cached', cached)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                f()
+            elapsed = time.perf_counter() - start
+            rates[name] = len(rows) * repeats / max(elapsed, 1e-9)
+        results[policy.name] = rates
+    return results
+
+
+def read_rows(con: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """Return the (answer, ASR text) of every recognized result."""
+    text = "json_extract(audio_asr.data, '$.text')"
+    if asr_storage.has_compact_tables(con):
+        text = f"COALESCE(audio_asr.text, {text})"
+    rows = con.execute(
+        f"SELECT audio_trials.answer, {text} FROM audio_asr "
+        "JOIN audio_results ON audio_asr.ref = audio_results.id "
+        "JOIN audio_trials ON audio_results.trial = audio_trials.id "
+        "WHERE json_valid(audio_asr.data) AND audio_trials.answer IS NOT NULL"
+    ).fetchall()
+    return [(answer, text or '') for answer, text in rows]
+
+
+def main(argv):
+    del argv  # Unused
+    try:
+        homonyms = read_homonym_groups(FLAGS.homonyms)
+    except FileNotFoundError:
+        homonyms = {}
+    con = sqlite3.connect(FLAGS.dbfile)
+    rows = read_rows(con)
+    con.close()
+    print(f'Scoring {len(rows)} rows, {len(set(a for a, _ in rows))} answers')
+    for name, rates in benchmark(rows, homonyms, FLAGS.scoring_repeats).items():
+        print(f'{name:8s}: {rates["uncached"]:10.0f} rows/s uncached, '
+              f'{rates["cached"]:10.0f} rows/s cached')
+
+
+if __name__ == '__main__':
+    app.run(main)
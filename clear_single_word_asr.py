@@ -4,7 +4,9 @@ Remove the ASR results for the single-word tests. [Generated by Gemini.]
 This script maps the relationship from audio_asr -> audio_results 
 -> audio_trials to find all ASR records associated with the 
 cnc, win, or nu6 projects. It then updates those the ASR data fields to be 
-an empty string ("").
+an empty string (""), and removes the copies of the old transcript kept by
+asr_storage (audio_asr.text, audio_asr_words and audio_asr_raw) in the same
+transaction.
 
 The project name "all" means remove the ASR results for all rows in the 
 database.
@@ -19,6 +21,8 @@ import sys
 from absl import app
 from absl import flags
 
+import asr_storage
+
 def print_asr_data_counts(cursor: sqlite3.Cursor):
     """
     Queries the database to count the number of empty and non-empty 'data' 
@@ -59,6 +63,31 @@ def print_asr_data_counts(cursor: sqlite3.Cursor):
         print(f"Error executing count query: {e}")
 
 
+def clear_asr(cursor: sqlite3.Cursor, target_refs: str, params=()) -> int:
+    """
+    Empties audio_asr.data for the results selected by the target_refs query,
+    and clears the transcript copies asr_storage keeps (the text column, the
+    words table and the raw table), without committing.  Returns the number of
+    audio_asr rows that were cleared.
+    """
+    con = cursor.connection
+    if 'text' in asr_storage.table_columns(con, 'audio_asr'):
+        set_clause, stale = "data = '', text = NULL", "OR text IS NOT NULL"
+    else:
+        set_clause, stale = "data = ''", ""
+    cursor.execute(f"""
+        UPDATE audio_asr
+        SET {set_clause}
+        WHERE ref IN ({target_refs})
+        AND (IFNULL(data, ' ') != '' {stale});
+    """, params)
+    updated_rows = cursor.rowcount
+    for table in ('audio_asr_words', 'audio_asr_raw'):
+        if asr_storage.table_columns(con, table):
+            cursor.execute(f"DELETE FROM {table} WHERE ref IN ({target_refs})", params)
+    return updated_rows
+
+
 # Define command-line flags
 FLAGS = flags.FLAGS
 flags.DEFINE_boolean('dry_run', True, 
@@ -143,22 +172,16 @@ def main(argv):
             print("\n=== CLEAR EXECUTION MODE ACTIVATED ===")
             print(f"Clearing ASR data for: {project_scope_text}")
             
-            # Update the data to an empty string
-            update_query = f"""
-                UPDATE audio_asr
-                SET data = ''
-                WHERE ref IN (
-                    SELECT ar.id
-                    FROM audio_results ar
-                    JOIN audio_trials at ON ar.trial = at.id
-                    WHERE 1=1
-                      {project_filter_sql}
-                      AND LOWER(at.answer) LIKE '{FLAGS.word.lower()}'
-                )
-                AND IFNULL(data, ' ') != '';
+            # The results of the targeted trials
+            target_refs = f"""
+                SELECT ar.id
+                FROM audio_results ar
+                JOIN audio_trials at ON ar.trial = at.id
+                WHERE 1=1
+                  {project_filter_sql}
+                  AND LOWER(at.answer) LIKE '{FLAGS.word.lower()}'
             """
-            cursor.execute(update_query, project_params)
-            updated_rows = cursor.rowcount
+            updated_rows = clear_asr(cursor, target_refs, project_params)
             
             # Commit the changes
             conn.commit()
@@ -0,0 +1,99 @@
+"""Per-utterance decode budget for the Whisper engines.
+
+Noisy responses (QuickSIN at 0 dB SNR in particular) sometimes make Whisper
+hallucinate repetitive text until it runs out of tokens, and then try again
+at every temperature of its fallback ladder.  One such utterance can take
+many times longer than its neighbours.  A DecodeBudget bounds this with
+three guards:
+
+  token_cap     At most tokens_per_second generated tokens per second of
+                audio (but at least min_tokens) in each 30 second window.
+  fallback_cap  At most max_fallbacks temperature fallbacks per window.
+  wall_clock    At most max_seconds of decoding per utterance; past that
+                every decoding step is forced to end the text.
+
+The engines in asr.py enforce the budget and list the guards that fired in
+the result's 'decode_budget' entry, counting only the decoding Whisper kept
+for each window (a window cut off at one temperature and decoded in full at
+the next is fine).  A result truncated by the token_cap or wall_clock guard
+is not usable, so the engine raises DecodeBudgetExceeded and offline_asr.py
+puts the utterance on a retry list instead.  Hitting the
+fallback_cap still leaves the last (best) decoding, which is kept.
+
+This module does not import Whisper, so offline_asr.py can use it even when
+the engines are mocked out.
+"""
+import dataclasses
+from typing import Any, Dict, List, Optional, Tuple
+
+# The temperature ladder of whisper.transcribe.
+WHISPER_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+# Whisper's own cap on the tokens decoded per window (n_text_ctx // 2).
+MAX_SAMPLE_LEN = 224
+# Thresholds whisper.transcribe uses to decide whether to fall back.
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+GUARDS = ['token_cap', 'fallback_cap', 'wall_clock']
+# Guards that leave a truncated, unusable result.
+HARD_GUARDS = ['token_cap', 'wall_clock']
+
+
+class DecodeBudgetExceeded(RuntimeError):
+    """Raised when decoding an utterance hit the token or wall-clock guard."""
+
+    def __init__(self, guards: List[str], result: Optional[Dict[str, Any]] = None):
+        super().__init__(f'Decode budget exceeded ({", ".join(guards)})')
+        self.guards = guards
+        self.result = result
+
+
+@dataclasses.dataclass(frozen=True)
+class DecodeBudget:
+    """Limits on decoding one utterance. A zero or negative limit is off."""
+    tokens_per_second: float = 0.0
+    min_tokens: int = 32
+    max_fallbacks: int = -1
+    max_seconds: float = 0.0
+
+    def enabled(self) -> bool:
+        return (self.tokens_per_second > 0 or self.max_fallbacks >= 0 or
+                self.max_seconds > 0)
+
+    def sample_len(self, audio_seconds: float) -> Optional[int]:
+        """Return the number of tokens to allow per window, or None for Whisper's."""
+        if self.tokens_per_second <= 0:
+            return None
+        tokens = int(self.tokens_per_second * min(audio_seconds, 30.0) + 0.5)
+        return min(MAX_SAMPLE_LEN, max(self.min_tokens, tokens))
+
+    def temperatures(self) -> Tuple[float, ...]:
+        """Return the temperature ladder, cut after max_fallbacks fallbacks."""
+        if self.max_fallbacks < 0:
+            return WHISPER_TEMPERATURES
+        return WHISPER_TEMPERATURES[:self.max_fallbacks + 1]
+
+    def key(self) -> Dict[str, Any]:
+        """Return the settings that change the decoding, for cache keys."""
+        return dataclasses.asdict(self) if self.enabled() else {}
+
+
+def needs_fallback(segment: Dict[str, Any]) -> bool:
+    """Return whether whisper.transcribe would retry a segment at a higher temperature."""
+    compression_ratio = segment.get('compression_ratio', 0.0)
+    avg_logprob = segment.get('avg_logprob', 0.0)
+    no_speech_prob = segment.get('no_speech_prob', 0.0)
+    if (no_speech_prob > NO_SPEECH_THRESHOLD and avg_logprob < LOGPROB_THRESHOLD):
+        return False  # Silence.
+    return (compression_ratio > COMPRESSION_RATIO_THRESHOLD or
+            avg_logprob < LOGPROB_THRESHOLD)
+
+
+def fallback_cap_fired(budget: DecodeBudget, segments: List[Dict[str, Any]]) -> bool:
+    """Return whether the cut temperature ladder stopped Whisper from falling back."""
+    temperatures = budget.temperatures()
+    if len(temperatures) == len(WHISPER_TEMPERATURES):
+        return False
+    return any(segment.get('temperature') == temperatures[-1] and needs_fallback(segment)
+               for segment in segments)
@@ -0,0 +1,109 @@
+"""Tests for decode_budget.py and its enforcement in asr.py."""
+
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import torch
+from absl.testing import absltest
+from whisper.decoding import DecodingOptions, DecodingTask
+from whisper.model import ModelDimensions, Whisper
+
+import asr
+import decode_budget
+from decode_budget import DecodeBudget, DecodeBudgetExceeded
+
+
+def random_whisper_engine() -> asr.WhisperASR:
+    """Return a WhisperASR with a tiny untrained model, which never stops talking."""
+    torch.manual_seed(0)
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=8,
+                           n_audio_head=1, n_audio_layer=1, n_vocab=51864,
+                           n_text_ctx=448, n_text_state=8, n_text_head=1,
+                           n_text_layer=1)
+    engine = asr.WhisperASR.__new__(asr.WhisperASR)
+    engine.model = Whisper(dims)
+    engine.meta = {'model_name': 'random', 'model_type': 'default'}
+    return engine
+
+
+class DecodeBudgetTest(absltest.TestCase):
+
+    def test_limits(self):
+        self.assertFalse(DecodeBudget().enabled())
+        self.assertEqual(DecodeBudget().key(), {})
+        self.assertIsNone(DecodeBudget().sample_len(3.0))
+        self.assertEqual(DecodeBudget().temperatures(),
+                         decode_budget.WHISPER_TEMPERATURES)
+
+        budget = DecodeBudget(tokens_per_second=10, max_fallbacks=2)
+        self.assertTrue(budget.enabled())
+        self.assertEqual(budget.sample_len(1.0), 32)  # min_tokens
+        self.assertEqual(budget.sample_len(5.0), 50)
+        self.assertEqual(budget.sample_len(60.0), decode_budget.MAX_SAMPLE_LEN)
+        self.assertEqual(budget.temperatures(), (0.0, 0.2, 0.4))
+        self.assertEqual(budget.key()['max_fallbacks'], 2)
+
+    def test_fallback_cap_fired(self):
+        repetitive = {'temperature': 0.2, 'compression_ratio': 3.0, 'avg_logprob': -0.5}
+        fine = {'temperature': 0.2, 'compression_ratio': 1.5, 'avg_logprob': -0.5}
+        silence = {'temperature': 0.2, 'compression_ratio': 1.0, 'avg_logprob': -2.0,
+                   'no_speech_prob': 0.9}
+        budget = DecodeBudget(max_fallbacks=1)
+        self.assertTrue(decode_budget.fallback_cap_fired(budget, [fine, repetitive]))
+        self.assertFalse(decode_budget.fallback_cap_fired(budget, [fine, silence]))
+        self.assertFalse(decode_budget.fallback_cap_fired(DecodeBudget(), [repetitive]))
+
+    def test_engine_guards(self):
+        engine = random_whisper_engine()
+        audio = np.zeros(3 * 16000, dtype=np.float32)
+        with mock.patch('whisper.load_audio', return_value=audio):
+            with self.assertRaises(DecodeBudgetExceeded) as e:
+                engine.recognize('reply.wav', budget=DecodeBudget(
+                    tokens_per_second=5, min_tokens=8, max_fallbacks=0))
+            self.assertEqual(e.exception.guards, ['token_cap'])
+            self.assertEqual(e.exception.result['decode_budget']['sample_len'], 15)
+            self.assertEqual(e.exception.result['decode_budget']['temperatures'], [0.0])
+
+            with self.assertRaises(DecodeBudgetExceeded) as e:
+                engine.recognize('reply.wav', budget=DecodeBudget(
+                    max_seconds=1e-6, max_fallbacks=0))
+            self.assertEqual(e.exception.guards, ['wall_clock'])
+
+    def test_engine_guards_of_accepted_attempt(self):
+        engine = random_whisper_engine()
+        audio = np.zeros(3 * 16000, dtype=np.float32)
+        budget = DecodeBudget(tokens_per_second=5, min_tokens=8, max_fallbacks=1)
+        # The number of text tokens each attempt returns, by temperature.
+        lengths = {}
+
+        def run(task, mel):
+            return [SimpleNamespace(tokens=[0] * lengths[task.options.temperature])]
+
+        def transcribe(audio, temperature, sample_len, **options):
+            # Two windows, each retried as whisper.transcribe does.
+            for _ in range(2):
+                for t in temperature:
+                    task = DecodingTask(engine.model, DecodingOptions(
+                        temperature=t, sample_len=sample_len))
+                    result, = task.run(None)
+                    if len(result.tokens) < sample_len:
+                        break
+            return {'text': '', 'segments': []}
+
+        with mock.patch('whisper.load_audio', return_value=audio), \
+                mock.patch.object(DecodingTask, 'run', run), \
+                mock.patch.object(engine.model, 'transcribe', transcribe):
+            # Cut off at T=0, but the retry ends with EOT at its last step.
+            lengths.update({0.0: 15, 0.2: 14})
+            result = engine.recognize('reply.wav', budget=budget)
+            self.assertEqual(result['decode_budget']['guards'], [])
+
+            lengths.update({0.0: 15, 0.2: 15})
+            with self.assertRaises(DecodeBudgetExceeded) as e:
+                engine.recognize('reply.wav', budget=budget)
+            self.assertEqual(e.exception.guards, ['token_cap'])
+
+
+if __name__ == '__main__':
+    absltest.main()
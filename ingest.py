@@ -0,0 +1,169 @@
+"""Background conversion of uploaded responses into trimmed WAV files.
+
+AudioBP.audio_result saves each recording as the browser sent it (usually
+MP4).  Rather than waiting for the nightly prepare_audio.py batch, every new
+upload is handed to a small pool of background threads which
+
+  1. converts it with ffmpeg to 16 kHz mono 16-bit PCM,
+  2. removes the leading silence with prepare_audio's endpointing, and
+  3. writes <upload>.wav next to the upload (the name offline_asr.py and
+     prepare_audio.py use), recording its duration and SHA-256 in the
+     audio_uploads table.
+
+prepare_audio.py skips uploads whose WAV already exists, so it only picks
+up what the ingest stage missed (such as uploads from before it existed or
+while ffmpeg failed).
+
+Each web server process shuts its pool down at exit, finishing the queued
+conversions.  Uploads still left 'pending' (the process was killed first)
+are converted by finish_stale, which upload_manifest.py runs nightly.
+
+The work is done by ffmpeg and NumPy, which release the GIL, so threads are
+enough and the web server needs no extra processes.
+"""
+import atexit
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+import prepare_audio
+from storage import log_sql_call
+
+INGEST_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS audio_uploads (
+        ref INTEGER PRIMARY KEY,
+        wav_filename TEXT,
+        original_seconds REAL,
+        duration REAL,
+        sha256 TEXT,
+        status TEXT,
+        error TEXT,
+        t TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(ref) REFERENCES audio_results(id)
+    );
+"""
+
+# Number of uploads converted at the same time.
+MAX_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+# A conversion pending for longer than this was lost with its process.
+STALE_PENDING_SECONDS = 3600
+
+
+def ensure_tables(con: sqlite3.Connection):
+    con.executescript(INGEST_SCHEMA)
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def record_upload(db_path: str, rowid: int, **fields):
+    """Insert or replace the audio_uploads row of an upload."""
+    query = (
+        "INSERT OR REPLACE INTO audio_uploads "
+        f"(ref, {', '.join(fields)}) VALUES ({', '.join('?' * (len(fields) + 1))})")
+    args = (rowid,) + tuple(fields.values())
+    log_sql_call("execute", query, args)
+    con = sqlite3.connect(db_path, timeout=10.0)
+    try:
+        con.execute(query, args)
+        con.commit()
+    finally:
+        con.close()
+
+
+def ingest_upload(db_path: str, rowid: int, fpath: str) -> Dict[str, Any]:
+    """Convert and endpoint one upload, and record the result.
+
+    Args:
+        db_path: Path of the experiments database.
+        rowid: The audio_results id of the upload.
+        fpath: Path of the uploaded file.
+
+    Returns:
+        The fields stored in audio_uploads.
+    """
+    try:
+        record = prepare_audio.process_file(fpath, channels=1)
+        if record is None:
+            fields = {"status": "error", "error": "ffmpeg produced no audio"}
+        else:
+            fields = {
+                "wav_filename": os.path.basename(record["output"]),
+                "original_seconds": record["original_seconds"],
+                "duration": record["trimmed_seconds"],
+                "sha256": file_sha256(record["output"]),
+                "status": "done",
+                "error": None,
+            }
+    except Exception as e:
+        fields = {"status": "error", "error": str(e)}
+    record_upload(db_path, rowid, **fields)
+    return fields
+
+
+def finish_stale(db_path: str, directory: str,
+                 older_than: float = STALE_PENDING_SECONDS) -> int:
+    """Convert the uploads left 'pending' by a process that stopped first.
+
+    Args:
+        db_path: Path of the experiments database.
+        directory: Directory holding the uploads.
+        older_than: Only uploads pending for longer than this many seconds.
+
+    Returns:
+        The number of uploads converted (or marked as errors).
+    """
+    con = sqlite3.connect(db_path, timeout=10.0)
+    try:
+        rows = con.execute("""
+            SELECT au.ref, ar.reply_filename FROM audio_uploads au
+            JOIN audio_results ar ON ar.id = au.ref
+            WHERE au.status = 'pending' AND au.t < datetime('now', ?)
+        """, (f"-{older_than} seconds",)).fetchall()
+    finally:
+        con.close()
+    for rowid, fname in rows:
+        if fname:
+            ingest_upload(db_path, rowid, os.path.join(directory, fname))
+        else:
+            record_upload(db_path, rowid, status="error", error="no upload")
+    return len(rows)
+
+
+class Ingestor:
+    """A pool of threads converting uploads in the background."""
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingest")
+
+    def submit(self, db_path: str, rowid: int,
+               fpath: str) -> concurrent.futures.Future:
+        record_upload(db_path, rowid, status="pending")
+        return self.executor.submit(ingest_upload, db_path, rowid, fpath)
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+_ingestor: Optional[Ingestor] = None
+_ingestor_lock = threading.Lock()
+
+
+def get_ingestor() -> Ingestor:
+    """Return this process's Ingestor, starting it on first use."""
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = Ingestor()
+            # Finish the queued conversions when the worker is reloaded.
+            atexit.register(_ingestor.shutdown)
+        return _ingestor
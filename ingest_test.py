@@ -0,0 +1,95 @@
+"""Tests for ingest.py."""
+
+import hashlib
+import os
+import sqlite3
+from unittest import mock
+
+import numpy as np
+from absl.testing import absltest
+
+import ingest
+
+
+class IngestTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = self.create_tempdir()
+        self.db_path = os.path.join(self.temp_dir.full_path, 'test.db')
+        con = sqlite3.connect(self.db_path)
+        ingest.ensure_tables(con)
+        con.close()
+        self.upload = self.temp_dir.create_file('sin_1_2_abc', content='mp4').full_path
+        # 1s of silence, then 1s of a tone.
+        fs = 16000
+        t = np.arange(fs) / fs
+        tone = (np.sin(2 * np.pi * 440 * t) * 10000).astype(np.int16)
+        self.audio = np.concatenate([np.zeros(fs, dtype=np.int16), tone])
+
+    def fetch(self, rowid):
+        con = sqlite3.connect(self.db_path)
+        con.row_factory = sqlite3.Row
+        row = con.execute('SELECT * FROM audio_uploads WHERE ref=?', (rowid,)).fetchone()
+        con.close()
+        return dict(row)
+
+    def test_ingest(self):
+        ingestor = ingest.Ingestor(max_workers=1)
+        with mock.patch('prepare_audio.read_mp4',
+                        return_value=(16000, self.audio)) as read_mp4:
+            future = ingestor.submit(self.db_path, 7, self.upload)
+            fields = future.result()
+        ingestor.shutdown()
+        self.assertEqual(read_mp4.call_args.kwargs['channels'], 1)
+
+        wav = self.upload + '.wav'
+        self.assertTrue(os.path.exists(wav))
+        row = self.fetch(7)
+        self.assertEqual(row['status'], 'done')
+        self.assertEqual(row['wav_filename'], os.path.basename(wav))
+        self.assertAlmostEqual(row['original_seconds'], 2.0)
+        self.assertLess(row['duration'], row['original_seconds'])
+        self.assertEqual(row['duration'], fields['duration'])
+        with open(wav, 'rb') as f:
+            self.assertEqual(row['sha256'], hashlib.sha256(f.read()).hexdigest())
+
+    def test_ingest_error(self):
+        with mock.patch('prepare_audio.read_mp4', return_value=(0, None)):
+            ingest.ingest_upload(self.db_path, 8, self.upload)
+        row = self.fetch(8)
+        self.assertEqual(row['status'], 'error')
+        self.assertIsNone(row['sha256'])
+        self.assertFalse(os.path.exists(self.upload + '.wav'))
+
+    def test_get_ingestor_shuts_down_at_exit(self):
+        with mock.patch.object(ingest, '_ingestor', None), \
+                mock.patch('atexit.register') as register:
+            ingestor = ingest.get_ingestor()
+            self.assertIs(ingest.get_ingestor(), ingestor)
+        register.assert_called_once_with(ingestor.shutdown)
+        ingestor.shutdown()
+
+    def test_finish_stale(self):
+        con = sqlite3.connect(self.db_path)
+        con.executescript("""
+            CREATE TABLE audio_results (id INTEGER PRIMARY KEY, reply_filename TEXT);
+            INSERT INTO audio_results VALUES (1, 'sin_1_2_abc'), (2, NULL), (3, 'sin_1_2_abc');
+            INSERT INTO audio_uploads (ref, status, t) VALUES
+                (1, 'pending', datetime('now', '-2 hours')),
+                (2, 'pending', datetime('now', '-2 hours')),
+                (3, 'pending', datetime('now'));
+        """)
+        con.commit()
+        con.close()
+        with mock.patch('prepare_audio.read_mp4', return_value=(16000, self.audio)):
+            self.assertEqual(ingest.finish_stale(self.db_path, self.temp_dir.full_path), 2)
+        self.assertEqual(self.fetch(1)['status'], 'done')
+        self.assertEqual(self.fetch(2)['status'], 'error')
+        # Recently queued, so possibly still being converted.
+        self.assertEqual(self.fetch(3)['status'], 'pending')
+        self.assertEqual(ingest.finish_stale(self.db_path, self.temp_dir.full_path), 0)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -15,6 +15,12 @@ WHAT THIS SCRIPT DOES:
 3. Creates a UNIQUE INDEX on 'ref'. This acts as a 'bouncer'—it forces 
    the 'REPLACE' part of 'INSERT OR REPLACE' to actually overwrite 
    existing records instead of duplicating them.
+4. Adds the scoring columns used by score_and_report.py.
+5. Creates the compact ASR tables (audio_asr.text, audio_asr_words and
+   audio_asr_raw, see asr_storage.py) and backfills them in batches.
+6. Adds indexed generated columns for model_name, model_type and
+   config_fingerprint to audio_asr, so results can be selected by model
+   without parsing the JSON.
 """
 
 import sqlite3
@@ -23,6 +29,8 @@ import os
 import absl.flags as flags
 import absl.app as app
 
+import asr_storage
+
 def migrate_database(db_file):
     print(f"Connecting to {db_file}...")
     # Use a context manager for the connection to handle closing automatically
@@ -81,11 +89,44 @@ def add_asr_columns_if_needed(db_file):
               pass
       con.commit()
 
+def add_compact_asr_tables(db_file, batch_size=1000, raw_storage='inline'):
+    """Create the compact ASR tables and backfill them from audio_asr.data.
+
+    See asr_storage for the layout. Rows are converted in batches of
+    batch_size, each in its own transaction, so the migration can be stopped
+    and restarted on a large database.
+    """
+    with sqlite3.connect(db_file) as con:
+        converted = asr_storage.backfill(con, batch_size=batch_size,
+                                         raw_storage=raw_storage)
+        print(f"Backfilled the compact ASR tables for {converted} rows.")
+        if raw_storage == 'cold' and converted:
+            # Give the space freed in audio_asr back to the file system.
+            con.execute("VACUUM")
+
+
+def add_model_columns(db_file):
+    """Add the generated model columns of audio_asr and their indexes.
+
+    See asr_storage.MODEL_COLUMNS. Needs SQLite 3.31 or newer.
+    """
+    with sqlite3.connect(db_file) as con:
+        asr_storage.ensure_model_columns(con)
+        con.commit()
+        print("Indexed audio_asr columns: " + ", ".join(asr_storage.MODEL_COLUMNS))
+
+
 try:
   flags.DEFINE_string('dbfile', 'experiments_malcolm.db', 
                       'Path to the SQLite database file to migrate.')
 except flags.DuplicateFlagError:
     pass # Flag was already defined by another module during pytest collection
+flags.DEFINE_integer('backfill_batch_size', 1000,
+                     'Number of audio_asr rows converted per transaction when '
+                     'backfilling the compact ASR tables.')
+flags.DEFINE_bool('cold_raw_asr', False,
+                  'While backfilling, also move the full ASR JSON into the '
+                  'compressed audio_asr_raw table.')
 FLAGS = flags.FLAGS
 
 def main(*argv):
@@ -96,6 +137,10 @@ def main(*argv):
         return
     migrate_database(FLAGS.dbfile)
     add_asr_columns_if_needed(FLAGS.dbfile)
+    add_compact_asr_tables(FLAGS.dbfile,
+                           batch_size=FLAGS.backfill_batch_size,
+                           raw_storage='cold' if FLAGS.cold_raw_asr else 'inline')
+    add_model_columns(FLAGS.dbfile)
 
 if __name__ == "__main__":
   app.run(main)
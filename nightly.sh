@@ -1,6 +1,6 @@
 #!/bin/bash
 
-bash -c "source ~mslaney/miniconda3/etc/profile.d/conda.sh; conda init bash; conda activate quicksin; cd /var/www/jnd; python3 offline_asr.py"
+bash -c "source ~mslaney/miniconda3/etc/profile.d/conda.sh; conda init bash; conda activate quicksin; cd /var/www/jnd; python3 offline_asr.py; python3 upload_manifest.py --dbfile experiments.db --uploads_dir uploads; python3 upload_manifest.py --dbfile /var/www/jnd.emily/experiments.db --uploads_dir uploads; python3 -m review_modules.coverage --dbfile experiments.db; python3 -m review_modules.coverage --dbfile /var/www/jnd.emily/experiments.db"
 
 new_filename=$(date "+%Y-%m-%d")_experiments.db
 # cp experiments.db ~/StanfordAudiologyDrive/QuickSIN/backup/$new_filename
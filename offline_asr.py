@@ -5,9 +5,12 @@ judgement about whether the right words were recognized.
 
 The only output from this program is an update datbase file.
 """
+import contextlib
 import copy
 from datetime import datetime
+import gc
 import json
+import multiprocessing
 import os
 import pathlib
 import pprint
@@ -16,15 +19,21 @@ import sqlite3
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 from tqdm import tqdm
-from typing import Any, Dict, List, Optional, Tuple
-from multiprocessing import Pool
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 from functools import partial
 
 from absl import app
 from absl import flags
 from absl.flags import DuplicateFlagError # To handle potential flag redefinition during testing
+import torch
 import asr
+import asr_cache
+import asr_storage
+import asr_timing
+import decode_budget
 
 default_sample_rate = 22050
 
@@ -97,10 +106,18 @@ flags.DEFINE_integer(
     0,
     'For testing: only process this many rows and then quit.'
 )
-flags.DEFINE_integer(
-    'num_workers',
-    1,
-    'Number of concurrent workers for ASR processing. Running multiple workers will multiply your RAM/VRAM usage.'
+try:
+    flags.DEFINE_integer(
+        'num_workers',
+        1,
+        'Number of concurrent workers for ASR processing. Running multiple workers will multiply your RAM/VRAM usage, unless --share_model is set.'
+    )
+except DuplicateFlagError:
+    pass # Flag was already defined by another module during pytest collection
+flags.DEFINE_boolean(
+    'share_model',
+    False,
+    'Load the Whisper model once in the parent process and fork the workers, so they share the read-only weight pages copy-on-write instead of each loading their own copy (Linux/macOS, CPU decoding only).'
 )
 flags.DEFINE_list(
   'target_projects',
@@ -145,6 +162,57 @@ flags.DEFINE_float(
     10.0,
     'Penalty to apply to out-of-vocabulary words. Higher means stricter adherence to the valid words list.'
 )
+flags.DEFINE_string(
+    'asr_cache',
+    '',
+    'Path to a persistent ASR result cache (a SQLite file kept outside the experiments database). Results are looked up by audio hash and decoding options before running Whisper. Empty disables the cache.'
+)
+flags.DEFINE_integer(
+    'asr_cache_max_mb',
+    4096,
+    'Evict the least recently used results once the ASR cache grows past this many megabytes; 0 means unbounded.'
+)
+flags.DEFINE_enum(
+    'raw_asr_storage',
+    'inline',
+    asr_storage.RAW_STORAGE_MODES,
+    'Where to keep Whisper\'s full JSON: "inline" in audio_asr.data, or "cold" compressed in the audio_asr_raw table, leaving only the top-level fields in audio_asr.data. The text and words always go to the compact audio_asr.text column and audio_asr_words table.'
+)
+flags.DEFINE_float(
+    'decode_tokens_per_second',
+    0.0,
+    'Decode budget: allow at most this many generated tokens per second of audio (and at least 32) in each 30 second window. 0 disables this guard.'
+)
+flags.DEFINE_integer(
+    'decode_max_fallbacks',
+    -1,
+    'Decode budget: allow at most this many temperature fallbacks per window. -1 keeps Whisper\'s full temperature ladder.'
+)
+flags.DEFINE_float(
+    'decode_max_seconds',
+    0.0,
+    'Decode budget: stop decoding an utterance after this many seconds. 0 disables this guard.'
+)
+flags.DEFINE_string(
+    'retry_list',
+    '',
+    'If set, write the audio_results ids of the utterances that exceeded the decode budget (and were not stored) to this file, one per line.'
+)
+flags.DEFINE_string(
+    'retry_refs',
+    '',
+    'If set, only process the audio_results ids listed in this file (such as a --retry_list from an earlier run), typically with a larger decode budget.'
+)
+flags.DEFINE_string(
+    'timing_trace',
+    '',
+    'If set, write the per-stage timing of every task (see asr_timing.py) to this JSONL file.'
+)
+flags.DEFINE_string(
+    'timing_summary',
+    '',
+    'If set, write the end-of-run timing summary (real-time factor, utterances per second and latency percentiles per project and model) to this JSON file.'
+)
 flags.DEFINE_string(
     'valid_words',
     'valid_words.json',
@@ -406,6 +474,254 @@ def init_worker(asr_class_name: str, model_name: str):
     # Instantiate the model
     asr_class = getattr(asr, asr_class_name)
     worker_asr_engine = asr_class(model_name)
+    asr_timing.instrument_engine(worker_asr_engine)
+
+
+# --- Each process opens its own connection to the ASR result cache ---
+worker_asr_cache = None
+
+def get_worker_cache(cache_file: str) -> asr_cache.ASRCache:
+    """Return this process's connection to the ASR result cache."""
+    global worker_asr_cache
+    if worker_asr_cache is None or worker_asr_cache.path != cache_file:
+        worker_asr_cache = asr_cache.ASRCache(cache_file)
+    return worker_asr_cache
+
+
+def result_cache_key(audio_path: str,
+                     asr_class_name: str,
+                     model_name: str,
+                     initial_prompt: str = '',
+                     priming: Optional[Tuple[str, float]] = None,
+                     language: str = 'en',
+                     valid_words: Optional[List[str]] = None,
+                     oov_penalty: Optional[float] = None,
+                     budget: Optional[decode_budget.DecodeBudget] = None) -> str:
+    """Return the ASR cache key for decoding one file with these options.
+
+    Args:
+        audio_path: Path to the WAV file to recognize.
+        asr_class_name: Name of the ASR engine class.
+        model_name: The Whisper model name.
+        initial_prompt: The prompt passed to the recognizer.
+        priming: The (filename, duration) of the acoustic prime, or None.
+        language: Language code used for transcription.
+        valid_words: Valid words for forced decoding, or None.
+        oov_penalty: OOV penalty for forced decoding, or None.
+        budget: The decode budget, or None.
+
+    Returns:
+        The cache key.
+    """
+    priming_id = ''
+    if priming is not None:
+        priming_filename, priming_length = priming
+        priming_id = f'{asr_cache.file_digest(priming_filename)}:{priming_length}'
+    return asr_cache.make_key(asr_cache.file_digest(audio_path),
+                              model_name, asr_class_name,
+                              prompt=initial_prompt,
+                              valid_words=valid_words,
+                              oov_penalty=oov_penalty,
+                              priming=priming_id,
+                              language=language,
+                              budget=budget.key() if budget else None)
+
+
+def config_fingerprint(asr_class_name: str, model_name: str,
+                       language: str = 'en', **options) -> str:
+    """Return a short id for the decoding configuration of a run.
+
+    It is stored with each result (and indexed in audio_asr.config_fingerprint)
+    so the results of one configuration of a sweep can be selected together.
+
+    Args:
+        asr_class_name: Name of the ASR engine class.
+        model_name: The Whisper model name.
+        language: Language code used for transcription.
+        **options: The other options that change the decoding, such as
+            whether prompts, priming or forced vocabularies are used.
+
+    Returns:
+        The first 16 hex digits of a digest of the configuration.
+    """
+    return asr_cache.value_digest({'engine': asr_class_name,
+                                   'model_name': model_name,
+                                   'language': language,
+                                   **options})[:16]
+
+
+def process_memory_usage(pid: int) -> Dict[str, int]:
+    """Return the resident and proportional set sizes of a process.
+
+    The proportional set size (PSS) charges each shared page to all the
+    processes mapping it, so summing PSS over the workers gives the real
+    memory cost of the pool, while RSS counts shared weights once per worker.
+
+    Args:
+        pid: The process id to measure.
+
+    Returns:
+        A dictionary with 'rss', 'pss', 'shared' and 'private' sizes in bytes,
+        or an empty dictionary if /proc/<pid>/smaps_rollup is not available.
+    """
+    fields = {'Rss': 'rss', 'Pss': 'pss',
+              'Shared_Clean': 'shared', 'Shared_Dirty': 'shared',
+              'Private_Clean': 'private', 'Private_Dirty': 'private'}
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].rstrip(':') in fields:
+                    key = fields[parts[0].rstrip(':')]
+                    usage[key] = usage.get(key, 0) + int(parts[1]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return usage
+
+
+def report_worker_memory(pids: List[int]) -> List[Dict[str, int]]:
+    """Print the memory use of the parent and each worker process.
+
+    Args:
+        pids: The process ids of the pool workers.
+
+    Returns:
+        A list with the memory usage dictionary of each worker (the parent is
+        only printed).
+    """
+    def mb(n: int) -> str:
+        return f'{n / (1024 * 1024):8.1f}MB'
+
+    parent = process_memory_usage(os.getpid())
+    if not parent:
+        print('Worker memory report is not available on this platform.')
+        return []
+    print(f'Parent  pid {os.getpid():7d}: RSS {mb(parent.get("rss", 0))}  '
+          f'PSS {mb(parent.get("pss", 0))}')
+    usages = []
+    for pid in pids:
+        usage = process_memory_usage(pid)
+        if not usage:
+            continue
+        usages.append(usage)
+        print(f'Worker  pid {pid:7d}: RSS {mb(usage.get("rss", 0))}  '
+              f'PSS {mb(usage.get("pss", 0))}  '
+              f'shared {mb(usage.get("shared", 0))}  '
+              f'private {mb(usage.get("private", 0))}')
+    if usages:
+        print(f'Total worker RSS {mb(sum(u.get("rss", 0) for u in usages))}, '
+              f'PSS {mb(sum(u.get("pss", 0) for u in usages))}')
+    return usages
+
+
+def report_cache_savings(cache: asr_cache.ASRCache, run_id: int) -> Dict[str, Any]:
+    """Print how much decoding the ASR cache saved in a run, then evict.
+
+    Args:
+        cache: The ASR result cache.
+        run_id: The cache's id for this run.
+
+    Returns:
+        The run's cache statistics.
+    """
+    report = cache.run_report(run_id)
+    print(f"ASR cache: {report['hits']} hits, {report['misses']} misses "
+          f"({100 * report['hit_rate']:.1f}% hit rate); saved "
+          f"{report['saved_seconds']:.1f}s of decoding, spent "
+          f"{report['decode_seconds']:.1f}s decoding.")
+    evicted = cache.evict()
+    count, size = cache.size()
+    print(f'ASR cache holds {count} results ({size / (1024 * 1024):.1f}MB) '
+          f'after evicting {evicted}.')
+    return report
+
+
+def cuda_in_use() -> bool:
+    """Whether a model loaded here would be on, or CUDA is already set up for, a GPU."""
+    return torch.cuda.is_available() or torch.cuda.is_initialized()
+
+
+def create_worker_pool(asr_class_name: str,
+                       model_name: str,
+                       num_workers: int,
+                       share_model: bool = False):
+    """Create the multiprocessing pool used to run the ASR workers.
+
+    By default every worker loads its own copy of the model, so memory grows
+    linearly with the number of workers. With share_model the model is loaded
+    once in this (parent) process and the workers are forked after it, so they
+    all map the same weight pages copy-on-write. Whisper inference never
+    writes to the weights, so those pages stay shared.
+
+    Args:
+        asr_class_name: Name of the ASR wrapper class to instantiate.
+        model_name: Whisper model name to load.
+        num_workers: Number of worker processes.
+        share_model: If True, load the model in the parent and fork the workers.
+            Only for CPU decoding.
+
+    Returns:
+        A multiprocessing Pool ready to run process_audio_task.
+
+    Raises:
+        RuntimeError: If share_model is set and CUDA is available, or the
+            platform can not fork.
+    """
+    if not share_model:
+        return multiprocessing.Pool(processes=num_workers,
+                                    initializer=init_worker,
+                                    initargs=(asr_class_name, model_name))
+    if cuda_in_use():
+        # whisper.load_model puts the model on the GPU when there is one, and
+        # a CUDA context does not survive the fork.
+        raise RuntimeError('--share_model can not be used with CUDA, since the '
+                           'forked workers can not use the parent\'s GPU model. '
+                           'Run without --share_model.')
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError as e:
+        raise RuntimeError('--share_model needs the fork start method, '
+                           'which is not available on this platform.') from e
+    init_worker(asr_class_name, model_name)
+    # Move everything allocated so far (the model's Python objects) out of the
+    # garbage collector's reach, so collections in the workers don't touch,
+    # and so copy, the pages holding them.
+    gc.collect()
+    gc.freeze()
+    return context.Pool(processes=num_workers)
+
+def run_submitted(worker_func, submission: Tuple[float, Tuple]):
+    """Run worker_func on a (submit time, task) pair made when it was queued."""
+    submitted, task = submission
+    return worker_func(task, submitted=submitted)
+
+def imap_submitted(pool, worker_func, tasks: Sequence[Tuple],
+                   max_queued: int) -> Iterator:
+    """Run worker_func on the tasks in pool, yielding the results as they finish.
+
+    Pool.imap_unordered's task handler thread reads its whole input at once,
+    so a time stamped as it reads each task would be the start of the run.
+    Instead at most max_queued tasks (one per worker) are in the pool at a
+    time: the next one is handed over, stamped with time.time(), as a result
+    comes back.  Close the generator before the pool, or the task handler
+    thread may wait for a free slot forever.
+    """
+    slots = threading.Semaphore(max_queued)
+
+    def submissions():
+        for task in tasks:
+            slots.acquire()
+            yield time.time(), task
+
+    try:
+        for result in pool.imap_unordered(partial(run_submitted, worker_func),
+                                          submissions()):
+            slots.release()
+            yield result
+    finally:
+        # Unblock the task handler if the results were not all read.
+        slots.release(len(tasks))
 
 def get_audio_queue(
       con: sqlite3.Connection, 
@@ -448,15 +764,23 @@ def get_audio_queue(
     return q
 
 
-def update(con: sqlite3.Connection, rowid: int, res: dict, verbose: bool = False):
+def update(con: sqlite3.Connection, rowid: int, res: dict, verbose: bool = False,
+           raw_storage: str = 'inline'):
     """Write ASR results into the database for a single trial.
 
+    Besides the JSON in audio_asr.data, this fills the compact text column and
+    audio_asr_words rows read by the analysis programs (see asr_storage).
+
     Args:
         con: An open SQLite connection.
         rowid: The audio_results row ID for which the ASR result applies.
         res: The ASR result dictionary to store.
+        verbose: If True, print the stored result.
+        raw_storage: 'inline' keeps the full JSON in audio_asr.data; 'cold'
+            stores it compressed in audio_asr_raw and keeps only the top-level
+            fields in audio_asr.data.
     """
-    res_json = json.dumps(res)
+    res_json = asr_storage.stored_data(res, raw_storage)
     cur = con.cursor()
     
     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_audio_asr_ref ON audio_asr (ref)")
@@ -465,10 +789,12 @@ def update(con: sqlite3.Connection, rowid: int, res: dict, verbose: bool = False
     
     try:
         cur.execute(sql, (rowid, res_json))
+        asr_storage.write_compact(cur, rowid, res, raw_storage=raw_storage)
         con.commit()
         if verbose:
             print(f'Updating audio_asr for ref {rowid} with ASR result {res_json}.')
     except Exception as exc:
+        con.rollback()
         print(
             f'Failed to update audio_asr for ref {rowid} with ASR result {res_json}: {exc}'
         )
@@ -483,6 +809,7 @@ def recognize_with_priming(audio_path: str,
                            initial_prompt: str = '',
                            language: str = 'en',
                            debug: bool = False,
+                           timer: Optional[asr_timing.TaskTimer] = None,
                            **kwargs) -> Dict[str, Any]:
     """Run ASR on combined priming and target audio, then discard the prime.
 
@@ -493,18 +820,22 @@ def recognize_with_priming(audio_path: str,
         adjust_timing: If True, timestamps are rebased after removing the prime.
         initial_prompt: The initial prompt to use for ASR.
         debug: If True, print debug output for ASR results.
+        timer: If given, records the priming_concat and transcribe stages.
         **kwargs: Additional arguments to pass to the ASR engine (like valid_words).
 
     Returns:
         The filtered ASR result dictionary after removing the priming segment.
     """
-    combined_path = concatenate_audio_files(priming_path, audio_path)
+    timer = timer or asr_timing.TaskTimer()
+    with timer.stage('priming_concat'):
+        combined_path = concatenate_audio_files(priming_path, audio_path)
     combined_result = {}
     try:
-        asr_result = worker_asr_engine.recognize(combined_path, 
-                                                 initial_prompt=initial_prompt,
-                                                 language=language,
-                                                 **kwargs)
+        with timer.stage('transcribe'):
+            asr_result = worker_asr_engine.recognize(combined_path, 
+                                                     initial_prompt=initial_prompt,
+                                                     language=language,
+                                                     **kwargs)
         if debug:
           print("ASR result for combined audio:")
           pprint.pprint(asr_result)
@@ -530,7 +861,12 @@ def process_audio_task(task: Tuple,
                        valid_word_map: Dict[str, List[str]] = {},
                        language: str = 'en',
                        debug: bool = False,
-                       ) -> Tuple[int, Optional[Dict[str, Any]], Optional[str]]:
+                       asr_class_name: str = '',
+                       model_name: str = '',
+                       asr_cache_file: str = '',
+                       submitted: Optional[float] = None,
+                       budget: Optional[decode_budget.DecodeBudget] = None,
+                       ) -> Tuple[int, Optional[Dict[str, Any]], Optional[str], Dict[str, Any]]:
     """Perform ASR on a single pending audio task. 
 
     Use a prompt, grammar constraints, and audio priming only for the single word projects.
@@ -542,14 +878,37 @@ def process_audio_task(task: Tuple,
         prompt_map: Mapping from project name to initial prompt string.
         valid_word_map: Mapping from project name to list of valid words.
         debug: If True, print debug output during processing.
+        asr_class_name: Name of the ASR engine class, part of the cache key.
+        model_name: Whisper model name, part of the cache key.
+        asr_cache_file: Path to the ASR result cache, or '' to always decode.
+        submitted: time.time() when the task was handed to a free worker
+            (see imap_submitted), used to measure the queue wait.
+        budget: Limits on the decoding of this utterance. If the budget is
+            exceeded no result is returned, and the timing record lists the
+            guards that fired under 'budget_guards'.
 
     Returns:
         A tuple containing the row ID, ASR result dictionary or None,
-        and an optional error message.
+        an optional error message, and the task's timing record (see
+        asr_timing).
     """
+    task_start = time.perf_counter()
+    timer = asr_timing.TaskTimer()
+    if submitted is not None:
+        timer.add('queue_wait', max(0.0, time.time() - submitted))
     # SQL Result: audio_results.id, reply_filename, project, data, users.username
     rowid, fname, project, audio_asr_data, username, answer = task
     test_filename = audio_to_filename(fname, audiodir)
+    timing = {'rowid': rowid, 'project': project, 'engine': asr_class_name,
+              'model_name': model_name, 'cache_hit': False, 'error': None}
+
+    def finish(asr_result, error=None):
+        timing.update(timer.stages)
+        timing.update(asr_timing.engine_stats.snapshot())
+        timing['error'] = error
+        timing['task_seconds'] = time.perf_counter() - task_start
+        sys.stdout.flush()
+        return rowid, asr_result, error, timing
 
     initial_prompt = ''
     if project in single_project_list and prompt_map and project in prompt_map:
@@ -569,8 +928,35 @@ def process_audio_task(task: Tuple,
         asr_kwargs['valid_words'] = [answer]
         asr_kwargs['oov_penalty'] = FLAGS.oov_penalty
 
+    if budget is not None and budget.enabled():
+        asr_kwargs['budget'] = budget
+
+    use_priming = project in single_project_list and username in audio_priming_dict
+    asr_timing.engine_stats.reset()
     try:
-        if project in single_project_list and username in audio_priming_dict:
+        with timer.stage('audio_load'):
+            timing['audio_seconds'] = get_wav_duration_seconds(test_filename)
+        cache, cache_key = None, None
+        if asr_cache_file:
+            cache = get_worker_cache(asr_cache_file)
+            cache_key = result_cache_key(
+                test_filename, asr_class_name, model_name, initial_prompt,
+                audio_priming_dict[username] if use_priming else None,
+                language, **asr_kwargs)
+            # The parent marks the hit and counts it (see main), so the workers
+            # only read the cache file.
+            cached = cache.lookup(cache_key, touch=False)
+            if cached is not None:
+                asr_result, decode_seconds = cached
+                timing['cache_key'] = cache_key
+                timing['cache_seconds'] = decode_seconds
+                if debug:
+                    print(f'Using cached ASR result for row {rowid}')
+                timing['cache_hit'] = True
+                return finish(asr_result)
+
+        decode_start = time.time()
+        if use_priming:
           priming_filename, priming_audio_length = audio_priming_dict[username]
           if debug:
             print('\n**********************************************')
@@ -582,7 +968,9 @@ def process_audio_task(task: Tuple,
                                              initial_prompt=initial_prompt,
                                              language=language,
                                              debug=debug,
+                                             timer=timer,
                                              **asr_kwargs)
+          stats = asr_timing.engine_stats.snapshot()
           if debug:
             print('ASR result with prime:')
             pprint.pprint(asr_result)
@@ -596,19 +984,28 @@ def process_audio_task(task: Tuple,
             print('ASR result without prime:' )
             pprint.pprint(asr_result2)
             sys.stdout.flush()
+            # Only count the decoding that produced the stored result.
+            asr_timing.engine_stats.restore(stats)
         else:
-          asr_result = worker_asr_engine.recognize(
-             test_filename, 
-             initial_prompt=initial_prompt,
-             language=language,
-             **asr_kwargs)
+          with timer.stage('transcribe'):
+            asr_result = worker_asr_engine.recognize(
+               test_filename, 
+               initial_prompt=initial_prompt,
+               language=language,
+               **asr_kwargs)
           if debug:
             print('No prime asr result:', asr_result)
-        sys.stdout.flush()
-        return rowid, asr_result, None
+        timing['budget_guards'] = (asr_result or {}).get('decode_budget', {}).get('guards', [])
+        if cache is not None and asr_result:
+            decode_seconds = time.time() - decode_start
+            cache.store(cache_key, asr_result, decode_seconds)
+            timing['cache_seconds'] = decode_seconds
+        return finish(asr_result)
+    except decode_budget.DecodeBudgetExceeded as e:
+        timing['budget_guards'] = e.guards
+        return finish(None, str(e))
     except Exception as e:
-        sys.stdout.flush()
-        return rowid, None, str(e)
+        return finish(None, str(e))
 
 #################### MAIN Program ####################
 
@@ -626,6 +1023,15 @@ def main(asr_class_name: str,
          count: int = 0,
          debug: bool = False,
          verbose: bool = False,
+         share_model: bool = False,
+         asr_cache_file: str = '',
+         asr_cache_max_mb: int = 0,
+         raw_storage: str = 'inline',
+         timing_trace: str = '',
+         timing_summary: str = '',
+         budget: Optional[decode_budget.DecodeBudget] = None,
+         retry_list: str = '',
+         retry_refs: Optional[List[int]] = None,
          ):
     """Process pending audio results through Whisper ASR.
 
@@ -642,13 +1048,33 @@ def main(asr_class_name: str,
         target_projects: List of project names to include in the ASR processing.
         count: Optional limit on the number of tasks to process.
         debug: If True, enable verbose debug output.
+        verbose: If True, print each database update.
+        share_model: If True, load the model once and share it with forked workers.
+        asr_cache_file: Path to the persistent ASR result cache, or '' for none.
+        asr_cache_max_mb: Size limit of the ASR result cache in megabytes.
+        raw_storage: Where to keep the full Whisper JSON ('inline' or 'cold').
+        timing_trace: Path of a JSONL file for the per-task timing records.
+        timing_summary: Path of a JSON file for the end-of-run timing summary.
+        budget: Limits on the decoding time of each utterance.
+        retry_list: Path of a file for the ids of the utterances that exceeded
+            the decode budget.
+        retry_refs: If given, only process these audio_results ids.
+
+    Returns:
+        The timing summary (see asr_timing.summarize), or None if there was
+        nothing to do.
     """
     print(f'Offline_ASR started at {datetime.now()} with {db_file}')
+    run_start = time.time()
     single_word_project_list = single_word_projects.split(',') if single_word_projects else []
     
     # Fetch all pending tasks in the main process
     with sqlite3.connect(db_file) as con:
         tasks = get_audio_queue(con, target_projects=target_projects)
+    if retry_refs is not None:
+        retry_set = set(retry_refs)
+        tasks = [task for task in tasks if task[0] in retry_set]
+        print(f'Retrying {len(tasks)} of the {len(retry_set)} listed utterances.')
 
     if not tasks:
         print("No tasks found.")
@@ -659,6 +1085,23 @@ def main(asr_class_name: str,
         print(f"Limiting to first {count} tasks for testing.")
     print(f"Processing {len(tasks)} tasks using {num_workers} worker(s)...")
 
+    cache, cache_run_id = None, 0
+    if asr_cache_file:
+        cache = asr_cache.ASRCache(asr_cache_file,
+                                   max_bytes=asr_cache_max_mb * 1024 * 1024)
+        cache_run_id = cache.start_run(f'{db_file} {asr_class_name} {model_name}')
+
+    fingerprint = config_fingerprint(
+        asr_class_name, model_name, language,
+        single_word_projects=sorted(single_word_project_list),
+        use_prompt=bool(prompt_map),
+        use_prime=bool(audio_priming_dict),
+        use_forced=FLAGS.use_forced,
+        use_exact=FLAGS.use_exact,
+        oov_penalty=FLAGS.oov_penalty if FLAGS.use_forced or FLAGS.use_exact else None,
+        **({'decode_budget': budget.key()} if budget and budget.enabled() else {}))
+    print(f'Configuration fingerprint: {fingerprint}')
+
     # Bind the static arguments to our worker function
     worker_func = partial(
         process_audio_task,
@@ -668,60 +1111,123 @@ def main(asr_class_name: str,
         prompt_map=prompt_map,
         valid_word_map=valid_word_map,
         language=language,
-        debug=debug
+        debug=debug,
+        asr_class_name=asr_class_name,
+        model_name=model_name,
+        asr_cache_file=asr_cache_file,
+        budget=budget,
     )
 
     row_count = 0
+    timing_records = []
+    retries = []
+    trace = open(timing_trace, 'w') if timing_trace else None
+
+    def store(rowid, asr_result, error, timing):
+        """Write one task's result to the database and its timing to the trace."""
+        nonlocal row_count
+        if cache is not None and 'cache_seconds' in timing:
+            # Buffered, and written once every cache.flush_every tasks.
+            cache.record(cache_run_id, timing['cache_hit'], timing['cache_seconds'])
+            if timing['cache_hit']:
+                cache.touch(timing.pop('cache_key'))
+        if error:
+            print(f"\n[!] Error on row {rowid}: {error}")
+            if timing.get('budget_guards'):
+                retries.append((rowid, timing['budget_guards']))
+        elif asr_result:
+            asr_result['config_fingerprint'] = fingerprint
+            start = time.perf_counter()
+            update(con, rowid, asr_result, verbose=verbose, raw_storage=raw_storage)
+            timing['db_write'] = time.perf_counter() - start
+            row_count += 1
+        timing_records.append(timing)
+        asr_timing.write_record(trace, timing)
+        sys.stdout.flush()  # Ensure progress bar updates correctly
 
     # Re-open the DB connection in the main thread for writing results
     with sqlite3.connect(db_file) as con:
+        asr_storage.ensure_compact_tables(con)
+        asr_storage.ensure_model_columns(con)
         if num_workers <= 1:
             # For a single worker, manually initialize the global engine in the main thread
             init_worker(asr_class_name, model_name)
             for task in tqdm(tasks):
-                rowid, asr_result, error = worker_func(task)
-                if error:
-                    print(f"\n[!] Error on row {rowid}: {error}")
-                    continue
-                if asr_result:
-                    update(con, rowid, asr_result, verbose=verbose)
-                    row_count += 1
-                sys.stdout.flush()  # Ensure progress bar updates correctly
+                store(*worker_func(task, submitted=time.time()))
         else:
-            # For multiprocessing, tell the pool to run init_worker on boot
-            with Pool(
-                processes=num_workers, 
-                initializer=init_worker, 
-                initargs=(asr_class_name, model_name)
-            ) as pool:
-                for rowid, asr_result, error in tqdm(pool.imap_unordered(worker_func, tasks), total=len(tasks)):
-                    if error:
-                        print(f"\n[!] Error on row {rowid}: {error}")
-                        continue
-                    if asr_result:
-                        update(con, rowid, asr_result, verbose=verbose)
-                        row_count += 1
-                    sys.stdout.flush()  # Ensure progress bar updates correctly
+            # For multiprocessing, either each worker runs init_worker on boot,
+            # or the workers inherit the model loaded here (share_model).
+            with create_worker_pool(asr_class_name, model_name, num_workers,
+                                    share_model=share_model) as pool:
+                # One task per worker at a time, so each task's queue_wait
+                # runs from when a worker is free to take it.
+                with contextlib.closing(imap_submitted(
+                        pool, worker_func, tasks, num_workers)) as results:
+                    for result in tqdm(results, total=len(tasks)):
+                        store(*result)
+                # Measure while the workers are still alive, with the model loaded.
+                report_worker_memory(
+                    [p.pid for p in multiprocessing.active_children()])
+
+    if trace is not None:
+        trace.close()
+    if retries:
+        print(f'{len(retries)} utterances exceeded the decode budget and were not stored.')
+    if retry_list:
+        with open(retry_list, 'w') as f:
+            for rowid, guards in sorted(retries):
+                f.write(f'{rowid}\t{",".join(guards)}\n')
 
     print(f'Finished processing {row_count} rows.')
+    if cache is not None:
+        report_cache_savings(cache, cache_run_id)
+        cache.close()
+
+    summary = asr_timing.summarize(timing_records, wall_seconds=time.time() - run_start)
+    print(asr_timing.format_summary(summary))
+    if timing_summary:
+        with open(timing_summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
 
     
 def deduplicate(db_file: str, **kw):
   """Delete duplicate audio_asr rows matching the provided keys.
 
+  Uses the indexed generated columns of audio_asr (see
+  asr_storage.MODEL_COLUMNS) when the database has them.
+
   Args:
       db_file: Path to the SQLite database.
       **kw: Key/value pairs used to identify duplicates in the JSON data.
+          The keys must be fields of asr_storage.MODEL_COLUMNS.
   """
   con = sqlite3.connect(db_file)
-  dup, sep = "json_extract(data, '$.' || ?) = ?", " AND "
-  clause = sep.join((dup,) * len(kw))
-  args = sum(kw.items(), ())
+  clause = " AND ".join(asr_storage.model_field_sql(con, key) + " = ?"
+                        for key in kw)
+  args = tuple(kw.values())
   cur = con.cursor()
+  # Drop the compact copies of the deleted results too.
+  for table in ('audio_asr_words', 'audio_asr_raw'):
+    if asr_storage.table_columns(con, table):
+      cur.execute(f"DELETE FROM {table} WHERE ref IN "
+                  "(SELECT ref FROM audio_asr WHERE " + clause + ")", args)
   cur.execute("DELETE FROM audio_asr WHERE " + clause, args)
   con.commit()
   con.close()
 
+def read_retry_refs(path: str) -> List[int]:
+    """Read the audio_results ids from a --retry_list file.
+
+    Args:
+        path: The file, with an id at the start of each line.
+
+    Returns:
+        The ids in the file.
+    """
+    with open(path) as f:
+        return [int(line.split()[0]) for line in f if line.strip()]
+
 def get_valid_projects(db_path: str) -> list[str]:
     """
     Connects to the SQLite database and returns a list of unique project names
@@ -856,7 +1362,19 @@ def run_main(argv):
         target_projects=FLAGS.target_projects,
         count=FLAGS.count,
         debug=FLAGS.debug,
-        verbose=FLAGS.verbose)
+        verbose=FLAGS.verbose,
+        share_model=FLAGS.share_model,
+        asr_cache_file=FLAGS.asr_cache,
+        asr_cache_max_mb=FLAGS.asr_cache_max_mb,
+        raw_storage=FLAGS.raw_asr_storage,
+        timing_trace=FLAGS.timing_trace,
+        timing_summary=FLAGS.timing_summary,
+        budget=decode_budget.DecodeBudget(
+            tokens_per_second=FLAGS.decode_tokens_per_second,
+            max_fallbacks=FLAGS.decode_max_fallbacks,
+            max_seconds=FLAGS.decode_max_seconds),
+        retry_list=FLAGS.retry_list,
+        retry_refs=read_retry_refs(FLAGS.retry_refs) if FLAGS.retry_refs else None)
 
 
 if __name__ == '__main__':
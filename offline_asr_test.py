@@ -1,7 +1,10 @@
 """Tests for offline_asr.py."""
 
+import contextlib
 import json
+import multiprocessing.pool
 import os
+import time
 import sqlite3
 import tempfile
 from unittest import mock
@@ -174,6 +177,225 @@ class OfflineASRTest(absltest.TestCase):
             # Verify the mocked recognize method was called
             self.assertTrue(mock_engine.recognize.called)
 
+    @mock.patch('offline_asr.cuda_in_use', return_value=False)
+    @mock.patch('offline_asr.asr')
+    def test_main_shared_model(self, mock_asr_module, unused_cuda):
+        """Tests that forked workers reuse the engine loaded in the parent."""
+        mock_engine = mock.MagicMock()
+        mock_engine.recognize.return_value = {'text': 'hello world', 'segments': []}
+        mock_asr_module.WhisperASR.return_value = mock_engine
+
+        offline_asr.main('WhisperASR', 'tiny.en', self.db_path, self.audiodir,
+                         num_workers=2, target_projects=['quick', 'cnc'],
+                         share_model=True)
+
+        # The model is only loaded once, in the parent process.
+        mock_asr_module.WhisperASR.assert_called_once_with('tiny.en')
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT ref, data FROM audio_asr ORDER BY ref").fetchall()
+        conn.close()
+        self.assertEqual([r[0] for r in rows], [101, 102])
+        self.assertEqual(json.loads(rows[0][1])['text'], 'hello world')
+
+    @mock.patch('offline_asr.cuda_in_use', return_value=True)
+    @mock.patch('offline_asr.asr')
+    def test_shared_model_refuses_cuda(self, mock_asr_module, unused_cuda):
+        """A model loaded onto the GPU can not be shared with forked workers."""
+        with self.assertRaisesRegex(RuntimeError, 'CUDA'):
+            offline_asr.create_worker_pool('WhisperASR', 'tiny.en', 2, share_model=True)
+        mock_asr_module.WhisperASR.assert_not_called()
+
+    @mock.patch('offline_asr.asr')
+    def test_main_timing(self, mock_asr_module):
+        """Tests the per-task timing trace and the end-of-run summary."""
+        def recognize(*args, **kwargs):
+            time.sleep(0.3)
+            return {'text': 'hello world', 'segments': []}
+
+        mock_engine = mock.MagicMock()
+        mock_engine.recognize.side_effect = recognize
+        mock_asr_module.WhisperASR.return_value = mock_engine
+        trace_path = os.path.join(self.temp_dir.full_path, 'timing.jsonl')
+        summary_path = os.path.join(self.temp_dir.full_path, 'timing.json')
+
+        summary = offline_asr.main('WhisperASR', 'tiny.en', self.db_path, self.audiodir,
+                                   target_projects=['quick', 'cnc'],
+                                   timing_trace=trace_path,
+                                   timing_summary=summary_path)
+
+        records = offline_asr.asr_timing.read_trace(trace_path)
+        self.assertEqual(sorted(r['rowid'] for r in records), [101, 102])
+        for r in records:
+            self.assertEqual(r['model_name'], 'tiny.en')
+            self.assertAlmostEqual(r['audio_seconds'], 2.0, places=2)
+            for stage in ('audio_load', 'transcribe', 'db_write', 'task_seconds'):
+                self.assertGreaterEqual(r[stage], 0.0)
+            # Each task waits from its own submission, not from the start of the run.
+            self.assertLess(r['queue_wait'], 0.2)
+        self.assertEqual(summary['all']['utterances'], 2)
+        self.assertEqual({g['project'] for g in summary['groups']}, {'quick', 'cnc'})
+        with open(summary_path) as f:
+            self.assertEqual(json.load(f)['all']['utterances'], 2)
+
+    def test_imap_submitted(self):
+        """Tests that queue_wait doesn't grow with a task's place in the queue."""
+        def worker(task, submitted):
+            started = time.time()
+            time.sleep(0.1)
+            return task, started - submitted
+
+        with multiprocessing.pool.ThreadPool(2) as pool:
+            with contextlib.closing(offline_asr.imap_submitted(
+                    pool, worker, list(range(6)), 2)) as results:
+                results = list(results)
+            self.assertEqual(sorted(task for task, _ in results), list(range(6)))
+            for _, wait in results:
+                self.assertLess(wait, 0.05)
+
+            # Stopping early must not leave the task handler waiting.
+            with contextlib.closing(offline_asr.imap_submitted(
+                    pool, worker, list(range(6)), 2)) as results:
+                next(results)
+
+    @mock.patch('offline_asr.asr')
+    def test_main_decode_budget(self, mock_asr_module):
+        """Tests that utterances over the decode budget go on the retry list."""
+        budget = offline_asr.decode_budget.DecodeBudget(max_seconds=30.0)
+        calls = []
+
+        def recognize(audio_path, **kwargs):
+            calls.append(kwargs.get('budget'))
+            if len(calls) == 1:
+                raise offline_asr.decode_budget.DecodeBudgetExceeded(['wall_clock'])
+            return {'text': 'hello world', 'segments': []}
+
+        mock_engine = mock.MagicMock()
+        mock_engine.recognize.side_effect = recognize
+        mock_asr_module.WhisperASR.return_value = mock_engine
+        retry_path = os.path.join(self.temp_dir.full_path, 'retry.txt')
+
+        summary = offline_asr.main('WhisperASR', 'tiny.en', self.db_path, self.audiodir,
+                                   target_projects=['quick'], budget=budget,
+                                   retry_list=retry_path)
+        self.assertEqual(calls, [budget])
+        self.assertEqual(summary['all']['guards'], {'wall_clock': 1})
+        self.assertEqual(offline_asr.read_retry_refs(retry_path), [101])
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM audio_asr').fetchone()[0], 0)
+        conn.close()
+
+        # Retrying only processes the listed utterances.
+        offline_asr.main('WhisperASR', 'tiny.en', self.db_path, self.audiodir,
+                         target_projects=['quick', 'cnc'],
+                         retry_refs=offline_asr.read_retry_refs(retry_path),
+                         retry_list=retry_path)
+        self.assertLen(calls, 2)
+        self.assertIsNone(calls[1])
+        conn = sqlite3.connect(self.db_path)
+        refs = [r[0] for r in conn.execute('SELECT ref FROM audio_asr')]
+        conn.close()
+        self.assertEqual(refs, [101])
+        self.assertEqual(offline_asr.read_retry_refs(retry_path), [])
+
+    @mock.patch('offline_asr.asr')
+    def test_main_compact_storage(self, mock_asr_module):
+        """Tests that the text and words go into the compact tables."""
+        mock_engine = mock.MagicMock()
+        mock_engine.recognize.return_value = {
+            'text': 'hello world',
+            'segments': [{'start': 0.0, 'end': 1.0,
+                          'words': [{'word': 'hello', 'start': 0.0, 'end': 0.5,
+                                     'probability': 0.9},
+                                    {'word': 'world', 'start': 0.5, 'end': 1.0,
+                                     'probability': 0.8}]}]}
+        mock_asr_module.WhisperASR.return_value = mock_engine
+
+        offline_asr.main('WhisperASR', 'tiny.en', self.db_path, self.audiodir,
+                         target_projects=['quick'], raw_storage='cold')
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute('SELECT text FROM audio_asr WHERE ref = 101')
+                         .fetchone()[0], 'hello world')
+        words = offline_asr.asr_storage.load_words(conn)
+        self.assertEqual([w['word'] for w in words[101]], ['hello', 'world'])
+        self.assertAlmostEqual(words[101][1]['probability'], 0.8)
+        # Cold storage keeps only the top-level fields in audio_asr.data.
+        data = json.loads(conn.execute('SELECT data FROM audio_asr WHERE ref = 101')
+                          .fetchone()[0])
+        self.assertNotIn('segments', data)
+        full = offline_asr.asr_storage.load_result(conn, 101)
+        self.assertLen(full['segments'][0]['words'], 2)
+        self.assertEqual(conn.execute(
+            'SELECT config_fingerprint FROM audio_asr WHERE ref = 101').fetchone()[0],
+            data['config_fingerprint'])
+        conn.close()
+
+    def test_deduplicate(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany('INSERT INTO audio_asr (ref, data) VALUES (?, ?)', [
+            (101, json.dumps({'model_name': 'tiny.en', 'model_type': 'forced'})),
+            (102, json.dumps({'model_name': 'tiny.en', 'model_type': 'default'})),
+        ])
+        conn.commit()
+        offline_asr.asr_storage.ensure_model_columns(conn)
+        conn.close()
+
+        offline_asr.deduplicate(self.db_path, model_name='tiny.en', model_type='forced')
+        conn = sqlite3.connect(self.db_path)
+        refs = [r[0] for r in conn.execute('SELECT ref FROM audio_asr')]
+        conn.close()
+        self.assertEqual(refs, [102])
+
+        with self.assertRaises(ValueError):
+            offline_asr.deduplicate(self.db_path, text='hello')
+
+    @mock.patch('offline_asr.asr')
+    def test_main_asr_cache(self, mock_asr_module):
+        """Tests that a second run over cleared rows is served from the cache."""
+        mock_engine = mock.MagicMock()
+        mock_engine.recognize.return_value = {'text': 'hello world', 'segments': []}
+        mock_asr_module.WhisperASR.return_value = mock_engine
+        cache_path = os.path.join(self.temp_dir.full_path, 'asr_cache.db')
+
+        def run():
+            offline_asr.main('WhisperASR', 'tiny.en', self.db_path, self.audiodir,
+                             target_projects=['quick', 'cnc'],
+                             asr_cache_file=cache_path)
+
+        # Both results point at the same audio file and use the same options,
+        # so the second one is already served from the cache.
+        run()
+        self.assertEqual(mock_engine.recognize.call_count, 1)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE audio_asr SET data = ''")
+        conn.commit()
+        conn.close()
+        run()
+        self.assertEqual(mock_engine.recognize.call_count, 1)
+
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT ref, data FROM audio_asr ORDER BY ref").fetchall()
+        conn.close()
+        self.assertEqual(json.loads(rows[1][1])['text'], 'hello world')
+
+        # A different model misses the cache.
+        cache = offline_asr.asr_cache.ASRCache(cache_path)
+        target = os.path.join(self.audiodir, f"{self.target_audio_name}.wav")
+        self.assertIsNotNone(cache.lookup(
+            offline_asr.result_cache_key(target, 'WhisperASR', 'tiny.en')))
+        self.assertIsNone(cache.lookup(
+            offline_asr.result_cache_key(target, 'WhisperASR', 'base.en')))
+        cache.close()
+
+    def test_process_memory_usage(self):
+        usage = offline_asr.process_memory_usage(os.getpid())
+        if not usage:
+            self.skipTest('/proc/<pid>/smaps_rollup is not available')
+        self.assertGreater(usage['rss'], 0)
+        self.assertGreater(usage['pss'], 0)
+        self.assertLessEqual(usage['pss'], usage['rss'])
+
 
 if __name__ == '__main__':
     absltest.main()
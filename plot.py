@@ -64,3 +64,85 @@ def logistic_results(spin_snrs, scores):
     axis.plot([logistic_params[1], logistic_params[1]], [0, 0.5], ':')
     return audio_labeled(fig, axis)
 
+
+def fit_psychometric_curves(groups, max_iter: int = 200, tol: float = 1e-6):
+  """Fits psychometric_curve to many sets of results at once.
+
+  Minimizes the same squared error as the curve_fit in logistic_results, but
+  with a Levenberg-Marquardt iteration that updates every group together:
+  each step solves one 2x2 system per group with array operations, instead
+  of calling curve_fit once per group.
+
+  Args:
+    groups: A sequence of (snrs, scores) pairs, one per subject.
+    max_iter: Maximum number of iterations.
+    tol: Relative decrease of the squared error at which a fit is done.
+
+  Returns:
+    Arrays with the growth rate c and midpoint d (the SNR-50 threshold) of
+    each group, and whether its fit converged.  Groups with fewer than two
+    distinct SNRs, or whose midpoint lies more than the range of SNRs
+    tested outside that range (e.g. all correct), are not converged.
+  """
+  n = len(groups)
+  width = max((len(x) for x, _ in groups), default=0)
+  x = np.zeros((n, width))
+  y = np.zeros((n, width))
+  mask = np.zeros((n, width))
+  for i, (snrs, scores) in enumerate(groups):
+    x[i, :len(snrs)] = snrs
+    y[i, :len(scores)] = scores
+    mask[i, :len(snrs)] = 1.0
+  counts = mask.sum(axis=1)
+  # Start from a unit growth rate, and the midpoint the area above the
+  # scores would give a step function over the SNRs tested.
+  lo = np.where(mask > 0, x, np.inf).min(axis=1, initial=np.inf)
+  hi = np.where(mask > 0, x, -np.inf).max(axis=1, initial=-np.inf)
+  mean_score = (y * mask).sum(axis=1) / np.maximum(counts, 1)
+  c = np.ones(n)
+  with np.errstate(invalid='ignore'):
+    d = np.where(counts > 0, lo + (1 - mean_score) * (hi - lo), 0.0)
+  damping = np.full(n, 1e-3)
+  converged = np.zeros(n, dtype=bool)
+  active = np.array([len(np.unique(snrs)) > 1 for snrs, _ in groups],
+                    dtype=bool)
+
+  def squared_error(c, d):
+    p = psychometric_curve(x, c[:, None], d[:, None])
+    return (((p - y) * mask) ** 2).sum(axis=1)
+
+  with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+    error = squared_error(c, d)
+    for _ in range(max_iter):
+      if not active.any():
+        break
+      p = psychometric_curve(x, c[:, None], d[:, None])
+      dp = p * (1 - p) * mask
+      jc = dp * (x - d[:, None])
+      jd = -c[:, None] * dp
+      r = (p - y) * mask
+      a11 = (jc * jc).sum(axis=1) * (1 + damping)
+      a12 = (jc * jd).sum(axis=1)
+      a22 = (jd * jd).sum(axis=1) * (1 + damping)
+      b1 = (jc * r).sum(axis=1)
+      b2 = (jd * r).sum(axis=1)
+      det = a11 * a22 - a12 * a12
+      ok = active & (det > 0)
+      step_c = np.where(ok, (a12 * b2 - a22 * b1) / det, 0.0)
+      step_d = np.where(ok, (a12 * b1 - a11 * b2) / det, 0.0)
+      new_error = squared_error(c + step_c, d + step_d)
+      # The curve rises with SNR, so the growth rate stays positive.
+      better = ok & (new_error < error) & (c + step_c > 0)
+      converged |= better & (error - new_error <= tol * np.maximum(error, 1e-12))
+      c = np.where(better, c + step_c, c)
+      d = np.where(better, d + step_d, d)
+      error = np.where(better, new_error, error)
+      damping = np.where(better, damping / 10, damping * 10)
+      # A step that can't be improved by any damping is a minimum, too.
+      converged |= active & (damping > 1e12) & (error < np.inf)
+      active &= ok & ~converged
+  # A midpoint far outside the SNRs tested (e.g. when every word was right)
+  # is an extrapolation, not a threshold.
+  converged &= np.isfinite(c) & np.isfinite(d) & (c > 0)
+  converged &= (d > lo - (hi - lo)) & (d < hi + (hi - lo))
+  return c, d, converged
@@ -0,0 +1,130 @@
+"""Cache of the rendered /plot images.
+
+Rendering a results plot fits a psychometric curve and draws a matplotlib
+figure, which takes far longer than the queries behind it.  The images only
+change when new results come in, so they are cached under
+(project, user or "all") together with a data version: a small tuple from
+the database (such as the largest result and annotation rowids) that changes
+whenever the plotted data may have.
+
+  * The cache holds at most max_entries images, dropping the least recently
+    used.
+  * Every image has an ETag derived from its key and version, so a browser
+    that already has the current image gets a 304 without anything being
+    queried beyond the version, let alone rendered.
+  * When the caller accepts a stale image, a version change returns the
+    cached image at once and renders the new one in a background thread.
+
+Only the rendering runs in the background; the data is always read on the
+request thread, where the database connection lives.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import threading
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from flask import Response, request
+
+MAX_ENTRIES = 64
+
+
+def plot_etag(key: Hashable, version: Hashable) -> str:
+    return hashlib.sha1(repr((key, version)).encode()).hexdigest()[:20]
+
+
+class PlotCache:
+    """A bounded LRU cache of PNG images, keyed by plot and data version."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        # key -> (version, etag, png), least recently used first
+        self.entries = collections.OrderedDict()
+        self.rendering = {}  # key -> Future of a background render
+        self.lock = threading.Lock()
+        self.executor = None
+        self.stats = collections.Counter()
+
+    def _store(self, key, version, png: bytes) -> Tuple[str, bytes]:
+        etag = plot_etag(key, version)
+        with self.lock:
+            self.entries[key] = (version, etag, png)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return etag, png
+
+    def _render_later(self, key, version, render: Callable[[Any], bytes], data):
+        def run():
+            try:
+                self._store(key, version, render(data))
+            finally:
+                with self.lock:
+                    self.rendering.pop(key, None)
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="plot")
+        self.rendering[key] = self.executor.submit(run)
+
+    def get(self, key: Hashable, version: Hashable,
+            fetch: Callable[[], Any], render: Callable[[Any], bytes],
+            stale_ok: bool = False) -> Tuple[str, bytes]:
+        """Return the ETag and PNG of a plot, rendering it if needed.
+
+        Args:
+            key: Identifies the plot.
+            version: The current version of the plotted data.
+            fetch: Reads the data to plot; always called on this thread.
+            render: Turns the data into a PNG.
+            stale_ok: Whether an image of an older version may be returned
+                while the current one renders in the background.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[0] == version or stale_ok):
+                self.entries.move_to_end(key)
+                if entry[0] == version:
+                    self.stats["hits"] += 1
+                    return entry[1:]
+                self.stats["stale"] += 1
+                stale = True
+            else:
+                self.stats["misses"] += 1
+                stale = False
+        data = fetch()
+        if not stale:
+            return self._store(key, version, render(data))
+        with self.lock:
+            if key not in self.rendering:
+                self._render_later(key, version, render, data)
+        return entry[1:]
+
+    def respond(self, key: Hashable, version: Hashable,
+                fetch: Callable[[], Any], render: Callable[[Any], bytes],
+                stale_ok: bool = False) -> Response:
+        """Return the plot as a Flask response, or 304 if the browser has it."""
+        if request.if_none_match.contains(plot_etag(key, version)):
+            self.stats["not_modified"] += 1
+            return self._response(plot_etag(key, version), b"").make_conditional(
+                request)
+        etag, png = self.get(key, version, fetch, render, stale_ok)
+        return self._response(etag, png).make_conditional(request)
+
+    @staticmethod
+    def _response(etag: str, png: bytes) -> Response:
+        response = Response(png, mimetype="image/png")
+        response.set_etag(etag)
+        # the browser may keep the image, but must check it is still current
+        response.cache_control.no_cache = True
+        return response
+
+    def wait(self, key: Optional[Hashable] = None):
+        """Wait for the background renders (of one key, if given)."""
+        with self.lock:
+            futures = [f for k, f in self.rendering.items()
+                       if key is None or k == key]
+        concurrent.futures.wait(futures)
+
+
+plot_cache = PlotCache()
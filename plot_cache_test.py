@@ -0,0 +1,66 @@
+"""Tests for plot_cache.py."""
+
+import flask
+from absl.testing import absltest
+
+from plot_cache import PlotCache, plot_etag
+
+
+class PlotCacheTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.renders = []
+        self.cache = PlotCache(max_entries=2)
+
+    def render(self, data):
+        self.renders.append(data)
+        return f'png {data}'.encode()
+
+    def get(self, key, version, stale_ok=False):
+        return self.cache.get(key, version, lambda: version, self.render, stale_ok)
+
+    def test_hits_and_eviction(self):
+        etag, png = self.get(('quick', 'all'), (1,))
+        self.assertEqual(png, b'png (1,)')
+        self.assertEqual(etag, plot_etag(('quick', 'all'), (1,)))
+        self.assertEqual(self.get(('quick', 'all'), (1,)), (etag, png))
+        self.assertLen(self.renders, 1)
+
+        self.get(('quick', 'all'), (2,))  # New data.
+        self.assertLen(self.renders, 2)
+
+        self.get(('quick', '1'), (2,))
+        self.get(('quick', '2'), (2,))  # Evicts ('quick', 'all').
+        self.assertEqual(self.cache.stats['evictions'], 1)
+        self.get(('quick', 'all'), (2,))
+        self.assertLen(self.renders, 5)
+
+    def test_stale(self):
+        self.get(('quick', 'all'), (1,))
+        etag, png = self.get(('quick', 'all'), (2,), stale_ok=True)
+        self.assertEqual(png, b'png (1,)')
+        self.cache.wait()
+        self.assertEqual(self.cache.stats['stale'], 1)
+        self.assertEqual(self.get(('quick', 'all'), (2,))[1], b'png (2,)')
+        self.assertLen(self.renders, 2)
+
+    def test_respond(self):
+        app = flask.Flask(__name__)
+        key = ('quick', 'all')
+        with app.test_request_context('/plot'):
+            response = self.cache.respond(key, (1,), lambda: 1, self.render)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        etag = response.get_etag()[0]
+
+        with app.test_request_context('/plot', headers={'If-None-Match': f'"{etag}"'}):
+            response = self.cache.respond(
+                key, (1,), lambda: self.fail('fetched'), self.render)
+        self.assertEqual(response.status_code, 304)
+        self.assertLen(self.renders, 1)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -2,11 +2,20 @@
 # convert them from MP3 format to WAV format, removing the silence at the start
 # of each utterance.  The recordings start at the start of the audio playback,
 # so there are a number of seconds of silence.
+#
+# ffmpeg's output is read through a pipe, so several copies of this program
+# (or several worker processes, see --num_workers) can run at once.  Each
+# finished file is appended to a manifest (--manifest) so an interrupted run
+# can be restarted.
 
 import glob
+import json
+import multiprocessing
 import os
+import struct
 import subprocess
-from typing import Dict, List, Optional, Tuple, Union
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -17,107 +26,238 @@ from absl import app
 from absl import flags
 
 
-def read_mp4(audio_url, 
-             tmp_wav_file: str = '/tmp/audio.wav') -> Tuple[float, NDArray]:
-  # Use ffmpeg to convert the mp4 to wav at 16kHz
-  # '-y' overwrites output file
-  subprocess.run(['ffmpeg', '-y', '-loglevel', 'quiet', '-i', audio_url, 
-                  '-acodec', 'pcm_s16le', '-ar', '16000', tmp_wav_file])
+def parse_wav(wav_bytes: bytes) -> Tuple[int, Optional[NDArray]]:
+  """Decode a 16-bit PCM WAV file held in memory.
 
-  # Read the wav file using scipy
-  if not os.path.exists(tmp_wav_file):
-    print(f'FFMPEG did not produce an audio file for {audio_url}.')
+  When ffmpeg writes a WAV file to a pipe it can't go back to fill in the
+  chunk sizes, so the data chunk is taken to run to the end of the stream.
+
+  Returns:
+    The sample rate and the samples (samples x channels for more than one
+    channel), like scipy.io.wavfile.read, or (0, None) if this is not a WAV
+    file.
+  """
+  if len(wav_bytes) < 12 or wav_bytes[:4] != b'RIFF' or wav_bytes[8:12] != b'WAVE':
     return 0, None
-  rate, data = scipy.io.wavfile.read(tmp_wav_file)
+  pos = 12
+  rate, channels = 0, 1
+  while pos + 8 <= len(wav_bytes):
+    chunk_id, chunk_size = struct.unpack('<4sI', wav_bytes[pos:pos + 8])
+    pos += 8
+    if chunk_id == b'fmt ':
+      _, channels, rate, _, _, bits = struct.unpack('<HHIIHH', wav_bytes[pos:pos + 16])
+      if bits != 16:
+        raise ValueError(f'Expected 16 bit samples, not {bits}')
+    elif chunk_id == b'data':
+      data = wav_bytes[pos:]
+      if chunk_size not in (0, 0xFFFFFFFF):
+        data = data[:chunk_size]
+      frame_bytes = 2 * channels
+      samples = np.frombuffer(data[:len(data) // frame_bytes * frame_bytes],
+                              dtype='<i2')
+      if channels > 1:
+        samples = samples.reshape(-1, channels)
+      return rate, samples
+    pos += chunk_size + (chunk_size & 1)  # Chunks are padded to even sizes.
+  return 0, None
 
-  # Display the sample rate and the first few samples of the audio data
-  # print(f"Sample rate: {rate} Hz")
-  # print(f"First 10 samples: {data[:10]}")
 
-  # Optionally, remove the temporary wav file
-  os.remove(tmp_wav_file)
+def read_mp4(audio_url: str,
+             channels: Optional[int] = None) -> Tuple[float, NDArray]:
+  # Use ffmpeg to convert the mp4 to 16-bit wav at 16kHz, written to a pipe
+  # (and to the given number of channels, if any)
+  channel_args = ['-ac', str(channels)] if channels else []
+  process = subprocess.run(['ffmpeg', '-loglevel', 'quiet', '-i', audio_url,
+                            '-acodec', 'pcm_s16le', '-ar', '16000',
+                            *channel_args, '-f', 'wav', 'pipe:1'],
+                           stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+  rate, data = parse_wav(process.stdout)
+  if data is None or not len(data):
+    print(f'FFMPEG did not produce an audio file for {audio_url}.')
+    return 0, None
   return rate, data # To match scipy.io.wavefile API
 
 
-def frame_energy(data: NDArray) -> float:
-  """Calculates the energy of an audio frame."""
-  
-  # Define frame size and hop length (in samples)
-  frame_size = 1024  # Adjust as needed, 64ms at 16kHz
-  hop_length = 512   # Adjust as needed, 32ms at 16kHz
+def frame_energy(data: NDArray,
+                 frame_size: int = 1024,  # 64ms at 16kHz
+                 hop_length: int = 512    # 32ms at 16kHz
+                 ) -> Tuple[NDArray, int]:
+  """Calculates the energy of each audio frame.
 
-  # Calculate the number of frames
-  num_samples = len(data)
-  num_frames = 1 + int(np.floor((num_samples - frame_size) / hop_length))
+  The sums of squares of 16-bit samples are computed exactly as integers
+  (from a running sum), so they are the same as summing each frame in
+  floating point.
 
-  # Initialize an empty list to store energy per frame
-  energy_per_frame = []
+  Returns:
+    The energy of each frame, and the hop length between frames.
+  """
+  num_samples = len(data)
+  num_frames = max(0, 1 + (num_samples - frame_size) // hop_length)
 
-  # Iterate through frames and calculate energy
-  for i in range(num_frames):
-    start_sample = i * hop_length
-    end_sample = start_sample + frame_size
-    frame = data[start_sample:end_sample]
-    energy = np.sum(frame.astype(float)**2)
-    energy_per_frame.append(energy)
-  return np.asarray(energy_per_frame), hop_length
+  squares = np.asarray(data).astype(np.int64)**2
+  if squares.ndim > 1:
+    squares = squares.sum(axis=tuple(range(1, squares.ndim)))
+  cumulative = np.concatenate(([0], np.cumsum(squares)))
+  starts = np.arange(num_frames) * hop_length
+  energy_per_frame = cumulative[starts + frame_size] - cumulative[starts]
+  return energy_per_frame.astype(float), hop_length
 
 
 def endpoint_audio(audio_data: NDArray,
                    energy_per_frame: NDArray, fs: float, hop_length: int, 
                    energy_threshold: float = 0.0,
-                   min_width: int = 5) -> NDArray:
+                   min_width: int = 5,
+                   plot: bool = False) -> NDArray:
+  """Removes the silence before the first run of min_width loud frames.
+
+  Keeps 20 frames before the start of the run.  If plot is set, draws the
+  energy, threshold and endpoint on the current matplotlib axes.
+  """
+  if not len(energy_per_frame):
+    return audio_data
   if energy_threshold <= 0.0:
     energy_threshold = np.max(energy_per_frame)/ 10.0  
   above_threshold = energy_per_frame > energy_threshold
-  locs = np.nonzero(above_threshold)[0]
-  # print(locs)
-  for loc in locs:
-    # print(loc, all(energy_per_frame[loc:loc+min_width] > energy_threshold))
-    if all(energy_per_frame[loc:loc+min_width] > energy_threshold):
-      loc = max(loc-20, 0)
-      plt.plot(energy_per_frame)
-      plt.axhline(energy_threshold, ls='--')
-      plt.axvline(loc, ls='--')
-      return audio_data[loc*hop_length:]
-  return audio_data
+  # A run that reaches the end of the recording is allowed to be shorter.
+  padded = np.concatenate((above_threshold, np.ones(min_width - 1, dtype=bool)))
+  runs = np.lib.stride_tricks.sliding_window_view(padded, min_width).all(axis=1)
+  if not runs.any():
+    return audio_data
+  loc = max(int(np.argmax(runs)) - 20, 0)
+  if plot:
+    plt.plot(energy_per_frame)
+    plt.axhline(energy_threshold, ls='--')
+    plt.axvline(loc, ls='--')
+  return audio_data[loc*hop_length:]
+
+
+def process_file(file: str, output_suffix: str = '.wav',
+                 plot: bool = False,
+                 channels: Optional[int] = None) -> Optional[Dict[str, Any]]:
+  """Converts and endpoints one recording.
+
+  The output is written to a temporary name and then renamed, so a file
+  that exists is always complete.  channels, if given, is the number of
+  channels to convert to.
+
+  Returns:
+    The manifest record of the file, or None if it could not be decoded.
+  """
+  output_wav_filename = file + output_suffix
+  rate, audio_data = read_mp4(file, channels=channels)
+  if audio_data is None:
+    return None
+  energy_per_frame, hop_length = frame_energy(audio_data)
+  if plot:
+    plt.figure()
+  new_audio = endpoint_audio(audio_data, energy_per_frame, rate, hop_length,
+                             plot=plot)
+  if plot:
+    plt.savefig(file + '.endpoint.png')
+    plt.close()
+  print(f'{file}: Original audio {audio_data.shape[0]/rate}s, '
+        f'new size {new_audio.shape[0]/rate}s')
+
+  # Write out the new .wav file.
+  temp_filename = output_wav_filename + f'.{os.getpid()}.tmp'
+  scipy.io.wavfile.write(temp_filename, rate, new_audio)
+  os.replace(temp_filename, output_wav_filename)
+  return {'input': file,
+          'output': output_wav_filename,
+          'rate': rate,
+          'original_seconds': audio_data.shape[0]/rate,
+          'trimmed_seconds': new_audio.shape[0]/rate}
+
+
+def read_manifest(manifest: str) -> List[Dict[str, Any]]:
+  """Reads the records of the files already processed."""
+  if not manifest or not os.path.exists(manifest):
+    return []
+  with open(manifest) as f:
+    return [json.loads(line) for line in f if line.strip()]
 
 
 def process_all_files(directory: str = '.', pattern='sin*', 
                       output_suffix: str = '.wav',
-                      skip_suffixes: Tuple[str] = ('.mp4', )):
+                      skip_suffixes: Tuple[str] = ('.mp4', ),
+                      num_workers: int = 1,
+                      manifest: Optional[str] = None,
+                      plot: bool = False) -> List[Dict[str, Any]]:
+  """Converts and endpoints all the recordings in a directory.
+
+  Args:
+    directory: Where to find the recordings.
+    pattern: Glob pattern of the recordings.
+    output_suffix: Added to each recording's name to get its WAV file.
+    skip_suffixes: Files with these suffixes are not recordings.
+    num_workers: Number of processes converting files in parallel.
+    manifest: JSONL file listing the files processed so far, or None.
+    plot: Whether to save a plot of each file's endpoint.
+
+  Returns:
+    The manifest records of the files processed in this run.
+  """
+  done = {record['input'] for record in read_manifest(manifest)}
   all_files = glob.glob(os.path.join(directory, pattern))
+  todo = []
   for file in all_files:
-    if file.endswith(output_suffix):
+    if file.endswith((output_suffix, '.tmp', '.png')):
       # Already processed.  Skip now.
       continue
     if any([file.endswith(s) for s in skip_suffixes]):
       continue
-    # Should check to see if output file is already there and then skip...
     output_wav_filename = file + output_suffix
-    if os.path.exists(output_wav_filename):
-      continue
-
-    rate, audio_data = read_mp4(file)
-    if audio_data is None:
+    if file in done or os.path.exists(output_wav_filename):
       continue
-    energy_per_frame, hop_length = frame_energy(audio_data)
-    new_audio = endpoint_audio(audio_data, energy_per_frame, rate, hop_length)
-    print(f'{file}: Original audio {audio_data.shape[0]/rate}s, '
-          f'new size {new_audio.shape[0]/rate}s')
+    todo.append(file)
 
-    # Write out the new .wav file.
-    scipy.io.wavfile.write(output_wav_filename, rate, new_audio)
+  worker = partial(process_file, output_suffix=output_suffix, plot=plot)
+  records = []
+  pool = None
+  manifest_file = open(manifest, 'a') if manifest else None
+  try:
+    if num_workers <= 1:
+      results = map(worker, todo)
+    else:
+      pool = multiprocessing.Pool(num_workers)
+      results = pool.imap_unordered(worker, todo)
+    for record in results:
+      if record is None:
+        continue
+      records.append(record)
+      if manifest_file:
+        manifest_file.write(json.dumps(record) + '\n')
+        manifest_file.flush()
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+    if manifest_file:
+      manifest_file.close()
+  print(f'Processed {len(records)} of {len(todo)} new files.')
+  return records
 
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('directory', 'uploads',
                     'Where to find the audio files to process')
+try:
+  flags.DEFINE_integer('num_workers', 1,
+                       'Number of processes converting files in parallel')
+except flags.DuplicateFlagError:
+  pass # Flag was already defined by another module during pytest collection
+flags.DEFINE_string('manifest', 'prepare_audio_manifest.jsonl',
+                    'File in --directory listing the files already processed. '
+                    'Empty to not keep one.')
+flags.DEFINE_bool('plot_endpoints', False,
+                  'Save a plot of the energy and endpoint of each file')
 
 def main(argv):
   """Main entry point."""
-  # Add your code logic here
-  process_all_files(FLAGS.directory)
+  manifest = (os.path.join(FLAGS.directory, FLAGS.manifest)
+              if FLAGS.manifest else None)
+  process_all_files(FLAGS.directory, num_workers=FLAGS.num_workers,
+                    manifest=manifest, plot=FLAGS.plot_endpoints)
 
 if __name__ == '__main__':
   app.run(main) 
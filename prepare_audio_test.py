@@ -1,5 +1,6 @@
 """Tests for prepare_audio.py."""
 
+import io
 import os
 from unittest import mock
 
@@ -54,7 +55,7 @@ class PrepareAudioTest(absltest.TestCase):
         energy, hop_length = prepare_audio.frame_energy(self.test_audio)
         
         trimmed_audio = prepare_audio.endpoint_audio(
-            self.test_audio, energy, self.fs, hop_length
+            self.test_audio, energy, self.fs, hop_length, plot=True
         )
         
         # The tone starts at sample 80,000.
@@ -67,11 +68,54 @@ class PrepareAudioTest(absltest.TestCase):
         
         self.assertEqual(len(trimmed_audio), expected_length)
         
-        # Verify that the hardcoded plot calls don't fire a real window
+        # Verify that the plot calls don't fire a real window
         self.assertTrue(mock_plt.plot.called)
         self.assertTrue(mock_plt.axhline.called)
         self.assertTrue(mock_plt.axvline.called)
 
+    @mock.patch('prepare_audio.plt')
+    def test_endpoint_audio_defaults(self, mock_plt):
+        """Tests that nothing is plotted by default, and edge cases."""
+        energy, hop_length = prepare_audio.frame_energy(self.test_audio)
+        prepare_audio.endpoint_audio(self.test_audio, energy, self.fs, hop_length)
+        self.assertFalse(mock_plt.plot.called)
+
+        # A loud run at the very end may be shorter than min_width.
+        energy = np.array([0.0, 0.0, 0.0, 0.0, 10.0, 10.0])
+        trimmed = prepare_audio.endpoint_audio(np.arange(6 * 512), energy, self.fs, 512)
+        self.assertLen(trimmed, 6 * 512)
+        # Silence is returned unchanged.
+        silence = np.zeros(4096, dtype=np.int16)
+        self.assertIs(prepare_audio.endpoint_audio(
+            silence, np.zeros(7), self.fs, 512), silence)
+
+    def test_frame_energy_matches_loop(self):
+        """Tests the vectorized energy against a frame by frame computation."""
+        rng = np.random.default_rng(0)
+        audio = (rng.normal(size=20000) * 8000).astype(np.int16)
+        energy, hop_length = prepare_audio.frame_energy(audio)
+        expected = [np.sum(audio[i:i + 1024].astype(float)**2)
+                    for i in range(0, len(audio) - 1024 + 1, hop_length)]
+        np.testing.assert_array_equal(energy, expected)
+        self.assertEmpty(prepare_audio.frame_energy(audio[:1000])[0])
+
+    @mock.patch('prepare_audio.subprocess.run')
+    def test_read_mp4(self, mock_run):
+        """Tests decoding ffmpeg's WAV output from a pipe, with unknown sizes."""
+        wav = io.BytesIO()
+        scipy.io.wavfile.write(wav, self.fs, self.test_audio)
+        data = bytearray(wav.getvalue())
+        data[4:8] = data[40:44] = b'\xff\xff\xff\xff'
+        mock_run.return_value = mock.MagicMock(stdout=bytes(data))
+
+        rate, audio = prepare_audio.read_mp4('sin_test.mp4')
+        self.assertEqual(rate, self.fs)
+        np.testing.assert_array_equal(audio, self.test_audio)
+        self.assertIn('pipe:1', mock_run.call_args[0][0])
+
+        mock_run.return_value = mock.MagicMock(stdout=b'')
+        self.assertEqual(prepare_audio.read_mp4('missing.mp4'), (0, None))
+
     @mock.patch('prepare_audio.read_mp4')
     @mock.patch('prepare_audio.plt')
     def test_process_all_files(self, mock_plt, mock_read_mp4):
@@ -102,6 +146,32 @@ class PrepareAudioTest(absltest.TestCase):
         
         # Ensure it was actually trimmed compared to the original 11s array
         self.assertLess(len(data), len(self.test_audio))
+        self.assertFalse(mock_plt.plot.called)
+
+    @mock.patch('prepare_audio.read_mp4')
+    def test_process_all_files_parallel(self, mock_read_mp4):
+        """Tests the process pool and the manifest of finished files."""
+        mock_read_mp4.return_value = (self.fs, self.test_audio)
+        names = [f'sin_{i}' for i in range(3)]
+        for name in names:
+            with open(os.path.join(self.temp_dir.full_path, name), 'w') as f:
+                f.write('dummy metadata')
+        manifest = os.path.join(self.temp_dir.full_path, 'manifest.jsonl')
+
+        records = prepare_audio.process_all_files(
+            directory=self.temp_dir.full_path, num_workers=2, manifest=manifest)
+        self.assertLen(records, 3)
+        done = prepare_audio.read_manifest(manifest)
+        self.assertEqual(sorted(os.path.basename(r['input']) for r in done), names)
+        for record in done:
+            rate, data = scipy.io.wavfile.read(record['output'])
+            self.assertLen(data, 106880)
+            self.assertAlmostEqual(record['trimmed_seconds'], 106880 / self.fs)
+
+        # Files in the manifest are not processed again.
+        os.remove(done[0]['output'])
+        self.assertEmpty(prepare_audio.process_all_files(
+            directory=self.temp_dir.full_path, manifest=manifest))
 
 
 if __name__ == '__main__':
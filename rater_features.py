@@ -0,0 +1,194 @@
+"""A persistent, incremental table of per-rating features for summarize_raters.
+
+summarize_raters.py runs once per project for each run_exp3 tag, and each run
+used to repeat the join in fetch_trials, then score every ASR transcript
+against its answer and parse every annotation list.  This module keeps the
+results in a sidecar SQLite file next to the experiments database
+(experiments_features.db for experiments.db), in the utterance_features
+table: one row per review annotation, with the trial's subject, project, SNR
+and ASR model, and the precomputed
+
+  asr_matched           The number of answer keywords the ASR recognized
+                        (summarize_raters.score_trial).
+  audiologist_fraction  The fraction of keywords the audiologist marked
+                        correct (summarize_raters.fraction_true).
+  rater_fraction        The same for the rater of this review annotation.
+
+The rows also keep the raw values summarize_raters prints, so they can stand
+in for the rows fetch_trials used to return.
+
+refresh() brings the table up to date.  Every source row has a fingerprint
+of its joined values and of the homonym map, which SQLite computes as it
+reads them (with the sidecar attached to the same connection), so only new
+and changed rows are scored again; rows no longer in the database are
+deleted.
+"""
+import hashlib
+import os
+import sqlite3
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import asr_storage
+
+FEATURES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS features.utterance_features (
+        review_rowid INTEGER NOT NULL,
+        annotation_rowid INTEGER NOT NULL,  -- -1 without an audiologist annotation
+        asr_rowid INTEGER NOT NULL,
+        utterance_id INTEGER,
+        user INTEGER,
+        username TEXT,
+        lang TEXT,
+        project TEXT,
+        snr,
+        answer TEXT,
+        asr_model_name TEXT,
+        audio_asr_text TEXT,
+        audio_annotation_data TEXT,
+        review_annotation_data TEXT,
+        labeler_username TEXT,
+        asr_matched INTEGER,
+        audiologist_fraction REAL,
+        rater_fraction REAL,
+        fingerprint TEXT,
+        PRIMARY KEY (review_rowid, annotation_rowid, asr_rowid)
+    );
+    CREATE INDEX IF NOT EXISTS features.utterance_features_project
+        ON utterance_features (lang, project);
+"""
+
+# The values of a rating, in the order of the source query.
+SOURCE_FIELDS = ['utterance_id', 'user', 'username', 'lang', 'project', 'snr',
+                 'answer', 'asr_model_name', 'audio_asr_text',
+                 'audio_annotation_data', 'review_annotation_data',
+                 'labeler_username']
+KEY_FIELDS = ['review_rowid', 'annotation_rowid', 'asr_rowid']
+FEATURE_FIELDS = ['asr_matched', 'audiologist_fraction', 'rater_fraction']
+
+Scorer = Callable[[str, Any], int]
+
+
+def features_path(dbfile: str) -> str:
+    """The sidecar file of an experiments database."""
+    root, _ = os.path.splitext(dbfile)
+    return f'{root}_features.db'
+
+
+def row_fingerprint(*values: Any) -> str:
+    """A hash of the values of a row (registered as feature_fingerprint() in SQL)."""
+    return hashlib.sha1(repr(values).encode()).hexdigest()[:16]
+
+
+def source_query(con: sqlite3.Connection) -> str:
+    """The keys and values of every rating in the experiments database."""
+    json_text = "CASE WHEN json_valid(asr.data) THEN json_extract(asr.data, '$.text') END"
+    if 'text' in asr_storage.table_columns(con, 'audio_asr'):
+        asr_text = f'COALESCE(asr.text, {json_text})'
+    else:
+        asr_text = json_text
+    model_name = asr_storage.model_field_sql(con, 'model_name', 'asr')
+    return f"""
+        SELECT
+            ra.rowid AS review_rowid,
+            COALESCE(aa.rowid, -1) AS annotation_rowid,
+            asr.rowid AS asr_rowid,
+            ar.id AS utterance_id,
+            ar.subject AS user,
+            u.username AS username,
+            at.lang,
+            at.project,
+            at.snr,
+            at.answer,
+            {model_name} AS asr_model_name,
+            {asr_text} AS audio_asr_text,
+            aa.data AS audio_annotation_data,
+            ra.data AS review_annotation_data,
+            labeler_user.username AS labeler_username
+        FROM audio_results ar
+        JOIN audio_trials at ON ar.trial = at.id
+        JOIN users u ON ar.subject = u.id
+        LEFT JOIN audio_annotations aa ON ar.id = aa.ref
+        JOIN review_annotations ra ON ar.id = ra.ref
+        JOIN users labeler_user ON ra.labeler = labeler_user.id
+        LEFT JOIN audio_asr asr ON ar.id = asr.ref
+        WHERE asr.data IS NOT NULL AND asr.data != ''
+          AND ra.data IS NOT NULL AND ra.data != ''
+    """
+
+
+def refresh(con: sqlite3.Connection, path: str, homonyms_digest: str,
+            score: Scorer, fraction: Callable[[Any], float]) -> Dict[str, int]:
+    """Bring the feature table of the database on con up to date.
+
+    Args:
+        con: A connection to the experiments database.  The feature file is
+            attached to it as "features" (and stays attached).
+        path: The feature file.
+        homonyms_digest: Identifies the homonym map score uses (see
+            scoring.homonym_digest); changing it rescores every rating.
+        score: Returns the number of keywords of an answer recognized in an
+            ASR transcript.
+        fraction: Returns the fraction of true values of an annotation list.
+
+    Returns:
+        The number of ratings 'scored' and 'deleted'.
+    """
+    if 'features' not in [row[1] for row in con.execute('PRAGMA database_list')]:
+        con.execute('ATTACH DATABASE ? AS features', (path,))
+    con.executescript(FEATURES_SCHEMA)
+    con.create_function('feature_fingerprint', -1, row_fingerprint, deterministic=True)
+
+    source = source_query(con)
+    fields = ', '.join(f'src.{f}' for f in SOURCE_FIELDS)
+    keys = ' AND '.join(f'f.{k} = src.{k}' for k in KEY_FIELDS)
+    changed = con.execute(f"""
+        SELECT src.*, feature_fingerprint(?, {fields}) FROM ({source}) src
+        LEFT JOIN features.utterance_features f ON {keys}
+        WHERE f.fingerprint IS NOT feature_fingerprint(?, {fields})
+    """, (homonyms_digest, homonyms_digest)).fetchall()
+
+    records = []
+    for row in changed:
+        values = dict(zip(KEY_FIELDS + SOURCE_FIELDS, row[:-1]))
+        values['asr_matched'] = score(values['answer'], values['audio_asr_text'])
+        values['audiologist_fraction'] = fraction(values['audio_annotation_data'])
+        values['rater_fraction'] = fraction(values['review_annotation_data'])
+        values['fingerprint'] = row[-1]
+        records.append(values)
+    columns = KEY_FIELDS + SOURCE_FIELDS + FEATURE_FIELDS + ['fingerprint']
+    con.executemany(
+        f"INSERT OR REPLACE INTO features.utterance_features ({', '.join(columns)}) "
+        f"VALUES ({', '.join(':' + c for c in columns)})", records)
+
+    deleted = con.execute(f"""
+        DELETE FROM features.utterance_features
+        WHERE ({', '.join(KEY_FIELDS)}) NOT IN
+            (SELECT {', '.join(KEY_FIELDS)} FROM ({source}))
+    """).rowcount
+    con.commit()
+    return {'scored': len(records), 'deleted': deleted}
+
+
+def fetch(con: sqlite3.Connection, language: str, project: Optional[str],
+          asr_model: Optional[str] = None) -> List[sqlite3.Row]:
+    """The distinct ratings of a language and project from the feature table.
+
+    The rows have the columns of summarize_raters.fetch_trials, plus the
+    FEATURE_FIELDS.  A project (or asr_model) of None selects all of them.
+    """
+    con.row_factory = sqlite3.Row
+    params: Tuple[Any, ...] = (language,)
+    filters = ''
+    if project is not None:
+        filters += 'AND project = ?'
+        params += (project,)
+    if asr_model is not None:
+        filters += ' AND asr_model_name = ?'
+        params += (asr_model,)
+    return con.execute(f"""
+        SELECT DISTINCT user, username, project, snr, answer, utterance_id,
+            audio_annotation_data, review_annotation_data, audio_asr_text,
+            asr_model_name, labeler_username, {', '.join(FEATURE_FIELDS)}
+        FROM features.utterance_features
+        WHERE lang = ? {filters}
+    """, params).fetchall()
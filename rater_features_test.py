@@ -0,0 +1,96 @@
+"""Tests for rater_features.py."""
+
+import json
+import os
+import sqlite3
+
+from absl.testing import absltest
+
+import rater_features
+
+
+def score(answer, text):
+    return len(set(answer.split()) & set((text or '').lower().split()))
+
+
+def fraction(data):
+    values = json.loads(data) if data else []
+    return sum(values) / len(values) if values else 0.0
+
+
+class RaterFeaturesTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dbfile = os.path.join(self.create_tempdir().full_path, 'test.db')
+        self.features = rater_features.features_path(self.dbfile)
+        self.con = sqlite3.connect(self.dbfile)
+        self.con.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT);
+            CREATE TABLE audio_trials (id INTEGER PRIMARY KEY, project TEXT,
+                                       snr INTEGER, answer TEXT, lang TEXT);
+            CREATE TABLE audio_results (id INTEGER PRIMARY KEY, subject INTEGER,
+                                        trial INTEGER);
+            CREATE TABLE audio_annotations (ref INTEGER, data TEXT);
+            CREATE TABLE review_annotations (ref INTEGER, labeler INTEGER, data TEXT);
+            CREATE TABLE audio_asr (ref INTEGER, data TEXT);
+            INSERT INTO users VALUES (1, 'A1S1'), (101, 'rater1'), (102, 'rater2');
+            INSERT INTO audio_trials VALUES (11, 'quick', 0, 'white cat', 'en'),
+                                            (12, 'win', 5, 'dog', 'en');
+            INSERT INTO audio_results VALUES (201, 1, 11), (202, 1, 12);
+            INSERT INTO audio_asr VALUES (201, '{"text": "White cat", "model_name": "large"}'),
+                                         (202, '{"text": "bird", "model_name": "large"}');
+            INSERT INTO audio_annotations VALUES (201, '[true, true]');
+            INSERT INTO review_annotations VALUES (201, 101, '[true, false]'),
+                                                  (201, 102, '[false, false]'),
+                                                  (202, 101, '[true]');
+        """)
+        self.con.commit()
+
+    def tearDown(self):
+        self.con.close()
+        super().tearDown()
+
+    def refresh(self, digest='h1'):
+        return rater_features.refresh(self.con, self.features, digest, score, fraction)
+
+    def test_features(self):
+        self.assertEqual(self.refresh(), {'scored': 3, 'deleted': 0})
+        rows = rater_features.fetch(self.con, 'en', 'quick')
+        self.assertEqual(
+            sorted((r['labeler_username'], r['asr_matched'], r['audiologist_fraction'],
+                    r['rater_fraction']) for r in rows),
+            [('rater1', 2, 1.0, 0.5), ('rater2', 2, 1.0, 0.0)])
+        self.assertEqual(rows[0]['asr_model_name'], 'large')
+        # Without an audiologist annotation.
+        (row,) = rater_features.fetch(self.con, 'en', 'win')
+        self.assertEqual((row['asr_matched'], row['audiologist_fraction']), (0, 0.0))
+        self.assertEmpty(rater_features.fetch(self.con, 'en', 'win', asr_model='tiny'))
+
+    def test_incremental(self):
+        self.refresh()
+        self.assertEqual(self.refresh(), {'scored': 0, 'deleted': 0})
+
+        self.con.execute("UPDATE review_annotations SET data = '[true, true]' "
+                         "WHERE labeler = 102")
+        self.assertEqual(self.refresh(), {'scored': 1, 'deleted': 0})
+        fractions = sorted(r['rater_fraction']
+                           for r in rater_features.fetch(self.con, 'en', 'quick'))
+        self.assertEqual(fractions, [0.5, 1.0])
+
+        self.con.execute("DELETE FROM review_annotations WHERE ref = 202")
+        self.assertEqual(self.refresh(), {'scored': 0, 'deleted': 1})
+        self.assertEmpty(rater_features.fetch(self.con, 'en', 'win'))
+
+        # A different homonym map rescores everything.
+        self.assertEqual(self.refresh('h2'), {'scored': 2, 'deleted': 0})
+
+        # The feature file persists between connections.
+        con = sqlite3.connect(self.dbfile)
+        self.addCleanup(con.close)
+        self.assertEqual(rater_features.refresh(con, self.features, 'h2', score, fraction),
+                         {'scored': 0, 'deleted': 0})
+
+
+if __name__ == '__main__':
+    absltest.main()
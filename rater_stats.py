@@ -0,0 +1,292 @@
+"""NumPy statistics for summarize_raters, with subject-level bootstrap intervals.
+
+The point statistics (Pearson's r, the mean bias, regression fits and the
+residual standard deviations) take sample weights, which can have leading
+dimensions: with a (resamples, n) weight matrix they compute every resample
+at once.  A bootstrap resample of the subjects is a vector of how many times
+each subject was drawn, so giving each point the count of its subject
+resamples whole subjects (a cluster bootstrap), keeping a subject's trials
+together, since they are not independent.  subject_resample_weights() draws
+those counts for thousands of resamples at once.
+
+ResidualData holds the utterance scores behind summarize_raters' residual
+standard deviations, summed by (subject, project/SNR) cell, so that the
+ratios of all the resamples take a few array operations over the cells,
+whatever the number of ratings.
+"""
+import dataclasses
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+NORMALIZATIONS = ('normalization_by_utterance', 'normalization_by_snr')
+
+
+def _weights(x: NDArray, weights: Optional[ArrayLike]) -> NDArray:
+    if weights is None:
+        return np.ones(x.shape[-1])
+    return np.asarray(weights, dtype=float)
+
+
+def _weighted_mean(values: NDArray, weights: NDArray) -> NDArray:
+    total = weights.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (weights * values).sum(axis=-1) / total
+
+
+def pearson(x: ArrayLike, y: ArrayLike, weights: Optional[ArrayLike] = None):
+    """Pearson's correlation of x and y, optionally weighted.
+
+    Args:
+        x: Values, shape (n,).
+        y: Values, shape (n,).
+        weights: Weight of each point, shape (n,) or (..., n) to compute
+            several weightings (e.g. bootstrap resamples) at once.
+
+    Returns:
+        The correlation (an array for weights with leading dimensions); NaN
+        with fewer than two points or when x or y does not vary.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    w = _weights(x, weights)
+    points = (w > 0).sum(axis=-1)
+    dx = x - _weighted_mean(x, w)[..., None]
+    dy = y - _weighted_mean(y, w)[..., None]
+    sxy = (w * dx * dy).sum(axis=-1)
+    sxx = (w * dx * dx).sum(axis=-1)
+    syy = (w * dy * dy).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = sxy / np.sqrt(sxx * syy)
+    # A constant variable leaves rounding noise rather than an exact 0.
+    scale = np.maximum(np.abs(x).max(initial=0), np.abs(y).max(initial=0)) ** 2
+    degenerate = (points < 2) | (sxx <= 1e-24 * scale) | (syy <= 1e-24 * scale)
+    return _scalar(np.where(degenerate, np.nan, r))
+
+
+def mean_bias(x: ArrayLike, y: ArrayLike, weights: Optional[ArrayLike] = None):
+    """The mean signed difference y - x (NaN for no points)."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return _scalar(_weighted_mean(y - x, _weights(x, weights)))
+
+
+def fit_regression(x: ArrayLike, y: ArrayLike,
+                   fixed_slope: Optional[float] = None) -> Tuple[float, float]:
+    """Least-squares (slope, intercept) of y on x, or the intercept for a fixed slope.
+
+    With no variance in x, the slope is 0 and the intercept mean(y).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if fixed_slope is not None:
+        return fixed_slope, float(np.mean(y - fixed_slope * x))
+    dx = x - x.mean()
+    denominator = float(dx @ dx)
+    if not denominator:
+        return 0.0, float(y.mean())
+    slope = float(dx @ (y - y.mean())) / denominator
+    return slope, float(y.mean() - slope * x.mean())
+
+
+def population_std(values: ArrayLike, weights: Optional[ArrayLike] = None):
+    """The (weighted) population standard deviation; NaN for no values."""
+    values = np.asarray(values, dtype=float)
+    w = _weights(values, weights)
+    mean = _weighted_mean(values, w)
+    return _scalar(np.sqrt(_weighted_mean((values - mean[..., None]) ** 2, w)))
+
+
+def _scalar(value: NDArray):
+    return float(value) if np.ndim(value) == 0 else value
+
+
+def subject_resample_weights(subjects: int, resamples: int,
+                             rng: Optional[np.random.Generator] = None) -> NDArray:
+    """How often each subject is drawn in each bootstrap resample.
+
+    Returns:
+        A (resamples, subjects) integer array; each row sums to subjects.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if not subjects:
+        return np.zeros((resamples, 0), dtype=np.int64)
+    return rng.multinomial(subjects, np.full(subjects, 1 / subjects), size=resamples)
+
+
+def interval(samples: ArrayLike, confidence: float = 0.95) -> Tuple[float, float]:
+    """The percentile interval of bootstrap samples, ignoring NaN (NaN if all are)."""
+    samples = np.asarray(samples, dtype=float)
+    samples = samples[~np.isnan(samples)]
+    if not samples.size:
+        return float('nan'), float('nan')
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(samples, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def subject_codes(subjects: Sequence[Any]) -> Tuple[NDArray, int]:
+    """Number the distinct subjects: the code of each entry, and how many there are."""
+    _, codes = np.unique(np.asarray(subjects, dtype=object).astype(str), return_inverse=True)
+    return codes.reshape(-1), int(codes.max()) + 1 if len(codes) else 0
+
+
+def bootstrap_comparison(x: ArrayLike, y: ArrayLike, subjects: Sequence[Any],
+                         resamples: int = 2000, confidence: float = 0.95,
+                         rng: Optional[np.random.Generator] = None
+                         ) -> Dict[str, Tuple[float, float]]:
+    """Subject-level bootstrap intervals of the Pearson r and bias of y vs x.
+
+    Args:
+        x: Values, one per point (e.g. a subject/project/SNR summary).
+        y: Values, same length as x.
+        subjects: The subject of each point; resampled as clusters.
+        resamples: Number of bootstrap resamples.
+        confidence: Coverage of the intervals.
+        rng: Random generator, for reproducible intervals.
+
+    Returns:
+        The 'pearson' and 'bias' (low, high) intervals.
+    """
+    codes, count = subject_codes(subjects)
+    weights = subject_resample_weights(count, resamples, rng)[:, codes]
+    return {'pearson': interval(pearson(x, y, weights), confidence),
+            'bias': interval(mean_bias(x, y, weights), confidence)}
+
+
+@dataclasses.dataclass
+class ResidualData:
+    """The sums behind the ASR and rater residual standard deviations.
+
+    Each utterance has a normalized ASR score and the scores of its valid
+    raters, whose mean is its utterance baseline; the project/SNR baseline is
+    the mean of the utterance baselines of the project and SNR.  Residuals
+    are scores minus the baseline.  Only utterances with a rater score count.
+
+    The attributes hold, for each (subject, project/SNR) cell, sums over its
+    utterances (u_*) and ratings (r_*), of which the weighted residual moments
+    of any subject weighting follow.
+
+    Attributes:
+        cell_subject: The subject code of each cell.
+        cell_bucket: The project/SNR code of each cell.
+        subjects: Number of subjects.
+        buckets: Number of project/SNR pairs.
+        sums: Per-cell sums, keyed by name (see from_scores).
+    """
+    cell_subject: NDArray
+    cell_bucket: NDArray
+    subjects: int
+    buckets: int
+    sums: Dict[str, NDArray]
+
+    @classmethod
+    def from_scores(cls, asr_scores: Dict[Tuple[Any, Any, Any], float],
+                    rater_scores: Dict[Tuple[Any, Any, Any], List[float]],
+                    utterance_subjects: Dict[Tuple[Any, Any, Any], Any]) -> 'ResidualData':
+        """Build from the dicts of summarize_raters.utterance_scores.
+
+        Args:
+            asr_scores: The normalized ASR score, keyed by
+                (project, snr, utterance_id).
+            rater_scores: The valid raters' scores of each utterance.
+            utterance_subjects: The subject of each utterance.
+        """
+        keys = [key for key, scores in rater_scores.items() if scores and key in asr_scores]
+        n = np.array([len(rater_scores[key]) for key in keys], dtype=np.intp)
+        asr = np.array([asr_scores[key] for key in keys], dtype=float)
+        ratings = np.array([s for key in keys for s in rater_scores[key]], dtype=float)
+        rating_utterance = np.repeat(np.arange(len(keys)), n)
+        mean = np.bincount(rating_utterance, weights=ratings, minlength=len(keys)) / np.maximum(n, 1)
+
+        subject, subjects = subject_codes([utterance_subjects[key] for key in keys])
+        _, bucket = np.unique(np.array([f'{p}\0{s}' for p, s, _ in keys], dtype=str),
+                              return_inverse=True)
+        bucket = bucket.reshape(-1)
+        buckets = int(bucket.max()) + 1 if len(keys) else 0
+        cells, cell = np.unique(subject * max(buckets, 1) + bucket, return_inverse=True)
+        cell = cell.reshape(-1)
+
+        def by_cell(values: NDArray, index: NDArray = cell) -> NDArray:
+            return np.bincount(index, weights=values, minlength=len(cells))
+
+        rating_cell = cell[rating_utterance]
+        rating_mean = mean[rating_utterance]
+        sums = {
+            'u_count': by_cell(np.ones(len(keys))),
+            'u_mean': by_cell(mean),
+            'u_mean2': by_cell(mean ** 2),
+            'u_asr': by_cell(asr),
+            'u_asr2': by_cell(asr ** 2),
+            'u_asr_mean': by_cell(asr * mean),
+            'r_count': by_cell(np.ones(len(ratings)), rating_cell),
+            'r_score': by_cell(ratings, rating_cell),
+            'r_score2': by_cell(ratings ** 2, rating_cell),
+            'r_score_mean': by_cell(ratings * rating_mean, rating_cell),
+            'r_mean': by_cell(rating_mean, rating_cell),
+            'r_mean2': by_cell(rating_mean ** 2, rating_cell),
+        }
+        return cls(cell_subject=(cells // max(buckets, 1)).astype(np.intp),
+                   cell_bucket=(cells % max(buckets, 1)).astype(np.intp),
+                   subjects=subjects, buckets=buckets, sums=sums)
+
+    def std_ratio(self, normalization: str = 'normalization_by_snr',
+                  subject_weights: Optional[ArrayLike] = None
+                  ) -> Tuple[NDArray, NDArray, NDArray]:
+        """The ASR and rater residual standard deviations, and ASR/Rater.
+
+        Args:
+            normalization: One of NORMALIZATIONS.
+            subject_weights: The weight of each subject, shape (subjects,) or
+                (resamples, subjects).  All 1 by default.
+
+        Returns:
+            (asr_std, rater_std, ratio), scalars or one per resample; NaN
+            where there are no residuals or the rater residuals do not vary.
+        """
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(f'Unknown residual normalization: {normalization}')
+        if subject_weights is None:
+            subject_weights = np.ones(self.subjects)
+        w = np.asarray(subject_weights, dtype=float)[..., self.cell_subject]
+        s = self.sums
+        if normalization == 'normalization_by_utterance':
+            # Residuals against each utterance's own mean: fixed per utterance.
+            asr = (s['u_count'], s['u_asr'] - s['u_mean'],
+                   s['u_asr2'] - 2 * s['u_asr_mean'] + s['u_mean2'])
+            rater = (s['r_count'], s['r_score'] - s['r_mean'],
+                     s['r_score2'] - 2 * s['r_score_mean'] + s['r_mean2'])
+            asr_std = _moment_std(w, *asr)
+            rater_std = _moment_std(w, *rater)
+        else:
+            # The project/SNR baselines move with the weights.
+            onehot = np.zeros((len(self.cell_bucket), max(self.buckets, 1)))
+            onehot[np.arange(len(self.cell_bucket)), self.cell_bucket] = 1
+            with np.errstate(invalid='ignore', divide='ignore'):
+                baseline = ((w * s['u_mean']) @ onehot) / ((w * s['u_count']) @ onehot)
+            b = np.nan_to_num(baseline[..., self.cell_bucket])
+            asr_std = _moment_std(w, s['u_count'], s['u_asr'] - b * s['u_count'],
+                                  s['u_asr2'] - 2 * b * s['u_asr'] + b * b * s['u_count'])
+            rater_std = _moment_std(w, s['r_count'], s['r_score'] - b * s['r_count'],
+                                    s['r_score2'] - 2 * b * s['r_score'] + b * b * s['r_count'])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Rounding leaves about 1e-9 of spread where the residuals are equal.
+            ratio = np.where(rater_std > 1e-6, asr_std / rater_std, np.nan)
+        return _scalar(asr_std), _scalar(rater_std), _scalar(ratio)
+
+    def bootstrap_std_ratio(self, normalization: str = 'normalization_by_snr',
+                            resamples: int = 2000, confidence: float = 0.95,
+                            rng: Optional[np.random.Generator] = None) -> Tuple[float, float]:
+        """Subject-level bootstrap interval of the residual std-dev ratio."""
+        weights = subject_resample_weights(self.subjects, resamples, rng)
+        return interval(self.std_ratio(normalization, weights)[2], confidence)
+
+
+def _moment_std(w: NDArray, count: NDArray, total: NDArray, squares: NDArray) -> NDArray:
+    """The standard deviation of values from their weighted count, sum and sum of squares."""
+    n = (w * count).sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (w * total).sum(axis=-1) / n
+        variance = (w * squares).sum(axis=-1) / n - mean ** 2
+    return np.sqrt(np.maximum(variance, 0))
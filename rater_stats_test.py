@@ -0,0 +1,120 @@
+"""Tests for rater_stats.py."""
+
+import math
+import time
+from collections import defaultdict
+
+import numpy as np
+from absl.testing import absltest
+
+import rater_stats
+
+
+def random_scores(rng, subjects=12, utterances=200):
+    """Scores keyed by (project, snr, utterance_id), as in summarize_raters."""
+    asr, raters, owners = {}, defaultdict(list), {}
+    for u in range(utterances):
+        key = (rng.choice(['quick', 'win']), int(rng.integers(0, 4)) * 5, u)
+        asr[key] = float(rng.integers(0, 6)) / 5
+        raters[key] = [float(rng.integers(0, 6)) / 5 for _ in range(rng.integers(0, 4))]
+        owners[key] = f'A1S{rng.integers(0, subjects)}'
+    return asr, raters, owners
+
+
+def std(values):
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / len(values))
+
+
+def reference_ratio(asr, raters, normalization):
+    """The residual std-dev ratio, as summarize_raters computed it with lists."""
+    means = {k: sum(v) / len(v) for k, v in raters.items() if v}
+    if normalization == 'normalization_by_utterance':
+        baseline = means
+    else:
+        buckets = defaultdict(list)
+        for (project, snr, _), m in means.items():
+            buckets[project, snr].append(m)
+        baseline = {k: sum(buckets[k[:2]]) / len(buckets[k[:2]]) for k in means}
+    asr_residuals = [asr[k] - baseline[k] for k in asr if k in baseline]
+    rater_residuals = [s - baseline[k] for k, v in raters.items() if k in baseline for s in v]
+    return std(asr_residuals), std(rater_residuals), std(asr_residuals) / std(rater_residuals)
+
+
+class RaterStatsTest(absltest.TestCase):
+
+    def test_pearson(self):
+        rng = np.random.default_rng(0)
+        x, y = rng.random(50), rng.random(50)
+        self.assertAlmostEqual(rater_stats.pearson(x, y), np.corrcoef(x, y)[0, 1])
+        self.assertTrue(math.isnan(rater_stats.pearson([1.0], [2.0])))
+        self.assertTrue(math.isnan(rater_stats.pearson([0.1] * 3, [1, 2, 3])))
+        # Integer weights are the same as repeating the points.
+        w = rng.integers(0, 3, size=50)
+        self.assertAlmostEqual(rater_stats.pearson(x, y, w),
+                               np.corrcoef(np.repeat(x, w), np.repeat(y, w))[0, 1])
+        self.assertAlmostEqual(rater_stats.mean_bias(x, y, w),
+                               np.mean(np.repeat(y - x, w)))
+
+    def test_fit_regression(self):
+        slope, intercept = rater_stats.fit_regression([0, 1, 2], [1, 3, 5])
+        self.assertAlmostEqual(slope, 2)
+        self.assertAlmostEqual(intercept, 1)
+        self.assertEqual(rater_stats.fit_regression([1, 1], [2, 4]), (0.0, 3.0))
+        self.assertEqual(rater_stats.fit_regression([0, 1], [1, 3], fixed_slope=1.0),
+                         (1.0, 1.5))
+
+    def test_residual_ratio(self):
+        asr, raters, owners = random_scores(np.random.default_rng(1))
+        data = rater_stats.ResidualData.from_scores(asr, raters, owners)
+        for normalization in rater_stats.NORMALIZATIONS:
+            expected = reference_ratio(asr, raters, normalization)
+            for value, want in zip(data.std_ratio(normalization), expected):
+                self.assertAlmostEqual(value, want)
+        with self.assertRaises(ValueError):
+            data.std_ratio('normalization_by_subject')
+
+    def test_resampled_ratio(self):
+        # A resample is the data with each subject's utterances repeated.
+        rng = np.random.default_rng(2)
+        asr, raters, owners = random_scores(rng, subjects=4, utterances=60)
+        data = rater_stats.ResidualData.from_scores(asr, raters, owners)
+        weights = rater_stats.subject_resample_weights(data.subjects, 5, rng)
+        self.assertEqual(weights.shape, (5, 4))
+        self.assertTrue((weights.sum(axis=1) == 4).all())
+        ratios = data.std_ratio('normalization_by_snr', weights)[2]
+        subjects = sorted(set(owners.values()))
+        for w, ratio in zip(weights, ratios):
+            count = dict(zip(subjects, w))
+            repeated_asr, repeated_raters = {}, {}
+            for (project, snr, u), score in asr.items():
+                for copy in range(count[owners[project, snr, u]]):
+                    repeated_asr[project, snr, (u, copy)] = score
+                    repeated_raters[project, snr, (u, copy)] = raters[project, snr, u]
+            expected = reference_ratio(repeated_asr, repeated_raters, 'normalization_by_snr')
+            self.assertAlmostEqual(ratio, expected[2])
+
+    def test_bootstrap(self):
+        rng = np.random.default_rng(3)
+        x = rng.random(300)
+        y = x + rng.normal(0, 0.1, 300)
+        subjects = rng.integers(0, 30, 300)
+        intervals = rater_stats.bootstrap_comparison(x, y, subjects, resamples=500, rng=rng)
+        low, high = intervals['pearson']
+        self.assertLess(low, rater_stats.pearson(x, y))
+        self.assertGreater(high, rater_stats.pearson(x, y))
+        self.assertLess(intervals['bias'][0], intervals['bias'][1])
+
+        # Our data size: 40 subjects and about 20k ratings.
+        asr, raters, owners = random_scores(rng, subjects=40, utterances=8000)
+        start = time.perf_counter()
+        data = rater_stats.ResidualData.from_scores(asr, raters, owners)
+        low, high = data.bootstrap_std_ratio(resamples=2000, rng=rng)
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertLessEqual(low, data.std_ratio()[2])
+        self.assertGreaterEqual(high, data.std_ratio()[2])
+        self.assertTrue(all(math.isnan(b) for b in rater_stats.interval([np.nan])))
+
+
+if __name__ == '__main__':
+    absltest.main()
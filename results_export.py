@@ -0,0 +1,227 @@
+"""Columnar export of the scored results (Parquet or Arrow IPC).
+
+quicksin_results.csv keeps every field of a result as text, including the
+full Whisper JSON, so readers have to parse the whole file (and the JSON and
+comma-joined lists inside it) to get at a couple of columns.  The columnar
+export has typed columns instead: the word lists and match vectors are list
+columns, and the Whisper JSON goes to a separate file next to it
+(quicksin_results_asr.parquet for quicksin_results.parquet), keyed by
+results_id, which few readers need.
+
+The format is chosen by the file extension: .parquet, or .arrow (.feather)
+for Arrow IPC.  Both are compressed with zstd.  load_results() reads either,
+or the CSV export, into a pandas DataFrame with the same columns, reading
+only the columns asked for.
+
+pyarrow is only needed for the columnar formats, and is imported when they
+are used.
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+EXTENSIONS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+
+# The exported fields of a score_and_report.QS_result, and their types.
+COLUMNS = [
+    ('results_id', 'int'), ('results_subject', 'int'), ('results_trial', 'int'),
+    ('results_reply_filename', 'str'), ('results_time', 'str'),
+    ('trials_id', 'int'), ('trials_project', 'str'), ('trials_snr', 'float'),
+    ('trials_lang', 'str'), ('trials_level_number', 'int'),
+    ('trials_trial_number', 'int'), ('trials_filename', 'str'),
+    ('trials_answer', 'str'), ('trials_active', 'bool'),
+    ('user_id', 'int'), ('user_name', 'str'), ('user_ip', 'str'),
+    ('user_time', 'str'), ('user_info_id', 'int'), ('user_info_key', 'str'),
+    ('user_info_value', 'str'), ('user_info_time', 'str'), ('asr_id', 'int'),
+    ('asr_gt_word_count', 'int'), ('asr_correct_word_count', 'int'),
+    ('asr_clean_tokens', 'str'), ('annotation_ref', 'int'),
+    ('annotation_matches', 'list<bool>'), ('asr_words', 'list<str>'),
+    ('asr_matches', 'list<bool>'), ('asr_times', 'list<float>'),
+    ('audiology_asr_matches', 'list<bool>'),
+]
+LIST_COLUMNS = {name: kind for name, kind in COLUMNS if kind.startswith('list')}
+
+
+def export_format(filename: str) -> str:
+    """Return 'parquet' or 'arrow', from the extension of filename."""
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in EXTENSIONS:
+        raise ValueError(f'Unknown columnar export format: {filename} '
+                         f'(use one of {", ".join(EXTENSIONS)})')
+    return EXTENSIONS[ext]
+
+
+def asr_filename(filename: str) -> str:
+    """The file holding the Whisper JSON of an export."""
+    root, ext = os.path.splitext(filename)
+    return f'{root}_asr{ext}'
+
+
+def _arrow_type(pa, kind: str):
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(),
+             'bool': pa.bool_()}
+    if kind.startswith('list<'):
+        return pa.list_(types[kind[5:-1]])
+    return types[kind]
+
+
+def _convert(kind: str, value: Any) -> Any:
+    """Convert a field of a result (as scored, or read back from the CSV)."""
+    if value is None or value == '':
+        return [] if kind.startswith('list') else None
+    if kind == 'int':
+        return int(value)
+    if kind == 'float':
+        return float(value)
+    if kind == 'bool':
+        return bool(int(value)) if isinstance(value, str) else bool(value)
+    if kind == 'str':
+        return str(value)
+    return list(value)
+
+
+class _TableWriter:
+    """Writes record batches to a Parquet or Arrow IPC file."""
+    __slots__ = ('filename', 'writer')
+
+    def __init__(self, filename: str, schema, compression: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.filename = filename
+        if export_format(filename) == 'parquet':
+            self.writer = pq.ParquetWriter(filename + '.tmp', schema,
+                                           compression=compression)
+        else:
+            self.writer = pa.ipc.new_file(
+                filename + '.tmp', schema,
+                options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    def write(self, batch) -> None:
+        if batch.num_rows:
+            self.writer.write_batch(batch)
+
+    def close(self) -> None:
+        self.writer.close()
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+class ColumnarExportSink:
+    """Writes the results to a columnar export, batch_size rows at a time.
+
+    A score_and_report.ResultSink.  The files are written under temporary
+    names and only replace an earlier export when closed.
+    """
+    __slots__ = ('filename', 'batch_size', 'schema', 'asr_schema', 'columns',
+                 'asr_json', 'results', 'asr', 'count')
+
+    def __init__(self, filename: str, batch_size: int = 1000,
+                 compression: str = 'zstd'):
+        import pyarrow as pa
+        self.filename = filename
+        self.batch_size = batch_size
+        self.schema = pa.schema([(name, _arrow_type(pa, kind))
+                                 for name, kind in COLUMNS])
+        self.asr_schema = pa.schema([('results_id', pa.int64()),
+                                     ('asr_json', pa.string())])
+        self.results = _TableWriter(filename, self.schema, compression)
+        self.asr = _TableWriter(asr_filename(filename), self.asr_schema, compression)
+        self.columns: Dict[str, List[Any]] = {name: [] for name, _ in COLUMNS}
+        self.asr_json: Dict[str, List[Any]] = {'results_id': [], 'asr_json': []}
+        self.count = 0
+
+    def add(self, result) -> None:
+        for name, kind in COLUMNS:
+            self.columns[name].append(_convert(kind, getattr(result, name)))
+        asr_results = result.asr_results
+        if asr_results is not None and not isinstance(asr_results, str):
+            asr_results = json.dumps(asr_results)
+        self.asr_json['results_id'].append(_convert('int', result.results_id))
+        self.asr_json['asr_json'].append(asr_results)
+        self.count += 1
+        if len(self.asr_json['results_id']) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        import pyarrow as pa
+        self.results.write(pa.RecordBatch.from_pydict(self.columns, schema=self.schema))
+        self.asr.write(pa.RecordBatch.from_pydict(self.asr_json, schema=self.asr_schema))
+        for values in (*self.columns.values(), *self.asr_json.values()):
+            values.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.results.close()
+        self.asr.close()
+
+
+def _read_columnar(filename: str, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    columns = list(columns) if columns is not None else None
+    if export_format(filename) == 'parquet':
+        table = pq.read_table(filename, columns=columns)
+    else:
+        table = feather.read_table(filename, columns=columns)
+    return table.to_pandas()
+
+
+def _split(value: Any, item=str) -> List[Any]:
+    if not isinstance(value, str) or not value:
+        return []
+    return [item(v) for v in value.split(',')]
+
+
+def load_results(filename: str, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """Read a results export (columnar, or the CSV) into a DataFrame.
+
+    Args:
+        filename: A .parquet, .arrow or .feather export, or the .csv export
+            of score_and_report.
+        columns: The columns to read (all of COLUMNS by default).
+
+    Returns:
+        A DataFrame with the requested columns, whatever the format.  The
+        values of the list columns are sequences (lists when read from the
+        CSV, NumPy arrays from the columnar formats).
+    """
+    if not filename.lower().endswith('.csv'):
+        return _read_columnar(filename, columns)
+    columns = list(columns) if columns is not None else [n for n, _ in COLUMNS]
+    frame = pd.read_csv(filename, usecols=columns, keep_default_na=False,
+                        na_values={c: [''] for c in columns if c not in LIST_COLUMNS})
+    for name in columns:
+        kind = LIST_COLUMNS.get(name)
+        if kind == 'list<bool>' and name == 'annotation_matches':
+            frame[name] = [json.loads(v) or [] for v in frame[name]]
+        elif kind == 'list<bool>':
+            frame[name] = [_split(v, lambda m: m == 'True') for v in frame[name]]
+        elif kind == 'list<float>':
+            frame[name] = [_split(v, float) for v in frame[name]]
+        elif kind == 'list<str>':
+            frame[name] = [_split(v) for v in frame[name]]
+    return frame[columns]
+
+
+def load_asr_json(filename: str) -> Dict[int, Any]:
+    """Return the parsed Whisper JSON of each results_id of an export."""
+    if filename.lower().endswith('.csv'):
+        frame = pd.read_csv(filename, usecols=['results_id', 'asr_results'])
+        pairs = zip(frame['results_id'], frame['asr_results'])
+    else:
+        frame = _read_columnar(asr_filename(filename))
+        pairs = zip(frame['results_id'], frame['asr_json'])
+    return {int(i): json.loads(data) for i, data in pairs if isinstance(data, str)}
+
+
+def write_frame(frame: pd.DataFrame, filename: str, compression: str = 'zstd') -> None:
+    """Write a DataFrame as Parquet or Arrow IPC, by the extension of filename."""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if export_format(filename) == 'parquet':
+        pq.write_table(table, filename, compression=compression)
+    else:
+        feather.write_feather(table, filename, compression=compression)
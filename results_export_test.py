@@ -0,0 +1,76 @@
+"""Tests for results_export.py."""
+
+import importlib.util
+import os
+from pathlib import Path
+
+from absl.testing import absltest
+
+import results_export
+import run_exp3_summary
+import score_and_report
+
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+def make_result(results_id, project='quick', matches=(True, False)):
+    r = score_and_report.QS_result(results_id, *[None] * 28)
+    r.results_subject, r.trials_project, r.trials_snr = 1, project, 5
+    r.user_name, r.trials_answer, r.trials_active = 'A1S1', 'white silk', 1
+    r.asr_results = {'text': ' white, silk', 'segments': []}
+    r.annotation_matches = [True, True]
+    r.asr_words = [' white', ' silk']
+    r.asr_times = [0.5, 1.25]
+    r.asr_matches = list(matches)
+    r.audiology_asr_matches = [a == b for a, b in zip(matches, r.annotation_matches)]
+    return r
+
+
+class ResultsExportTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.results = [make_result(1), make_result(2, 'win', (True, True))]
+        self.csv_file = self.create_tempfile('results.csv').full_path
+        score_and_report.save_results_as_csv(self.results, self.csv_file)
+
+    def check_loaded(self, filename):
+        frame = results_export.load_results(filename)
+        self.assertEqual(list(frame.columns), [n for n, _ in results_export.COLUMNS])
+        self.assertEqual(list(frame['results_id']), [1, 2])
+        self.assertEqual(list(frame['asr_words'][0]), [' white', ' silk'])
+        self.assertEqual(list(frame['asr_times'][0]), [0.5, 1.25])
+        self.assertEqual(list(frame['asr_matches'][0]), [True, False])
+        self.assertEqual(list(frame['annotation_matches'][1]), [True, True])
+        self.assertEqual(results_export.load_asr_json(filename)[2]['text'], ' white, silk')
+
+        frame = results_export.load_results(filename, columns=['trials_project'])
+        self.assertEqual(list(frame.columns), ['trials_project'])
+
+    def test_csv(self):
+        self.check_loaded(self.csv_file)
+
+    @absltest.skipUnless(HAVE_PYARROW, 'needs pyarrow')
+    def test_columnar(self):
+        for ext in ('.parquet', '.arrow'):
+            filename = os.path.join(self.create_tempdir().full_path, 'results' + ext)
+            sink = results_export.ColumnarExportSink(filename, batch_size=1)
+            for r in self.results:
+                sink.add(r)
+            sink.close()
+            self.assertTrue(os.path.exists(results_export.asr_filename(filename)))
+            self.check_loaded(filename)
+
+    def test_export_format(self):
+        self.assertEqual(results_export.export_format('a/b.PARQUET'), 'parquet')
+        self.assertEqual(results_export.export_format('b.feather'), 'arrow')
+        with self.assertRaises(ValueError):
+            results_export.export_format('b.csv')
+
+    def test_run_exp3_agreement(self):
+        agreement = run_exp3_summary.results_agreement(Path(self.csv_file))
+        self.assertEqual(agreement, {'quick': 0.5, 'win': 1.0})
+
+
+if __name__ == '__main__':
+    absltest.main()
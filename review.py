@@ -2,9 +2,11 @@ import json, os
 from storage import DatabaseBP, relpath, Database
 from flask import Blueprint, session, request, send_from_directory, abort, Response
 from audio import upload_location
+from serving import send_immutable
+import upload_manifest
 from review_modules.helpers import extract_username, save_review_annotation
 from review_modules.consent_upload import ensure_consent_form_column
-from review_modules import state, queries, file_selection, responses
+from review_modules import state, queries, file_selection, responses, coverage
 
 # Database configuration - change this to use a different database
 # You can also set SELECTED_DATABASE environment variable to override this
@@ -92,8 +94,9 @@ def review_result(db):
         
         unclear = request.args.get("unclear", "false").lower() in ("true", "1", "yes")
         
+        new_review = False
         try:
-            save_review_annotation(db, ref_id, labeler_id, annotations_str, unclear)
+            new_review = save_review_annotation(db, ref_id, labeler_id, annotations_str, unclear)
         except Exception as e:
             error_msg = str(e)
             
@@ -124,7 +127,8 @@ def review_result(db):
         reviewed_project = reviewed_file_info[1] if reviewed_file_info else None
         #update
         state.remove_played_audio(db, username, ref_id)
-        state.increment_total_reviews(db, username)
+        if new_review:
+            state.increment_total_reviews(db, username)
         #check success
         if reviewed_subject_id and reviewed_project and queries.is_test_complete(db, labeler_id, reviewed_subject_id, reviewed_project):
             state.add_completed_test(db, username, reviewed_subject_id, reviewed_project)
@@ -132,11 +136,7 @@ def review_result(db):
             reviewer_state = state.get_reviewer_state(db, username)
             remaining_tests = [t for t in reviewer_state['remaining_tests'] 
                              if (t["subject"], t["project"]) != (reviewed_subject_id, reviewed_project)]
-            try:
-                db.execute("UPDATE reviewers SET remaining_tests = ? WHERE username = ?",
-                          (json.dumps(remaining_tests), username))
-            except:
-                pass
+            state.update_remaining_tests(db, username, remaining_tests)
             state.clear_test_in_progress(db, username)
         #get next
         file_data, subject_id, project, current_level, total_files, absolute_file_num = file_selection.get_current_file_data(db, labeler_id, username)
@@ -202,15 +202,25 @@ class ReviewBP(DatabaseBP):
         def handle_review_review(db): return Response(status=204)
         self._route_db("/review")(handle_review_review)
         self.record(lambda setup: self._bind_db(setup.app))
+        self.after_request(self._flush_reviewer_state)
         self._fallback_db = db
         self._blueprint_db = None
     
     def _bind_db(self, app):
         try:
             self._blueprint_db = Database(app, SELECTED_DATABASE, REVIEW_SCHEMA, ["PRAGMA foreign_keys = ON"])
+            with app.app_context():
+                coverage.ensure_coverage_tables(self._blueprint_db.get())
+                upload_manifest.ensure_table(self._blueprint_db.get(), upload_location)
+                state.recount_total_reviews(self._blueprint_db.get())
         except Exception:
             raise
     
+    def _flush_reviewer_state(self, response):
+        if self._blueprint_db is not None:
+            state.flush(self._blueprint_db)
+        return response
+
     def _route_db(self, *a, **kw):
         from functools import wraps
         from flask import jsonify
@@ -230,4 +240,4 @@ class ReviewBP(DatabaseBP):
         return wrapper
     
     def audio_lists(self, db): return "[]"
-    def upload(self, db, fname): return send_from_directory(upload_location, fname)
+    def upload(self, db, fname): return send_immutable(upload_location, fname)
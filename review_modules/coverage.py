@@ -0,0 +1,149 @@
+"""Materialized review coverage, so assigning a test is an indexed read.
+
+review_coverage has one row per (subject, project) with the number of
+recorded files and of distinct patient-type reviewers, and review_progress
+has the number of files each labeler reviewed in it.  Both are updated
+incrementally when a result is recorded (audio.py) and when a new review is
+saved (helpers.save_review_annotation), and rebuilt from audio_results and
+review_annotations by ensure_coverage_tables when they are empty.  Rows
+deleted or edited by hand are not seen by the incremental updates, so run
+this module periodically to rebuild both tables:
+
+    python -m review_modules.coverage --dbfile experiments.db
+"""
+
+import sqlite3
+
+from absl import app, flags
+
+COVERAGE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_coverage (
+  subject INTEGER NOT NULL,
+  project TEXT NOT NULL,
+  total_files INTEGER NOT NULL DEFAULT 0,
+  patient_reviewers INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (subject, project)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_review_coverage_order
+  ON review_coverage (patient_reviewers, subject, project);
+CREATE TABLE IF NOT EXISTS review_progress (
+  labeler INTEGER NOT NULL,
+  subject INTEGER NOT NULL,
+  project TEXT NOT NULL,
+  files_reviewed INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (labeler, subject, project)
+) WITHOUT ROWID;
+"""
+
+# The (subject, project) of an audio_results row.
+_TEST_OF_RESULT = """
+    SELECT ar.subject, at.project FROM audio_results ar
+    JOIN audio_trials at ON ar.trial = at.id
+    WHERE ar.id = ? AND ar.subject IS NOT NULL AND at.project IS NOT NULL
+"""
+
+_IS_PATIENT = """
+    SELECT 1 FROM user_info
+    WHERE user = ? AND info_key = 'test-type' AND value = 'patient'
+"""
+
+
+def ensure_coverage_tables(con: sqlite3.Connection):
+    """Create the coverage tables, filling them in if they are new."""
+    con.executescript(COVERAGE_SCHEMA)
+    if con.execute("SELECT 1 FROM review_coverage LIMIT 1").fetchone() is None:
+        rebuild(con)
+
+
+def rebuild(con: sqlite3.Connection):
+    """Recompute both tables from audio_results and review_annotations.
+
+    In one transaction, so readers never see them empty and no concurrent
+    update is lost.
+    """
+    con.executescript("""
+        BEGIN IMMEDIATE;
+        DELETE FROM review_coverage;
+        DELETE FROM review_progress;
+        INSERT INTO review_progress (labeler, subject, project, files_reviewed)
+        SELECT ra.labeler, ar.subject, at.project, COUNT(DISTINCT ra.ref)
+        FROM review_annotations ra
+        JOIN audio_results ar ON ra.ref = ar.id
+        JOIN audio_trials at ON ar.trial = at.id
+        WHERE ra.labeler IS NOT NULL AND ar.subject IS NOT NULL
+          AND at.project IS NOT NULL
+        GROUP BY ra.labeler, ar.subject, at.project;
+        INSERT INTO review_coverage (subject, project, total_files, patient_reviewers)
+        SELECT ar.subject, at.project, COUNT(*), (
+            SELECT COUNT(*) FROM review_progress rp
+            WHERE rp.subject = ar.subject AND rp.project = at.project
+            AND EXISTS (SELECT 1 FROM user_info ui WHERE ui.user = rp.labeler
+                        AND ui.info_key = 'test-type' AND ui.value = 'patient'))
+        FROM audio_results ar
+        JOIN audio_trials at ON ar.trial = at.id
+        WHERE ar.subject IS NOT NULL AND at.project IS NOT NULL
+        GROUP BY ar.subject, at.project;
+        COMMIT;
+    """)
+
+
+def record_result(db, result_id):
+    """Count a new audio_results row in its test's total_files."""
+    test = db.queryone(_TEST_OF_RESULT, (result_id,))
+    if test is None:
+        return
+    db.execute(
+        "INSERT INTO review_coverage (subject, project, total_files) "
+        "VALUES (?, ?, 1) ON CONFLICT (subject, project) "
+        "DO UPDATE SET total_files = total_files + 1", test)
+
+
+def record_review(db, ref_id, labeler_id):
+    """Count a labeler's first review of ref_id.
+
+    Must only be called when the (ref, labeler) annotation is new.  A
+    patient-type labeler's first file in a test also adds one to the test's
+    patient_reviewers.
+    """
+    test = db.queryone(_TEST_OF_RESULT, (ref_id,))
+    if test is None:
+        return
+    subject, project = test
+    db.execute(
+        "INSERT INTO review_progress (labeler, subject, project, files_reviewed) "
+        "VALUES (?, ?, ?, 1) ON CONFLICT (labeler, subject, project) "
+        "DO UPDATE SET files_reviewed = files_reviewed + 1",
+        (labeler_id, subject, project))
+    first = db.queryone(
+        "SELECT files_reviewed = 1 FROM review_progress "
+        "WHERE labeler = ? AND subject = ? AND project = ?",
+        (labeler_id, subject, project))
+    if first[0] and db.queryone(_IS_PATIENT, (labeler_id,)):
+        db.execute(
+            "INSERT INTO review_coverage (subject, project, patient_reviewers) "
+            "VALUES (?, ?, 1) ON CONFLICT (subject, project) "
+            "DO UPDATE SET patient_reviewers = patient_reviewers + 1",
+            (subject, project))
+
+
+FLAGS = flags.FLAGS
+try:
+    flags.DEFINE_string("dbfile", "experiments.db", "Path to the SQLite database.")
+except flags.DuplicateFlagError:
+    pass  # Also defined by the analysis programs, when imported together.
+
+
+def main(argv):
+    con = sqlite3.connect(FLAGS.dbfile, timeout=10.0)
+    try:
+        con.executescript(COVERAGE_SCHEMA)
+        rebuild(con)
+        tests, = con.execute("SELECT COUNT(*) FROM review_coverage").fetchone()
+        progress, = con.execute("SELECT COUNT(*) FROM review_progress").fetchone()
+    finally:
+        con.close()
+    print(f"Review coverage: {tests} tests, {progress} labeler progress rows rebuilt.")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,179 @@
+"""Tests for review_modules/coverage.py."""
+
+import os
+import random
+
+import flask
+from absl.testing import absltest
+
+from storage import Database, relpath
+from review_modules import coverage, queries
+from review_modules.helpers import save_review_annotation
+
+# get_available_tests as it was before the coverage tables, for reference.
+JOIN_QUERY = """
+    SELECT ar.subject, at.project, COUNT(DISTINCT CASE WHEN ui_labeler.value = 'patient' THEN ra.labeler END)
+    FROM audio_results ar
+    LEFT JOIN audio_trials at ON ar.trial = at.id
+    LEFT JOIN user_info ui ON ar.subject = ui.user
+    LEFT JOIN review_annotations ra ON ar.id = ra.ref
+    LEFT JOIN user_info ui_labeler ON ra.labeler = ui_labeler.user AND ui_labeler.info_key = 'test-type'
+    WHERE ui.info_key = 'test-type' AND ui.value = 'patient'
+    AND EXISTS (SELECT 1 FROM audio_results ar2
+                LEFT JOIN audio_trials at2 ON ar2.trial = at2.id
+                WHERE ar2.subject = ar.subject AND at2.project = at.project
+                AND ar2.id NOT IN (SELECT ref FROM review_annotations WHERE labeler = ?))
+    GROUP BY ar.subject, at.project
+    ORDER BY 3, 1, 2
+"""
+
+# The per-test count of complete patient reviewers file_selection used to run.
+COMPLETE_QUERY = """
+    SELECT COUNT(*) FROM (
+        SELECT ra.labeler FROM review_annotations ra
+        JOIN audio_results ar ON ra.ref = ar.id
+        JOIN audio_trials at ON ar.trial = at.id
+        JOIN user_info ui_labeler ON ui_labeler.user = ra.labeler
+            AND ui_labeler.info_key = 'test-type' AND ui_labeler.value = 'patient'
+        WHERE ar.subject = ? AND at.project = ?
+        GROUP BY ra.labeler
+        HAVING COUNT(DISTINCT ra.ref) >= (
+            SELECT COUNT(*) FROM audio_results ar2
+            JOIN audio_trials at2 ON ar2.trial = at2.id
+            JOIN upload_manifest um ON um.ref = ar2.id AND um.playable
+            WHERE ar2.subject = ? AND at2.project = ?))
+"""
+
+
+class CoverageTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app = flask.Flask(__name__)
+        path = os.path.join(self.create_tempdir().full_path, 'test.db')
+        self.db = Database(self.app, path, relpath('schema.sql'))
+        self.enterContext(self.app.app_context())
+        self.rng = random.Random(0)
+        self.db.get().executescript("""
+            INSERT INTO audio_trials (id, project, active) VALUES
+                (1, 'quick', 1), (2, 'quick', 1), (3, 'win', 1), (4, 'nu6', 1);
+        """)
+        # Subjects 1-4 are patients, 5 is a pilot; labelers 10-12 are patient
+        # reviewers and 13 is an in-clinic audiologist.
+        for user, test_type in [(1, 'patient'), (2, 'patient'), (3, 'patient'), (4, 'patient'),
+                                (5, 'pilot'), (10, 'patient'), (11, 'patient'),
+                                (12, 'patient'), (13, 'in_clinic_audiologist')]:
+            self.db.execute('INSERT INTO users (id, username) VALUES (?, ?)',
+                            (user, f'user{user}'))
+            self.db.execute("INSERT INTO user_info (user, info_key, value) "
+                            "VALUES (?, 'test-type', ?)", (user, test_type))
+
+    def add_result(self, playable=True):
+        rowid = self.db.execute(
+            'INSERT INTO audio_results (subject, trial, reply_filename) VALUES (?, ?, ?)',
+            (self.rng.randint(1, 5), self.rng.randint(1, 4), 'upload'))
+        self.db.execute(
+            "INSERT INTO upload_manifest (ref, reply_filename, playable) VALUES (?, 'upload', ?)",
+            (rowid, int(playable)))
+        coverage.record_result(self.db, rowid)
+        return rowid
+
+    def assert_matches_join(self):
+        for labeler in (10, 11, 12, 13):
+            self.assertEqual(
+                [tuple(r) for r in queries.get_available_tests(self.db, labeler)],
+                [tuple(r) for r in self.db.queryall(JOIN_QUERY, (labeler,))])
+
+    def assert_complete_matches(self):
+        complete = queries.get_complete_patient_reviewers(self.db)
+        for subject, project in self.db.queryall(
+                'SELECT subject, project FROM review_coverage'):
+            self.assertEqual(
+                complete.get((subject, project), 0),
+                self.db.queryone(COMPLETE_QUERY, (subject, project, subject, project))[0])
+
+    def test_incremental(self):
+        coverage.ensure_coverage_tables(self.db.get())
+        results = [self.add_result() for _ in range(30)]
+        self.assert_matches_join()
+        for _ in range(60):
+            ref, labeler = self.rng.choice(results), self.rng.randint(10, 13)
+            # Saving the same review again must not count it twice.
+            save_review_annotation(self.db, ref, labeler, '[true]', False)
+            if self.rng.random() < 0.2:
+                results.append(self.add_result(playable=self.rng.random() < 0.8))
+            self.assert_matches_join()
+            self.assert_complete_matches()
+        self.assertNotEmpty(queries.get_complete_patient_reviewers(self.db))
+
+        counts = self.db.queryall('SELECT * FROM review_coverage ORDER BY 1, 2')
+        progress = self.db.queryall('SELECT * FROM review_progress ORDER BY 1, 2, 3')
+        coverage.rebuild(self.db.get())
+        self.assertEqual(self.db.queryall('SELECT * FROM review_coverage ORDER BY 1, 2'), counts)
+        self.assertEqual(self.db.queryall('SELECT * FROM review_progress ORDER BY 1, 2, 3'),
+                         progress)
+
+    def test_rebuild_after_deletes(self):
+        self.db.get().executescript("""
+            INSERT INTO audio_results (id, subject, trial) VALUES
+                (100, 1, 1), (101, 1, 2), (102, 2, 3);
+            INSERT INTO upload_manifest (ref, reply_filename, playable) VALUES
+                (100, 'upload', 1), (101, 'upload', 1), (102, 'upload', 1);
+        """)
+        coverage.ensure_coverage_tables(self.db.get())
+        for ref, labeler in [(100, 10), (101, 10), (100, 11), (102, 11)]:
+            save_review_annotation(self.db, ref, labeler, '[true]', False)
+        self.assertEqual(queries.get_complete_patient_reviewers(self.db),
+                         {(1, 'quick'): 1, (2, 'win'): 1})
+
+        # Deleted by hand, which the incremental updates don't see.
+        self.db.get().executescript("""
+            DELETE FROM review_annotations WHERE ref = 102;
+            DELETE FROM review_annotations WHERE ref = 101;
+            DELETE FROM upload_manifest WHERE ref = 101;
+            DELETE FROM audio_results WHERE id = 101;
+        """)
+        coverage.rebuild(self.db.get())
+        self.assertEqual(
+            [tuple(r) for r in self.db.queryall('SELECT * FROM review_coverage ORDER BY 1, 2')],
+            [(1, 'quick', 1, 2), (2, 'win', 1, 0)])
+        self.assertEqual(queries.get_complete_patient_reviewers(self.db), {(1, 'quick'): 2})
+        self.assert_matches_join()
+        self.assert_complete_matches()
+
+    def test_complete_counts_playable_files(self):
+        self.db.get().executescript("""
+            INSERT INTO audio_results (id, subject, trial) VALUES (100, 1, 1), (101, 1, 2);
+            INSERT INTO upload_manifest (ref, reply_filename, playable) VALUES
+                (100, 'upload', 1), (101, 'missing', 0);
+        """)
+        coverage.ensure_coverage_tables(self.db.get())
+        # Result 101 can't be played, so reviewing 100 completes the test.
+        save_review_annotation(self.db, 100, 10, '[true]', False)
+        save_review_annotation(self.db, 100, 13, '[true]', False)
+        self.assertEqual(queries.get_complete_patient_reviewers(self.db), {(1, 'quick'): 1})
+        self.assert_complete_matches()
+
+    def test_backfill_and_quick_win(self):
+        # Data written before the tables existed is filled in by ensure.
+        self.db.get().executescript("""
+            DROP TABLE review_coverage; DROP TABLE review_progress;
+            INSERT INTO audio_results (id, subject, trial) VALUES
+                (100, 1, 1), (101, 1, 4), (102, 2, 3), (103, 5, 1);
+            INSERT INTO review_annotations (ref, labeler, data) VALUES
+                (100, 10, '[]'), (100, 13, '[]'), (102, 10, '[]'), (102, 11, '[]');
+        """)
+        coverage.ensure_coverage_tables(self.db.get())
+        self.assertEqual(
+            [tuple(r) for r in queries.get_available_tests(self.db, 10)], [(1, 'nu6', 0)])
+        self.assertEqual(
+            [tuple(r) for r in queries.get_available_tests(self.db, 12)],
+            [(1, 'nu6', 0), (1, 'quick', 1), (2, 'win', 2)])
+        self.assertEqual(
+            [tuple(r) for r in queries.get_available_tests(self.db, 12, quick_win_only=True)],
+            [(1, 'quick', 1), (2, 'win', 2)])
+        self.assert_matches_join()
+
+
+if __name__ == '__main__':
+    absltest.main()
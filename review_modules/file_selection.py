@@ -2,19 +2,18 @@
 # If a reviewer leaves in the middle of a test, we want them to resume where they left off when they come back
 # Reviewers complete one patient-list combination at a time, and then are assigned a different patient and different list.
 
-import json
 import os
 import random
 from flask import session
 from review_modules import state, queries
 
+# With CAP_COMPLETED_PATIENT_PROJECTS, tests this many patient-type reviewers
+# have completed are no longer assigned.
+MAX_COMPLETE_PATIENT_REVIEWERS = 5
+
 
 def _reviewer_in_clinic(db, username):
-    try:
-        r = db.queryone("SELECT test_type FROM reviewers WHERE username = ?", (username,))
-        return bool(r and r[0] == "in_clinic_audiologist")
-    except Exception:
-        return False
+    return state.reviewer(db, username).test_type == "in_clinic_audiologist"
 
 
 def get_current_file_data(db, user_id, username=None):
@@ -62,35 +61,10 @@ def get_current_file_data(db, user_id, username=None):
     
     remaining_tests = state.get_remaining_tests(db, username, user_id)
     if os.environ.get("CAP_COMPLETED_PATIENT_PROJECTS", "0").lower() in ("1", "true", "yes", "on") and not _reviewer_in_clinic(db, username):
+        complete = queries.get_complete_patient_reviewers(db)
         remaining_tests = [
             t for t in remaining_tests
-            if db.queryone(
-                """
-                SELECT COUNT(*)
-                FROM (
-                    SELECT ra.labeler
-                    FROM review_annotations ra
-                    JOIN audio_results ar ON ra.ref = ar.id
-                    JOIN audio_trials at ON ar.trial = at.id
-                    JOIN user_info ui_labeler
-                        ON ui_labeler.user = ra.labeler
-                        AND ui_labeler.info_key = 'test-type'
-                        AND ui_labeler.value = 'patient'
-                    WHERE ar.subject = ? AND at.project = ?
-                    GROUP BY ra.labeler
-                    HAVING COUNT(DISTINCT ra.ref) >= (
-                        SELECT COUNT(*)
-                        FROM audio_results ar2
-                        JOIN audio_trials at2 ON ar2.trial = at2.id
-                        WHERE ar2.subject = ?
-                          AND at2.project = ?
-                          AND ar2.reply_filename IS NOT NULL
-                          AND ar2.reply_filename != ''
-                    )
-                ) x
-                """,
-                (t["subject"], t["project"], t["subject"], t["project"])
-            )[0] < 5
+            if complete.get((t["subject"], t["project"]), 0) < MAX_COMPLETE_PATIENT_REVIEWERS
         ]
     
     if not remaining_tests:
@@ -115,12 +89,7 @@ def get_current_file_data(db, user_id, username=None):
     files = queries.get_test_files(db, user_id, subject_id, project)
     if not files:
         remaining_tests = [t for t in remaining_tests if (t["subject"], t["project"]) != (subject_id, project)]
-        try:
-            db.execute(
-                "UPDATE reviewers SET remaining_tests = ? WHERE username = ?",
-                (json.dumps(remaining_tests), username))
-        except:
-            pass
+        state.update_remaining_tests(db, username, remaining_tests)
         return get_current_file_data(db, user_id, username)
     
     total_files = queries.get_total_test_files(db, subject_id, project)
@@ -131,11 +100,6 @@ def get_current_file_data(db, user_id, username=None):
     state.update_test_in_progress(db, username, subject_id, project, first_file_id, total_files, files_reviewed, current_file_num)
     
     remaining_tests = [t for t in remaining_tests if (t["subject"], t["project"]) != (subject_id, project)]
-    try:
-        db.execute(
-            "UPDATE reviewers SET remaining_tests = ? WHERE username = ?",
-            (json.dumps(remaining_tests), username))
-    except:
-        pass
+    state.update_remaining_tests(db, username, remaining_tests)
     
     return files[0], subject_id, project, 0, total_files, current_file_num
\ No newline at end of file
@@ -1,4 +1,5 @@
 from flask import session, request, abort
+from review_modules import coverage
 
 def extract_username():
     username = session.get("username") or request.args.get("username")
@@ -15,6 +16,7 @@ def extract_username():
 
 
 def save_review_annotation(db, ref_id, labeler_id, annotations_str, unclear):
+    """Insert or update labeler_id's annotation of ref_id; True if it is new."""
     # Verify foreign keys exist before inserting
     ref_exists = db.queryone("SELECT 1 FROM audio_results WHERE id = ?", (ref_id,))
     labeler_exists = db.queryone("SELECT 1 FROM users WHERE id = ?", (labeler_id,))
@@ -48,4 +50,6 @@ def save_review_annotation(db, ref_id, labeler_id, annotations_str, unclear):
         else:
             db.execute("INSERT INTO review_annotations (ref, data, labeler) VALUES (?, ?, ?)",
                       (ref_id, annotations_str, labeler_id))
+        coverage.record_review(db, ref_id, labeler_id)
+    return not existing
 
@@ -1,27 +1,48 @@
-import os
-
 def get_available_tests(db, user_id, *, quick_win_only=False):
-    """If quick_win_only, only WIN and QuickSIN (project ``quick``) patient tests."""
-    project_clause = "AND at.project IN ('quick', 'win')" if quick_win_only else ""
+    """Patient tests with files user_id has not reviewed, least reviewed first.
+
+    Returns (subject, project, total_reviews) rows, where total_reviews is the
+    number of distinct patient-type reviewers.  Reads the review_coverage and
+    review_progress tables (see coverage.py).  If quick_win_only, only WIN and
+    QuickSIN (project ``quick``) patient tests.
+    """
+    project_clause = "AND rc.project IN ('quick', 'win')" if quick_win_only else ""
     return db.queryall(f"""
-        SELECT ar.subject, at.project, COUNT(DISTINCT CASE WHEN ui_labeler.info_key = 'test-type' AND ui_labeler.value = 'patient' THEN ra.labeler ELSE NULL END) as total_reviews
-        FROM audio_results ar
-        LEFT JOIN audio_trials at ON ar.trial = at.id
-        LEFT JOIN users u ON ar.subject = u.id
-        LEFT JOIN user_info ui ON u.id = ui.user
-        LEFT JOIN review_annotations ra ON ar.id = ra.ref
-        LEFT JOIN users u_labeler ON ra.labeler = u_labeler.id
-        LEFT JOIN user_info ui_labeler ON u_labeler.id = ui_labeler.user AND ui_labeler.info_key = 'test-type'
-        WHERE ui.info_key = 'test-type' AND ui.value = 'patient'
+        SELECT rc.subject, rc.project, rc.patient_reviewers AS total_reviews
+        FROM review_coverage rc
+        LEFT JOIN review_progress rp ON rp.labeler = ?
+            AND rp.subject = rc.subject AND rp.project = rc.project
+        WHERE rc.total_files > COALESCE(rp.files_reviewed, 0)
         {project_clause}
-        AND ar.id NOT IN (SELECT ref FROM review_annotations WHERE labeler = ?)
-        AND EXISTS (SELECT 1 FROM audio_results ar2 
-                    LEFT JOIN audio_trials at2 ON ar2.trial = at2.id
-                    WHERE ar2.subject = ar.subject AND at2.project = at.project
-                    AND ar2.id NOT IN (SELECT ref FROM review_annotations WHERE labeler = ?))
-        GROUP BY ar.subject, at.project
-        ORDER BY total_reviews ASC, ar.subject ASC, at.project ASC
-    """, (user_id, user_id))
+        AND EXISTS (SELECT 1 FROM user_info ui WHERE ui.user = rc.subject
+                    AND ui.info_key = 'test-type' AND ui.value = 'patient')
+        ORDER BY total_reviews ASC, rc.subject ASC, rc.project ASC
+    """, (user_id,))
+
+def get_complete_patient_reviewers(db):
+    """{(subject, project): number of patient-type reviewers who reviewed every file}.
+
+    Only playable files (see upload_manifest.py) count, as only those are
+    offered for review.  One grouped read of upload_manifest and the
+    review_progress table (see coverage.py); tests nobody has completed are
+    left out.
+    """
+    return {(r[0], r[1]): r[2] for r in db.queryall("""
+        WITH playable AS (
+            SELECT ar.subject, at.project, COUNT(*) AS files
+            FROM upload_manifest um
+            JOIN audio_results ar ON ar.id = um.ref
+            JOIN audio_trials at ON ar.trial = at.id
+            WHERE um.playable
+            GROUP BY ar.subject, at.project)
+        SELECT p.subject, p.project, COUNT(*)
+        FROM playable p
+        JOIN review_progress rp ON rp.subject = p.subject AND rp.project = p.project
+            AND rp.files_reviewed >= p.files
+        WHERE EXISTS (SELECT 1 FROM user_info ui WHERE ui.user = rp.labeler
+                      AND ui.info_key = 'test-type' AND ui.value = 'patient')
+        GROUP BY p.subject, p.project
+    """)}
 
 def get_test_files(db, user_id, subject_id, project):
     try:
@@ -30,6 +51,7 @@ def get_test_files(db, user_id, subject_id, project):
                    at.project, at.trial_number, at.level_number,
                    COUNT(CASE WHEN ui_labeler.info_key = 'test-type' AND ui_labeler.value = 'patient' THEN ra.ref ELSE NULL END) as review_count, u.username
             FROM audio_results ar
+            JOIN upload_manifest um ON um.ref = ar.id AND um.playable
             LEFT JOIN audio_trials at ON ar.trial = at.id
             LEFT JOIN review_annotations ra ON ar.id = ra.ref
             LEFT JOIN users u_labeler ON ra.labeler = u_labeler.id
@@ -49,23 +71,22 @@ def get_test_files(db, user_id, subject_id, project):
                 'list_number': r[6] or 0,
                 'level_number': r[7] or 0,
                 'review_count': r[8]} for r in results
-                if r[1] and isinstance(r[1], str) and os.path.exists(f"/var/www/jnd/uploads/{r[1]}")]
+                if r[1] and isinstance(r[1], str)]
     except Exception:
         return []
 
 def get_total_test_files(db, subject_id, project):
     try:
-        result = db.queryall("""
-            SELECT ar.id, ar.reply_filename
+        result = db.queryone("""
+            SELECT COUNT(*)
             FROM audio_results ar
+            JOIN upload_manifest um ON um.ref = ar.id AND um.playable
             LEFT JOIN audio_trials at ON ar.trial = at.id
             WHERE ar.subject = ? AND at.project = ?
             AND ar.reply_filename IS NOT NULL 
             AND ar.reply_filename != ''
         """, (subject_id, project))
-        return sum(1 for r in result 
-                   if r[1] and isinstance(r[1], str) 
-                   and os.path.exists(f"/var/www/jnd/uploads/{r[1]}"))
+        return result[0] if result else 0
     except Exception:
         return 0
 
@@ -1,183 +1,224 @@
 import json
-from flask import session
+import logging
+import sqlite3
+import time
+from flask import g
+
+# Columns of the reviewers table held in ReviewerState, in load order.
+FIELDS = ("test_in_progress", "completed_tests", "remaining_tests",
+          "most_recent_subject", "total_reviews", "played_audio", "test_type")
+JSON_FIELDS = {"test_in_progress", "completed_tests", "remaining_tests", "played_audio"}
+# Attempts at writing back a reviewer's state before the request fails.
+FLUSH_ATTEMPTS = 3
+
+
+class ReviewerState:
+    """One reviewer's row of the reviewers table, for the current request.
+
+    Loaded once per request by reviewer(), changed in memory by the methods
+    below, and written back by flush() (ReviewBP calls it after each request).
+    total_reviews is kept by count_review() rather than recounted from
+    review_annotations.
+    """
+
+    def __init__(self, username, row=None):
+        self.username = username
+        self.exists = row is not None
+        row = row or (None,) * len(FIELDS)
+        self.test_in_progress = json.loads(row[0]) if row[0] else None
+        self.completed_tests = json.loads(row[1]) if row[1] else []
+        self.remaining_tests = json.loads(row[2]) if row[2] else []
+        self.most_recent_subject = row[3]
+        self.total_reviews = row[4] or 0
+        self.played_audio = json.loads(row[5]) if row[5] else []
+        self.test_type = row[6] or 'patient'
+        self.dirty = set()
+
+    @classmethod
+    def load(cls, db, username):
+        try:
+            row = db.queryone(
+                f"SELECT {', '.join(FIELDS)} FROM reviewers WHERE username = ?",
+                (username,))
+        except Exception:
+            row = None
+        return cls(username, row)
+
+    def as_dict(self):
+        return {
+            'test_in_progress': dict(self.test_in_progress) if self.test_in_progress else None,
+            'completed_tests': list(self.completed_tests),
+            'remaining_tests': list(self.remaining_tests),
+            'most_recent_subject': self.most_recent_subject,
+            'total_reviews': self.total_reviews,
+            'played_audio': list(self.played_audio),
+            'reviewer_test_type': self.test_type,
+        }
+
+    def set_test_in_progress(self, progress):
+        self.test_in_progress = progress
+        self.dirty.add("test_in_progress")
+
+    def add_played_audio(self, file_id):
+        if file_id not in self.played_audio:
+            self.played_audio.append(file_id)
+            self.dirty.add("played_audio")
+
+    def remove_played_audio(self, file_id):
+        if file_id in self.played_audio:
+            self.played_audio.remove(file_id)
+            self.dirty.add("played_audio")
+
+    def count_review(self):
+        self.total_reviews += 1
+        self.dirty.add("total_reviews")
+
+    def add_completed_test(self, subject_id, project):
+        test_pair = {"subject": subject_id, "project": project}
+        if test_pair not in self.completed_tests:
+            self.completed_tests.append(test_pair)
+            self.dirty.add("completed_tests")
+
+    def set_most_recent_subject(self, subject_id):
+        self.most_recent_subject = subject_id
+        self.dirty.add("most_recent_subject")
+
+    def set_remaining_tests(self, remaining):
+        self.remaining_tests = list(remaining)
+        self.dirty.add("remaining_tests")
+
+    def flush(self, db):
+        """Write the changed fields back with a single UPDATE."""
+        if not self.dirty or not self.exists:
+            return
+        fields = sorted(self.dirty)
+        values = [json.dumps(getattr(self, f)) if f in JSON_FIELDS and getattr(self, f) is not None
+                  else getattr(self, f) for f in fields]
+        db.execute(
+            f"UPDATE reviewers SET {', '.join(f + ' = ?' for f in fields)} WHERE username = ?",
+            values + [self.username])
+        self.dirty.clear()
+
+
+def reviewer(db, username):
+    """The ReviewerState of username for this request, loading it on first use."""
+    states = g.setdefault("_reviewer_states", {})
+    if username not in states:
+        states[username] = ReviewerState.load(db, username)
+    return states[username]
+
+
+def flush(db):
+    """Write back the reviewer states changed during this request.
+
+    A write that fails with an OperationalError (such as "database is
+    locked", after the connection's own busy timeout) is retried.  A write
+    that still fails is logged and its error raised once the other states
+    are written, so the request fails rather than losing the changes its
+    response reported.
+    """
+    error = None
+    for rev in g.pop("_reviewer_states", {}).values():
+        for attempt in range(1, FLUSH_ATTEMPTS + 1):
+            try:
+                rev.flush(db)
+                break
+            except Exception as e:
+                db.get().rollback()
+                if isinstance(e, sqlite3.OperationalError) and attempt < FLUSH_ATTEMPTS:
+                    logging.warning("Retrying the reviewer state write of %s: %s",
+                                    rev.username, e)
+                    time.sleep(0.1 * attempt)
+                    continue
+                logging.exception("Could not write the reviewer state of %s (%s)",
+                                  rev.username, ", ".join(sorted(rev.dirty)))
+                error = error or e
+                break
+    if error is not None:
+        raise error
+
+
+def recount_total_reviews(con):
+    """Reset every reviewer's total_reviews from review_annotations."""
+    con.execute("""
+        UPDATE reviewers SET total_reviews = (
+            SELECT COUNT(*) FROM review_annotations ra
+            JOIN users u ON ra.labeler = u.id
+            WHERE u.username = reviewers.username)
+    """)
+    con.commit()
 
 
 def get_reviewer_state(db, username):
-    """Get reviewer state from database. Recalculates total_reviews for accuracy."""
-    try:
-        result = db.queryone(
-            "SELECT test_in_progress, completed_tests, remaining_tests, most_recent_subject, total_reviews, played_audio, test_type "
-            "FROM reviewers WHERE username = ?",
-            (username,))
-        if result:
-            user_result = db.queryone("SELECT id FROM users WHERE username = ?", (username,))
-            if user_result:
-                user_id = user_result[0]
-                count_result = db.queryone("SELECT COUNT(*) FROM review_annotations WHERE labeler = ?", (user_id,))
-                actual_count = count_result[0] if count_result else 0
-                stored_count = result[4] if result[4] is not None else 0
-                
-                if actual_count != stored_count:
-                    try:
-                        db.execute("UPDATE reviewers SET total_reviews = ? WHERE username = ?", (actual_count, username))
-                    except:
-                        pass
-                # dictionary holding reviewer state
-                tt = result[6] if len(result) > 6 and result[6] else 'patient'
-                return {
-                    'test_in_progress': json.loads(result[0]) if result[0] else None,
-                    'completed_tests': json.loads(result[1]) if result[1] else [],
-                    'remaining_tests': json.loads(result[2]) if result[2] else [],
-                    'most_recent_subject': result[3],
-                    'total_reviews': actual_count,
-                    'played_audio': json.loads(result[5]) if result[5] else [],
-                    'reviewer_test_type': tt,
-                }
-            else:
-                stored_count = result[4] if result[4] is not None else 0
-                tt = result[6] if len(result) > 6 and result[6] else 'patient'
-                return {
-                    'test_in_progress': json.loads(result[0]) if result[0] else None,
-                    'completed_tests': json.loads(result[1]) if result[1] else [],
-                    'remaining_tests': json.loads(result[2]) if result[2] else [],
-                    'most_recent_subject': result[3],
-                    'total_reviews': stored_count,
-                    'played_audio': json.loads(result[5]) if result[5] else [],
-                    'reviewer_test_type': tt,
-                }
-    except Exception:
-        pass
-    return {
-        'test_in_progress': None,
-        'completed_tests': [],
-        'remaining_tests': [],
-        'most_recent_subject': None,
-        'total_reviews': 0,
-        'played_audio': [],
-        'reviewer_test_type': 'patient',
-    }
+    """Get reviewer state as a dictionary (copies; change it with the functions below)."""
+    return reviewer(db, username).as_dict()
 
 
 def update_test_in_progress(db, username, subject_id, project, current_index, total_files=None, files_reviewed=None, current_file_num=None):
     """Update test_in_progress with current progress."""
     if not username:
         return
-    try:
-        progress_data = {
-            "subject": subject_id,
-            "project": project,
-            "index": current_index
-        }
-        if total_files is not None:
-            progress_data["total_files"] = total_files
-        if files_reviewed is not None:
-            progress_data["files_reviewed"] = files_reviewed
-        if current_file_num is not None:
-            progress_data["current_file_num"] = current_file_num
-        
-        test_in_progress = json.dumps(progress_data)
-        db.execute(
-            "UPDATE reviewers SET test_in_progress = ? WHERE username = ?",
-            (test_in_progress, username))
-    except Exception:
-        pass
+    progress_data = {
+        "subject": subject_id,
+        "project": project,
+        "index": current_index
+    }
+    if total_files is not None:
+        progress_data["total_files"] = total_files
+    if files_reviewed is not None:
+        progress_data["files_reviewed"] = files_reviewed
+    if current_file_num is not None:
+        progress_data["current_file_num"] = current_file_num
+    reviewer(db, username).set_test_in_progress(progress_data)
 
 
 def clear_test_in_progress(db, username):
     """Clear test_in_progress."""
     if not username:
         return
-    try:
-        db.execute(
-            "UPDATE reviewers SET test_in_progress = NULL WHERE username = ?",
-            (username,))
-    except Exception:
-        pass
+    reviewer(db, username).set_test_in_progress(None)
 
 
 def add_played_audio(db, username, file_id):
     """Add file_id to played_audio list to monitor participants leaving without reviewing."""
     if not username or not file_id:
         return
-    try:
-        state = get_reviewer_state(db, username)
-        played_audio = state['played_audio']
-        if file_id not in played_audio:
-            played_audio.append(file_id)
-            db.execute(
-                "UPDATE reviewers SET played_audio = ? WHERE username = ?",
-                (json.dumps(played_audio), username))
-    except Exception:
-        pass
+    reviewer(db, username).add_played_audio(file_id)
 
 # when removed, take it out again
 def remove_played_audio(db, username, file_id):
     """Remove file_id from played_audio list."""
     if not username or not file_id:
         return
-    try:
-        state = get_reviewer_state(db, username)
-        played_audio = state['played_audio']
-        if file_id in played_audio:
-            played_audio.remove(file_id)
-            db.execute(
-                "UPDATE reviewers SET played_audio = ? WHERE username = ?",
-                (json.dumps(played_audio), username))
-    except Exception:
-        pass
+    reviewer(db, username).remove_played_audio(file_id)
 
 
 def increment_total_reviews(db, username):
-    """Update total_reviews count (recalculated from actual count)."""
+    """Count one more review (call once per new annotation)."""
     if not username:
         return
-    try:
-        user_result = db.queryone("SELECT id FROM users WHERE username = ?", (username,))
-        if not user_result:
-            return
-        
-        user_id = user_result[0]
-        count_result = db.queryone("SELECT COUNT(*) FROM review_annotations WHERE labeler = ?", (user_id,))
-        actual_count = count_result[0] if count_result else 0
-        
-        db.execute(
-            "UPDATE reviewers SET total_reviews = ? WHERE username = ?",
-            (actual_count, username))
-    except Exception:
-        pass
+    reviewer(db, username).count_review()
 
 
 def add_completed_test(db, username, subject_id, project):
     """Add test to completed_tests list."""
     if not username:
         return
-    try:
-        state = get_reviewer_state(db, username)
-        completed_tests = state['completed_tests']
-        
-        test_pair = {"subject": subject_id, "project": project}
-        if test_pair not in completed_tests:
-            completed_tests.append(test_pair)
-            db.execute(
-                "UPDATE reviewers SET completed_tests = ? WHERE username = ?",
-                (json.dumps(completed_tests), username))
-    except Exception:
-        pass
+    reviewer(db, username).add_completed_test(subject_id, project)
 
 
 def update_most_recent_subject(db, username, subject_id):
     """Update most_recent_subject."""
     if not username or not subject_id:
         return
-    
-    try:
-        reviewer_exists = db.queryone("SELECT 1 FROM reviewers WHERE username = ?", (username,))
-        if reviewer_exists:
-            db.execute(
-                "UPDATE reviewers SET most_recent_subject = ? WHERE username = ?",
-                (subject_id, username))
-    except Exception:
-        pass
+    reviewer(db, username).set_most_recent_subject(subject_id)
+
+
+def update_remaining_tests(db, username, remaining):
+    """Replace remaining_tests."""
+    if not username:
+        return
+    reviewer(db, username).set_remaining_tests(remaining)
 
 
 def calculate_and_update_remaining_tests(db, username, user_id):
@@ -187,13 +228,12 @@ def calculate_and_update_remaining_tests(db, username, user_id):
     
     try:
         from review_modules import queries
-        rev_state = get_reviewer_state(db, username)
-        in_clinic = rev_state['reviewer_test_type'] == 'in_clinic_audiologist'
-        available_tests = queries.get_available_tests(db, user_id, in_clinic=in_clinic)
-        completed_tests = rev_state['completed_tests']
-        completed_set = {(t["subject"], t["project"]) for t in completed_tests}
+        rev = reviewer(db, username)
+        in_clinic = rev.test_type == 'in_clinic_audiologist'
+        available_tests = queries.get_available_tests(db, user_id, quick_win_only=in_clinic)
+        completed_set = {(t["subject"], t["project"]) for t in rev.completed_tests}
         
-        test_in_progress = rev_state['test_in_progress']
+        test_in_progress = rev.test_in_progress
         in_progress_set = set()
         if test_in_progress:
             in_progress_set.add((test_in_progress["subject"], test_in_progress["project"]))
@@ -204,10 +244,7 @@ def calculate_and_update_remaining_tests(db, username, user_id):
             if (test[0], test[1]) not in completed_set and (test[0], test[1]) not in in_progress_set
         ]
         
-        db.execute(
-            "UPDATE reviewers SET remaining_tests = ? WHERE username = ?",
-            (json.dumps(remaining), username))
-        
+        rev.set_remaining_tests(remaining)
         return remaining
     except Exception:
         return []
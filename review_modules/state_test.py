@@ -0,0 +1,110 @@
+"""Tests for review_modules/state.py."""
+
+import json
+import os
+import sqlite3
+from unittest import mock
+
+import flask
+from absl.testing import absltest
+
+from storage import Database, relpath
+from review_modules import state
+
+
+class ReviewerStateTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.app = flask.Flask(__name__)
+        path = os.path.join(self.create_tempdir().full_path, 'test.db')
+        self.db = Database(self.app, path, relpath('schema.sql'))
+        with self.app.app_context():
+            self.db.get().executescript("""
+                INSERT INTO users (id, username) VALUES (7, 'rev');
+                INSERT INTO reviewers (username, role, years_practicing, consent_form,
+                                       played_audio, total_reviews)
+                VALUES ('rev', 'audiologist', 3, x'00', '[5]', 0);
+                INSERT INTO review_annotations (ref, labeler, data) VALUES
+                    (1, 7, '[]'), (2, 7, '[]');
+            """)
+
+    def traced(self):
+        statements = []
+        self.db.get().set_trace_callback(statements.append)
+        return statements
+
+    def row(self):
+        with self.app.app_context():
+            return self.db.queryone(
+                'SELECT test_in_progress, completed_tests, remaining_tests, '
+                'most_recent_subject, total_reviews, played_audio '
+                "FROM reviewers WHERE username = 'rev'")
+
+    def test_one_load_and_one_write_per_request(self):
+        with self.app.test_request_context():
+            statements = self.traced()
+            self.assertEqual(state.get_reviewer_state(self.db, 'rev')['played_audio'], [5])
+            state.add_played_audio(self.db, 'rev', 6)
+            state.remove_played_audio(self.db, 'rev', 5)
+            state.increment_total_reviews(self.db, 'rev')
+            state.add_completed_test(self.db, 'rev', 3, 'quick')
+            state.add_completed_test(self.db, 'rev', 3, 'quick')
+            state.update_most_recent_subject(self.db, 'rev', 3)
+            state.update_test_in_progress(self.db, 'rev', 4, 'win', 11, total_files=10)
+            state.update_remaining_tests(self.db, 'rev', [{'subject': 4, 'project': 'win'}])
+            reviewer_state = state.get_reviewer_state(self.db, 'rev')
+            self.assertEqual(reviewer_state['total_reviews'], 1)
+            self.assertEqual(reviewer_state['played_audio'], [6])
+            # The returned dictionary is a copy.
+            reviewer_state['played_audio'].append(8)
+            self.assertEqual(state.get_reviewer_state(self.db, 'rev')['played_audio'], [6])
+            self.assertLen([s for s in statements if s.startswith('SELECT')], 1)
+            self.assertEmpty([s for s in statements if s.startswith('UPDATE')])
+
+            state.flush(self.db)
+            self.assertLen([s for s in statements if s.startswith('UPDATE')], 1)
+            state.flush(self.db)
+            self.assertLen([s for s in statements if s.startswith('UPDATE')], 1)
+
+        test_in_progress, completed, remaining, recent, total, played = self.row()
+        self.assertEqual(json.loads(test_in_progress),
+                         {'subject': 4, 'project': 'win', 'index': 11, 'total_files': 10})
+        self.assertEqual(json.loads(completed), [{'subject': 3, 'project': 'quick'}])
+        self.assertEqual(json.loads(remaining), [{'subject': 4, 'project': 'win'}])
+        self.assertEqual((recent, total, json.loads(played)), (3, 1, [6]))
+
+        with self.app.test_request_context():
+            state.clear_test_in_progress(self.db, 'rev')
+            state.flush(self.db)
+            # An unknown reviewer has the defaults, and nothing to write.
+            self.assertEqual(state.get_reviewer_state(self.db, 'nobody')['total_reviews'], 0)
+            state.add_played_audio(self.db, 'nobody', 1)
+            state.flush(self.db)
+        self.assertIsNone(self.row()[0])
+
+    def test_flush_retries_and_raises(self):
+        locked = sqlite3.OperationalError('database is locked')
+        with self.app.test_request_context(), mock.patch('time.sleep'):
+            state.increment_total_reviews(self.db, 'rev')
+            with mock.patch.object(state.ReviewerState, 'flush', autospec=True,
+                                   side_effect=[locked, None]) as write:
+                state.flush(self.db)
+            self.assertEqual(write.call_count, 2)
+
+            state.increment_total_reviews(self.db, 'rev')
+            with mock.patch.object(state.ReviewerState, 'flush', side_effect=locked) as write, \
+                    self.assertLogs(level='ERROR') as logs:
+                with self.assertRaises(sqlite3.OperationalError):
+                    state.flush(self.db)
+            self.assertEqual(write.call_count, state.FLUSH_ATTEMPTS)
+            self.assertIn('rev (total_reviews)', logs.output[0])
+
+    def test_recount(self):
+        with self.app.app_context():
+            state.recount_total_reviews(self.db.get())
+        self.assertEqual(self.row()[4], 2)
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -10,13 +10,25 @@ set -euo pipefail
 # 1) creates run_exp3/TAG if needed
 # 2) copies ../jnd.emily/experiments.db to run_exp3/TAG/experiments.db if not already there
 # 2a) runs clear_single_word_asr.py to clear any existing ASR results for the target projects
-# 3) runs offline_asr.py with the given arguments
+# 3) runs offline_asr.py with the given arguments, writing the per-task timing
+#    to run_exp3/TAG/asr_timing.jsonl and its summary (real-time factor,
+#    utterances/s, p95 latency) to run_exp3/TAG/asr_timing_summary.json, and
+#    the utterances over the decode budget (if one is set) to
+#    run_exp3/TAG/asr_retry.txt
 # 4) runs score_and_report.py and writes CSV output to run_exp3/TAG/quicksin_results.csv
-# 5) runs summarize_raters.py for each of the target projects (quick, win) and
-#     saves the output to run_exp3/TAG/summarize_raters_PROJECT.log
+#    (and, when pyarrow is installed, the columnar run_exp3/TAG/quicksin_results.parquet)
+# 5) runs summarize_raters.py once in batch mode for all the projects, writing
+#     the correlations and residual statistics of each project to
+#     run_exp3/TAG/summarize_raters_metrics.json (read by run_exp3_summary.py),
+#     the residual histogram of each project to
+#     run_exp3/TAG/residual_std_ratio_PROJECT.png, and its output to
+#     run_exp3/TAG/summarize_raters.log
 #
 # Flags:
 #   --recompute_all  Disable done-file checks and recompute all tags.
+#   --share_model    Load the model once and let the forked workers share it
+#                    (passes --share_model to offline_asr.py; CPU-only machines,
+#                    since CUDA does not survive the fork).
 
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 RUN_DIR="$SCRIPT_DIR/run_exp3"
@@ -26,7 +38,9 @@ SOURCE_DB="$SCRIPT_DIR/../jnd.emily/experiments.db"
 # Arguments always passed to offline_asr.py for every job.
 # Example: COMMON_ARGS=(--audiodir=uploads --num_workers=6)
 # Num workers = 2 seems to work well for 30 cores
-COMMON_ARGS=(--target_projects=quick,win --num_workers=2)
+# --asr_cache reuses results already decoded with the same options by any tag.
+COMMON_ARGS=(--target_projects=quick,win --num_workers=2
+             --asr_cache="$RUN_DIR/asr_cache.db")
 
 RECOMPUTE_ALL=false
 for arg in "$@"; do
@@ -34,13 +48,16 @@ for arg in "$@"; do
     --recompute_all)
       RECOMPUTE_ALL=true
       ;;
+    --share_model)
+      COMMON_ARGS+=(--share_model)
+      ;;
     -h|--help)
-      echo "Usage: $0 [--recompute_all]"
+      echo "Usage: $0 [--recompute_all] [--share_model]"
       exit 0
       ;;
     *)
       echo "Unknown argument: $arg" >&2
-      echo "Usage: $0 [--recompute_all]" >&2
+      echo "Usage: $0 [--recompute_all] [--share_model]" >&2
       exit 2
       ;;
   esac
@@ -78,10 +95,12 @@ while IFS= read -r line || [[ -n "$line" ]]; do
   echo "=== Processing ASR for tag: $tag ==="
   tag_dir="$RUN_DIR/$tag"
   tag_db="$tag_dir/experiments.db"
-  done_file="$tag_dir/summarize_raters_win.log"
+  done_file="$tag_dir/summarize_raters_metrics.json"
+  # Tags summarized before batch mode have per-project logs instead.
+  old_done_file="$tag_dir/summarize_raters_win.log"
 
-  if [[ "$RECOMPUTE_ALL" != true && -f "$done_file" ]]; then
-    echo "[$tag] Found $done_file, skipping database copy/ASR/summarize steps."
+  if [[ "$RECOMPUTE_ALL" != true && ( -f "$done_file" || -f "$old_done_file" ) ]]; then
+    echo "[$tag] Found summarize_raters output, skipping database copy/ASR/summarize steps."
     continue
   fi
 
@@ -99,20 +118,24 @@ while IFS= read -r line || [[ -n "$line" ]]; do
     eval "args=($rest)"
   fi
 
-  cmd=(python "$SCRIPT_DIR/offline_asr.py" --dbfile "$tag_db" "${COMMON_ARGS[@]}" "${args[@]}")
+  cmd=(python "$SCRIPT_DIR/offline_asr.py" --dbfile "$tag_db" "${COMMON_ARGS[@]}"
+       --timing_trace "$tag_dir/asr_timing.jsonl"
+       --timing_summary "$tag_dir/asr_timing_summary.json"
+       --retry_list "$tag_dir/asr_retry.txt" "${args[@]}")
 
   echo "[$tag] Running: ${cmd[*]}"
   "${cmd[@]}"
 
   score_csv="$tag_dir/quicksin_results.csv"
   score_cmd=(python "$SCRIPT_DIR/score_and_report.py" --dbfile "$tag_db" --csv_output "$score_csv")
+  if python -c "import pyarrow" 2>/dev/null; then
+    score_cmd+=(--columnar_output "$tag_dir/quicksin_results.parquet")
+  fi
   echo "[$tag] Running: ${score_cmd[*]}"
   "${score_cmd[@]}"
 
-  for project in quick win; do
-    summary_log="$tag_dir/summarize_raters_${project}.log"
-    summary_cmd=(python "$SCRIPT_DIR/summarize_raters.py" --dbfile "$tag_db" --project "$project" --residual_plot "$tag_dir/residual_std_ratio_${project}.png" --residual_normalization normalization_by_snr)
-    echo "[$tag] Running: ${summary_cmd[*]} > $summary_log"
-    "${summary_cmd[@]}" > "$summary_log" 2>&1
-  done
+  summary_log="$tag_dir/summarize_raters.log"
+  summary_cmd=(python "$SCRIPT_DIR/summarize_raters.py" --dbfile "$tag_db" --batch_metrics "$done_file" --residual_plot_pattern "$tag_dir/residual_std_ratio_{project}.png" --residual_normalization normalization_by_snr)
+  echo "[$tag] Running: ${summary_cmd[*]} > $summary_log"
+  "${summary_cmd[@]}" > "$summary_log" 2>&1
 done < "$JOBS_FILE"
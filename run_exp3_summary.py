@@ -1,26 +1,39 @@
-"""Summarize run_exp3 correlations from summarize_raters logs.
+"""Summarize run_exp3 correlations from summarize_raters output.
 
-This script reads tags from run_exp3.jobs, then for each tag looks in:
+This script reads tags from run_exp3.jobs, then for each tag reads the
+ASR-vs-raters Pearson correlation and the residual std-dev ratio of each
+project from run_exp3/<TAG>/summarize_raters_metrics.json, written by
+summarize_raters.py --batch_metrics.
+
+Tags run before batch mode have one log per project instead:
 - run_exp3/<TAG>/summarize_raters_quick.log
 - run_exp3/<TAG>/summarize_raters_win.log
 
-It searches for lines containing "ASR vs. Raters" and extracts the Pearson
-correlation value from text like:
+For those it searches for lines containing "ASR vs. Raters" and extracts the
+Pearson correlation value from text like:
     ASR vs. Raters: Pearson=0.123, bias (Y-X)=-0.045
 
 Finally, it creates a plot with one series per project (quick and win) over
 job tags.
+
+It also prints, for each tag, how often the ASR agrees with the audiologist
+on each keyword, from the tag's score_and_report export: the columnar
+run_exp3/<TAG>/quicksin_results.parquet (or .arrow) if there is one, else
+quicksin_results.csv (see results_export).
 """
 
+import json
 import math
 import re
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 from absl import app
 from absl import flags
 
+import results_export
+
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("jobs_file", "run_exp3.jobs", "Path to run_exp3 jobs file.")
@@ -34,6 +47,10 @@ flags.DEFINE_string(
 
 PROJECTS = ("quick", "win")
 BAD_MODEL_TAGS = {"large_exact_-10", "large_forced_-10"}
+RESULTS_EXPORTS = ("quicksin_results.parquet", "quicksin_results.arrow", "quicksin_results.csv")
+METRICS_FILE = "summarize_raters_metrics.json"
+# The residual normalization run_exp3.sh uses.
+RESIDUAL_NORMALIZATION = "normalization_by_snr"
 PEARSON_RE = re.compile(r"Pearson=([-+]?\d*\.?\d+|nan)", re.IGNORECASE)
 STD_RATIO_RE = re.compile(r"ASR/Rater=([-+]?\d*\.?\d+|nan)", re.IGNORECASE)
 
@@ -105,15 +122,45 @@ def extract_residual_std_ratio(log_file: Path) -> Optional[float]:
     return last_value
 
 
+def load_batch_metrics(tag_dir: Path) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Return the summarize_raters batch metrics of a tag by project, if it has them.
+
+    When a project has several ASR models, the one with the most trials is used.
+    """
+    metrics_file = tag_dir / METRICS_FILE
+    if not metrics_file.exists():
+        return None
+    with metrics_file.open("r", encoding="utf-8") as file:
+        records = json.load(file)["metrics"]
+    by_project: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        best = by_project.get(record["project"])
+        if best is None or record["trials"] > best["trials"]:
+            by_project[record["project"]] = record
+    return by_project
+
+
+def metric_value(record: Optional[Dict[str, Any]], key: str) -> Optional[float]:
+    """A metric of a batch record; NaN when summarize_raters could not compute it."""
+    if record is None:
+        return None
+    value = record.get(key)
+    return float("nan") if value is None else float(value)
+
+
 def collect_correlations(tags: List[str], run_dir: Path) -> Dict[str, List[Optional[float]]]:
     """Collect quick/win correlations for each tag in order."""
     result: Dict[str, List[Optional[float]]] = {project: [] for project in PROJECTS}
 
     for tag in tags:
         tag_dir = run_dir / tag
+        metrics = load_batch_metrics(tag_dir)
         for project in PROJECTS:
-            log_file = tag_dir / f"summarize_raters_{project}.log"
-            value = extract_asr_vs_raters_correlation(log_file)
+            if metrics is not None:
+                value = metric_value(metrics.get(project), "asr_vs_raters_pearson")
+            else:
+                log_file = tag_dir / f"summarize_raters_{project}.log"
+                value = extract_asr_vs_raters_correlation(log_file)
             result[project].append(value)
     return result
 
@@ -124,13 +171,49 @@ def collect_std_ratios(tags: List[str], run_dir: Path) -> Dict[str, List[Optiona
 
     for tag in tags:
         tag_dir = run_dir / tag
+        metrics = load_batch_metrics(tag_dir)
         for project in PROJECTS:
-            log_file = tag_dir / f"summarize_raters_{project}.log"
-            value = extract_residual_std_ratio(log_file)
+            if metrics is not None:
+                value = metric_value(metrics.get(project), f"{RESIDUAL_NORMALIZATION}_std_ratio")
+            else:
+                log_file = tag_dir / f"summarize_raters_{project}.log"
+                value = extract_residual_std_ratio(log_file)
             result[project].append(value)
     return result
 
 
+def find_results_export(tag_dir: Path) -> Optional[Path]:
+    """Return the tag's results export, preferring the columnar formats."""
+    for name in RESULTS_EXPORTS:
+        if (tag_dir / name).exists():
+            return tag_dir / name
+    return None
+
+
+def results_agreement(results_file: Path) -> Dict[str, float]:
+    """Fraction of keywords where the ASR and the audiologist agree, by project."""
+    frame = results_export.load_results(
+        str(results_file), columns=["trials_project", "audiology_asr_matches"])
+    agreement: Dict[str, float] = {}
+    for project, matches in frame.groupby("trials_project")["audiology_asr_matches"]:
+        flat = [bool(m) for trial in matches for m in trial]
+        if flat:
+            agreement[project] = float(np.mean(flat))
+    return agreement
+
+
+def collect_agreements(tags: List[str], run_dir: Path) -> Dict[str, List[Optional[float]]]:
+    """Collect quick/win ASR-vs-audiologist agreement for each tag in order."""
+    result: Dict[str, List[Optional[float]]] = {project: [] for project in PROJECTS}
+
+    for tag in tags:
+        results_file = find_results_export(run_dir / tag)
+        agreement = results_agreement(results_file) if results_file else {}
+        for project in PROJECTS:
+            result[project].append(agreement.get(project))
+    return result
+
+
 def create_plot(tags: List[str], correlations: Dict[str, List[Optional[float]]], output_plot: Path) -> None:
     """Create and save a quick-vs-win correlation plot across tags."""
     import matplotlib.pyplot as plt
@@ -220,6 +303,17 @@ def print_ratio_summary(tags: List[str], std_ratios: Dict[str, List[Optional[flo
         print("\t".join(row))
 
 
+def print_agreement_summary(tags: List[str], agreements: Dict[str, List[Optional[float]]]) -> None:
+    """Print a text table of ASR-vs-audiologist keyword agreement."""
+    print("Tag\tquick_agreement\twin_agreement")
+    for i, tag in enumerate(tags):
+        row = [tag]
+        for project in PROJECTS:
+            value = agreements[project][i]
+            row.append("NA" if value is None else f"{value:.3f}")
+        print("\t".join(row))
+
+
 def main(argv: List[str]) -> None:
     del argv
 
@@ -239,6 +333,7 @@ def main(argv: List[str]) -> None:
     std_ratios = collect_std_ratios(tags, run_dir)
     print_summary(tags, correlations)
     print_ratio_summary(tags, std_ratios)
+    print_agreement_summary(tags, collect_agreements(tags, run_dir))
     create_plot(tags, correlations, output_plot)
     create_ratio_plot(tags, std_ratios, output_ratio_plot)
     print(f"Wrote plot to {output_plot}")
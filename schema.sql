@@ -84,6 +84,37 @@ CREATE TABLE audio_results (
   FOREIGN KEY(trial) REFERENCES audio_trials(id)
 );
 
+/*
+ * The trimmed 16 kHz mono WAV made from each upload by ingest.py, with its
+ * duration and content hash.  Keyed to audio_results.
+ */
+CREATE TABLE audio_uploads (
+  ref INTEGER PRIMARY KEY,
+  wav_filename TEXT,
+  original_seconds REAL, /* Length of the upload */
+  duration REAL, /* Length after removing the leading silence */
+  sha256 TEXT, /* Of the WAV file */
+  status TEXT, /* pending, done or error */
+  error TEXT,
+  t TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY(ref) REFERENCES audio_results(id)
+);
+
+/*
+ * Whether the upload of each audio_results row is a non-empty file in the
+ * uploads directory, with its size and duration, so the review pages need not
+ * check the file system (see upload_manifest.py).
+ */
+CREATE TABLE upload_manifest (
+  ref INTEGER PRIMARY KEY,
+  reply_filename TEXT,
+  playable BOOLEAN NOT NULL CHECK(playable IN(0,1)),
+  size INTEGER, /* Bytes */
+  duration REAL, /* Seconds, from audio_uploads.original_seconds */
+  t TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY(ref) REFERENCES audio_results(id)
+);
+
 /*
  * Table that describes the ASR response for a user trial.  Contains the ASR
  * response, and is keyed to the quick_results above.
@@ -91,8 +122,42 @@ CREATE TABLE audio_results (
 CREATE TABLE audio_asr (
   ref INTEGER,
   data TEXT, /* JSON encoded dictionary of ASR Results */
+  text TEXT, /* The recognized text, copied out of data for the analysis programs */
+  /* Indexed copies of the fields we select results by (see asr_storage.py) */
+  model_name TEXT GENERATED ALWAYS AS
+    (CASE WHEN json_valid(data) THEN json_extract(data, '$.model_name') END) VIRTUAL,
+  model_type TEXT GENERATED ALWAYS AS
+    (CASE WHEN json_valid(data) THEN json_extract(data, '$.model_type') END) VIRTUAL,
+  config_fingerprint TEXT GENERATED ALWAYS AS
+    (CASE WHEN json_valid(data) THEN json_extract(data, '$.config_fingerprint') END) VIRTUAL,
   FOREIGN KEY(ref) REFERENCES audio_results(id)
 );
+CREATE INDEX idx_audio_asr_model ON audio_asr (model_name, model_type);
+CREATE INDEX idx_audio_asr_config_fingerprint ON audio_asr (config_fingerprint);
+
+/*
+ * One row per word recognized by the ASR (from the segments in audio_asr.data),
+ * so the analysis programs don't need to parse the JSON.
+ */
+CREATE TABLE audio_asr_words (
+  ref INTEGER NOT NULL,
+  idx INTEGER NOT NULL, /* Position of the word in the result */
+  segment INTEGER NOT NULL, /* Whisper segment containing the word */
+  word TEXT,
+  start_time REAL,
+  end_time REAL,
+  prob REAL,
+  PRIMARY KEY (ref, idx)
+) WITHOUT ROWID;
+
+/*
+ * Optional cold storage of the full ASR JSON (zlib compressed), used when
+ * audio_asr.data only keeps the top-level fields.
+ */
+CREATE TABLE audio_asr_raw (
+  ref INTEGER PRIMARY KEY,
+  data BLOB
+);
 
 /*
  * Table that describes which words that the audiologist identified as being
@@ -132,3 +197,26 @@ CREATE TABLE review_annotations (
   FOREIGN KEY(ref) REFERENCES audio_results(id),
   FOREIGN KEY(labeler) REFERENCES users(id)
 );
+
+/*
+ * Materialized review coverage (see review_modules/coverage.py): the number of
+ * files and of distinct patient-type reviewers of each test, and the number of
+ * files each labeler reviewed in it.  Kept up to date as results and reviews
+ * are recorded.
+ */
+CREATE TABLE review_coverage (
+  subject INTEGER NOT NULL,
+  project TEXT NOT NULL,
+  total_files INTEGER NOT NULL DEFAULT 0,
+  patient_reviewers INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (subject, project)
+) WITHOUT ROWID;
+CREATE INDEX idx_review_coverage_order
+  ON review_coverage (patient_reviewers, subject, project);
+CREATE TABLE review_progress (
+  labeler INTEGER NOT NULL,
+  subject INTEGER NOT NULL,
+  project TEXT NOT NULL,
+  files_reviewed INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (labeler, subject, project)
+) WITHOUT ROWID;
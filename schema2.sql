@@ -84,6 +84,22 @@ CREATE TABLE audio_results (
   FOREIGN KEY(trial) REFERENCES audio_trials(id)
 );
 
+/*
+ * The trimmed 16 kHz mono WAV made from each upload by ingest.py, with its
+ * duration and content hash.  Keyed to audio_results.
+ */
+CREATE TABLE audio_uploads (
+  ref INTEGER PRIMARY KEY,
+  wav_filename TEXT,
+  original_seconds REAL, /* Length of the upload */
+  duration REAL, /* Length after removing the leading silence */
+  sha256 TEXT, /* Of the WAV file */
+  status TEXT, /* pending, done or error */
+  error TEXT,
+  t TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY(ref) REFERENCES audio_results(id)
+);
+
 /*
  * Table that describes the ASR response for a user trial.  Contains the ASR
  * response, and is keyed to the quick_results above.
@@ -91,14 +107,48 @@ CREATE TABLE audio_results (
 CREATE TABLE audio_asr (
   ref INTEGER,
   data TEXT, /* JSON encoded dictionary of ASR Results */
+  text TEXT, /* The recognized text, copied out of data for the analysis programs */
+  /* Indexed copies of the fields we select results by (see asr_storage.py) */
+  model_name TEXT GENERATED ALWAYS AS
+    (CASE WHEN json_valid(data) THEN json_extract(data, '$.model_name') END) VIRTUAL,
+  model_type TEXT GENERATED ALWAYS AS
+    (CASE WHEN json_valid(data) THEN json_extract(data, '$.model_type') END) VIRTUAL,
+  config_fingerprint TEXT GENERATED ALWAYS AS
+    (CASE WHEN json_valid(data) THEN json_extract(data, '$.config_fingerprint') END) VIRTUAL,
   gt_word_count INTEGER,
   correct_word_count INTEGER,
   asr_clean_tokens TEXT,
   FOREIGN KEY(ref) REFERENCES audio_results(id)
 );
+CREATE INDEX idx_audio_asr_model ON audio_asr (model_name, model_type);
+CREATE INDEX idx_audio_asr_config_fingerprint ON audio_asr (config_fingerprint);
 
 CREATE UNIQUE INDEX idx_audio_asr_ref ON audio_asr (ref);
 
+/*
+ * One row per word recognized by the ASR (from the segments in audio_asr.data),
+ * so the analysis programs don't need to parse the JSON.
+ */
+CREATE TABLE audio_asr_words (
+  ref INTEGER NOT NULL,
+  idx INTEGER NOT NULL, /* Position of the word in the result */
+  segment INTEGER NOT NULL, /* Whisper segment containing the word */
+  word TEXT,
+  start_time REAL,
+  end_time REAL,
+  prob REAL,
+  PRIMARY KEY (ref, idx)
+) WITHOUT ROWID;
+
+/*
+ * Optional cold storage of the full ASR JSON (zlib compressed), used when
+ * audio_asr.data only keeps the top-level fields.
+ */
+CREATE TABLE audio_asr_raw (
+  ref INTEGER PRIMARY KEY,
+  data BLOB
+);
+
 /*
  * Table that describes which words that the audiologist identified as being
  * correctly spoken by the patient.  (We want to compare these results to the
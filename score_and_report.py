@@ -10,6 +10,17 @@ It performs two main actions:
    to generate a CSV export, confusion matrices, an HTML discrepancy report, and 
    a terminal summary.
 
+The rows are read from the database in chunks (--chunk_size) and each scored
+result is passed to all the outputs at once (see ResultSink), so memory use
+doesn't grow with the database.
+
+With --incremental, only the results whose rows changed since the last run
+(or all of them, when the homonym file changed) are scored and written
+back, and their rows are merged into the existing CSV export.  Each result
+has a fingerprint of its joined rows (one per ASR and annotation row) in the
+audio_score_state table; see changed_results_query.  The reports (and the --columnar_output export) are
+then made from the merged CSV, without reading the database again.
+
 To measure coverage:
   coverage run score_and_report_test.py
   coverage report -m --include=score_and_report.py
@@ -19,18 +30,24 @@ import sqlite3
 import json
 import re
 import csv
+import hashlib
+import itertools
 import os
 from datetime import datetime
-from dataclasses import dataclass
-from typing import Dict, Set, List, Optional, Tuple, Any, Union
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
-import numpy as np
 from numpy.typing import ArrayLike, NDArray
 import matplotlib.pyplot as plt
 from absl import app
 from absl import flags
 from absl import logging
 
+import agreement
+import asr_storage
+import results_export
+import scoring
+
 FLAGS = flags.FLAGS
 
 # Define command-line flags
@@ -40,13 +57,17 @@ except flags.DuplicateFlagError:
   pass # Flag was already defined by another module during pytest collection
 flags.DEFINE_string('homonyms', 'homonym_list.csv', 'Path to the comma-delimited homonyms file.')
 flags.DEFINE_string('csv_output', 'quicksin_results.csv', 'Where to store the CSV export.')
+flags.DEFINE_string('columnar_output', '', 'If given, also export the results to this Parquet (.parquet) or Arrow IPC (.arrow) file; see results_export.')
 flags.DEFINE_string('discrepancies', 'asr_audiology_discrepancies.html', 'Where to store the final discrepancy report.')
 flags.DEFINE_bool('only_foreign', False, 'Whether to only show foreign recognizer results in discrepancies html')
 flags.DEFINE_bool('only_discrepancies', True, 'Whether to only show human/machine discrepancies the final html')
 flags.DEFINE_string('subject_filter', 'A\\d+[SP]\\d+', 'Regex to filter which subjects to include in the analysis.')
+flags.DEFINE_integer('report_page_size', 1000, 'Number of rows per page of the discrepancy report.')
+flags.DEFINE_integer('chunk_size', 1000, 'Number of result rows to fetch, score and write back at a time.')
+flags.DEFINE_bool('incremental', False, 'Only score the results that changed since the last run, and merge them into the CSV export.')
 
 
-@dataclass
+@dataclass(slots=True)
 class QS_result:
     """Dataclass containing everything retrieved from the web database to describe one trial.
     Must perfectly align with the explicit SQL query (now 29 columns).
@@ -134,68 +155,213 @@ def fix_encoding(bad_string: str) -> str:
     return html_encoded
 
 
-def save_results_as_csv(all_results: List[QS_result], csv_file: str = 'quicksin_results.csv') -> str:
-    """Exports the processed results to a CSV file."""
-    header = [
-        'results_id', 'results_subject', 'results_trial', 'results_reply_filename',
-        'results_time', 'trials_id', 'trials_project', 'trials_snr', 'trials_lang',
-        'trials_level_number', 'trials_trial_number', 'trials_filename',
-        'trials_answer', 'trials_active', 'user_id', 'user_name', 'user_ip',
-        'user_time', 'user_info_id', 'user_info_key', 'user_info_value',
-        'user_info_time', 'asr_id', 'asr_results', 
-        # NEW: Added headers for the export
-        'asr_gt_word_count', 'asr_correct_word_count', 'asr_clean_tokens',
-        'annotation_ref', 'annotation_matches', 'asr_words', 'asr_matches', 
-        'asr_times', 'audiology_asr_matches'
+CSV_HEADER = [
+    'results_id', 'results_subject', 'results_trial', 'results_reply_filename',
+    'results_time', 'trials_id', 'trials_project', 'trials_snr', 'trials_lang',
+    'trials_level_number', 'trials_trial_number', 'trials_filename',
+    'trials_answer', 'trials_active', 'user_id', 'user_name', 'user_ip',
+    'user_time', 'user_info_id', 'user_info_key', 'user_info_value',
+    'user_info_time', 'asr_id', 'asr_results', 
+    # NEW: Added headers for the export
+    'asr_gt_word_count', 'asr_correct_word_count', 'asr_clean_tokens',
+    'annotation_ref', 'annotation_matches', 'asr_words', 'asr_matches', 
+    'asr_times', 'audiology_asr_matches'
+]
+
+
+def result_csv_row(result: QS_result) -> List[Any]:
+    """The CSV export row of one result, in the order of CSV_HEADER."""
+    return [
+        result.results_id, result.results_subject, result.results_trial,
+        result.results_reply_filename, result.results_time,
+        result.trials_id, result.trials_project, result.trials_snr,
+        result.trials_lang, result.trials_level_number,
+        result.trials_trial_number, result.trials_filename,
+        result.trials_answer,
+        result.trials_active, result.user_id, result.user_name, result.user_ip,
+        result.user_time, result.user_info_id, result.user_info_key,
+        result.user_info_value, result.user_info_time, result.asr_id,
+        result.asr_results if isinstance(result.asr_results, str) else json.dumps(result.asr_results),
+        # NEW: Extracting the scoring data for the row
+        result.asr_gt_word_count, result.asr_correct_word_count, result.asr_clean_tokens,
+        result.annotation_ref,
+        json.dumps(result.annotation_matches),
+        ','.join(result.asr_words) if result.asr_words else '',
+        ','.join([str(m) for m in result.asr_matches]) if result.asr_matches else '',
+        ','.join([str(t) for t in result.asr_times]) if result.asr_times else '',
+        ','.join([str(m) for m in result.audiology_asr_matches]) if result.audiology_asr_matches else ''
     ]
 
-    with open(csv_file, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
-        for result in all_results:
-            row_data = [
-                result.results_id, result.results_subject, result.results_trial,
-                result.results_reply_filename, result.results_time,
-                result.trials_id, result.trials_project, result.trials_snr,
-                result.trials_lang, result.trials_level_number,
-                result.trials_trial_number, result.trials_filename,
-                result.trials_answer,
-                result.trials_active, result.user_id, result.user_name, result.user_ip,
-                result.user_time, result.user_info_id, result.user_info_key,
-                result.user_info_value, result.user_info_time, result.asr_id,
-                json.dumps(result.asr_results), 
-                # NEW: Extracting the scoring data for the row
-                result.asr_gt_word_count, result.asr_correct_word_count, result.asr_clean_tokens,
-                result.annotation_ref,
-                json.dumps(result.annotation_matches),
-                ','.join(result.asr_words) if result.asr_words else '',
-                ','.join([str(m) for m in result.asr_matches]) if result.asr_matches else '',
-                ','.join([str(t) for t in result.asr_times]) if result.asr_times else '',
-                ','.join([str(m) for m in result.audiology_asr_matches]) if result.audiology_asr_matches else ''
-            ]
-            writer.writerow(row_data)
-
-    logging.info(f'Results written to {csv_file}')
+
+class ResultSink:
+    """Receives the scored results one at a time, in results_id order.
+
+    main() streams each result to all its sinks as soon as it is scored, so
+    no pass needs the whole list of results.
+    """
+    __slots__ = ()
+
+    def add(self, result: QS_result) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class CsvSink(ResultSink):
+    """Writes the CSV export."""
+    __slots__ = ('csv_file', 'f', 'writer')
+
+    def __init__(self, csv_file: str):
+        self.csv_file = csv_file
+        self.f = open(csv_file, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(CSV_HEADER)
+
+    def add(self, result: QS_result) -> None:
+        self.writer.writerow(result_csv_row(result))
+
+    def close(self) -> None:
+        self.f.close()
+        logging.info(f'Results written to {self.csv_file}')
+
+
+class CsvMergeSink(ResultSink):
+    """Merges rescored results into an existing CSV export.
+
+    The export is read alongside the results (both in results_id order) and
+    the merged rows are written to a new file, which then replaces it.  A
+    rescored result replaces (or is added to) the rows with its results_id.
+
+    Args:
+        csv_file: The CSV export, as written by CsvSink.
+        removed_ids: The results_ids whose rows are dropped: results no longer
+            in the database, or no longer scored.  Ids may still be added
+            while merging, as long as the merge hasn't reached them.
+    """
+    __slots__ = ('csv_file', 'removed_ids', 'old', 'reader', 'pending', 'out',
+                 'writer', 'merged')
+
+    def __init__(self, csv_file: str, removed_ids: Set[int]):
+        self.csv_file = csv_file
+        self.removed_ids = removed_ids
+        self.old = open(csv_file, newline='')
+        self.reader = csv.reader(self.old)
+        next(self.reader, None)  # Header
+        self.pending = next(self.reader, None)
+        self.out = open(csv_file + '.tmp', 'w', newline='')
+        self.writer = csv.writer(self.out)
+        self.writer.writerow(CSV_HEADER)
+        self.merged = 0
+
+    def _copy_before(self, results_id: Optional[int]) -> None:
+        """Copy the old rows before results_id (or all of them), and drop the
+        one with results_id."""
+        while self.pending is not None:
+            old_id = int(self.pending[0])
+            if results_id is not None and old_id > results_id:
+                break
+            if old_id != results_id and old_id not in self.removed_ids:
+                self.writer.writerow(self.pending)
+            self.pending = next(self.reader, None)
+
+    def add(self, result: QS_result) -> None:
+        self._copy_before(result.results_id)
+        self.writer.writerow(result_csv_row(result))
+        self.merged += 1
+
+    def close(self) -> None:
+        self._copy_before(None)
+        self.old.close()
+        self.out.close()
+        os.replace(self.csv_file + '.tmp', self.csv_file)
+        logging.info(f'Merged {self.merged} results into {self.csv_file}')
+
+
+def save_results_as_csv(all_results: Iterable[QS_result], csv_file: str = 'quicksin_results.csv') -> str:
+    """Exports the processed results to a CSV file."""
+    sink = CsvSink(csv_file)
+    for result in all_results:
+        sink.add(result)
+    sink.close()
+    return csv_file
+
+
+def merge_results_csv(changed_results: Iterable[QS_result], removed_ids: Set[int],
+                      csv_file: str = 'quicksin_results.csv') -> str:
+    """Merges rescored results (in results_id order) into an existing CSV
+    export.  See CsvMergeSink."""
+    sink = CsvMergeSink(csv_file, removed_ids)
+    for result in changed_results:
+        sink.add(result)
+    sink.close()
     return csv_file
 
 
+def _csv_list(value: str, item=str) -> List[Any]:
+    return [item(v) for v in value.split(',')] if value else []
+
+
+def iter_results_csv(csv_file: str) -> Iterator[QS_result]:
+    """Reads back the results of a CSV export, for the reports.
+
+    Words containing commas are split in two, as the export doesn't quote
+    them within the asr_words column.
+    """
+    int_fields = {f.name for f in fields(QS_result) if f.type in (int, Optional[int])}
+    with open(csv_file, newline='') as f:
+        for row in csv.DictReader(f):
+            values = {k: (int(v) if k in int_fields and v else v or None)
+                      for k, v in row.items()}
+            values['annotation_matches'] = json.loads(row['annotation_matches'])
+            values['asr_words'] = _csv_list(row['asr_words'])
+            values['asr_matches'] = _csv_list(row['asr_matches'], lambda m: m == 'True')
+            values['asr_times'] = _csv_list(row['asr_times'], float)
+            values['audiology_asr_matches'] = _csv_list(
+                row['audiology_asr_matches'], lambda m: m == 'True')
+            yield QS_result(**values)
+
+
+def load_results_csv(csv_file: str) -> List[QS_result]:
+    return list(iter_results_csv(csv_file))
+
+
 def accumulate_errors(sum_arr: NDArray, human: ArrayLike, asr: ArrayLike) -> None:
     assert sum_arr.ndim == 2
     assert sum_arr.shape == (2, 2)
-    for h, a in zip(human, asr):
-        sum_arr[int(h), int(a)] += 1
+    n = min(len(human), len(asr))
+    sum_arr += agreement.confusion(list(human)[:n], list(asr)[:n])
 
 
-def all_test_confusions(all_results: List[QS_result], valid_subject_re: re.Pattern) -> Dict[str, NDArray]:
-    all_confusions = {}
-    for r in all_results:
-        if valid_subject_re.match(r.user_name):
+class ConfusionSink(ResultSink):
+    """Collects the human and ASR matches of each test's trials, from which
+    come the confusion matrices (see agreement.MatchArrays)."""
+    __slots__ = ('valid_subject_re', 'builder')
+
+    def __init__(self, valid_subject_re: re.Pattern):
+        self.valid_subject_re = valid_subject_re
+        self.builder = agreement.MatchArraysBuilder()
+
+    def add(self, r: QS_result) -> None:
+        if self.valid_subject_re.match(r.user_name):
             if r.annotation_matches and r.asr_matches and len(r.annotation_matches) == len(r.asr_matches):
-                test_name = r.trials_project
-                if test_name not in all_confusions:
-                    all_confusions[test_name] = np.zeros((2, 2), dtype=int)
-                accumulate_errors(all_confusions[test_name], r.annotation_matches, r.asr_matches)
-    return all_confusions
+                self.builder.add(r.trials_project, r.user_name, r.trials_snr,
+                                 r.annotation_matches, r.asr_matches)
+
+    def matches(self) -> agreement.MatchArrays:
+        # Keep the tests in the order they were first seen.
+        return self.builder.build(sort_labels=False)
+
+    @property
+    def confusions(self) -> Dict[str, NDArray]:
+        return self.matches().confusions(by=('project',))
+
+
+def all_test_confusions(all_results: Iterable[QS_result], valid_subject_re: re.Pattern) -> Dict[str, NDArray]:
+    sink = ConfusionSink(valid_subject_re)
+    for r in all_results:
+        sink.add(r)
+    return sink.confusions
 
 
 def plot_confusions(all_confusions: Dict[str, NDArray]):
@@ -227,21 +393,11 @@ def plot_confusions(all_confusions: Dict[str, NDArray]):
     logging.info('Saved confusion_matrices.png')
 
 
-def generate_html_report(all_results: List[QS_result], db_file: str, 
-                         only_discrepancies: bool, only_foreign: bool, 
-                         valid_subject_re: re.Pattern, max_number: int = 10000) -> Tuple[str, int]:
-    
-    current_time = datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")
-    db_mod_time = "Unknown"
-    if os.path.exists(db_file):
-        mtime = os.path.getmtime(db_file)
-        db_mod_time = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %I:%M:%S %p")
-    
-    html_output = f"""
+HTML_HEADER = """
     <!DOCTYPE html>
     <html>
     <head>
-    <title>Online SPIN Test vs Audiologist Discrepancies</title>
+    <title>Online SPIN Test vs Audiologist Discrepancies{title}</title>
     <style>
       table {{ border-collapse: collapse; width: 100%; }}
       th, td {{ border: 1px solid #dddddd; text-align: left; padding: 8px; }}
@@ -250,9 +406,13 @@ def generate_html_report(all_results: List[QS_result], db_file: str,
     </style>
     </head>
     <body>
-    <h1>QuickSIN ASR vs Audiologist Discrepancies</h1>
+    <h1>QuickSIN ASR vs Audiologist Discrepancies{title}</h1>
     <p><strong>Report Generated:</strong> {current_time}</p>
-    <p><strong>Database Last Modified:</strong> {db_mod_time} <em>({os.path.basename(db_file)})</em></p>
+    <p><strong>Database Last Modified:</strong> {db_mod_time} <em>({db_name})</em></p>
+    {nav}
+"""
+
+HTML_TABLE_HEADER = """
     <table>
       <tr>
         <th>Subject</th>
@@ -266,206 +426,519 @@ def generate_html_report(all_results: List[QS_result], db_file: str,
         <th>Agree</th>
         <th>Subject Audio</th>
       </tr>
-    """
+"""
 
-    row_count = 0
-    for result in all_results[:max_number]:
-        if not valid_subject_re.match(result.user_name): continue
-        if not result.annotation_matches or not result.asr_matches: continue
-        
-        # Discrepancy check
-        if only_discrepancies and result.annotation_matches == result.asr_matches: continue
 
-        # Foreign check
-        if only_foreign and result.asr_words and all([r.isascii() for r in result.asr_words]): continue
-        
-        html_output += "<tr>"
-        html_output += f"<td>{result.user_name}</td>"
-        html_output += f"<td>{result.trials_project}</td>"
-        html_output += f"<td>{result.trials_trial_number}</td>"
-        html_output += f"<td>{result.trials_level_number}</td>"
-        html_output += f"<td>{result.trials_answer}</td>"
-        html_output += f"<td>{', '.join([fix_encoding(r) for r in result.asr_words]) if result.asr_words else 'N/A'}</td>"
-        html_output += f"<td>{result.annotation_matches}</td>"
-        html_output += f"<td>{result.asr_matches}</td>"
-        
-        if result.audiology_asr_matches and all(result.audiology_asr_matches):
-            html_output += "<td>&#9989;</td>" 
-        else:
-            html_output += "<td>&#10008;</td>" 
-            
-        audio_url = f"https://quicksin.stanford.edu/uploads/{result.results_reply_filename}.wav"
-        html_output += f'<td><audio controls> <source src={audio_url} type=audio/mp4>Your browser does not support the audio element.</audio></td>'
-        html_output += "</tr>\n"
-        row_count += 1
+def html_header(db_file: str, title: str = '', nav: str = '') -> str:
+    """The top of a report page, up to its table (or list of pages)."""
+    current_time = datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")
+    db_mod_time = "Unknown"
+    if os.path.exists(db_file):
+        mtime = os.path.getmtime(db_file)
+        db_mod_time = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %I:%M:%S %p")
+    return HTML_HEADER.format(title=title, current_time=current_time,
+                              db_mod_time=db_mod_time,
+                              db_name=os.path.basename(db_file), nav=nav)
 
-    html_output += "</table></body></html>"
-    return html_output, row_count
 
+def html_report_row(result: QS_result, only_discrepancies: bool,
+                    only_foreign: bool, valid_subject_re: re.Pattern) -> Optional[str]:
+    """The report's table row for a result, or None if it isn't shown."""
+    if not valid_subject_re.match(result.user_name): return None
+    if not result.annotation_matches or not result.asr_matches: return None
+    
+    # Discrepancy check
+    if only_discrepancies and result.annotation_matches == result.asr_matches: return None
 
-def main(argv: List[str]) -> None:
-    del argv  # Unused
+    # Foreign check
+    if only_foreign and result.asr_words and all([r.isascii() for r in result.asr_words]): return None
 
-    assert os.path.exists(FLAGS.dbfile), f'Database file {FLAGS.dbfile} does not exist.'
-
-    # 1. Load the homonyms dictionary
-    homonyms_map = load_homonyms(FLAGS.homonyms)
+    asr_words = ', '.join([fix_encoding(r) for r in result.asr_words]) if result.asr_words else 'N/A'
+    if result.audiology_asr_matches and all(result.audiology_asr_matches):
+        agree = "&#9989;"
+    else:
+        agree = "&#10008;"
+    # preload=none: the browser doesn't fetch anything until a player is started.
+    audio_url = f"https://quicksin.stanford.edu/uploads/{result.results_reply_filename}.wav"
+    return (
+        f"<tr><td>{result.user_name}</td><td>{result.trials_project}</td>"
+        f"<td>{result.trials_trial_number}</td><td>{result.trials_level_number}</td>"
+        f"<td>{result.trials_answer}</td><td>{asr_words}</td>"
+        f"<td>{result.annotation_matches}</td><td>{result.asr_matches}</td>"
+        f"<td>{agree}</td>"
+        f'<td><audio controls preload="none"> <source src={audio_url} type=audio/mp4>Your browser does not support the audio element.</audio></td>'
+        "</tr>\n")
+
+
+class HtmlReportSink(ResultSink):
+    """Writes the HTML discrepancy report as the results arrive.
+
+    Each row is written to the file as soon as its result arrives.  A report
+    of more than page_size rows is split into pages (report-001.html,
+    report-002.html, ... next to report.html), linked to each other, and
+    report.html becomes an index of the pages.
+
+    Args:
+        filename: Where to write the report.
+        db_file: The database, whose modification time the report shows.
+        only_discrepancies: Only show the results where the ASR and the
+            audiologist disagree.
+        only_foreign: Only show results with non-ASCII recognized words.
+        valid_subject_re: The subjects to show.
+        max_number: If given, the number of results to consider.
+        page_size: The number of rows per page.
+    """
+    __slots__ = ('filename', 'db_file', 'only_discrepancies', 'only_foreign',
+                 'valid_subject_re', 'max_number', 'page_size', 'seen',
+                 'row_count', 'f', 'pages')
+
+    def __init__(self, filename: str, db_file: str, only_discrepancies: bool,
+                 only_foreign: bool, valid_subject_re: re.Pattern,
+                 max_number: Optional[int] = None, page_size: int = 1000):
+        self.filename = filename
+        self.db_file = db_file
+        self.only_discrepancies = only_discrepancies
+        self.only_foreign = only_foreign
+        self.valid_subject_re = valid_subject_re
+        self.max_number = max_number
+        self.page_size = page_size
+        self.seen = 0
+        self.row_count = 0
+        # For each page: [rows, first subject, last subject]
+        self.pages: List[List[Any]] = []
+        self._open_page()
+
+    def page_filename(self, page: int) -> str:
+        root, ext = os.path.splitext(self.filename)
+        return f'{root}-{page:03d}{ext or ".html"}'
+
+    def _nav(self, page: int, last: bool) -> str:
+        links = [f'<a href="{os.path.basename(self.filename)}">Index</a>']
+        if page > 1:
+            links.append(f'<a href="{os.path.basename(self.page_filename(page - 1))}">Previous</a>')
+        links.append(f'Page {page}')
+        if not last:
+            links.append(f'<a href="{os.path.basename(self.page_filename(page + 1))}">Next</a>')
+        return f'<p>{" | ".join(links)}</p>'
+
+    def _open_page(self) -> None:
+        self.pages.append([0, None, None])
+        page = len(self.pages)
+        # The first page doesn't know yet whether it is the whole report.
+        nav = self._nav(page, last=True) if page > 1 else ''
+        title = f' (page {page})' if page > 1 else ''
+        self.f = open(self.page_filename(page), 'w')
+        self.f.write(html_header(self.db_file, title, nav) + HTML_TABLE_HEADER)
+
+    def _close_page(self, last: bool) -> None:
+        self.f.write("</table>")
+        if len(self.pages) > 1 or not last:
+            self.f.write(self._nav(len(self.pages), last))
+        self.f.write("</body></html>")
+        self.f.close()
+
+    def add(self, result: QS_result) -> None:
+        self.seen += 1
+        if self.max_number is not None and self.seen > self.max_number: return
+        row = html_report_row(result, self.only_discrepancies, self.only_foreign,
+                              self.valid_subject_re)
+        if row is None: return
+        if self.pages[-1][0] >= self.page_size:
+            self._close_page(last=False)
+            self._open_page()
+        page = self.pages[-1]
+        page[0] += 1
+        page[1] = page[1] or result.user_name
+        page[2] = result.user_name
+        self.f.write(row)
+        self.row_count += 1
+
+    def close(self) -> None:
+        self._close_page(last=True)
+        # Remove the pages left over from a longer report.
+        stale = len(self.pages) + 1
+        while os.path.exists(self.page_filename(stale)):
+            os.remove(self.page_filename(stale))
+            stale += 1
+        if len(self.pages) == 1:
+            os.replace(self.page_filename(1), self.filename)
+            return
+        with open(self.filename, 'w') as f:
+            f.write(html_header(self.db_file))
+            f.write(f"<p>{self.row_count} rows in {len(self.pages)} pages:</p>\n<ol>\n")
+            first_row = 1
+            for page, (rows, first, last) in enumerate(self.pages, 1):
+                f.write(f'<li><a href="{os.path.basename(self.page_filename(page))}">'
+                        f'Rows {first_row}-{first_row + rows - 1}</a> ({first} to {last})</li>\n')
+                first_row += rows
+            f.write("</ol></body></html>")
+
+
+def generate_html_report(all_results: Iterable[QS_result], db_file: str, 
+                         only_discrepancies: bool, only_foreign: bool, 
+                         valid_subject_re: re.Pattern, max_number: int = 10000) -> Tuple[str, int]:
+    """Returns a single page report of the results, and its number of rows."""
+    rows = []
+    for result in itertools.islice(all_results, max_number):
+        row = html_report_row(result, only_discrepancies, only_foreign, valid_subject_re)
+        if row is not None:
+            rows.append(row)
+    html_output = ''.join([html_header(db_file), HTML_TABLE_HEADER, *rows,
+                           "</table></body></html>"])
+    return html_output, len(rows)
+
+
+SCORE_STATE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS audio_score_state (
+        ref INTEGER PRIMARY KEY,
+        fingerprint TEXT,
+        t TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
 
-    # 2. Connect to the database
-    conn = sqlite3.connect(FLAGS.dbfile)
-    cursor = conn.cursor()
+# The scores written back by this script, which a result's fingerprint leaves out.
+SCORE_COLUMNS = ('audio_asr.gt_word_count', 'audio_asr.correct_word_count',
+                 'audio_asr.asr_clean_tokens')
 
-    # 3. Explicit Column Selection (Now including the 3 new scoring metrics)
-    query = """
-        SELECT 
-          audio_results.id, audio_results.subject, audio_results.trial, audio_results.reply_filename, audio_results.t,
-          audio_trials.id, audio_trials.project, audio_trials.snr, audio_trials.lang, audio_trials.level_number, audio_trials.trial_number, audio_trials.filename, audio_trials.answer, audio_trials.active,
-          users.id, users.username, users.ip, users.t,
-          user_info.user, user_info.info_key, user_info.value, user_info.t,
-          audio_asr.ref, audio_asr.data, audio_asr.gt_word_count, audio_asr.correct_word_count, audio_asr.asr_clean_tokens,
-          audio_annotations.ref, audio_annotations.data
+RESULTS_JOINS = """
         FROM audio_results
         LEFT JOIN audio_trials ON audio_results.trial=audio_trials.id
         LEFT JOIN users ON audio_results.subject=users.id
         LEFT JOIN (select * from user_info where info_key='test-type' group by user) as 'user_info' ON users.id=user_info.user
         LEFT JOIN audio_asr ON audio_results.id=audio_asr.ref
         LEFT JOIN audio_annotations ON audio_results.id=audio_annotations.ref
-        WHERE user_info.info_key='test-type'
+"""
+RESULTS_WHERE = "WHERE user_info.info_key='test-type'"
+# A result's rows, one per ASR and annotation row, in a fixed order.
+RESULTS_ORDER = "ORDER BY audio_results.id, audio_asr.rowid, audio_annotations.rowid"
+
+
+def result_columns(compact: bool) -> List[str]:
+    """The columns of QS_result (including the 3 scoring metrics), followed by
+    the compact ASR text, if any."""
+    return [
+        'audio_results.id', 'audio_results.subject', 'audio_results.trial', 'audio_results.reply_filename', 'audio_results.t',
+        'audio_trials.id', 'audio_trials.project', 'audio_trials.snr', 'audio_trials.lang', 'audio_trials.level_number', 'audio_trials.trial_number', 'audio_trials.filename', 'audio_trials.answer', 'audio_trials.active',
+        'users.id', 'users.username', 'users.ip', 'users.t',
+        'user_info.user', 'user_info.info_key', 'user_info.value', 'user_info.t',
+        'audio_asr.ref', 'audio_asr.data', *SCORE_COLUMNS,
+        'audio_annotations.ref', 'audio_annotations.data',
+        'audio_asr.text' if compact else 'NULL',
+    ]
+
+
+def row_fingerprint(*values: Any) -> str:
+    """A hash of the values of a row (registered as score_fingerprint() in SQL)."""
+    return hashlib.sha1(repr(values).encode()).hexdigest()[:16]
+
+
+def result_fingerprint(columns: List[str], row: tuple, homonyms_digest: str) -> str:
+    """The fingerprint of a selected result row: everything but its scores,
+    and the homonyms it was scored with."""
+    return row_fingerprint(homonyms_digest, *[
+        v for c, v in zip(columns, row) if c not in SCORE_COLUMNS])
+
+
+def group_fingerprint(fingerprints: Iterable[str]) -> str:
+    """The fingerprint of a result, from those of its rows in any order."""
+    return row_fingerprint(*sorted(fingerprints))
+
+
+class GroupFingerprint:
+    """group_fingerprint as an SQL aggregate (score_group_fingerprint())."""
+
+    def __init__(self):
+        self.fingerprints: List[str] = []
+
+    def step(self, fingerprint: str) -> None:
+        self.fingerprints.append(fingerprint)
+
+    def finalize(self) -> str:
+        return group_fingerprint(self.fingerprints)
+
+
+def changed_results_query(columns: List[str]) -> str:
+    """Selects the rows of the results whose fingerprint differs from the
+    stored one.
+
+    A result has a row for each of its ASR and annotation rows, and all of
+    them are selected when any changed.  SQLite computes the fingerprints
+    (with row_fingerprint and GroupFingerprint) as it reads the joined rows,
+    so only the changed rows reach Python to be parsed and scored.  The
+    query takes the homonyms digest as its parameter.
     """
-    cursor.execute(query)
-    raw_rows = cursor.fetchall()
+    fingerprint = ', '.join(['?'] + [c for c in columns if c not in SCORE_COLUMNS])
+    return f"""
+        SELECT {', '.join(columns)}
+        {RESULTS_JOINS}
+        {RESULTS_WHERE}
+          AND audio_results.id IN (
+            SELECT audio_results.id
+            {RESULTS_JOINS}
+            LEFT JOIN audio_score_state ON audio_results.id=audio_score_state.ref
+            {RESULTS_WHERE}
+            GROUP BY audio_results.id
+            HAVING MAX(audio_score_state.fingerprint)
+              IS NOT score_group_fingerprint(score_fingerprint({fingerprint})))
+        {RESULTS_ORDER}
+    """
+
 
-    updates: List[tuple] = []
-    all_results: List[QS_result] = []
+class ScoreUpdater(ResultSink):
+    """Writes the scores of the results, and the fingerprints of the rows
+    they were scored from, back to the database in batches."""
+    __slots__ = ('cursor', 'batch_size', 'updates', 'fingerprints', 'group',
+                 'updated')
+
+    def __init__(self, cursor: sqlite3.Cursor, batch_size: int = 1000):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.updates: List[tuple] = []
+        self.fingerprints: List[Tuple[int, str]] = []
+        # The results_id and row fingerprints of the result being read
+        self.group: Optional[Tuple[int, List[str]]] = None
+        self.updated = 0
+
+    def fingerprint(self, results_id: int, fingerprint: str) -> None:
+        """Adds the fingerprint of a row; a result's rows come one after another."""
+        if self.group is not None and self.group[0] == results_id:
+            self.group[1].append(fingerprint)
+            return
+        self._end_group()
+        self.group = (results_id, [fingerprint])
+        if len(self.fingerprints) >= self.batch_size:
+            self.flush()
+
+    def _end_group(self) -> None:
+        if self.group is not None:
+            self.fingerprints.append((self.group[0], group_fingerprint(self.group[1])))
+            self.group = None
+
+    def add(self, result: QS_result) -> None:
+        self.updates.append((result.asr_gt_word_count, result.asr_correct_word_count,
+                             result.asr_clean_tokens, result.asr_id))
+        if len(self.updates) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.updates:
+            update_query = """
+                UPDATE audio_asr 
+                SET gt_word_count = ?, correct_word_count = ?, asr_clean_tokens = ? 
+                WHERE ref = ?
+            """
+            self.cursor.executemany(update_query, self.updates)
+            self.updated += len(self.updates)
+        self.cursor.executemany(
+            "INSERT OR REPLACE INTO audio_score_state (ref, fingerprint) VALUES (?, ?)",
+            self.fingerprints)
+        self.updates = []
+        self.fingerprints = []
+
+    def close(self) -> None:
+        self._end_group()
+        self.flush()
+        logging.info(f"Successfully processed and updated {self.updated} records in DB.")
+
+
+def iter_chunks(cursor: sqlite3.Cursor, chunk_size: int) -> Iterator[List[tuple]]:
+    """Yields the rows of an executed query, chunk_size rows at a time."""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def score_result(row: tuple, matchers: scoring.MatcherCache,
+                 words_by_ref: Dict[int, List[Dict[str, Any]]]) -> Optional[QS_result]:
+    """Scores one selected row, or returns None if it isn't to be scored."""
+    a_result = QS_result(*row[:-1])
+    compact_text = row[-1]
     
-    # 4. Process each trial for scoring AND reporting
-    for row in raw_rows:
-        a_result = QS_result(*row)
+    # Cleanup routine
+    a_result.user_name = fix_random_user_names(a_result.user_name)
+    if a_result.user_name in ['A1P8', 'A1P9', 'A2P15']:
+        return None # Skip bad direction followers
         
-        # Cleanup routine
-        a_result.user_name = fix_random_user_names(a_result.user_name)
-        if a_result.user_name in ['A1P8', 'A1P9', 'A2P15']:
-            continue # Skip bad direction followers
-            
-        if not a_result.asr_results or not a_result.trials_answer:
-            continue
-
-        # Parse JSON blocks
+    if not a_result.asr_results or not a_result.trials_answer:
+        return None
+
+    # Parse JSON blocks, unless the compact tables already hold the text
+    if compact_text is None:
         try:
             a_result.asr_results = json.loads(a_result.asr_results)
             asr_text = a_result.asr_results.get('text', '')
         except json.JSONDecodeError:
             logging.error(f"Invalid ASR JSON found for ref {a_result.asr_id}. Skipping.")
-            continue
-
-        if isinstance(a_result.annotation_matches, str):
-            try:
-                a_result.annotation_matches = json.loads(a_result.annotation_matches)
-            except json.JSONDecodeError:
-                a_result.annotation_matches = []
-
-        # Extract words for reporting
-        a_result.asr_words = []
-        a_result.asr_times = []
-        if (a_result.asr_results and 'segments' in a_result.asr_results and
-            a_result.asr_results['segments'] and 'words' in a_result.asr_results['segments'][0]):
-            a_result.asr_words = [w['word'] for w in a_result.asr_results['segments'][0]['words']]
-            a_result.asr_times = [w.get('start', 0.0) for w in a_result.asr_results['segments'][0]['words']]
-
-        # 5. Core Scoring Logic
-        asr_tokens = clean_and_tokenize(asr_text)
-        asr_tokens_str = ",".join(sorted(asr_tokens))
-        
-        gt_slots = a_result.trials_answer.split()
-        gt_word_count = len(gt_slots)
-        correct_word_count = 0
-        a_result.asr_matches = []
-
-        for gt_slot in gt_slots:
-            slot_options = gt_slot.split('/')
-            acceptable_words: Set[str] = set()
-            
-            for option in slot_options:
-                clean_option = re.sub(r'[^\w\s]', '', option).lower()
-                if clean_option:
-                    acceptable_words.update(homonyms_map.get(clean_option, {clean_option}))
-
-            if not acceptable_words:
-                a_result.asr_matches.append(False)
-                continue
+            return None
+    else:
+        asr_text = compact_text
 
-            match = bool(acceptable_words.intersection(asr_tokens))
-            a_result.asr_matches.append(match)
-            if match:
-                correct_word_count += 1
-                
-        # Since we are scoring on the fly, immediately assign the calculated values to the dataclass
-        # so they get written out to the CSV correctly
-        a_result.asr_gt_word_count = gt_word_count
-        a_result.asr_correct_word_count = correct_word_count
-        a_result.asr_clean_tokens = asr_tokens_str
-
-        # Calculate Audilogy vs ASR Agreement
-        if a_result.annotation_matches and len(a_result.annotation_matches) == len(a_result.asr_matches):
-            a_result.audiology_asr_matches = [not(a ^ b) for a, b in zip(a_result.asr_matches, a_result.annotation_matches)]
-        else:
-            a_result.audiology_asr_matches = []
-
-        updates.append((gt_word_count, correct_word_count, asr_tokens_str, a_result.asr_id))
-        all_results.append(a_result)
-
-    # 6. Database Update
-    if updates:
-        update_query = """
-            UPDATE audio_asr 
-            SET gt_word_count = ?, correct_word_count = ?, asr_clean_tokens = ? 
-            WHERE ref = ?
-        """
-        cursor.executemany(update_query, updates)
-        conn.commit()
-        logging.info(f"Successfully processed and updated {len(updates)} records in DB.")
+    if isinstance(a_result.annotation_matches, str):
+        try:
+            a_result.annotation_matches = json.loads(a_result.annotation_matches)
+        except json.JSONDecodeError:
+            a_result.annotation_matches = []
+
+    # Extract words for reporting
+    a_result.asr_words = []
+    a_result.asr_times = []
+    if compact_text is not None:
+        words = words_by_ref.get(a_result.asr_id, [])
+        a_result.asr_words = [w['word'] for w in words]
+        a_result.asr_times = [w['start'] if w['start'] is not None else 0.0 for w in words]
+    elif (a_result.asr_results and 'segments' in a_result.asr_results and
+        a_result.asr_results['segments'] and 'words' in a_result.asr_results['segments'][0]):
+        a_result.asr_words = [w['word'] for w in a_result.asr_results['segments'][0]['words']]
+        a_result.asr_times = [w.get('start', 0.0) for w in a_result.asr_results['segments'][0]['words']]
+
+    # 5. Core Scoring Logic
+    asr_tokens = clean_and_tokenize(asr_text)
+    asr_tokens_str = ",".join(sorted(asr_tokens))
+    
+    answer_matcher = matchers.get(a_result.trials_answer)
+    a_result.asr_matches = answer_matcher.matches(asr_tokens)
+
+    # Since we are scoring on the fly, immediately assign the calculated values to the dataclass
+    # so they get written out to the CSV correctly
+    a_result.asr_gt_word_count = len(answer_matcher)
+    a_result.asr_correct_word_count = sum(a_result.asr_matches)
+    a_result.asr_clean_tokens = asr_tokens_str
+
+    # Calculate Audilogy vs ASR Agreement
+    if a_result.annotation_matches and len(a_result.annotation_matches) == len(a_result.asr_matches):
+        a_result.audiology_asr_matches = [not(a ^ b) for a, b in zip(a_result.asr_matches, a_result.annotation_matches)]
+    else:
+        a_result.audiology_asr_matches = []
+    return a_result
 
-    conn.close()
 
-    # 7. Generate All Reports
-    print("\n--- Generating Reports ---")
-    valid_subject_re = re.compile(FLAGS.subject_filter)
-    
-    # CSV
-    save_results_as_csv(all_results, FLAGS.csv_output)
+def main(argv: List[str]) -> None:
+    del argv  # Unused
 
-    # Confusion Matrices
-    all_confusions = all_test_confusions(all_results, valid_subject_re=valid_subject_re)
-    plot_confusions(all_confusions)
+    assert os.path.exists(FLAGS.dbfile), f'Database file {FLAGS.dbfile} does not exist.'
+
+    # 1. Load the homonyms dictionary
+    homonyms_map = load_homonyms(FLAGS.homonyms)
+    # Each distinct answer is split into its slots and expanded only once
+    matchers = scoring.matcher_cache(scoring.REPORT, homonyms_map)
+    homonyms_digest = scoring.homonym_digest(homonyms_map)
 
-    # HTML Report
-    html_report, row_count = generate_html_report(
-        all_results, 
+    # 2. Connect to the database. The scores are written on this connection
+    # while the results are still being read, which SQLite allows for rows
+    # the query has already returned.
+    conn = sqlite3.connect(FLAGS.dbfile)
+    conn.executescript(SCORE_STATE_SCHEMA)
+    conn.create_function('score_fingerprint', -1, row_fingerprint, deterministic=True)
+    conn.create_aggregate('score_group_fingerprint', 1, GroupFingerprint)
+    cursor = conn.cursor()
+    updater = ScoreUpdater(conn.cursor(), FLAGS.chunk_size)
+
+    # An incremental run merges into the previous CSV export, so without one
+    # every result is scored.
+    incremental = FLAGS.incremental and os.path.exists(FLAGS.csv_output)
+    if FLAGS.incremental and not incremental:
+        logging.info(f'{FLAGS.csv_output} does not exist yet, scoring all results.')
+
+    # When the compact ASR tables exist, take the text and words from them
+    # instead of parsing every row's Whisper JSON (see asr_storage).
+    compact = asr_storage.has_compact_tables(conn)
+
+    removed_ids: Set[int] = set()
+    if incremental:
+        cursor.execute(f"""
+            SELECT ref FROM audio_score_state
+            WHERE ref NOT IN (SELECT audio_results.id {RESULTS_JOINS} {RESULTS_WHERE})
+        """)
+        removed_ids = {ref for ref, in cursor.fetchall()}
+        cursor.executemany("DELETE FROM audio_score_state WHERE ref = ?",
+                           [(ref,) for ref in removed_ids])
+    else:
+        cursor.execute("DELETE FROM audio_score_state")
+
+    # 3. The reports are written as the results are scored, in a single pass
+    # over the rows (an incremental run reports from the merged CSV instead).
+    print("\n--- Generating Reports ---")
+    valid_subject_re = re.compile(FLAGS.subject_filter)
+    confusions = ConfusionSink(valid_subject_re)
+    html_report = HtmlReportSink(
+        FLAGS.discrepancies,
         db_file=FLAGS.dbfile,  
         only_discrepancies=FLAGS.only_discrepancies,
         only_foreign=FLAGS.only_foreign,
-        valid_subject_re=valid_subject_re
+        valid_subject_re=valid_subject_re,
+        page_size=FLAGS.report_page_size
     )
-    with open(FLAGS.discrepancies, 'w') as f:
-        f.write(html_report)
-    print(f'Wrote {row_count} discrepancy rows to {FLAGS.discrepancies}')
+    report_sinks = [confusions, html_report]
+    if FLAGS.columnar_output:
+        report_sinks.append(results_export.ColumnarExportSink(
+            FLAGS.columnar_output, FLAGS.chunk_size))
+    if incremental:
+        sinks = [updater, CsvMergeSink(FLAGS.csv_output, removed_ids)]
+    else:
+        sinks = [updater, CsvSink(FLAGS.csv_output), *report_sinks]
+
+    # Explicit Column Selection (Now including the 3 new scoring metrics),
+    # followed by the compact ASR text, if any.
+    columns = result_columns(compact)
+    if incremental:
+        cursor.execute(changed_results_query(columns), (homonyms_digest,))
+    else:
+        cursor.execute(f"SELECT {', '.join(columns)} {RESULTS_JOINS} {RESULTS_WHERE} {RESULTS_ORDER}")
+
+    # 4. Process each trial for scoring AND reporting, a chunk of rows at a time
+    asr_ref = columns.index('audio_asr.ref')
+    changed, last_id = 0, None
+    for chunk in iter_chunks(cursor, FLAGS.chunk_size):
+        words_by_ref = {}
+        if compact:
+            words_by_ref = asr_storage.load_words(
+                conn, segment=0, refs=[row[asr_ref] for row in chunk if row[asr_ref] is not None])
+        for row in chunk:
+            changed += row[0] != last_id
+            last_id = row[0]
+            updater.fingerprint(row[0], result_fingerprint(columns, row, homonyms_digest))
+            a_result = score_result(row, matchers, words_by_ref)
+            if a_result is None:
+                removed_ids.add(row[0])  # From the merged CSV, if it was there
+                continue
+            for sink in sinks:
+                sink.add(a_result)
+    if incremental:
+        logging.info(f'{changed} results changed and {len(removed_ids)} were removed since the last run.')
+
+    for sink in sinks:
+        if sink not in report_sinks:
+            sink.close()
+    conn.commit()
+    conn.close()
+
+    if incremental:
+        for result in iter_results_csv(FLAGS.csv_output):
+            for sink in report_sinks:
+                sink.add(result)
+    for sink in report_sinks:
+        sink.close()
+    print(f'Wrote {html_report.row_count} discrepancy rows in {len(html_report.pages)} pages to {FLAGS.discrepancies}')
+
+    # Confusion Matrices
+    matches = confusions.matches()
+    tests, test_confusions = matches.group_confusions(by=('project',))
+    plot_confusions({test: c for (test,), c in zip(tests, test_confusions)})
 
     # Terminal Summary
-    total_tests = 0
-    total_correct = 0
     print('\nTest accuracies (ASR vs Human Agreement):')
-    for test, results in all_confusions.items():
-        num_tests = np.sum(results)
-        if num_tests > 0:
-            num_correct = results[0,0] + results[1,1]
-            total_tests += num_tests
-            total_correct += num_correct
-            print(f'{test}: {num_correct/num_tests*100:.2f}%')
-    if total_tests > 0:
-        print(f'Overall: {total_correct/total_tests*100:.2f}%')
-    else:
+    if not len(matches.human):
         print('No valid comparison data found for summary.')
-
+        return
+    rates = agreement.agreement_rate(test_confusions)
+    kappas = agreement.cohens_kappa(test_confusions)
+    for (test,), rate, kappa in zip(tests, rates, kappas):
+        print(f'{test}: {rate*100:.2f}% (kappa {kappa:.3f})')
+    overall = test_confusions.sum(axis=0)
+    print(f'Overall: {agreement.agreement_rate(overall)*100:.2f}% '
+          f'(kappa {agreement.cohens_kappa(overall):.3f})')
 
 if __name__ == '__main__':
     app.run(main)
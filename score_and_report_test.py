@@ -2,6 +2,7 @@
 
 import json
 import os
+import re
 import sqlite3
 from unittest import mock
 
@@ -11,6 +12,7 @@ from absl.testing import flagsaver
 from absl import flags
 
 import score_and_report
+import scoring
 
 FLAGS = flags.FLAGS
 
@@ -49,7 +51,7 @@ class ScoreAndReportTest(absltest.TestCase):
             CREATE TABLE audio_trials (id INTEGER PRIMARY KEY, project TEXT, snr INTEGER, lang TEXT, level_number INTEGER, trial_number INTEGER, filename TEXT, answer TEXT, active BOOLEAN);
             CREATE TABLE audio_results (id INTEGER PRIMARY KEY, subject INTEGER, trial INTEGER, reply_filename TEXT, t TEXT);
             CREATE TABLE audio_asr (ref INTEGER PRIMARY KEY, data TEXT, gt_word_count INTEGER, correct_word_count INTEGER, asr_clean_tokens TEXT);
-            CREATE TABLE audio_annotations (ref INTEGER PRIMARY KEY, data TEXT);
+            CREATE TABLE audio_annotations (ref INTEGER, data TEXT);
         """)
 
         # 2. Seed Data
@@ -192,6 +194,179 @@ class ScoreAndReportTest(absltest.TestCase):
                 # Restore original directory
                 os.chdir(original_cwd)
 
+    @mock.patch('score_and_report.plt.savefig')
+    def test_main_incremental(self, mock_savefig):
+        """Tests that an incremental run only rescores and merges changed results."""
+        original_cwd = os.getcwd()
+        os.chdir(self.temp_dir.full_path)
+        try:
+            with flagsaver.flagsaver(dbfile=self.db_path, homonyms=self.homonyms_path,
+                                     discrepancies=self.html_out_path,
+                                     csv_output=self.csv_out_path, incremental=True):
+                score_and_report.main([])  # No CSV yet, so everything is scored.
+                full = score_and_report.load_results_csv(self.csv_out_path)
+                self.assertEqual([r.results_id for r in full], [101, 102])
+                self.assertEqual(full[1].asr_matches, [True, True, True])
+                self.assertEqual(full[1].annotation_matches, [True, False, True])
+                self.assertEqual(full[0].asr_words, ['Hello', 'world'])
+
+                conn = sqlite3.connect(self.db_path)
+                # A changed transcript, and a score that must not be rewritten.
+                conn.execute("UPDATE audio_asr SET data = ? WHERE ref = 101",
+                             (json.dumps({"text": "Hello there"}),))
+                conn.execute("UPDATE audio_asr SET correct_word_count = 99 WHERE ref = 102")
+                conn.commit()
+                score_and_report.main([])
+                counts = dict(conn.execute("SELECT ref, correct_word_count FROM audio_asr"))
+                self.assertEqual(counts[101], 1)
+                self.assertEqual(counts[102], 99)
+                merged = score_and_report.load_results_csv(self.csv_out_path)
+                self.assertEqual([r.asr_correct_word_count for r in merged], [1, 3])
+                self.assertEqual(merged[1], full[1])
+
+                # A new homonym file rescores everything.
+                with open(self.homonyms_path, 'a') as f:
+                    f.write("hello, hallo\n")
+                score_and_report.main([])
+                counts = dict(conn.execute("SELECT ref, correct_word_count FROM audio_asr"))
+                self.assertEqual(counts[102], 3)
+
+                # A deleted result is dropped from the export.
+                conn.execute("DELETE FROM audio_results WHERE id = 101")
+                conn.commit()
+                score_and_report.main([])
+                conn.close()
+                merged = score_and_report.load_results_csv(self.csv_out_path)
+                self.assertEqual([r.results_id for r in merged], [102])
+        finally:
+            os.chdir(original_cwd)
+
+    @mock.patch('score_and_report.plt.savefig')
+    def test_main_incremental_duplicate_annotations(self, mock_savefig):
+        """Tests that a result with several annotation rows is merged whole."""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO audio_annotations VALUES (101, '[true, false]')")
+        conn.commit()
+        full_csv = os.path.join(self.temp_dir.full_path, 'full.csv')
+
+        def run(csv_file, incremental):
+            with flagsaver.flagsaver(dbfile=self.db_path, homonyms=self.homonyms_path,
+                                     discrepancies=self.html_out_path, chunk_size=1,
+                                     csv_output=csv_file, incremental=incremental):
+                score_and_report.main([])
+            with open(csv_file) as f:
+                return f.read()
+
+        def changed_ids():
+            query_conn = sqlite3.connect(self.db_path)
+            query_conn.create_function('score_fingerprint', -1, score_and_report.row_fingerprint)
+            query_conn.create_aggregate('score_group_fingerprint', 1,
+                                        score_and_report.GroupFingerprint)
+            digest = scoring.homonym_digest(
+                score_and_report.load_homonyms(self.homonyms_path))
+            columns = score_and_report.result_columns(compact=False)
+            ids = [row[0] for row in query_conn.execute(
+                score_and_report.changed_results_query(columns), (digest,))]
+            query_conn.close()
+            return ids
+
+        original_cwd = os.getcwd()
+        os.chdir(self.temp_dir.full_path)
+        try:
+            expected = run(full_csv, False)
+            self.assertEqual([r.results_id for r in score_and_report.load_results_csv(full_csv)],
+                             [101, 101, 102])
+            run(self.csv_out_path, False)
+            self.assertEqual(changed_ids(), [])
+            self.assertEqual(run(self.csv_out_path, True), expected)
+
+            # Changing one of the annotations rescores both of the result's rows.
+            conn.execute("UPDATE audio_annotations SET data = '[false, true]' "
+                         "WHERE rowid = (SELECT MAX(rowid) FROM audio_annotations WHERE ref = 101)")
+            conn.commit()
+            self.assertEqual(changed_ids(), [101, 101])
+            merged = run(self.csv_out_path, True)
+            self.assertEqual(changed_ids(), [])
+            self.assertEqual(merged, run(full_csv, False))
+        finally:
+            os.chdir(original_cwd)
+            conn.close()
+
+    @mock.patch('score_and_report.plt.savefig')
+    def test_main_chunked(self, mock_savefig):
+        """Tests that the outputs don't depend on the number of rows fetched at a time."""
+        outputs = []
+        for chunk_size in (1, 1000):
+            csv_file = os.path.join(self.temp_dir.full_path, f'out{chunk_size}.csv')
+            with flagsaver.flagsaver(dbfile=self.db_path, homonyms=self.homonyms_path,
+                                     discrepancies=self.html_out_path,
+                                     csv_output=csv_file, chunk_size=chunk_size):
+                score_and_report.main([])
+            with open(csv_file) as f:
+                outputs.append(f.read())
+            with open(self.html_out_path) as f:
+                self.assertEqual(f.read().count('<audio controls preload="none">'), 1)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_csv_merge_sink(self):
+        """Tests merging rescored results into an export, in results_id order."""
+        def result(results_id, user_name):
+            return score_and_report.QS_result(
+                results_id, *[None] * 14, user_name, *[None] * 13)
+
+        score_and_report.save_results_as_csv(
+            [result(i, 'old') for i in (1, 2, 4, 5)], self.csv_out_path)
+        removed = {5}
+        sink = score_and_report.CsvMergeSink(self.csv_out_path, removed)
+        sink.add(result(2, 'new'))
+        removed.add(3)  # Not in the export; and 4 is dropped before reaching it.
+        removed.add(4)
+        sink.add(result(6, 'new'))
+        sink.close()
+        merged = score_and_report.load_results_csv(self.csv_out_path)
+        self.assertEqual([(r.results_id, r.user_name) for r in merged],
+                         [(1, 'old'), (2, 'new'), (6, 'new')])
+        self.assertFalse(os.path.exists(self.csv_out_path + '.tmp'))
+
+    def test_html_report_pages(self):
+        """Tests that a long report is split into linked pages with an index."""
+        def result(results_id, user_name):
+            r = score_and_report.QS_result(
+                results_id, *[None] * 14, user_name, *[None] * 13)
+            r.results_reply_filename = f'rep{results_id}'
+            r.annotation_matches, r.asr_matches = [True], [False]
+            return r
+
+        valid_subject_re = re.compile('A\\d+S\\d+')
+        sink = score_and_report.HtmlReportSink(
+            self.html_out_path, self.db_path, True, False, valid_subject_re, page_size=2)
+        for i in range(5):
+            sink.add(result(i, f'A1S{i}'))
+        sink.add(result(5, 'other'))  # Not shown
+        sink.close()
+        self.assertEqual(sink.row_count, 5)
+        self.assertLen(sink.pages, 3)
+        with open(self.html_out_path) as f:
+            index = f.read()
+        self.assertIn('discrepancies-003.html">Rows 5-5</a> (A1S4 to A1S4)', index)
+        with open(sink.page_filename(2)) as f:
+            page = f.read()
+        self.assertEqual(page.count('<tr><td>'), 2)
+        self.assertIn('<a href="discrepancies-001.html">Previous</a>', page)
+        self.assertIn('<a href="discrepancies-003.html">Next</a>', page)
+        with open(sink.page_filename(3)) as f:
+            self.assertNotIn('Next', f.read())
+
+        # A report that fits in one page has no index.
+        sink = score_and_report.HtmlReportSink(
+            self.html_out_path, self.db_path, True, False, valid_subject_re, page_size=2)
+        sink.add(result(0, 'A1S0'))
+        sink.close()
+        with open(self.html_out_path) as f:
+            page = f.read()
+        self.assertEqual(page.count('<tr><td>'), 1)
+        self.assertNotIn('Index', page)
+
     def test_main_missing_db(self):
         """Ensures the program catches a missing DB file."""
         with flagsaver.flagsaver(dbfile="non_existent_db.db"):
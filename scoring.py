@@ -0,0 +1,231 @@
+"""Matching ASR transcripts against the keyword answers of audio_trials.
+
+An answer such as "WHITE/WIGHT silk JACKET" has one slot per keyword, and
+each slot lists its acceptable words, separated by slashes.  The scorers
+of this package used to split and normalize the answer (and look up its
+homonyms) again for every transcript they scored.  Here an answer is
+compiled once into an AnswerMatcher: a tuple of SlotMatchers, each holding
+the set of transcript tokens that match the slot.  Scoring a transcript is
+then one set lookup per slot.
+
+The scorers don't quite agree on what matches, and their results are kept
+as they were, so each has a Policy describing how it reads answers and
+transcripts:
+
+  EXACT     audio.py: words compared as written (the web app normalizes
+            both sides with Whisper's normalizer first).
+  REPORT    score_and_report.py: punctuation removed, lowercased, and each
+            alternative expanded with its homonyms.
+  RATERS    summarize_raters.py: like REPORT, but apostrophes are kept
+            (and also matched without), and a keyword repeated in the
+            answer is only counted once.
+  ANALYSIS  analyze_results.py: like REPORT, but a hyphenated word matches
+            when all its parts are recognized, and the time of each match
+            is kept.
+
+A MatcherCache compiles each distinct answer once for a policy and homonym
+map.  The cache is keyed by the answer text rather than the trial id, as
+AudioDB updates the answers of existing trials when the CSV files change.
+benchmark_scoring.py measures the scoring rate on a database.
+"""
+import collections
+import dataclasses
+import hashlib
+import json
+import math
+import re
+from typing import (AbstractSet, Any, Callable, Dict, FrozenSet, Iterable,
+                    List, Mapping, Optional, Tuple)
+
+Homonyms = Mapping[str, AbstractSet[str]]
+
+
+@dataclasses.dataclass(frozen=True)
+class SlotMatcher:
+    """The words that match one keyword of an answer."""
+    text: str  # The slot as written in the answer.
+    alternatives: FrozenSet[str]  # Normalized alternatives, with homonyms.
+    words: FrozenSet[str]  # Tokens, any of which matches.
+    # Hyphenated alternatives, which match when all their parts are present.
+    compounds: Tuple[Tuple[str, ...], ...] = ()
+
+    def match(self, tokens: AbstractSet[str]) -> bool:
+        return not self.words.isdisjoint(tokens) or any(
+            all(part in tokens for part in compound)
+            for compound in self.compounds)
+
+    def first_time(self, times: Mapping[str, float]) -> float:
+        """Return the earliest start time of a matching word, or NaN."""
+        starts = [times[w] for w in self.words if w in times]
+        starts += [times[c[0]] for c in self.compounds
+                   if all(part in times for part in c)]
+        return min(starts, default=math.nan)
+
+
+class AnswerMatcher(tuple):
+    """The SlotMatchers of one answer."""
+
+    def matches(self, tokens: AbstractSet[str]) -> List[bool]:
+        return [slot.match(tokens) for slot in self]
+
+    def count(self, tokens: AbstractSet[str]) -> int:
+        return sum(slot.match(tokens) for slot in self)
+
+    def fraction(self, tokens: AbstractSet[str]) -> float:
+        return self.count(tokens) / max(len(self), 1)
+
+    def match_times(self, times: Mapping[str, float]
+                    ) -> Tuple[List[bool], List[float]]:
+        """Return whether each slot matched, and when (NaN if it didn't)."""
+        return self.matches(times), [slot.first_time(times) for slot in self]
+
+
+def normalize_word(word: str, keep_hyphens: bool = False) -> str:
+    """Remove all but the letters (and maybe hyphens) of a word."""
+    if keep_hyphens:
+        return re.sub(r'[^\w-]', '', word.lower())
+    return re.sub(r'[^\w]', '', word.lower())
+
+
+def _identity(word: str) -> str:
+    return word
+
+
+@dataclasses.dataclass(frozen=True)
+class Policy:
+    """How a scorer reads answers and transcripts."""
+    name: str
+    slots: Callable[[str], List[str]]  # Splits an answer into keywords.
+    option: Callable[[str], str]  # Normalizes one slash alternative.
+    tokenize: Callable[[Any], Any]  # Transcript -> set (or dict) of tokens.
+    word: Callable[[str], str] = _identity  # Normalizes a word to match.
+    homonyms: bool = False
+    skip_empty: bool = False  # Ignore alternatives that normalize to ''.
+    strip_apostrophes: bool = False
+    hyphen_compounds: bool = False
+    distinct: bool = False  # Count a repeated keyword once.
+
+
+def _word_times(words: Iterable[Mapping[str, Any]]) -> Dict[str, float]:
+    """Map each normalized recognized word to its first start time."""
+    times = {}
+    for w in words:
+        times.setdefault(normalize_word(w['word']), w.get('start'))
+    return times
+
+
+EXACT = Policy(
+    name='exact',
+    slots=lambda answer: answer.split(' '),
+    option=_identity,
+    tokenize=lambda text: set(text.split(' ')))
+
+REPORT = Policy(
+    name='report',
+    slots=str.split,
+    option=lambda option: re.sub(r'[^\w\s]', '', option).lower(),
+    tokenize=lambda text: set(
+        re.sub(r'[^\w\s]', '', text).lower().split()) if text else set(),
+    homonyms=True,
+    skip_empty=True)
+
+RATERS = Policy(
+    name='raters',
+    slots=lambda answer: re.findall(r"\b[a-zA-Z/0-9']+\b", (answer or '').lower()),
+    option=_identity,
+    tokenize=lambda text: set(re.findall(
+        r"\b[a-z0-9']+\b", str(text).lower())) if text is not None else set(),
+    homonyms=True,
+    strip_apostrophes=True,
+    distinct=True)
+
+ANALYSIS = Policy(
+    name='analysis',
+    slots=lambda answer: answer.lower().split(' '),
+    option=lambda option: normalize_word(option, keep_hyphens=True),
+    tokenize=_word_times,
+    word=normalize_word,
+    homonyms=True,
+    hyphen_compounds=True)
+
+POLICIES = {p.name: p for p in (EXACT, REPORT, RATERS, ANALYSIS)}
+
+
+def compile_slot(policy: Policy, slot: str,
+                 homonyms: Optional[Homonyms] = None) -> SlotMatcher:
+    alternatives = set()
+    for option in slot.split('/'):
+        option = policy.option(option)
+        if policy.skip_empty and not option:
+            continue
+        alternatives.add(option)
+        if policy.homonyms and homonyms:
+            alternatives.update(homonyms.get(option, ()))
+        if policy.strip_apostrophes and "'" in option:
+            alternatives.add(option.replace("'", ''))
+    words, compounds = set(), []
+    for alternative in alternatives:
+        if policy.hyphen_compounds and '-' in alternative[1:]:
+            compounds.append(tuple(
+                policy.word(part) for part in alternative.split('-')))
+        else:
+            words.add(policy.word(alternative))
+    return SlotMatcher(slot, frozenset(alternatives), frozenset(words),
+                       tuple(sorted(compounds)))
+
+
+def compile_answer(policy: Policy, answer: str,
+                   homonyms: Optional[Homonyms] = None) -> AnswerMatcher:
+    slots = policy.slots(answer)
+    if policy.distinct:
+        slots = list(dict.fromkeys(slots))
+    return AnswerMatcher(compile_slot(policy, s, homonyms) for s in slots)
+
+
+def homonym_digest(homonyms: Optional[Homonyms]) -> str:
+    """A hash of the contents of a homonym map."""
+    items = sorted((k, sorted(v)) for k, v in (homonyms or {}).items())
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()[:16]
+
+
+class MatcherCache:
+    """Compiled answers of one policy and homonym map."""
+
+    def __init__(self, policy: Policy, homonyms: Optional[Homonyms] = None):
+        self.policy = policy
+        self.homonyms = homonyms or {}
+        self.answers: Dict[str, AnswerMatcher] = {}
+        self.stats = collections.Counter()
+
+    def get(self, answer: str) -> AnswerMatcher:
+        matcher = self.answers.get(answer)
+        if matcher is None:
+            self.stats['compiled'] += 1
+            matcher = self.answers[answer] = compile_answer(
+                self.policy, answer, self.homonyms)
+        return matcher
+
+    def tokens(self, transcript: Any):
+        return self.policy.tokenize(transcript)
+
+
+_caches: Dict[Tuple[str, str], MatcherCache] = {}
+_caches_by_id: Dict[Tuple[str, int], Tuple[Any, MatcherCache]] = {}
+
+
+def matcher_cache(policy: Policy,
+                  homonyms: Optional[Homonyms] = None) -> MatcherCache:
+    """Return the shared MatcherCache of a policy and homonym map.
+
+    Homonym maps are not expected to change once loaded: after the first
+    call, a map is recognized by its identity without hashing it again.
+    """
+    by_id = (policy.name, id(homonyms))
+    if by_id in _caches_by_id:
+        return _caches_by_id[by_id][1]
+    key = (policy.name, homonym_digest(homonyms))
+    if key not in _caches:
+        _caches[key] = MatcherCache(policy, homonyms)
+    # Keeping a reference to the map keeps its id from being reused.
+    _caches_by_id[by_id] = (homonyms, _caches[key])
+    return _caches[key]
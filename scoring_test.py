@@ -0,0 +1,61 @@
+"""Tests for scoring.py."""
+
+import math
+
+from absl.testing import absltest
+
+import scoring
+
+
+class ScoringTest(absltest.TestCase):
+
+    def test_exact(self):
+        matcher = scoring.compile_answer(scoring.EXACT, 'white/wight silk jacket')
+        self.assertLen(matcher, 3)
+        self.assertEqual(matcher.matches({'wight', 'jacket'}), [True, False, True])
+        self.assertAlmostEqual(matcher.fraction({'silk'}), 1 / 3)
+        self.assertEqual(matcher.fraction(set()), 0.0)
+
+    def test_report(self):
+        homonyms = {'toad': {'toad', 'toed'}, 'toed': {'toad', 'toed'}}
+        matcher = scoring.compile_answer(scoring.REPORT, 'The TOAD, jumped/JUMPS -', homonyms)
+        self.assertLen(matcher, 4)
+        tokens = scoring.REPORT.tokenize('The toed jumps!')
+        self.assertEqual(tokens, {'the', 'toed', 'jumps'})
+        # A slot with nothing left after removing punctuation never matches.
+        self.assertEqual(matcher.matches(tokens), [True, True, True, False])
+
+    def test_raters(self):
+        homonyms = {'their': {"they're"}, "they're": {'their'}}
+        matcher = scoring.compile_answer(scoring.RATERS, "Their dog's dog DOG", homonyms)
+        self.assertLen(matcher, 3)  # The repeated keyword counts once.
+        # A homonym, and a keyword without its apostrophe.
+        self.assertEqual(matcher.matches(scoring.RATERS.tokenize("They're dogs")),
+                         [True, True, False])
+        self.assertEqual(matcher.count(scoring.RATERS.tokenize("dog's")), 1)
+
+    def test_analysis(self):
+        matcher = scoring.compile_answer(scoring.ANALYSIS, 'ice-cream Cone/Cones')
+        times = scoring.ANALYSIS.tokenize([
+            {'word': ' Cones', 'start': 0.5}, {'word': ' ice', 'start': 1.0},
+            {'word': ' cream.', 'start': 1.5}])
+        self.assertEqual(matcher.match_times(times), ([True, True], [1.0, 0.5]))
+        matches, match_times = matcher.match_times(
+            scoring.ANALYSIS.tokenize([{'word': 'ice', 'start': 1.0}]))
+        self.assertEqual(matches, [False, False])
+        self.assertTrue(math.isnan(match_times[0]))
+
+    def test_matcher_cache(self):
+        homonyms = {'toad': {'toad', 'toed'}}
+        cache = scoring.matcher_cache(scoring.REPORT, homonyms)
+        self.assertIs(cache.get('toad'), cache.get('toad'))
+        self.assertEqual(cache.stats['compiled'], 1)
+        self.assertIs(scoring.matcher_cache(scoring.REPORT, homonyms), cache)
+        # An equal map shares the cache; a different one doesn't.
+        self.assertIs(scoring.matcher_cache(scoring.REPORT, dict(homonyms)), cache)
+        self.assertIsNot(scoring.matcher_cache(scoring.REPORT, {}), cache)
+        self.assertIsNot(scoring.matcher_cache(scoring.RATERS, homonyms), cache)
+
+
+if __name__ == '__main__':
+    absltest.main()
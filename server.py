@@ -3,6 +3,7 @@ from api_review import ReviewAPIBlueprint
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask import Flask, Response, redirect, send_from_directory
 from storage import relpath
+from serving import send_revalidated
 import os
 
 app = Flask(__name__, static_folder=relpath("static"), static_url_path="/static")
@@ -45,15 +46,13 @@ def static_files(filename):
     static_dir = relpath("static")
     file_path = os.path.join(static_dir, filename)
     if os.path.exists(file_path) and os.path.isfile(file_path):
-        # For PDFs, explicitly read in binary mode to prevent corruption
+        # Streamed from disk, with Range and ETag support (see serving.py)
         if filename.lower().endswith('.pdf'):
-            with open(file_path, 'rb') as f:
-                pdf_data = f.read()
-            response = Response(pdf_data, mimetype='application/pdf')
-            response.headers['Content-Disposition'] = f'inline; filename="{os.path.basename(filename)}"'
-            return response
+            return send_revalidated(
+                static_dir, filename, mimetype='application/pdf',
+                download_name=os.path.basename(filename))
         else:
-            return send_from_directory(static_dir, filename)
+            return send_revalidated(static_dir, filename)
     return Response("File not found", status=404)
 
 app.register_blueprint(APIBlueprint())
@@ -0,0 +1,70 @@
+"""Serving recordings and static files from disk.
+
+The review and results pages fetch the same recordings again and again, so
+the routes that serve files use send_file, which
+
+  * streams the file from disk in blocks instead of reading it into memory,
+  * answers Range requests with 206 Partial Content (audio elements seek
+    with these), and
+  * sets ETag and Last-Modified, answering If-None-Match and
+    If-Modified-Since with 304 Not Modified.
+
+Uploads are never rewritten: each has a unique (UUID) name, and the WAV made
+from it by ingest.py appears under its final name only once complete.  They
+are sent with a long, immutable Cache-Control so the browser doesn't ask
+again.  They are patients' recordings, served behind a login, so the
+Cache-Control is also private: only the browser may keep them, not a shared
+proxy or CDN.  Static files change when the site is updated, so the browser
+must revalidate them (cheaply, with the ETag).
+
+stream_json streams large query results as they are read.
+"""
+import json
+
+from flask import Response, send_from_directory, stream_with_context
+
+# One year, the longest max-age browsers honour.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def send_immutable(directory, filename, **kw):
+    """Send a file whose contents never change, for the browser to keep."""
+    response = send_from_directory(
+        directory, filename, conditional=True, etag=True,
+        max_age=IMMUTABLE_MAX_AGE, **kw)
+    # send_file marks any response with a max_age public.
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
+def send_revalidated(directory, filename, **kw):
+    """Send a file that may change, which the browser must revalidate."""
+    response = send_from_directory(
+        directory, filename, conditional=True, etag=True, max_age=0, **kw)
+    response.cache_control.max_age = None
+    response.cache_control.no_cache = True
+    return response
+
+
+def stream_json(records, ndjson=False):
+    """Stream records as a JSON list, or as NDJSON, without collecting them.
+
+    The records are serialized one at a time as the client reads them, so
+    memory use doesn't grow with their number.  The request context (and so
+    the database connection) stays open until the stream ends.
+    """
+    def json_list():
+        yield "["
+        for i, record in enumerate(records):
+            yield ("," if i else "") + json.dumps(record)
+        yield "]"
+
+    def json_lines():
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+    return Response(
+        stream_with_context(json_lines() if ndjson else json_list()),
+        mimetype="application/x-ndjson" if ndjson else "application/json")
@@ -0,0 +1,100 @@
+"""Tests for serving.py."""
+
+import json
+import os
+
+import flask
+from absl.testing import absltest
+
+import serving
+
+
+class ServingTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.create_tempdir().full_path
+        self.data = bytes(range(256)) * 64
+        with open(os.path.join(self.directory, 'sin_1_2_abc.wav'), 'wb') as f:
+            f.write(self.data)
+        with open(os.path.join(self.directory, 'form.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4')
+        app = flask.Flask(__name__)
+        app.add_url_rule('/upload/<fname>', 'upload',
+                         lambda fname: serving.send_immutable(self.directory, fname))
+        app.add_url_rule('/static/<fname>', 'static_files',
+                         lambda fname: serving.send_revalidated(
+                             self.directory, fname, mimetype='application/pdf',
+                             download_name=fname))
+        self.client = app.test_client()
+
+    def test_immutable(self):
+        response = self.client.get('/upload/sin_1_2_abc.wav')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)  # Not read into memory.
+        self.assertEqual(response.data, self.data)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('private', response.headers['Cache-Control'])
+        self.assertNotIn('public', response.headers['Cache-Control'])
+        self.assertIn(f'max-age={serving.IMMUTABLE_MAX_AGE}',
+                      response.headers['Cache-Control'])
+        self.assertIn('Last-Modified', response.headers)
+
+        etag = response.headers['ETag']
+        response = self.client.get('/upload/sin_1_2_abc.wav',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        self.assertEqual(self.client.get('/upload/missing').status_code, 404)
+        self.assertEqual(self.client.get('/upload/..%2Fx').status_code, 404)
+
+    def test_range(self):
+        response = self.client.get('/upload/sin_1_2_abc.wav',
+                                   headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.data[100:200])
+        self.assertEqual(response.headers['Content-Range'],
+                         f'bytes 100-199/{len(self.data)}')
+
+        response = self.client.get('/upload/sin_1_2_abc.wav',
+                                   headers={'Range': f'bytes={len(self.data)}-'})
+        self.assertEqual(response.status_code, 416)
+
+    def test_revalidated(self):
+        response = self.client.get('/static/form.pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'inline; filename=form.pdf')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        response = self.client.get(
+            '/static/form.pdf', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_stream_json(self):
+        app = flask.Flask(__name__)
+        consumed = []
+
+        def records():
+            for i in range(3):
+                consumed.append(i)
+                yield {'id': i}
+
+        with app.test_request_context('/recognized'):
+            response = serving.stream_json(records())
+            self.assertTrue(response.is_streamed)
+            self.assertEqual(consumed, [])  # Nothing read until sent.
+            self.assertEqual(json.loads(response.get_data()),
+                             [{'id': 0}, {'id': 1}, {'id': 2}])
+            response = serving.stream_json(iter([]))
+            self.assertEqual(json.loads(response.get_data()), [])
+            response = serving.stream_json(records(), ndjson=True)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            self.assertEqual(response.get_data(as_text=True).splitlines(),
+                             ['{"id": 0}', '{"id": 1}', '{"id": 2}'])
+
+
+if __name__ == '__main__':
+    absltest.main()
@@ -4,7 +4,7 @@ window.addEventListener("load", e => {
   const project = params.get("project")
   if (debug === "true") {
     const results = document.getElementById("results")
-    results.href = `api/${project}/plot?t=${Date.now()}`;
+    results.href = `api/${project}/plot`;
     document.getElementById("recognized").href =
       `recognized.html?project=${project}`
     for (const el of document.getElementsByClassName("debug")) {
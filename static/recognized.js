@@ -39,7 +39,7 @@ fetch(`api/${project}/recognized${window.location.search}`)
     for (const user of entries) {
       user_head = parent.appendChild(head.cloneNode(true))
       let plot = document.createElement("a")
-      plot.href = `api/${project}/plot?user=${user["id"]}`
+      plot.href = `api/${project}/plot?user=${user["id"]}&stale=1`
       plot.innerText = user["username"]
       // plot.setAttribute("target", "_blank")
       user_head.querySelector(".username").appendChild(plot)
@@ -69,7 +69,7 @@ fetch(`api/${project}/recognized${window.location.search}`)
 
     if((new URLSearchParams(window.location.search)).get("user") == "all") {
       let a = document.querySelector("#showall");
-      a.href = `api/${project}/plot?user=all`
+      a.href = `api/${project}/plot?user=all&stale=1`
       // a.setAttribute("target", "_blank")
     }
   })
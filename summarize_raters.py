@@ -17,6 +17,12 @@ field and counts answer words recognized by the ASR, including slash-separated
 alternatives and entries in ``--homonyms``. Boolean annotation lists are
 converted to their fraction of ``true`` values.
 
+These per-rating values are kept in a feature file next to the database
+(``--features_db``, see :mod:`rater_features`). Each run first updates it,
+scoring only the ratings that are new or changed since the last run (or all
+of them when the homonyms change), and then reads the project's trials from
+it. ``--nouse_features`` scores every trial from the source tables instead.
+
 Each output row and scatter-plot point represents one subject/project/SNR
 group, not one rater or individual audio result. The point's coordinates are
 the mean over that group's kept trial rows. If multiple reraters scored the
@@ -30,12 +36,28 @@ producing separate points:
 * Plot 3: the same normalized ASR value versus mean rerater true fraction.
 
 The CSV also includes the group's subject, project, SNR, and trial count.
+
+The statistics come from :mod:`rater_stats`, which also gives confidence
+intervals for the correlations, biases and residual std-dev ratio from
+``--bootstrap_resamples`` resamples of the subjects (a subject's trials are
+kept together).
+
+Batch mode
+----------
+``--batch_metrics`` reads the trials of every project of ``--language`` once
+and writes the correlations and residual statistics of each (project, ASR
+model) pair to one JSON (or Parquet/Arrow) file, which ``run_exp3_summary.py``
+reads instead of parsing the logs of one run per project.  With
+``--residual_plot_pattern`` it also saves the residual histogram of each
+project, as the runs for one project did.
 """
 
 import csv
 import json
 import logging
 import math
+import numpy as np
+import os
 import pandas as pd
 import re
 import sqlite3
@@ -45,6 +67,12 @@ from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 from absl import app
 from absl import flags
 
+import asr_storage
+import rater_features
+import rater_stats
+import results_export
+import scoring
+
 
 FLAGS = flags.FLAGS
 try:
@@ -138,8 +166,43 @@ flags.DEFINE_string(
 flags.DEFINE_string(
     "raw_output",
     "residual_raw_data.pkl",
-    "Path to write the raw per-utterance pandas DataFrame (pickle format) when "
-    "--dump_raw_data is set.",
+    "Path to write the raw per-utterance pandas DataFrame when --dump_raw_data is "
+    "set: Parquet (.parquet) or Arrow IPC (.arrow), read back with "
+    "results_export.load_results, or else a pickle.",
+)
+flags.DEFINE_string(
+    "batch_metrics",
+    None,
+    "Batch mode: compute the summary statistics, correlations and residual "
+    "statistics of every (project, ASR model) pair of --language in one pass, "
+    "and write them to this JSON (.json), Parquet (.parquet) or Arrow IPC "
+    "(.arrow) file instead of the usual summary CSV/plots.",
+)
+flags.DEFINE_string(
+    "residual_plot_pattern",
+    None,
+    "Batch mode: also create the per-subject residual histogram plot of each "
+    "project, in this PNG file with {project} replaced by the project, e.g. "
+    "residual_std_ratio_{project}.png.",
+)
+flags.DEFINE_integer(
+    "bootstrap_resamples",
+    2000,
+    "Number of subject-level bootstrap resamples for the confidence intervals "
+    "of the correlations, biases and residual std-dev ratios (0 disables them).",
+)
+flags.DEFINE_float("confidence", 0.95, "Coverage of the bootstrap confidence intervals.")
+flags.DEFINE_integer("bootstrap_seed", 0, "Random seed of the bootstrap resamples.")
+flags.DEFINE_bool(
+    "use_features",
+    True,
+    "Read the trials from the per-rating feature file (see rater_features.py), "
+    "updating it first, instead of scoring every trial again.",
+)
+flags.DEFINE_string(
+    "features_db",
+    None,
+    "Path to the feature file; by default <dbfile without .db>_features.db.",
 )
 
 
@@ -211,27 +274,25 @@ def extract_asr_words(asr_data: str) -> List[str]:
     if not asr_data:
         return []
     try:
-        text = str(json.loads(asr_data).get("text", "")).lower()
+        text = json.loads(asr_data).get("text", "")
     except (AttributeError, json.JSONDecodeError, TypeError):
         return []
-    return re.findall(r"\b[a-z0-9']+\b", text)
+    return asr_text_words(text)
 
 
-def extract_asr_model_name(asr_data: str) -> Optional[str]:
-    """Return the Whisper ``model_name`` stored in a JSON-encoded ASR result.
+def asr_text_words(text: Any) -> List[str]:
+    """Tokenize an ASR transcript into lowercase words.
 
     Args:
-        asr_data: JSON string as stored in ``audio_asr.data``.
+        text: The ASR ``text`` field, as stored in ``audio_asr.text``.
+            ``None`` yields an empty list.
 
     Returns:
-        The ``model_name`` value, or ``None`` if missing or unparseable.
+        List of lowercase word tokens (letters, digits, and apostrophes only).
     """
-    if not asr_data:
-        return None
-    try:
-        return json.loads(asr_data).get("model_name")
-    except (AttributeError, json.JSONDecodeError, TypeError):
-        return None
+    if text is None:
+        return []
+    return re.findall(r"\b[a-z0-9']+\b", str(text).lower())
 
 
 def score_trial(answer: str, asr_words: Iterable[str], homonyms: Dict[str, Set[str]]) -> int:
@@ -250,22 +311,9 @@ def score_trial(answer: str, asr_words: Iterable[str], homonyms: Dict[str, Set[s
     Returns:
         Number of distinct answer items that were matched.
     """
-    asr_word_set = set(asr_words)
-    answer_items = re.findall(r"\b[a-zA-Z/0-9']+\b", (answer or "").lower())
-    matched_items: Set[str] = set()
-
-    for item in answer_items:
-        if item in matched_items:
-            continue
-        candidates: Set[str] = set()
-        for component in item.split("/"):
-            candidates.add(component)
-            candidates.update(homonyms.get(component, set()))
-            if "'" in component:
-                candidates.add(component.replace("'", ""))
-        if candidates.intersection(asr_word_set):
-            matched_items.add(item)
-    return len(matched_items)
+    # Each distinct answer is compiled once (see scoring.py)
+    matcher = scoring.matcher_cache(scoring.RATERS, homonyms).get(answer or "")
+    return matcher.count(set(asr_words))
 
 
 def fraction_true(data: str) -> float:
@@ -294,6 +342,31 @@ def fraction_true(data: str) -> float:
     return sum(str(value).lower() == "true" for value in values) / len(values) if values else 0.0
 
 
+def trial_matched_words(row: sqlite3.Row, homonyms: Dict[str, Set[str]]) -> int:
+    """Return the :func:`score_trial` count of a trial row.
+
+    Uses the ``asr_matched`` column when the row comes from the feature table
+    (see :mod:`rater_features`), and otherwise scores the ASR text.
+    """
+    if "asr_matched" in row.keys():
+        return row["asr_matched"]
+    return score_trial(row["answer"], asr_text_words(row["audio_asr_text"]), homonyms)
+
+
+def trial_audiologist_fraction(row: sqlite3.Row) -> float:
+    """Return the :func:`fraction_true` of a row's audiologist annotation."""
+    if "audiologist_fraction" in row.keys():
+        return row["audiologist_fraction"]
+    return fraction_true(row["audio_annotation_data"])
+
+
+def trial_rater_fraction(row: sqlite3.Row) -> float:
+    """Return the :func:`fraction_true` of a row's review annotation."""
+    if "rater_fraction" in row.keys():
+        return row["rater_fraction"]
+    return fraction_true(row["review_annotation_data"])
+
+
 def is_valid_subject(username: str, subject_pattern: str, excluded_subjects: Iterable[str]) -> bool:
     """Return whether a subject username passes the validity filter.
 
@@ -318,10 +391,13 @@ def is_valid_subject(username: str, subject_pattern: str, excluded_subjects: Ite
 def fetch_trials(
     dbfile: str,
     language: str,
-    project: str,
+    project: Optional[str],
     subject_pattern: str,
     excluded_subjects: Iterable[str],
     allowed_raters: Set[str],
+    asr_model: Optional[str] = None,
+    features_db: Optional[str] = None,
+    homonyms: Optional[Dict[str, Set[str]]] = None,
 ) -> List[sqlite3.Row]:
     """Fetch trials from the database, filtered by subject and rater validity.
 
@@ -334,25 +410,95 @@ def fetch_trials(
     Args:
         dbfile: Path to the SQLite database file.
         language: Value of ``audio_trials.lang`` to include.
-        project: Value of ``audio_trials.project`` to include.
+        project: Value of ``audio_trials.project`` to include, or ``None``
+            for all projects.
         subject_pattern: Regex passed to :func:`is_valid_subject` for subject
             username validation.
         excluded_subjects: Usernames to reject regardless of pattern match.
         allowed_raters: Set of labeler usernames to accept. An empty set means
             all raters are allowed.
+        asr_model: If given, only fetch rows whose ASR ``model_name`` matches.
+            This uses the indexed ``audio_asr.model_name`` column when the
+            database has it (see :mod:`asr_storage`).
+        features_db: If given, first bring this feature file up to date with
+            ``homonyms`` (see :mod:`rater_features`), and read the trials from
+            it instead of joining the source tables.
 
     Returns:
         List of :class:`sqlite3.Row` objects with columns: ``user``,
         ``username``, ``project``, ``snr``, ``answer``, ``utterance_id``,
         ``audio_annotation_data``, ``review_annotation_data``,
-        ``audio_asr_data``, ``labeler_username``.
+        ``audio_asr_text``, ``asr_model_name``, ``labeler_username``.
+        The ASR text comes from the compact ``audio_asr.text`` column when it
+        has been filled (see :mod:`asr_storage`), and is otherwise extracted
+        from the JSON by SQLite, so the Whisper JSON never reaches Python.
+        Rows from a feature file also have the precomputed ``asr_matched``,
+        ``audiologist_fraction`` and ``rater_fraction``.
     """
     subject_regex = re.compile(subject_pattern)
     excluded = set(excluded_subjects)
+    if features_db is not None:
+        rows = fetch_features(dbfile, features_db, homonyms or {}, language, project, asr_model)
+    else:
+        rows = query_trials(dbfile, language, project, asr_model)
+
+    valid_rows = []
+    for row in rows:
+        if is_valid_subject(row["username"], subject_regex.pattern, excluded):
+            if not allowed_raters or row["labeler_username"] in allowed_raters:
+                valid_rows.append(row)
+    return valid_rows
+
+
+def fetch_features(
+    dbfile: str,
+    features_db: str,
+    homonyms: Dict[str, Set[str]],
+    language: str,
+    project: Optional[str],
+    asr_model: Optional[str] = None,
+) -> List[sqlite3.Row]:
+    """Refresh the feature file of a database and read a project's trials from it."""
+    connection = sqlite3.connect(dbfile)
+    try:
+        counts = rater_features.refresh(
+            connection,
+            features_db,
+            scoring.homonym_digest(homonyms),
+            lambda answer, text: score_trial(answer, asr_text_words(text), homonyms),
+            fraction_true,
+        )
+        logging.info(f"Updated {features_db}: {counts['scored']} ratings scored, {counts['deleted']} deleted")
+        return rater_features.fetch(connection, language, project, asr_model)
+    finally:
+        connection.close()
+
+
+def query_trials(
+    dbfile: str,
+    language: str,
+    project: Optional[str],
+    asr_model: Optional[str] = None,
+) -> List[sqlite3.Row]:
+    """Join the source tables for the trials of a project (see :func:`fetch_trials`)."""
     with sqlite3.connect(dbfile) as connection:
         connection.row_factory = sqlite3.Row
+        json_text = "CASE WHEN json_valid(asr.data) THEN json_extract(asr.data, '$.text') END"
+        if "text" in asr_storage.table_columns(connection, "audio_asr"):
+            asr_text = f"COALESCE(asr.text, {json_text})"
+        else:
+            asr_text = json_text
+        model_name = asr_storage.model_field_sql(connection, "model_name", "asr")
+        params: Tuple[Any, ...] = (language,)
+        filters = ""
+        if project is not None:
+            filters += "AND at.project = ?"
+            params += (project,)
+        if asr_model is not None:
+            filters += f" AND {model_name} = ?"
+            params += (asr_model,)
         rows = connection.execute(
-            """
+            f"""
             SELECT DISTINCT
                 ar.subject AS user,
                 u.username AS username,
@@ -362,7 +508,8 @@ def fetch_trials(
                 ar.id AS utterance_id,
                 aa.data AS audio_annotation_data,
                 ra.data AS review_annotation_data,
-                asr.data AS audio_asr_data,
+                {asr_text} AS audio_asr_text,
+                {model_name} AS asr_model_name,
                 labeler_user.username AS labeler_username
             FROM audio_results ar
             JOIN audio_trials at ON ar.trial = at.id
@@ -372,19 +519,13 @@ def fetch_trials(
             JOIN users labeler_user ON ra.labeler = labeler_user.id
             LEFT JOIN audio_asr asr ON ar.id = asr.ref
             WHERE at.lang = ?
-              AND at.project = ?
               AND asr.data IS NOT NULL AND asr.data != ''
               AND ra.data IS NOT NULL AND ra.data != ''
+              {filters}
             """,
-            (language, project),
+            params,
         ).fetchall()
-    
-    valid_rows = []
-    for row in rows:
-        if is_valid_subject(row["username"], subject_regex.pattern, excluded):
-            if not allowed_raters or row["labeler_username"] in allowed_raters:
-                valid_rows.append(row)
-    return valid_rows
+    return rows
 
 
 def build_raw_dataframe(rows: Iterable[sqlite3.Row], 
@@ -411,9 +552,9 @@ def build_raw_dataframe(rows: Iterable[sqlite3.Row],
     """
     records = []
     for row in rows:
-        if extract_asr_model_name(row["audio_asr_data"]) != asr_model:
+        if row["asr_model_name"] != asr_model:
             continue
-        matched = score_trial(row["answer"], extract_asr_words(row["audio_asr_data"]), homonyms)
+        matched = trial_matched_words(row, homonyms)
         records.append(
             {
                 "utterance_id": row["utterance_id"],
@@ -421,9 +562,9 @@ def build_raw_dataframe(rows: Iterable[sqlite3.Row],
                 "snr": row["snr"],
                 "subject": row["username"],
                 "asr_fraction_correct": matched / FLAGS.max_words,
-                "audiologist_fraction_correct": fraction_true(row["audio_annotation_data"]),
+                "audiologist_fraction_correct": trial_audiologist_fraction(row),
                 "rater_username": row["labeler_username"],
-                "rater_fraction_correct": fraction_true(row["review_annotation_data"]),
+                "rater_fraction_correct": trial_rater_fraction(row),
             }
         )
 
@@ -470,9 +611,9 @@ def summarize(rows: Iterable[sqlite3.Row], homonyms: Dict[str, Set[str]], per_tr
         # Return one entry per trial without aggregation
         summary = []
         for row in rows:
-            audio_fraction = fraction_true(row["audio_annotation_data"])
-            review_fraction = fraction_true(row["review_annotation_data"])
-            matched_words = score_trial(row["answer"], extract_asr_words(row["audio_asr_data"]), homonyms)
+            audio_fraction = trial_audiologist_fraction(row)
+            review_fraction = trial_rater_fraction(row)
+            matched_words = trial_matched_words(row, homonyms)
             summary.append(
                 {
                     "user": row["user"],
@@ -492,9 +633,9 @@ def summarize(rows: Iterable[sqlite3.Row], homonyms: Dict[str, Set[str]], per_tr
     for row in rows:
         groups[(row["user"], row["project"], row["snr"])].append(
             (
-                fraction_true(row["audio_annotation_data"]),
-                fraction_true(row["review_annotation_data"]),
-                score_trial(row["answer"], extract_asr_words(row["audio_asr_data"]), homonyms),
+                trial_audiologist_fraction(row),
+                trial_rater_fraction(row),
+                trial_matched_words(row, homonyms),
             )
         )
 
@@ -520,7 +661,7 @@ def summarize(rows: Iterable[sqlite3.Row], homonyms: Dict[str, Set[str]], per_tr
 
 
 def pearson(x: List[float], y: List[float]) -> float:
-    """Compute Pearson's correlation coefficient without requiring SciPy.
+    """Compute Pearson's correlation coefficient (see :mod:`rater_stats`).
 
     Args:
         x: First sequence of numeric values.
@@ -530,15 +671,7 @@ def pearson(x: List[float], y: List[float]) -> float:
         Pearson correlation in the range ``[-1, 1]``, or ``nan`` if fewer than
         two data points are provided or if either variable has zero variance.
     """
-    if len(x) < 2:
-        return float("nan")
-    x_mean = sum(x) / len(x)
-    y_mean = sum(y) / len(y)
-    numerator = sum((a - x_mean) * (b - y_mean) for a, b in zip(x, y))
-    denominator = math.sqrt(
-        sum((a - x_mean) ** 2 for a in x) * sum((b - y_mean) ** 2 for b in y)
-    )
-    return numerator / denominator if denominator else float("nan")
+    return float(rater_stats.pearson(x, y))
 
 
 def write_csv(summary: List[Dict[str, Any]]) -> None:
@@ -580,17 +713,12 @@ def print_outlier_details(
     """
     found = 0
     for row in rows:
-        asr_words = extract_asr_words(row["audio_asr_data"])
-        matched = score_trial(row["answer"], asr_words, homonyms)
+        matched = trial_matched_words(row, homonyms)
         normalized_asr = matched / FLAGS.max_words
-        audio_fraction = fraction_true(row["audio_annotation_data"])
+        audio_fraction = trial_audiologist_fraction(row)
         if normalized_asr <= asr_max and audio_fraction >= audio_min:
             found += 1
-            asr_text = ""
-            try:
-                asr_text = json.loads(row["audio_asr_data"]).get("text", "").strip()
-            except (json.JSONDecodeError, TypeError, AttributeError):
-                pass
+            asr_text = str(row["audio_asr_text"] or "").strip()
             print(
                 f"--- Outlier {found} ---\n"
                 f"  Subject:      {row['username']} (id={row['user']})\n"
@@ -605,6 +733,17 @@ def print_outlier_details(
         print(f"No outliers found with ASR <= {asr_max} and audiologist >= {audio_min}.")
 
 
+# (printed name, metrics key, X summary column, Y summary column)
+COMPARISONS = [
+    ("Audiologists vs. Raters", "audiologists_vs_raters",
+     "mean_fraction_audio_annotation_true", "mean_fraction_review_annotation_true"),
+    ("ASR vs. Audiologists", "asr_vs_audiologists",
+     "normalized_matched_word_count", "mean_fraction_audio_annotation_true"),
+    ("ASR vs. Raters", "asr_vs_raters",
+     "normalized_matched_word_count", "mean_fraction_review_annotation_true"),
+]
+
+
 def print_statistics(summary: List[Dict[str, Any]]) -> None:
     """Print Pearson correlation and mean bias for the three rater comparisons.
 
@@ -614,18 +753,46 @@ def print_statistics(summary: List[Dict[str, Any]]) -> None:
     Args:
         summary: List of summary dicts as returned by :func:`summarize`.
     """
-    comparisons = [
-        ("Audiologists vs. Raters", "mean_fraction_audio_annotation_true", "mean_fraction_review_annotation_true"),
-        ("ASR vs. Audiologists", "normalized_matched_word_count", "mean_fraction_audio_annotation_true"),
-        ("ASR vs. Raters", "normalized_matched_word_count", "mean_fraction_review_annotation_true"),
-    ]
     print(f"Fetched {len(summary)} subject/project/SNR summaries.")
-    for name, x_key, y_key in comparisons:
-        x = [row[x_key] for row in summary]
-        y = [row[y_key] for row in summary]
-        correlation = pearson(x, y)
-        bias = sum(b - a for a, b in zip(x, y)) / len(y) if y else float("nan")
-        print(f"{name}: Pearson={correlation:.3f}, bias (Y-X)={bias:.3f}")
+    for name, _key, x_key, y_key in COMPARISONS:
+        correlation, bias = compare(summary, x_key, y_key)
+        line = f"{name}: Pearson={correlation:.3f}, bias (Y-X)={bias:.3f}"
+        if FLAGS.bootstrap_resamples:
+            intervals = compare_intervals(summary, x_key, y_key)
+            line += (
+                f" ({FLAGS.confidence:.0%} CI: r {format_interval(intervals['pearson'])}, "
+                f"bias {format_interval(intervals['bias'])})"
+            )
+        print(line)
+
+
+def compare(summary: List[Dict[str, Any]], x_key: str, y_key: str) -> Tuple[float, float]:
+    """Return the Pearson r and the mean signed difference (Y - X) of two summary columns."""
+    x = [row[x_key] for row in summary]
+    y = [row[y_key] for row in summary]
+    return pearson(x, y), float(rater_stats.mean_bias(x, y))
+
+
+def compare_intervals(summary: List[Dict[str, Any]], x_key: str, y_key: str) -> Dict[str, Tuple[float, float]]:
+    """Return subject-level bootstrap intervals of :func:`compare` (see ``--bootstrap_resamples``)."""
+    return rater_stats.bootstrap_comparison(
+        [row[x_key] for row in summary],
+        [row[y_key] for row in summary],
+        [row["user"] for row in summary],
+        resamples=FLAGS.bootstrap_resamples,
+        confidence=FLAGS.confidence,
+        rng=bootstrap_rng(),
+    )
+
+
+def bootstrap_rng():
+    """A random generator for the bootstrap, seeded by ``--bootstrap_seed``."""
+    return np.random.default_rng(FLAGS.bootstrap_seed)
+
+
+def format_interval(bounds: Tuple[float, float], digits: int = 3) -> str:
+    """Format a confidence interval as ``[low, high]``."""
+    return f"[{bounds[0]:.{digits}f}, {bounds[1]:.{digits}f}]"
 
 
 def fit_regression(x: List[float], y: List[float], fixed_slope: Optional[float] = None) -> Tuple[float, float]:
@@ -648,16 +815,7 @@ def fit_regression(x: List[float], y: List[float], fixed_slope: Optional[float]
     Returns:
         Tuple of ``(slope, intercept)``.
     """
-    if fixed_slope is not None:
-        return fixed_slope, sum(y_i - fixed_slope * x_i for x_i, y_i in zip(x, y)) / len(y)
-
-    x_mean = sum(x) / len(x)
-    y_mean = sum(y) / len(y)
-    denominator = sum((x_i - x_mean) ** 2 for x_i in x)
-    if not denominator:
-        return 0.0, y_mean
-    slope = sum((x_i - x_mean) * (y_i - y_mean) for x_i, y_i in zip(x, y)) / denominator
-    return slope, y_mean - slope * x_mean
+    return rater_stats.fit_regression(x, y, fixed_slope)
 
 
 def add_fit_line(axis, x: List[float], y: List[float], slope: float, bias: float, linestyle: str, label_y_offset: float) -> None:
@@ -749,71 +907,74 @@ def scatter_plot(axis, summary: List[Dict[str, Any]], x_key: str, y_key: str,
     axis.grid(True, linestyle="--", alpha=0.6)
 
 
-def create_residual_plot(
-    rows: List[sqlite3.Row],
-    homonyms: Dict[str, Set[str]],
-    professional_raters: Set[str],
-    student_raters: Set[str],
-) -> None:
-    """Create and save a histogram of mean-subtracted ASR and rater scores.
+UtteranceKey = Tuple[str, Any, Any]
 
-        Residual baselines use professional+student rater scores and are controlled
-        by ``--residual_normalization``:
 
-        * ``normalization_by_utterance``: baseline is the mean rater score for each utterance.
-        * ``normalization_by_snr``: baseline is the mean rater score across utterances
-            with the same project and SNR.
+def utterance_scores(
+    rows: Iterable[sqlite3.Row],
+    homonyms: Dict[str, Set[str]],
+    valid_raters: Set[str],
+) -> Tuple[Dict[UtteranceKey, float], Dict[UtteranceKey, List[float]]]:
+    """Collect the normalized ASR score and the valid raters' scores of each utterance.
 
     Args:
         rows: Raw trial rows as returned by :func:`fetch_trials`.
         homonyms: Bidirectional homonym map as returned by :func:`read_homonyms`.
-        professional_raters: Set of professional rater usernames.
-        student_raters: Set of student rater usernames.
-    """
-    import matplotlib.pyplot as plt
-
-    valid_raters = professional_raters | student_raters
-
-    # Accumulate per-utterance ASR and review scores for valid raters.
-    # Key: (project, snr, utterance_id)
-    asr_scores: Dict[Tuple[str, Any, Any], float] = {}
-    utterance_rater_scores: Dict[Tuple[str, Any, Any], List[float]] = defaultdict(list)
+        valid_raters: Usernames of the raters whose scores are kept.
 
+    Returns:
+        Two dicts keyed by ``(project, snr, utterance_id)``: the ASR matched
+        count divided by ``--max_words``, and the list of rater fractions.
+    """
+    asr_scores: Dict[UtteranceKey, float] = {}
+    utterance_rater_scores: Dict[UtteranceKey, List[float]] = defaultdict(list)
     for row in rows:
         utterance_key = (row["project"], row["snr"], row["utterance_id"])
         if utterance_key not in asr_scores:
-            matched = score_trial(row["answer"], extract_asr_words(row["audio_asr_data"]), homonyms)
+            matched = trial_matched_words(row, homonyms)
             asr_scores[utterance_key] = matched / FLAGS.max_words
         if row["labeler_username"] in valid_raters:
             utterance_rater_scores[utterance_key].append(
-                fraction_true(row["review_annotation_data"])
+                trial_rater_fraction(row)
             )
+    return asr_scores, utterance_rater_scores
 
-    utterance_means: Dict[Tuple[str, Any, Any], float] = {
+
+def residual_baselines(
+    utterance_rater_scores: Dict[UtteranceKey, List[float]],
+    normalization: str,
+) -> Dict[UtteranceKey, float]:
+    """Return the rater baseline of each utterance for a ``--residual_normalization`` mode."""
+    utterance_means: Dict[UtteranceKey, float] = {
         key: (sum(scores) / len(scores))
         for key, scores in utterance_rater_scores.items()
         if scores
     }
+    if normalization == "normalization_by_utterance":
+        return utterance_means
+
+    # Compute project/SNR baseline as the mean across utterance means.
+    project_snr_to_utterance_means: Dict[Tuple[str, Any], List[float]] = defaultdict(list)
+    for (project, snr, _utterance_id), mean_value in utterance_means.items():
+        project_snr_to_utterance_means[(project, snr)].append(mean_value)
+    project_snr_baseline = {
+        key: (sum(values) / len(values))
+        for key, values in project_snr_to_utterance_means.items()
+        if values
+    }
+    return {
+        (project, snr, utterance_id): project_snr_baseline[(project, snr)]
+        for (project, snr, utterance_id) in utterance_means
+        if (project, snr) in project_snr_baseline
+    }
 
-    baseline_by_utterance: Dict[Tuple[str, Any, Any], float] = {}
-    if FLAGS.residual_normalization == "normalization_by_utterance":
-        baseline_by_utterance = utterance_means
-    else:
-        # Compute project/SNR baseline as the mean across utterance means.
-        project_snr_to_utterance_means: Dict[Tuple[str, Any], List[float]] = defaultdict(list)
-        for (project, snr, _utterance_id), mean_value in utterance_means.items():
-            project_snr_to_utterance_means[(project, snr)].append(mean_value)
-        project_snr_baseline = {
-            key: (sum(values) / len(values))
-            for key, values in project_snr_to_utterance_means.items()
-            if values
-        }
-        baseline_by_utterance = {
-            (project, snr, utterance_id): project_snr_baseline[(project, snr)]
-            for (project, snr, utterance_id) in utterance_means
-            if (project, snr) in project_snr_baseline
-        }
 
+def residuals(
+    asr_scores: Dict[UtteranceKey, float],
+    utterance_rater_scores: Dict[UtteranceKey, List[float]],
+    baseline_by_utterance: Dict[UtteranceKey, float],
+) -> Tuple[List[float], List[float]]:
+    """Subtract the baselines from the ASR and rater scores of each utterance."""
     asr_residuals = [
         asr_scores[key] - baseline_by_utterance[key]
         for key in asr_scores
@@ -825,6 +986,62 @@ def create_residual_plot(
             continue
         baseline = baseline_by_utterance[key]
         rater_residuals.extend(score - baseline for score in scores)
+    return asr_residuals, rater_residuals
+
+
+def residual_data(
+    rows: Iterable[sqlite3.Row],
+    asr_scores: Dict[UtteranceKey, float],
+    utterance_rater_scores: Dict[UtteranceKey, List[float]],
+) -> rater_stats.ResidualData:
+    """Collect the scores of :func:`utterance_scores` for the residual statistics.
+
+    Args:
+        rows: The trial rows the scores came from, for the subject of each
+            utterance.
+        asr_scores: Normalized ASR score of each utterance.
+        utterance_rater_scores: Valid raters' scores of each utterance.
+
+    Returns:
+        The :class:`rater_stats.ResidualData` of the scores, which gives the
+        residual standard deviations of either ``--residual_normalization``
+        mode and their bootstrap intervals.
+    """
+    subjects = {(row["project"], row["snr"], row["utterance_id"]): row["user"] for row in rows}
+    return rater_stats.ResidualData.from_scores(asr_scores, utterance_rater_scores, subjects)
+
+
+def create_residual_plot(
+    rows: List[sqlite3.Row],
+    homonyms: Dict[str, Set[str]],
+    professional_raters: Set[str],
+    student_raters: Set[str],
+    filename: Optional[str] = None,
+) -> None:
+    """Create and save a histogram of mean-subtracted ASR and rater scores.
+
+        Residual baselines use professional+student rater scores and are controlled
+        by ``--residual_normalization``:
+
+        * ``normalization_by_utterance``: baseline is the mean rater score for each utterance.
+        * ``normalization_by_snr``: baseline is the mean rater score across utterances
+            with the same project and SNR.
+
+    Args:
+        rows: Raw trial rows as returned by :func:`fetch_trials`.
+        homonyms: Bidirectional homonym map as returned by :func:`read_homonyms`.
+        professional_raters: Set of professional rater usernames.
+        student_raters: Set of student rater usernames.
+        filename: PNG file for the plot; by default ``--residual_plot``.
+    """
+    import matplotlib.pyplot as plt
+
+    filename = filename or FLAGS.residual_plot
+    asr_scores, utterance_rater_scores = utterance_scores(
+        rows, homonyms, professional_raters | student_raters
+    )
+    baseline_by_utterance = residual_baselines(utterance_rater_scores, FLAGS.residual_normalization)
+    asr_residuals, rater_residuals = residuals(asr_scores, utterance_rater_scores, baseline_by_utterance)
 
     debug_point_count = max(0, FLAGS.residual_debug_points)
     if debug_point_count:
@@ -883,20 +1100,19 @@ def create_residual_plot(
         print("Skipping residual plot: no valid residuals available.")
         return
 
-    def population_std(values: List[float]) -> float:
-        if not values:
-            return float("nan")
-        mean_value = sum(values) / len(values)
-        return math.sqrt(sum((value - mean_value) ** 2 for value in values) / len(values))
-
-    asr_std = population_std(asr_residuals)
-    rater_std = population_std(rater_residuals)
-    std_ratio = asr_std / rater_std if (not math.isnan(asr_std) and not math.isnan(rater_std) and rater_std != 0) else float("nan")
+    data = residual_data(rows, asr_scores, utterance_rater_scores)
+    asr_std, rater_std, std_ratio = data.std_ratio(FLAGS.residual_normalization)
+    ratio_interval = ""
+    if FLAGS.bootstrap_resamples:
+        bounds = data.bootstrap_std_ratio(
+            FLAGS.residual_normalization, FLAGS.bootstrap_resamples, FLAGS.confidence, bootstrap_rng()
+        )
+        ratio_interval = f" ({FLAGS.confidence:.0%} CI {format_interval(bounds, 4)})"
     print(
         "Residual standard deviation summary: "
         f"ASR={asr_std:.4f} (n={len(asr_residuals)}), "
         f"Rater={rater_std:.4f} (n={len(rater_residuals)}), "
-        f"ASR/Rater={std_ratio:.4f}"
+        f"ASR/Rater={std_ratio:.4f}{ratio_interval}"
     )
 
     figure, axis = plt.subplots()
@@ -917,8 +1133,9 @@ def create_residual_plot(
     axis.legend(fontsize=9)
     axis.grid(True, axis="y", linestyle="--", alpha=0.5)
     figure.tight_layout()
-    figure.savefig(FLAGS.residual_plot, dpi=150)
-    print(f"Wrote residual plot to {FLAGS.residual_plot}")
+    figure.savefig(filename, dpi=150)
+    plt.close(figure)
+    print(f"Wrote residual plot to {filename}")
 
 
 def create_subject_rater_plot(
@@ -948,10 +1165,10 @@ def create_subject_rater_plot(
 
     for row in rows:
         subject = row["user"]
-        matched = score_trial(row["answer"], extract_asr_words(row["audio_asr_data"]), homonyms)
+        matched = trial_matched_words(row, homonyms)
         asr_scores[subject].append(matched / FLAGS.max_words)
         rater_scores[(subject, row["labeler_username"])].append(
-            fraction_true(row["review_annotation_data"])
+            trial_rater_fraction(row)
         )
 
     subjects = sorted(asr_scores.keys())
@@ -1045,6 +1262,100 @@ def create_plot(summary: List[Dict[str, Any]], per_trial: bool = False) -> None:
     print(f"Wrote plot to {FLAGS.plot}")
 
 
+def batch_metrics(
+    rows: Iterable[sqlite3.Row],
+    homonyms: Dict[str, Set[str]],
+    valid_raters: Set[str],
+) -> List[Dict[str, Any]]:
+    """Compute the statistics of each (project, ASR model) pair of trial rows.
+
+    Gives the numbers a run for one ``--project`` prints (the correlations of
+    :func:`print_statistics` and the residual standard deviations of
+    :func:`create_residual_plot`), for every pair at once, and for both
+    residual normalization modes.
+
+    Args:
+        rows: Raw trial rows of any number of projects, as returned by
+            :func:`fetch_trials`.
+        homonyms: Bidirectional homonym map as returned by :func:`read_homonyms`.
+        valid_raters: Usernames of the raters used for the residual baselines.
+
+    Returns:
+        One flat dict per pair, sorted by project and model, with keys
+        ``project``, ``asr_model``, ``trials``, ``summaries``,
+        ``<comparison>_pearson`` and ``<comparison>_bias`` for each of
+        :data:`COMPARISONS`, and ``<mode>_asr_std``, ``<mode>_rater_std``,
+        ``<mode>_std_ratio``, ``<mode>_asr_n`` and ``<mode>_rater_n`` for
+        each residual normalization mode.  With ``--bootstrap_resamples``,
+        each Pearson r, bias and std-dev ratio also has ``_ci_low`` and
+        ``_ci_high`` bounds.
+    """
+    groups: Dict[Tuple[str, Any], List[sqlite3.Row]] = defaultdict(list)
+    for row in rows:
+        groups[(row["project"], row["asr_model_name"])].append(row)
+
+    metrics = []
+    for (project, asr_model), group_rows in sorted(groups.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        summary = summarize(group_rows, homonyms)
+        record: Dict[str, Any] = {
+            "project": project,
+            "asr_model": asr_model,
+            "trials": len(group_rows),
+            "summaries": len(summary),
+        }
+        for _name, key, x_key, y_key in COMPARISONS:
+            record[f"{key}_pearson"], record[f"{key}_bias"] = compare(summary, x_key, y_key)
+            if FLAGS.bootstrap_resamples:
+                intervals = compare_intervals(summary, x_key, y_key)
+                for statistic in ("pearson", "bias"):
+                    bounds = intervals[statistic]
+                    record[f"{key}_{statistic}_ci_low"], record[f"{key}_{statistic}_ci_high"] = bounds
+        asr_scores, utterance_rater_scores = utterance_scores(group_rows, homonyms, valid_raters)
+        data = residual_data(group_rows, asr_scores, utterance_rater_scores)
+        for mode in rater_stats.NORMALIZATIONS:
+            asr_std, rater_std, std_ratio = data.std_ratio(mode)
+            record.update(
+                {
+                    f"{mode}_asr_std": asr_std,
+                    f"{mode}_rater_std": rater_std,
+                    f"{mode}_std_ratio": std_ratio,
+                    f"{mode}_asr_n": int(data.sums["u_count"].sum()),
+                    f"{mode}_rater_n": int(data.sums["r_count"].sum()),
+                }
+            )
+            if FLAGS.bootstrap_resamples:
+                bounds = data.bootstrap_std_ratio(
+                    mode, FLAGS.bootstrap_resamples, FLAGS.confidence, bootstrap_rng()
+                )
+                record[f"{mode}_std_ratio_ci_low"], record[f"{mode}_std_ratio_ci_high"] = bounds
+        metrics.append(record)
+    return metrics
+
+
+def write_metrics(metrics: List[Dict[str, Any]], filename: str) -> None:
+    """Write :func:`batch_metrics` records as JSON, or as Parquet/Arrow by the extension.
+
+    The JSON file is an object with the run's settings and a ``metrics`` list;
+    NaN values are written as ``null``.
+    """
+    if os.path.splitext(filename)[1].lower() in results_export.EXTENSIONS:
+        results_export.write_frame(pd.DataFrame.from_records(metrics), filename)
+        return
+    clean = [
+        {key: (None if isinstance(value, float) and math.isnan(value) else value) for key, value in record.items()}
+        for record in metrics
+    ]
+    document = {
+        "dbfile": FLAGS.dbfile,
+        "language": FLAGS.language,
+        "rater_type": FLAGS.rater_type,
+        "max_words": FLAGS.max_words,
+        "metrics": clean,
+    }
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(document, file, indent=2)
+
+
 def main(argv: List[str]) -> None:
     """Entry point: load data, compute summaries, write CSV and optional plot.
 
@@ -1069,21 +1380,51 @@ def main(argv: List[str]) -> None:
         allowed_raters = student_raters
     else:
         allowed_raters = set()  # empty means allow all
+    features_db = None
+    if FLAGS.use_features:
+        features_db = FLAGS.features_db or rater_features.features_path(FLAGS.dbfile)
     rows = fetch_trials(
         FLAGS.dbfile,
         FLAGS.language,
-        FLAGS.project,
+        None if FLAGS.batch_metrics else FLAGS.project,
         FLAGS.subject_pattern,
         FLAGS.excluded_subjects,
         allowed_raters,
+        asr_model=FLAGS.asr_model if FLAGS.dump_raw_data else None,
+        features_db=features_db,
+        homonyms=homonyms,
     )
+    if FLAGS.batch_metrics:
+        metrics = batch_metrics(rows, homonyms, professional_raters | student_raters)
+        write_metrics(metrics, FLAGS.batch_metrics)
+        for record in metrics:
+            print(
+                f"{record['project']} / {record['asr_model']}: trials={record['trials']}, "
+                f"ASR vs. Raters Pearson={record['asr_vs_raters_pearson']:.3f}, "
+                f"ASR/Rater={record[FLAGS.residual_normalization + '_std_ratio']:.4f}"
+            )
+        print(f"Wrote {len(metrics)} project/ASR model metrics to {FLAGS.batch_metrics}")
+        if FLAGS.residual_plot_pattern:
+            project_rows: Dict[str, List[sqlite3.Row]] = defaultdict(list)
+            for row in rows:
+                project_rows[row["project"]].append(row)
+            for project, group_rows in sorted(project_rows.items()):
+                print(f"Residuals of {project}:")
+                create_residual_plot(
+                    group_rows, homonyms, professional_raters, student_raters,
+                    FLAGS.residual_plot_pattern.format(project=project),
+                )
+        return
     if FLAGS.dump_raw_data:
-        logging.info(f"Fetched {len(rows)} rows before filtering by asr_model={FLAGS.asr_model}")
+        logging.info(f"Fetched {len(rows)} rows for asr_model={FLAGS.asr_model}")
         dataframe = build_raw_dataframe(rows, homonyms, FLAGS.asr_model)
         if dataframe.empty:
             print(f"No rows found for asr_model={FLAGS.asr_model!r}; nothing written.")
             return
-        dataframe.to_pickle(FLAGS.raw_output)
+        if os.path.splitext(FLAGS.raw_output)[1].lower() in results_export.EXTENSIONS:
+            results_export.write_frame(dataframe, FLAGS.raw_output)
+        else:
+            dataframe.to_pickle(FLAGS.raw_output)
         print(f"Wrote {len(dataframe)} utterance rows to {FLAGS.raw_output}")
         print(dataframe.head())
         return
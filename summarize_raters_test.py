@@ -4,14 +4,19 @@ These tests focus on the residual normalization modes introduced by
 --residual_normalization.
 """
 
+import json
+import math
 import os
 import re
 import sqlite3
 import subprocess
 import sys
+from pathlib import Path
 
 from absl.testing import absltest
 
+import run_exp3_summary
+
 
 class SummarizeRatersResidualModeTest(absltest.TestCase):
 
@@ -233,6 +238,54 @@ class SummarizeRatersResidualModeTest(absltest.TestCase):
         ratio_project_snr = self._run_and_extract_ratio("normalization_by_snr")
         self.assertNotAlmostEqual(ratio_utterance, ratio_project_snr, places=2)
 
+    def test_batch_metrics(self):
+        # A second project in the same run, with one utterance (no residual spread).
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(
+            """
+            INSERT INTO audio_trials VALUES (13, 'win', 5, 'fish', 'en');
+            INSERT INTO audio_results VALUES (203, 1, 13);
+            INSERT INTO audio_asr VALUES (203, '{"text": "fish"}');
+            INSERT INTO review_annotations VALUES (203, 101, '[true]');
+            """
+        )
+        conn.commit()
+        conn.close()
+        tag_dir = os.path.join(self.temp_dir, "tag")
+        os.makedirs(tag_dir)
+        metrics_file = os.path.join(tag_dir, "summarize_raters_metrics.json")
+        subprocess.run(
+            [
+                sys.executable,
+                self.script_path,
+                "--dbfile", self.db_path,
+                "--homonyms", self.homonyms_path,
+                "--max_words", "1",
+                "--professional_raters", self.professional_raters_path,
+                "--student_raters", self.student_raters_path,
+                "--batch_metrics", metrics_file,
+                "--residual_plot_pattern", os.path.join(tag_dir, "residual_std_ratio_{project}.png"),
+            ],
+            cwd=self.temp_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        with open(metrics_file, encoding="utf-8") as file:
+            metrics = json.load(file)["metrics"]
+        self.assertEqual([(m["project"], m["asr_model"], m["trials"]) for m in metrics],
+                         [("quick", None, 4), ("win", None, 1)])
+        quick, win = metrics
+        self.assertAlmostEqual(quick["normalization_by_utterance_std_ratio"], 2.1213, places=3)
+        self.assertAlmostEqual(quick["normalization_by_snr_std_ratio"], 1.1547, places=3)
+        self.assertIsNone(win["asr_vs_raters_pearson"])
+        self.assertTrue(os.path.exists(os.path.join(tag_dir, "residual_std_ratio_quick.png")))
+
+        std_ratios = run_exp3_summary.collect_std_ratios(["tag"], Path(self.temp_dir))
+        self.assertAlmostEqual(std_ratios["quick"][0], 1.1547, places=3)
+        self.assertTrue(math.isnan(std_ratios["win"][0]))
+
 
 if __name__ == "__main__":
     absltest.main()
@@ -0,0 +1,101 @@
+"""Psychometric thresholds of every subject of a project, for /thresholds.
+
+Each project keeps the scored points of all its subjects and their fitted
+curves (plot.fit_psychometric_curves).  When the data version changes, only
+the rows added since the last update are read, and only the subjects they
+belong to are fitted again.  If rows were replaced or deleted instead (the
+number of rows added doesn't account for the change in the row count),
+everything is read and fitted again.
+
+The version is the tuple returned by AudioBP.audio_plot_version:
+(largest result id, largest scored rowid, number of scored rows).
+"""
+import collections
+import math
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Sequence, Tuple
+
+from plot import fit_psychometric_curves
+
+# (rowid, subject, snr, score)
+Row = Tuple[int, Any, float, float]
+
+
+def subject_fit(subject, points, c, d, converged) -> Dict[str, Any]:
+    """The JSON record of one subject's fitted curve."""
+    fit = converged and math.isfinite(c) and math.isfinite(d)
+    return {
+        "subject": subject,
+        "points": len(points),
+        "converged": bool(fit),
+        # SNR (dB) at which half the words are recognized
+        "threshold": float(d) if fit else None,
+        # rise in the fraction recognized per dB, at the threshold
+        "slope": float(c) / 4 if fit else None,
+    }
+
+
+class ProjectThresholds:
+    """The points and fitted curves of the subjects of one project."""
+
+    def __init__(self):
+        self.version = None
+        self.points = collections.defaultdict(list)  # subject -> [(snr, score)]
+        self.fits = {}  # subject -> subject_fit record
+        self.lock = threading.Lock()
+
+    def refit(self, subjects: Sequence[Hashable]):
+        groups = [tuple(zip(*self.points[s])) for s in subjects]
+        c, d, converged = fit_psychometric_curves(groups)
+        for i, subject in enumerate(subjects):
+            self.fits[subject] = subject_fit(
+                subject, self.points[subject], c[i], d[i], converged[i])
+
+    def update(self, version: Tuple, fetch_since: Callable[[int], List[Row]],
+               count_since: Callable[[int], int]) -> List[Dict[str, Any]]:
+        """Bring the fits up to date with the data version.
+
+        Args:
+            version: The current data version.
+            fetch_since: Returns the project's rows with a rowid above the
+                given one.
+            count_since: Returns the number of rows (of all projects) with a
+                rowid above the given one.
+
+        Returns:
+            The fit of every subject, ordered by subject.
+        """
+        with self.lock:
+            if version != self.version:
+                watermark = (self.version[1] or 0) if self.version else 0
+                appended = self.version is not None and (
+                    version[2] - self.version[2] == count_since(watermark))
+                if not appended:
+                    self.points.clear()
+                    self.fits.clear()
+                    watermark = 0
+                changed = set()
+                for _, subject, snr, score in fetch_since(watermark):
+                    self.points[subject].append((snr, score))
+                    changed.add(subject)
+                self.refit(sorted(changed, key=str))
+                self.version = version
+            return [self.fits[s] for s in sorted(self.fits, key=str)]
+
+
+class ThresholdCache:
+    """ProjectThresholds of each project."""
+
+    def __init__(self):
+        self.projects = collections.defaultdict(ProjectThresholds)
+        self.lock = threading.Lock()
+
+    def update(self, project: str, version: Tuple,
+               fetch_since: Callable[[int], List[Row]],
+               count_since: Callable[[int], int]) -> List[Dict[str, Any]]:
+        with self.lock:
+            thresholds = self.projects[project]
+        return thresholds.update(version, fetch_since, count_since)
+
+
+threshold_cache = ThresholdCache()
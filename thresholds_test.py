@@ -0,0 +1,94 @@
+"""Tests for thresholds.py and plot.fit_psychometric_curves."""
+
+import numpy as np
+from absl.testing import absltest
+from scipy.optimize import curve_fit
+
+import plot
+from thresholds import ProjectThresholds
+
+
+def noisy_subject(rng, c, d):
+    snrs = np.repeat(np.arange(0, 26, 5), 2).astype(float)
+    scores = plot.psychometric_curve(snrs, c, d) + rng.normal(0, 0.05, len(snrs))
+    return snrs, np.clip(scores, 0, 1)
+
+
+class FitTest(absltest.TestCase):
+
+    def test_matches_curve_fit(self):
+        rng = np.random.default_rng(0)
+        groups = [noisy_subject(rng, rng.uniform(0.3, 1.5), rng.uniform(3, 15))
+                  for _ in range(20)]
+        c, d, converged = plot.fit_psychometric_curves(groups)
+        self.assertTrue(converged.all())
+        for i, (snrs, scores) in enumerate(groups):
+            expected, _ = curve_fit(plot.psychometric_curve, snrs, scores, ftol=1e-4)
+            # Both reach the least squares minimum (which is flat along c when
+            # the curve is steep, so compare the errors rather than c).
+            error = np.sum((plot.psychometric_curve(snrs, c[i], d[i]) - scores) ** 2)
+            expected_error = np.sum(
+                (plot.psychometric_curve(snrs, *expected) - scores) ** 2)
+            self.assertLessEqual(error, expected_error * 1.001 + 1e-9)
+            self.assertAlmostEqual(d[i], expected[1], delta=0.25)
+
+    def test_undetermined(self):
+        c, d, converged = plot.fit_psychometric_curves([
+            (np.array([0., 5, 10]), np.ones(3)),  # All correct.
+            (np.array([5., 5]), np.array([0.2, 0.4])),  # One SNR.
+            (np.array([]), np.array([])),
+            (np.array([0., 5, 10, 15]), np.array([0, 0.2, 0.8, 1])),
+        ])
+        self.assertEqual(converged.tolist(), [False, False, False, True])
+        self.assertAlmostEqual(d[3], 7.5, places=3)
+
+
+class ProjectThresholdsTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rows = []
+        self.fetches = []
+
+    def add(self, subject, snrs, scores):
+        for snr, score in zip(snrs, scores):
+            self.rows.append((len(self.rows) + 1, subject, snr, score))
+
+    def update(self, thresholds):
+        version = (len(self.rows), len(self.rows), len(self.rows))
+
+        def fetch_since(rowid):
+            self.fetches.append(rowid)
+            return [r for r in self.rows if r[0] > rowid]
+
+        return thresholds.update(
+            version, fetch_since, lambda rowid: len(self.rows) - rowid)
+
+    def test_incremental(self):
+        thresholds = ProjectThresholds()
+        self.add(1, [0, 5, 10, 15], [0, 0.2, 0.8, 1])
+        self.add(2, [0, 5, 10, 15], [0, 0, 0.2, 0.8])
+        fits = self.update(thresholds)
+        self.assertEqual([f['subject'] for f in fits], [1, 2])
+        self.assertAlmostEqual(fits[0]['threshold'], 7.5, places=3)
+        self.assertGreater(fits[1]['threshold'], fits[0]['threshold'])
+
+        self.assertEqual(self.update(thresholds), fits)  # Nothing new.
+        self.assertEqual(self.fetches, [0])
+
+        self.add(3, [0, 5], [1, 1])
+        fits = self.update(thresholds)
+        self.assertEqual(self.fetches, [0, 8])  # Only the new rows.
+        self.assertEqual(fits[2], {'subject': 3, 'points': 2, 'converged': False,
+                                   'threshold': None, 'slope': None})
+
+        # A rewritten row changes the count without adding rows past the watermark.
+        self.rows[0] = (1, 1, 0, 0.5)
+        fits = thresholds.update((10, 10, 11), lambda rowid: self.rows,
+                                 lambda rowid: 0)
+        self.assertLen(fits, 3)
+        self.assertEqual(fits[0]['points'], 4)
+
+
+if __name__ == '__main__':
+    absltest.main()
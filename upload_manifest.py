@@ -0,0 +1,124 @@
+"""Which uploads have playable audio, so the review queries need not stat them.
+
+The upload_manifest table has one row per audio_results row, recording
+whether its reply_filename is a non-empty file in the uploads directory, its
+size, and its duration (from the ingest stage's audio_uploads table).
+AudioBP.audio_result records each upload as it is saved, and this script
+reconciles the table with the uploads directory, for uploads copied in from
+elsewhere, files removed since, and databases (such as the review database)
+that do not receive the uploads themselves.  It first converts the uploads
+whose ingest was lost with its web server process (see
+ingest.finish_stale).  Run it periodically:
+
+    python upload_manifest.py --dbfile experiments.db --uploads_dir uploads
+"""
+
+import os
+import sqlite3
+from typing import Dict
+
+from absl import app, flags
+
+import ingest
+from storage import relpath
+
+# Where AudioBP saves uploads, and the review pages serve them from.
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", relpath("uploads"))
+
+MANIFEST_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS upload_manifest (
+        ref INTEGER PRIMARY KEY,
+        reply_filename TEXT,
+        playable BOOLEAN NOT NULL CHECK(playable IN(0,1)),
+        size INTEGER,
+        duration REAL,
+        t TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(ref) REFERENCES audio_results(id)
+    );
+"""
+
+
+def ensure_table(con: sqlite3.Connection, directory: str = UPLOAD_DIR):
+    """Create the upload_manifest table, filling it in if it is new."""
+    ingest.ensure_tables(con)
+    con.executescript(MANIFEST_SCHEMA)
+    if con.execute("SELECT 1 FROM upload_manifest LIMIT 1").fetchone() is None:
+        reconcile(con, directory)
+
+
+def record_upload(db, rowid, fpath):
+    """Add the just saved upload of audio_results row rowid."""
+    size = os.path.getsize(fpath) if os.path.isfile(fpath) else None
+    db.execute(
+        "INSERT OR REPLACE INTO upload_manifest "
+        "(ref, reply_filename, playable, size) VALUES (?, ?, ?, ?)",
+        (rowid, os.path.basename(fpath), int(bool(size)), size))
+
+
+def upload_sizes(directory: str) -> Dict[str, int]:
+    """The size of each file in directory, from a single listing."""
+    try:
+        with os.scandir(directory) as entries:
+            return {e.name: e.stat().st_size for e in entries if e.is_file()}
+    except FileNotFoundError:
+        return {}
+
+
+def reconcile(con: sqlite3.Connection, directory: str = UPLOAD_DIR) -> Dict[str, int]:
+    """Bring upload_manifest up to date with audio_results and directory.
+
+    Returns:
+        The number of rows 'added', 'updated' and 'removed'.
+    """
+    sizes = upload_sizes(directory)
+    rows = con.execute("""
+        SELECT ar.id, ar.reply_filename, um.ref IS NOT NULL, um.reply_filename,
+               um.playable, um.size, um.duration, au.original_seconds
+        FROM audio_results ar
+        LEFT JOIN upload_manifest um ON um.ref = ar.id
+        LEFT JOIN audio_uploads au ON au.ref = ar.id
+    """).fetchall()
+    added, changed = [], []
+    for ref, fname, known, *old, duration in rows:
+        size = sizes.get(fname) if isinstance(fname, str) and fname else None
+        new = [fname, int(bool(size)), size, duration]
+        if not known:
+            added.append([ref] + new)
+        elif new != old:
+            changed.append([ref] + new)
+    con.executemany(
+        "INSERT OR REPLACE INTO upload_manifest "
+        "(ref, reply_filename, playable, size, duration) VALUES (?, ?, ?, ?, ?)",
+        added + changed)
+    removed = con.execute(
+        "DELETE FROM upload_manifest WHERE ref NOT IN (SELECT id FROM audio_results)"
+    ).rowcount
+    con.commit()
+    return {"added": len(added), "updated": len(changed), "removed": removed}
+
+
+FLAGS = flags.FLAGS
+try:
+    flags.DEFINE_string("dbfile", "experiments.db", "Path to the SQLite database.")
+except flags.DuplicateFlagError:
+    pass  # Also defined by the analysis programs, when imported together.
+flags.DEFINE_string("uploads_dir", UPLOAD_DIR,
+                    "Directory holding the uploads named by audio_results.reply_filename")
+
+
+def main(argv):
+    con = sqlite3.connect(FLAGS.dbfile, timeout=10.0)
+    try:
+        ingest.ensure_tables(con)
+        con.executescript(MANIFEST_SCHEMA)
+        stale = ingest.finish_stale(FLAGS.dbfile, FLAGS.uploads_dir)
+        counts = reconcile(con, FLAGS.uploads_dir)
+    finally:
+        con.close()
+    print(f"Finished {stale} stale pending uploads.")
+    print(f"Upload manifest: {counts['added']} added, {counts['updated']} updated, "
+          f"{counts['removed']} removed.")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,59 @@
+"""Tests for upload_manifest.py."""
+
+import os
+import sqlite3
+
+from absl.testing import absltest
+
+import upload_manifest
+
+
+class UploadManifestTest(absltest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.uploads = self.create_tempdir()
+        self.con = sqlite3.connect(
+            os.path.join(self.create_tempdir().full_path, 'test.db'))
+        self.addCleanup(self.con.close)
+        self.con.executescript("""
+            CREATE TABLE audio_results (id INTEGER PRIMARY KEY, subject INTEGER,
+                                        trial INTEGER, reply_filename TEXT);
+            INSERT INTO audio_results VALUES (1, 1, 1, 'sin_a'), (2, 1, 2, 'sin_b'),
+                                             (3, 1, 3, 'sin_empty'), (4, 1, 4, NULL);
+        """)
+        self.uploads.create_file('sin_a', content='mp4 data')
+        self.uploads.create_file('sin_empty', content='')
+
+    def manifest(self):
+        return self.con.execute(
+            'SELECT ref, reply_filename, playable, size, duration '
+            'FROM upload_manifest ORDER BY ref').fetchall()
+
+    def reconcile(self):
+        return upload_manifest.reconcile(self.con, self.uploads.full_path)
+
+    def test_reconcile(self):
+        upload_manifest.ensure_table(self.con, self.uploads.full_path)
+        self.assertEqual(self.manifest(), [(1, 'sin_a', 1, 8, None), (2, 'sin_b', 0, None, None),
+                                           (3, 'sin_empty', 0, 0, None), (4, None, 0, None, None)])
+        self.assertEqual(self.reconcile(), {'added': 0, 'updated': 0, 'removed': 0})
+
+        # sin_b arrives, ingest measures sin_a, and result 4 is removed.
+        self.uploads.create_file('sin_b', content='mp4')
+        self.con.execute("INSERT INTO audio_uploads (ref, original_seconds, status) "
+                         "VALUES (1, 2.5, 'done')")
+        self.con.execute('DELETE FROM audio_results WHERE id = 4')
+        self.con.execute("INSERT INTO audio_results VALUES (5, 2, 1, 'sin_c')")
+        self.assertEqual(self.reconcile(), {'added': 1, 'updated': 2, 'removed': 1})
+        self.assertEqual(self.manifest(), [(1, 'sin_a', 1, 8, 2.5), (2, 'sin_b', 1, 3, None),
+                                           (3, 'sin_empty', 0, 0, None),
+                                           (5, 'sin_c', 0, None, None)])
+
+    def test_missing_directory(self):
+        upload_manifest.ensure_table(self.con, os.path.join(self.uploads.full_path, 'none'))
+        self.assertEqual([r[2] for r in self.manifest()], [0, 0, 0, 0])
+
+
+if __name__ == '__main__':
+    absltest.main()